@@ -3,8 +3,7 @@ from django.contrib import admin
 from django.shortcuts import render
 from django.utils.html import format_html
 from django.utils.translation import gettext_lazy as _
-from django.db.models import Sum, F, DecimalField, Value, Count
-from django.db.models.functions import Coalesce
+from django.db.models import Sum, Count
 from django.utils import timezone
 from datetime import date, timedelta
 import logging
@@ -305,15 +304,12 @@ class BalanceDueFilter(admin.SimpleListFilter):
         )
 
     def queryset(self, request, queryset):
-        qs = queryset.annotate(
-            total_paid_amount=Coalesce(
-                Sum("payments__amount"), Value(0, output_field=DecimalField())
-            )
-        )
+        # Mismo saldo que muestra la columna "Saldo Pendiente"
+        qs = queryset.with_financials()
         if self.value() == "with_balance":
-            return qs.filter(expected_amount__gt=F("total_paid_amount"))
+            return qs.filter(balance_total__gt=0)
         if self.value() == "no_balance":
-            return qs.filter(expected_amount__lte=F("total_paid_amount"))
+            return qs.filter(balance_total__lte=0)
         return qs
 
 
@@ -342,6 +338,15 @@ class AppointmentAdmin(admin.ModelAdmin):
     inlines = [MedicalDocumentInlineForAppointment]
     readonly_fields = ("total_paid_display", "balance_due_display")
 
+    def get_queryset(self, request):
+        # Montos anotados en SQL: evita 3-4 consultas por fila del listado
+        return (
+            super()
+            .get_queryset(request)
+            .with_financials()
+            .select_related("patient", "institution")
+        )
+
     def total_paid_display(self, obj):
         return f"{obj.total_paid():.2f}"
 
@@ -68,6 +68,9 @@ from .api_views import (
     appointments_pending_api,
     reports_api,
     reports_export_api,
+    report_jobs_api,
+    report_job_detail_api,
+    report_job_download_api,
     institution_settings_api,
     doctor_profile_settings_api,
     bcv_rate_api,
@@ -326,6 +329,17 @@ urlpatterns = [
     ),
     path("reports/", reports_api, name="reports-api"),
     path("reports/export/", reports_export_api, name="reports-export-api"),
+    path("reports/jobs/", report_jobs_api, name="report-jobs-api"),
+    path(
+        "reports/jobs/<uuid:job_uuid>/",
+        report_job_detail_api,
+        name="report-job-detail-api",
+    ),
+    path(
+        "reports/jobs/<uuid:job_uuid>/download/",
+        report_job_download_api,
+        name="report-job-download-api",
+    ),
     path(
         "config/institution/", institution_settings_api, name="institution-settings-api"
     ),
@@ -496,6 +510,21 @@ urlpatterns = [
     # --- Auditoría ---
     path("events/", api_views.event_log_api, name="event-log-api"),
     path("notifications/", notifications_api, name="notifications-api"),
+    path(
+        "notifications/inbox/",
+        api_views.notification_inbox_api,
+        name="notification-inbox-api",
+    ),
+    path(
+        "notifications/unread-count/",
+        api_views.notification_unread_count_api,
+        name="notification-unread-count-api",
+    ),
+    path(
+        "notifications/mark-read/",
+        api_views.notification_mark_read_api,
+        name="notification-mark-read-api",
+    ),
     path(
         "audit/aggregates/", api_views.audit_dashboard_api, name="audit-dashboard-api"
     ),
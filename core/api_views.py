@@ -4,13 +4,14 @@ from rest_framework.decorators import (
     permission_classes,
     authentication_classes,
     action,
+    renderer_classes,
 )
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.conf import settings
 from rest_framework.authtoken.models import Token
 from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponse
+from django.http import FileResponse, HttpResponse, HttpResponseRedirect, QueryDict
 from django.template.loader import render_to_string
 from django.db.models import Sum, Count, Q, Max
 from .models import *
@@ -21,7 +22,9 @@ from datetime import datetime, timedelta, date  # as python_date
 from django.utils import timezone
 from django.utils.timezone import localdate
 import logging
-from weasyprint import HTML
+from core.utils.pdf_cache import PDFCache
+from core.utils.pdf_engine import PDFEngine, PDFEngineBusy
+from core.utils.qr import qr_data_uri
 from openpyxl import Workbook
 from decimal import Decimal
 import json
@@ -40,15 +43,22 @@ def remove_accents(text: str) -> str:
 from typing import Dict, Optional, cast, Any
 from rest_framework import filters
 from django_filters.rest_framework import DjangoFilterBackend
-import qrcode
-import base64
-from io import BytesIO
 from .services import generate_audit_code, get_bcv_rate, get_bcv_rate_logic
 from core.utils.document_verification import get_verification_url
 import traceback
 import secrets
 import string
-from core.permissions import IsDoctorOperatorOrReadOnly, can_access_patient
+from core.permissions import (
+    IsDoctorOperatorOrReadOnly,
+    PatientAccessScope,
+    can_access_patient,
+)
+from core.search import GlobalSearchEngine, PatientSearchIndex
+from core.utils.event_presentation import render_events
+from core.utils.notifications import NotificationInbox
+from core.utils.report_engine import ReportEngine
+from core.utils.report_export import EXPORT_RENDERERS, ReportExport
+from core.utils.report_jobs import ReportJobs
 from django.core.mail import send_mail
 from django.conf import settings
 from rest_framework.authentication import TokenAuthentication
@@ -143,7 +153,7 @@ class DoctorPatientRelationshipRequiredMixin:
         if not hasattr(user, "doctor_profile"):
             return queryset.none()
 
-        doctor = user.doctor_profile
+        scope = PatientAccessScope.for_request(self.request)
 
         patient_id = self.request.query_params.get("patient")
         if not patient_id:
@@ -155,20 +165,12 @@ class DoctorPatientRelationshipRequiredMixin:
             except (ValueError, TypeError):
                 return queryset.none()
 
-            patient_ids = DoctorPatientRelationship.objects.filter(
-                doctor=doctor, status="active"
-            ).values_list("patient_id", flat=True)
-
-            if target_id not in patient_ids:
+            if not scope.allows_as_doctor(target_id):
                 return queryset.none()
 
             return queryset.filter(patient_id=target_id)
 
-        patient_ids = DoctorPatientRelationship.objects.filter(
-            doctor=doctor, status="active"
-        ).values_list("patient_id", flat=True)
-
-        return queryset.filter(patient_id__in=patient_ids)
+        return scope.filter_doctor_queryset(queryset)
 
 
 class UnifiedPatientDoctorAccessMixin:
@@ -196,49 +198,20 @@ class UnifiedPatientDoctorAccessMixin:
         if not patient_id:
             patient_id = self.kwargs.get("patient_id") or self.kwargs.get("pk")
 
+        scope = PatientAccessScope.for_request(self.request)
+
         if patient_id:
             try:
                 target_id = int(patient_id)
             except (ValueError, TypeError):
                 return queryset.none()
 
-            if hasattr(user, "doctor_profile"):
-                doctor = user.doctor_profile
-                patient_ids = list(
-                    DoctorPatientRelationship.objects.filter(
-                        doctor=doctor, status="active"
-                    ).values_list("patient_id", flat=True)
-                )
-                if target_id in patient_ids:
-                    return queryset.filter(patient_id=target_id)
-
-            if hasattr(user, "patient_profile"):
-                patient_user = user.patient_profile
-                if can_access_patient(patient_user, target_id):
-                    return queryset.filter(patient_id=target_id)
+            if scope.allows(target_id):
+                return queryset.filter(patient_id=target_id)
 
             return queryset.none()
 
-        if hasattr(user, "doctor_profile"):
-            doctor = user.doctor_profile
-            patient_ids = list(
-                DoctorPatientRelationship.objects.filter(
-                    doctor=doctor, status="active"
-                ).values_list("patient_id", flat=True)
-            )
-            return queryset.filter(patient_id__in=patient_ids)
-
-        if hasattr(user, "patient_profile"):
-            patient_user = user.patient_profile
-            linked_ids = list(
-                PatientFamilyLink.objects.filter(
-                    patient_user=patient_user, status="active"
-                ).values_list("patient_id", flat=True)
-            )
-            linked_ids.append(patient_user.patient_id)
-            return queryset.filter(patient_id__in=linked_ids)
-
-        return queryset.none()
+        return scope.filter_queryset(queryset)
 
 
 # ==========================================
@@ -269,11 +242,9 @@ class PatientViewSet(viewsets.ModelViewSet):
             return queryset
 
         if hasattr(user, "doctor_profile"):
-            doctor = user.doctor_profile
-            patient_ids = DoctorPatientRelationship.objects.filter(
-                doctor=doctor, status="active"
-            ).values_list("patient_id", flat=True)
-            return queryset.filter(id__in=patient_ids)
+            return PatientAccessScope.for_request(
+                self.request
+            ).filter_doctor_queryset(queryset, field="id")
 
         if hasattr(user, "patient_profile"):
             return queryset.filter(id=user.patient_profile.patient_id)
@@ -927,11 +898,9 @@ class AppointmentViewSet(viewsets.ModelViewSet):
 
         # Filtro para Doctores (filtrar por relación doctor-paciente)
         if not user.is_superuser and hasattr(user, "doctor_profile"):
-            doctor = user.doctor_profile
-            patient_ids = DoctorPatientRelationship.objects.filter(
-                doctor=doctor, status="active"
-            ).values_list("patient_id", flat=True)
-            qs = qs.filter(patient_id__in=patient_ids)
+            qs = PatientAccessScope.for_request(self.request).filter_doctor_queryset(
+                qs
+            )
 
         # Filtro para Pacientes (solo sus propias citas)
         elif hasattr(user, "patient_profile"):
@@ -950,6 +919,11 @@ class AppointmentViewSet(viewsets.ModelViewSet):
         if appointment_date:
             qs = qs.filter(appointment_date=appointment_date)
 
+        # Saldo anotado en SQL solo para el detalle (get_balance_due); las
+        # acciones que escriben pagos u órdenes no deben leer anotaciones viejas
+        if self.action == "retrieve":
+            qs = qs.with_financials()
+
         return qs
 
     def perform_create(self, serializer):
@@ -1681,7 +1655,8 @@ def audit_dashboard_api(request):
 def appointment_search_api(request):
     """
     Busca citas por paciente, ID, o campos relacionados.
-    Soporta búsqueda por nombre, cédula, ID de cita, o fecha.
+    Soporta búsqueda por nombre, cédula, ID de cita, o fecha
+    (ver core.search.query_parser).
     ✅ SEGURIDAD: Solo retorna citas de pacientes con DoctorPatientRelationship activa
     """
     user = request.user
@@ -1691,12 +1666,7 @@ def appointment_search_api(request):
     if not hasattr(user, "doctor_profile"):
         return Response({"error": "No tienes acceso a este recurso"}, status=403)
 
-    doctor = user.doctor_profile
-    patient_ids = list(
-        DoctorPatientRelationship.objects.filter(
-            doctor=doctor, status="active"
-        ).values_list("patient_id", flat=True)
-    )
+    patient_ids = PatientAccessScope.for_request(request).doctor_patient_ids()
 
     q = request.query_params.get("q", "").strip()
     limit = int(request.query_params.get("limit", 10))
@@ -1705,40 +1675,9 @@ def appointment_search_api(request):
         return Response([])
 
     try:
-        from django.db import connection
-
-        db_vendor = connection.vendor
-
-        base_filter = Q(patient_id__in=patient_ids)
-
-        if db_vendor == "postgresql":
-            appointments = (
-                Appointment.objects.filter(
-                    base_filter,
-                    Q(patient__first_name__unaccent__icontains=q)
-                    | Q(patient__last_name__unaccent__icontains=q)
-                    | Q(patient__national_id__icontains=q)
-                    | Q(id__icontains=q)
-                    | Q(appointment_date__icontains=q),
-                )
-                .select_related("patient", "doctor", "institution")
-                .order_by("-appointment_date")[:limit]
-            )
-        else:
-            norm_q = remove_accents(q).lower()
-            pattern = rf"(?i){re.escape(norm_q)}"
-            appointments = (
-                Appointment.objects.filter(
-                    base_filter,
-                    Q(patient__first_name__regex=pattern)
-                    | Q(patient__last_name__regex=pattern)
-                    | Q(patient__national_id__icontains=q)
-                    | Q(id__icontains=q)
-                    | Q(appointment_date__icontains=q),
-                )
-                .select_related("patient", "doctor", "institution")
-                .order_by("-appointment_date")[:limit]
-            )
+        appointments = GlobalSearchEngine.search_appointments(
+            q, limit=limit, patient_scope=patient_ids
+        )
 
         serializer = AppointmentSerializer(appointments, many=True)
         return Response(serializer.data)
@@ -1751,7 +1690,8 @@ def appointment_search_api(request):
 def chargeorder_search_api(request):
     """
     Busca órdenes de cobro por paciente, ID, o campos relacionados.
-    Soporta búsqueda por nombre, cédula, ID de orden, ID de cita, o monto.
+    Soporta búsqueda por nombre, cédula, ID de orden, ID de cita, o fecha de emisión
+    (ver core.search.query_parser).
     ✅ SEGURIDAD: Solo retorna órdenes de pacientes con DoctorPatientRelationship activa
     """
     user = request.user
@@ -1761,12 +1701,7 @@ def chargeorder_search_api(request):
     if not hasattr(user, "doctor_profile"):
         return Response({"error": "No tienes acceso a este recurso"}, status=403)
 
-    doctor = user.doctor_profile
-    patient_ids = list(
-        DoctorPatientRelationship.objects.filter(
-            doctor=doctor, status="active"
-        ).values_list("patient_id", flat=True)
-    )
+    patient_ids = PatientAccessScope.for_request(request).doctor_patient_ids()
 
     q = request.query_params.get("q", "").strip()
     limit = int(request.query_params.get("limit", 10))
@@ -1775,43 +1710,9 @@ def chargeorder_search_api(request):
         return Response([])
 
     try:
-        from django.db import connection
-
-        db_vendor = connection.vendor
-        base_filter = Q(patient_id__in=patient_ids)
-
-        if db_vendor == "postgresql":
-            charge_orders = (
-                ChargeOrder.objects.filter(
-                    base_filter,
-                    Q(patient__first_name__unaccent__icontains=q)
-                    | Q(patient__middle_name__unaccent__icontains=q)
-                    | Q(patient__last_name__unaccent__icontains=q)
-                    | Q(patient__second_last_name__unaccent__icontains=q)
-                    | Q(patient__national_id__icontains=q)
-                    | Q(id__icontains=q)
-                    | Q(appointment__id__icontains=q),
-                )
-                .select_related("appointment", "patient", "institution", "doctor")
-                .order_by("-issued_at")[:limit]
-            )
-        else:
-            norm_q = remove_accents(q).lower()
-            pattern = rf"(?i){re.escape(norm_q)}"
-            charge_orders = (
-                ChargeOrder.objects.filter(
-                    base_filter,
-                    Q(patient__first_name__regex=pattern)
-                    | Q(patient__middle_name__regex=pattern)
-                    | Q(patient__last_name__regex=pattern)
-                    | Q(patient__second_last_name__regex=pattern)
-                    | Q(patient__national_id__icontains=q)
-                    | Q(id__icontains=q)
-                    | Q(appointment__id__icontains=q),
-                )
-                .select_related("appointment", "patient", "institution", "doctor")
-                .order_by("-issued_at")[:limit]
-            )
+        charge_orders = GlobalSearchEngine.search_orders(
+            q, limit=limit, patient_scope=patient_ids
+        )
 
         serializer = ChargeOrderSerializer(charge_orders, many=True)
         return Response(serializer.data)
@@ -1879,126 +1780,30 @@ def icd_search_api(request):
 def search(request):
     """
     Búsqueda global cross-entity para MEDOPZ.
-    Integra las búsquedas específicas que ya funcionan y están probadas.
-    Reutiliza la lógica existente para mantener consistencia y evitar duplicación.
+    Delegada en GlobalSearchEngine: los pacientes se resuelven una sola vez
+    contra el índice y citas/órdenes se buscan por patient_id__in o por PK.
     """
     query = request.GET.get("query", "").strip()
 
     if not query:
         return Response({"patients": [], "appointments": [], "orders": []})
 
-    # Inicializar resultados
-    patients_data = []
-    appointments_data = []
-    orders_data = []
-
     # Límite de resultados para evitar sobrecarga
     LIMIT = 5
 
     try:
-        from django.db import connection
-
-        db_vendor = connection.vendor
-
-        # 🔍 Búsqueda de Pacientes
-        from .models import Patient
-
-        if db_vendor == "postgresql":
-            patients = Patient.objects.filter(
-                Q(first_name__unaccent__icontains=query)
-                | Q(last_name__unaccent__icontains=query)
-                | Q(national_id__icontains=query)
-                | Q(email__icontains=query)
-            ).filter(active=True)[:LIMIT]
-        else:
-            norm_q = remove_accents(query).lower()
-            pattern = rf"(?i){re.escape(norm_q)}"
-            patients = Patient.objects.filter(
-                Q(first_name__regex=pattern)
-                | Q(last_name__regex=pattern)
-                | Q(national_id__icontains=query)
-                | Q(email__icontains=query)
-            ).filter(active=True)[:LIMIT]
-
-        from .serializers import PatientListSerializer
-
-        patients_data = PatientListSerializer(patients, many=True).data
-
-        # 📅 Búsqueda de Citas
-        from .models import Appointment
-
-        if db_vendor == "postgresql":
-            appointments = (
-                Appointment.objects.filter(
-                    Q(patient__first_name__unaccent__icontains=query)
-                    | Q(patient__last_name__unaccent__icontains=query)
-                    | Q(patient__national_id__icontains=query)
-                    | Q(id__icontains=query)
-                    | Q(appointment_date__icontains=query)
-                )
-                .select_related("patient", "doctor", "institution", "note")
-                .order_by("-appointment_date")[:LIMIT]
-            )
-        else:
-            norm_q = remove_accents(query).lower()
-            pattern = rf"(?i){re.escape(norm_q)}"
-            appointments = (
-                Appointment.objects.filter(
-                    Q(patient__first_name__regex=pattern)
-                    | Q(patient__last_name__regex=pattern)
-                    | Q(patient__national_id__icontains=query)
-                    | Q(id__icontains=query)
-                    | Q(appointment_date__icontains=query)
-                )
-                .select_related("patient", "doctor", "institution", "note")
-                .order_by("-appointment_date")[:LIMIT]
-            )
-
-        from .serializers import AppointmentSerializer
-
-        appointments_data = AppointmentSerializer(appointments, many=True).data
-
-        # 💳 Búsqueda de Órdenes de Cobro
-        from .models import ChargeOrder
-
-        if db_vendor == "postgresql":
-            charge_orders = (
-                ChargeOrder.objects.filter(
-                    Q(patient__first_name__unaccent__icontains=query)
-                    | Q(patient__last_name__unaccent__icontains=query)
-                    | Q(patient__national_id__icontains=query)
-                    | Q(id__icontains=query)
-                    | Q(appointment__id__icontains=query)
-                )
-                .select_related("appointment", "patient", "institution", "doctor")
-                .order_by("-issued_at")[:LIMIT]
-            )
-        else:
-            norm_q = remove_accents(query).lower()
-            pattern = rf"(?i){re.escape(norm_q)}"
-            charge_orders = (
-                ChargeOrder.objects.filter(
-                    Q(patient__first_name__regex=pattern)
-                    | Q(patient__last_name__regex=pattern)
-                    | Q(patient__national_id__icontains=query)
-                    | Q(id__icontains=query)
-                    | Q(appointment__id__icontains=query)
-                )
-                .select_related("appointment", "patient", "institution", "doctor")
-                .order_by("-issued_at")[:LIMIT]
-            )
-
-        # Serializar órdenes
-        from .serializers import ChargeOrderSerializer
-
-        orders_data = ChargeOrderSerializer(charge_orders, many=True).data
+        results = GlobalSearchEngine.search(query, limit=LIMIT)
 
         # Construir respuesta unificada
         return Response(
             {
-                "patients": patients_data,
-                "appointments": appointments_data,
-                "orders": orders_data,
+                "patients": PatientListSerializer(
+                    results["patients"], many=True
+                ).data,
+                "appointments": AppointmentSerializer(
+                    results["appointments"], many=True
+                ).data,
+                "orders": ChargeOrderSerializer(results["orders"], many=True).data,
             }
         )
 
@@ -2020,9 +1825,11 @@ def search(request):
 @permission_classes([IsAuthenticated])  # ← AGREGAR ESTA LÍNEA
 def appointments_pending_api(request):
     """
-    Obtiene TODAS las citas pendientes/programadas de la institución.
-    Incluye resumen financiero completo por cita.
+    Citas pendientes/programadas de la institución con su resumen financiero.
     Orden: más recientes primero (descendente por fecha).
+    Sin query params devuelve todas. Con limit y/o cursor se pagina por
+    keyset; si la página está llena, el cursor de la siguiente va en el
+    header X-Next-Cursor.
     """
     try:
         # Institución desde header o perfil del doctor
@@ -2035,85 +1842,27 @@ def appointments_pending_api(request):
                 {"error": "No se pudo determinar la institución"}, status=400
             )
 
-        # Query: todas las citas no completadas/canceladas
-        appointments = (
-            Appointment.objects.filter(
-                institution_id=institution_id,
-                status__in=["pending", "scheduled", "arrived", "in_consultation"],
+        limit = request.query_params.get("limit")
+        cursor = request.query_params.get("cursor")
+        page_size = None
+        if limit or cursor:
+            page_size = min(
+                int(limit) if limit else services.OPEN_APPOINTMENTS_DEFAULT_LIMIT,
+                services.OPEN_APPOINTMENTS_MAX_LIMIT,
             )
-            .select_related("patient", "institution")
-            .prefetch_related("charge_orders", "charge_orders__payments")
-            .order_by("-appointment_date", "-id")
-        )  # Más recientes primero
-
-        results = []
-        for appt in appointments:
-            # Obtener charge_order principal (excluir anuladas)
-            co = appt.charge_orders.exclude(status="void").first()
-
-            # Calcular totales
-            expected = float(co.total if co else (appt.expected_amount or 0))
-            payments = []
-            total_paid = 0.0
-
-            if co:
-                for p in co.payments.filter(status="confirmed"):
-                    payment_amount = float(p.amount or 0)
-                    total_paid += payment_amount
-                    payments.append(
-                        {
-                            "id": p.id,
-                            "amount": payment_amount,
-                            "method": p.method,
-                            "reference_number": p.reference_number,
-                            "received_at": p.received_at.isoformat()
-                            if p.received_at
-                            else None,
-                        }
-                    )
-
-            balance_due = expected - total_paid
-
-            # Determinar estado financiero
-            if total_paid >= expected and expected > 0:
-                financial_status = "paid"
-            elif total_paid > 0:
-                financial_status = "partially_paid"
-            else:
-                financial_status = "pending"
+        results = services.get_open_appointments(
+            institution_id, limit=page_size, cursor=cursor
+        )
 
-            results.append(
-                {
-                    "id": appt.id,
-                    "appointment_date": appt.appointment_date.isoformat(),
-                    "appointment_type": appt.appointment_type,
-                    "status": appt.status,
-                    "expected_amount": str(expected),
-                    "patient": {
-                        "id": appt.patient.id,
-                        "full_name": appt.patient.full_name,
-                        "national_id": appt.patient.national_id,
-                        "phone_number": appt.patient.phone_number,
-                    },
-                    "financial_summary": {
-                        "expected": expected,
-                        "paid": total_paid,
-                        "balance_due": balance_due,
-                        "status": financial_status,
-                    },
-                    "payments": payments,
-                    "charge_order": {
-                        "id": co.id,
-                        "status": co.status,
-                        "total_amount": expected,
-                    }
-                    if co
-                    else None,
-                }
+        response = Response(results)
+        if page_size and results and len(results) >= page_size:
+            response["X-Next-Cursor"] = services.encode_open_appointments_cursor(
+                results[-1]
             )
+        return response
 
-        return Response(results)
-
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
     except Exception as e:
         logger.error(f"Error en appointments_pending_api: {str(e)}")
         return Response({"error": str(e)}, status=500)
@@ -2136,24 +1885,15 @@ def appointment_detail_api(request, pk):
         if not hasattr(user, "doctor_profile"):
             return Response({"error": "No tienes acceso a este recurso"}, status=403)
 
-        doctor = user.doctor_profile
-
         appointment = (
-            Appointment.objects.select_related(
-                "patient", "doctor", "institution", "note"
-            )
+            Appointment.objects.with_financials()
+            .select_related("patient", "doctor", "institution", "note")
             .prefetch_related("diagnoses", "documents")
             .get(pk=pk)
         )
 
         patient_id = appointment.patient_id
-        patient_ids = list(
-            DoctorPatientRelationship.objects.filter(
-                doctor=doctor, status="active"
-            ).values_list("patient_id", flat=True)
-        )
-
-        if patient_id not in patient_ids:
+        if not PatientAccessScope.for_request(request).allows_as_doctor(patient_id):
             return Response(
                 {"error": "No tienes acceso a los datos de este paciente"}, status=403
             )
@@ -2321,9 +2061,12 @@ def event_log_api(request):
             entity_id=entity_id,
             patient_id=patient_id,
             limit=int(limit) if limit else None,
+            cursor=request.query_params.get("cursor"),
         )
 
-        return Response(data)
+        return audit_page_response(data, limit)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
     except Exception as e:
         logger.error(f"Error en event_log_api: {str(e)}")
         return Response({"error": str(e)}, status=500)
@@ -2335,113 +2078,19 @@ def reports_api(request):
     """
     Genera reportes financieros y clínicos por período.
     Nuevo paradigma: Agrupación por DoctorService (vía ChargeItem).
+    El cálculo vive en core/utils/report_engine.py.
     """
-    report_type = request.query_params.get("type", "FINANCIAL").upper()
-    start_date = request.query_params.get("start_date")
-    end_date = request.query_params.get("end_date")
-    currency = request.query_params.get("currency", "USD")
-
     try:
-        # Parsear fechas
-        start = datetime.strptime(start_date, "%Y-%m-%d").date() if start_date else None
-        end = datetime.strptime(end_date, "%Y-%m-%d").date() if end_date else None
-
-        rows = []
-
-        # --- REPORTE CLÍNICO (Agrupado por DoctorService) ---
-        if report_type in ["CLINICAL", "COMBINED"]:
-            # Filtrar citas por fecha
-            appointments = Appointment.objects.all()
-            if start:
-                appointments = appointments.filter(appointment_date__gte=start)
-            if end:
-                appointments = appointments.filter(appointment_date__lte=end)
-
-            # Obtener ítems de cobro asociados a las citas (vía ChargeOrder)
-            charge_items = ChargeItem.objects.filter(
-                order__appointment__in=appointments
-            ).select_related("doctor_service", "order__appointment")
-
-            # Agrupar por servicio y fecha de cita
-            items_by_service = (
-                charge_items.values(
-                    "doctor_service__name", "order__appointment__appointment_date"
-                )
-                .annotate(
-                    total_amount=Sum("subtotal"),  # Monto del ítem (subtotal)
-                    count=Count("id"),
-                )
-                .order_by("-order__appointment__appointment_date")
-            )
-
-            for item in items_by_service:
-                service_name = item["doctor_service__name"] or "General Service"
-                appointment_date = item["order__appointment__appointment_date"]
-
-                rows.append(
-                    {
-                        "id": f"CLI-{appointment_date}-{service_name}",
-                        "date": str(appointment_date),
-                        "type": "clinical",
-                        "entity": service_name,
-                        "status": "COMPLETED",
-                        "amount": float(item["total_amount"]),
-                        "currency": currency,
-                    }
-                )
-
-        # --- REPORTE FINANCIERO (Agrupado por DoctorService) ---
-        if report_type in ["FINANCIAL", "COMBINED"]:
-            # Filtrar pagos confirmados por fecha
-            payments = Payment.objects.filter(status="confirmed")
-            if start:
-                start_dt = timezone.make_aware(
-                    datetime.combine(start, datetime.min.time())
-                )
-                payments = payments.filter(received_at__gte=start_dt)
-            if end:
-                end_dt = timezone.make_aware(datetime.combine(end, datetime.max.time()))
-                payments = payments.filter(received_at__lte=end_dt)
-
-            # Obtener ítems de cobro asociados a los pagos (vía ChargeOrder)
-            charge_items = ChargeItem.objects.filter(
-                order__payments__in=payments
-            ).select_related("doctor_service", "order")
-
-            # Agrupar por servicio y fecha de pago
-            items_by_service = (
-                charge_items.values(
-                    "doctor_service__name", "order__payments__received_at__date"
-                )
-                .annotate(
-                    total_amount=Sum("subtotal"),  # Monto del ítem pagado
-                    count=Count("id"),
-                )
-                .order_by("-order__payments__received_at__date")
-            )
-
-            for item in items_by_service:
-                service_name = item["doctor_service__name"] or "General Service"
-                payment_date = item["order__payments__received_at__date"]
-
-                rows.append(
-                    {
-                        "id": f"FIN-{payment_date}-{service_name}",
-                        "date": str(payment_date),
-                        "type": "financial",
-                        "entity": service_name,
-                        "status": "CONFIRMED",
-                        "amount": float(item["total_amount"]),
-                        "currency": currency,
-                    }
-                )
-
-        # Ordenar filas combinadas por fecha
-        if report_type == "COMBINED":
-            rows.sort(key=lambda x: x.get("date", ""), reverse=True)
-
+        rows = ReportEngine(
+            request.query_params.get("type", "FINANCIAL"),
+            start_date=request.query_params.get("start_date"),
+            end_date=request.query_params.get("end_date"),
+            currency=request.query_params.get("currency", "USD"),
+        ).rows()
         return Response(rows)
 
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
     except Exception as e:
         logger.error(f"Error en reports_api: {str(e)}")
         return Response({"error": str(e)}, status=500)
@@ -2643,149 +2292,102 @@ def approve_minor_consent(request, patient_id):
 
 
 @api_view(["GET"])
+@renderer_classes(EXPORT_RENDERERS)
 def reports_export_api(request):
     """
-    Exporta reportes a formato Excel (XLSX).
-    Usa la función existente generate_excel_report si está disponible en services.py
+    Exporta reportes (FINANCIAL, CLINICAL, COMBINED) a Excel (XLSX) o CSV.
+    Streaming por bloques: ver core/utils/report_export.ReportExport.
+    Acotado a la institución activa y a los pacientes del usuario.
     """
+    institution = getattr(request, "current_institution", None)
+    if institution is None:
+        return Response(
+            {"error": "No se pudo determinar la institución"}, status=400
+        )
     try:
-        report_type = request.query_params.get("type", "FINANCIAL")
-        start_date = request.query_params.get("start_date")
-        end_date = request.query_params.get("end_date")
-        currency = request.query_params.get("currency", "USD")
-        export_format = request.query_params.get("format", "excel")
-
-        # Verificar si la función existe en services.py
-        from . import services
-
-        if not hasattr(services, "generate_excel_report"):
-            return Response(
-                {"error": "Función de exportación no disponible"}, status=501
-            )
-
-        # Preparar datos según el tipo
-        data = []
-
-        if report_type == "FINANCIAL":
-            # Reporte financiero: pagos por período
-            payments = Payment.objects.filter(status="confirmed").select_related(
-                "charge_order", "charge_order__patient"
-            )
-
-            if start_date:
-                payments = payments.filter(received_at__date__gte=start_date)
-            if end_date:
-                payments = payments.filter(received_at__date__lte=end_date)
-
-            for p in payments:
-                data.append(
-                    {
-                        "ID": p.id,
-                        "Fecha de Pago": p.received_at.strftime("%d/%m/%Y")
-                        if p.received_at
-                        else "",
-                        "Monto": float(p.amount),
-                        "Método": p.method or "",
-                        "Orden de Cobro": p.charge_order.id if p.charge_order else "",
-                        "Estado": p.status,
-                    }
-                )
-
-        elif report_type == "CLINICAL":
-            # Reporte clínico: citas por período
-            appointments = Appointment.objects.filter(
-                status__in=["pending", "completed", "canceled"]
-            )
-
-            if start_date:
-                appointments = appointments.filter(appointment_date__gte=start_date)
-            if end_date:
-                appointments = appointments.filter(appointment_date__lte=end_date)
-
-            for apt in appointments:
-                data.append(
-                    {
-                        "ID": apt.id,
-                        "Fecha de Cita": apt.appointment_date.strftime("%d/%m/%Y")
-                        if apt.appointment_date
-                        else "",
-                        "Paciente": apt.patient.full_name if apt.patient else "",
-                        "Estado": apt.get_status_display() or "",
-                        "Médico": apt.doctor.full_name if apt.doctor else "",
-                    }
-                )
-
-        elif report_type == "COMBINED":
-            # Reporte combinado: pagos + citas
-            # Pagos
-            payments = Payment.objects.filter(status="confirmed").select_related(
-                "charge_order", "charge_order__patient"
-            )
+        export = ReportExport(
+            report_type=request.query_params.get("type", "FINANCIAL"),
+            start_date=request.query_params.get("start_date"),
+            end_date=request.query_params.get("end_date"),
+            currency=request.query_params.get("currency", "USD"),
+            institution_id=institution.pk,
+            scope=PatientAccessScope.for_request(request),
+        )
+        return export.response(request.query_params.get("format", "excel"))
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
+    except Exception as e:
+        logger.error(f"Error en reports_export_api: {str(e)}")
+        return Response({"error": str(e)}, status=500)
 
-            if start_date:
-                payments = payments.filter(received_at__date__gte=start_date)
-            if end_date:
-                payments = payments.filter(received_at__date__lte=end_date)
 
-            for p in payments:
-                data.append(
-                    {
-                        "ID": p.id,
-                        "Tipo": "Pago",
-                        "Fecha": p.received_at.strftime("%d/%m/%Y")
-                        if p.received_at
-                        else "",
-                        "Monto": float(p.amount),
-                        "Método": p.method or "",
-                        "Estado": p.status,
-                    }
-                )
+@api_view(["POST"])
+def report_jobs_api(request):
+    """
+    Crea un reporte en segundo plano (o reutiliza uno idéntico reciente).
 
-            # Citas
-            appointments = Appointment.objects.filter(
-                status__in=["pending", "completed", "canceled"]
+    Body: {"kind": "export", "type", "start_date", "end_date", "currency",
+    "format": "excel|csv"} o {"kind": "institutional", "format": "pdf|excel",
+    "filters", "data", "currency"}. Responde 202 mientras se genera.
+    Los export se acotan a la institución activa y a los pacientes del usuario.
+    """
+    # Formulario: un valor por campo (dict(QueryDict) daría listas)
+    params: Dict[str, Any]
+    if isinstance(request.data, QueryDict):
+        params = request.data.dict()
+    else:
+        params = dict(request.data)
+    kind = params.pop("kind", "export")
+    if kind == "export":
+        institution = getattr(request, "current_institution", None)
+        if institution is None:
+            return Response(
+                {"error": "No se pudo determinar la institución"}, status=400
             )
+        params["institution_id"] = institution.pk
+    if kind == "institutional" and request.user.is_authenticated:
+        params.setdefault(
+            "user_name", request.user.get_full_name() or request.user.get_username()
+        )
+    try:
+        job, reused = ReportJobs.submit(kind, params, user=request.user)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
 
-            if start_date:
-                appointments = appointments.filter(appointment_date__gte=start_date)
-            if end_date:
-                appointments = appointments.filter(appointment_date__lte=end_date)
+    serializer = ReportJobSerializer(job, context={"request": request})
+    return Response(
+        {**serializer.data, "reused": reused},
+        status=200 if job.status == "done" else 202,
+    )
 
-            for apt in appointments:
-                data.append(
-                    {
-                        "ID": apt.id,
-                        "Tipo": "Cita",
-                        "Fecha": apt.appointment_date.strftime("%d/%m/%Y")
-                        if apt.appointment_date
-                        else "",
-                        "Paciente": apt.patient.full_name if apt.patient else "",
-                        "Estado": apt.get_status_display() or "",
-                        "Médico": apt.doctor.full_name if apt.doctor else "",
-                    }
-                )
-        else:
-            return Response(
-                {"error": f"Tipo de reporte no soportado: {report_type}"}, status=400
-            )
 
-        # Usar función de exportación si existe
-        file, content_type, filename = services.generate_excel_report(
-            report_type=report_type,
-            data=data,
-            start=start_date,
-            end=end_date,
-            currency=currency,
-        )
+@api_view(["GET"])
+def report_job_detail_api(request, job_uuid):
+    """Estado de un reporte en segundo plano (polling). Solo para quien lo pidió."""
+    job = get_object_or_404(ReportJobs.for_user(request.user), uuid=job_uuid)
+    if job.status in ("pending", "running") and ReportJobs.fail_stale(
+        ReportJob.objects.filter(pk=job.pk)
+    ):
+        job.refresh_from_db()
+    return Response(ReportJobSerializer(job, context={"request": request}).data)
 
-        # Retornar archivo para descargar
-        response = HttpResponse(file, content_type=content_type)
-        response["Content-Disposition"] = f'attachment; filename="{filename}"'
-        return response
 
-    except Exception as e:
-        logger.error(f"Error en reports_export_api: {str(e)}")
-        return Response({"error": str(e)}, status=500)
+@api_view(["GET"])
+def report_job_download_api(request, job_uuid):
+    """Descarga el artefacto de un reporte terminado. Solo para quien lo pidió."""
+    job = get_object_or_404(
+        ReportJobs.for_user(request.user), uuid=job_uuid, status="done"
+    )
+    if job.file_url:
+        return HttpResponseRedirect(job.file_url)
+    if not job.file:
+        return Response({"error": "Archivo no disponible"}, status=404)
+    return FileResponse(
+        job.file.open("rb"),
+        as_attachment=True,
+        filename=job.filename,
+        content_type=job.content_type,
+    )
 
 
 @api_view(["GET"])
@@ -2793,65 +2395,44 @@ def documents_api(request):
     return Response([])
 
 
+def serialize_notifications(notifications):
+    """Eventos de la bandeja en el formato de EventSerializer + estado de lectura."""
+    data = render_events([n.event for n in notifications])
+    for item, notification in zip(data, notifications):
+        item["notification_id"] = notification.id
+        item["is_read"] = notification.is_read
+    return data
+
+
 @api_view(["GET"])
 def notifications_api(request):
     """
-    Devuelve las 3 notificaciones más recientes de los últimos 7 días.
-    Filtra por notify=True (solo eventos que deben mostrarse).
-    Si no hay eventos con notify=True, hace fallback a los últimos 3 eventos.
+    Devuelve las 3 notificaciones más recientes de los últimos 7 días,
+    desde la bandeja materializada del usuario (NotificationInbox).
+    El contador de no leídas va en el header X-Unread-Count.
     """
     try:
-        # get_audit_logic devuelve directamente una LISTA de eventos
-        try:
-            all_events = services.get_audit_logic(
-                limit=10
-            )  # ✅ AUMENTADO: Traer más para filtrar
-        except Exception as e:
-            logger.error(f"Error en get_audit_logic: {str(e)}")
-            all_events = []
-
-        # Asegurar que es una lista
-        if not all_events:
-            all_events = []
-        elif not isinstance(all_events, list):
-            all_events = list(all_events)
-
-        # Filtrar por notify=True (solo notificaciones)
-        notifications = [
-            e for e in all_events if isinstance(e, dict) and e.get("notify", False)
-        ]
-
-        # Si hay eventos con notify=True, procesarlos
-        if notifications:
-            # Ordenar por timestamp descendente
-            try:
-                notifications.sort(key=lambda x: x.get("timestamp", ""), reverse=True)
-            except Exception:
-                pass
-
-            # Tomar las 3 notificaciones más recientes
-            top_3 = notifications[:3]
-
-            # Filtrar por ventana de 7 días
-            try:
-                cutoff = datetime.now() - timedelta(days=7)
-                recent = [
-                    n
-                    for n in top_3
-                    if n.get("timestamp")
-                    and datetime.fromisoformat(n["timestamp"]) > cutoff
-                ]
-            except Exception:
-                recent = top_3
+        cutoff = timezone.now() - timedelta(days=7)
+        user = request.user
 
-            # Si hay notificaciones recientes, devolverlas
-            if recent:
-                return Response(recent)
+        if user and user.is_authenticated:
+            recent = serialize_notifications(
+                NotificationInbox.page(user, limit=3, since=cutoff)
+            )
+            unread = NotificationInbox.unread_count(user)
+        else:
+            # Modo desarrollo sin autenticación: feed global
+            recent = render_events(
+                Event.objects.filter(notify=True, timestamp__gte=cutoff).order_by(
+                    "-timestamp", "-id"
+                )[:3]
+            )
+            unread = len(recent)
 
-        # ✅ NUEVO FALLBACK: Si no hay notify=True, mostrar últimos 3 eventos
-        fallback_events = all_events[:3]
-        if fallback_events:
-            return Response(fallback_events)
+        if recent:
+            response = Response(recent)
+            response["X-Unread-Count"] = str(unread)
+            return response
 
         # Si no hay notificaciones ni eventos, devolver evento de "sin actividad"
         no_activity = [
@@ -2903,6 +2484,68 @@ def notifications_api(request):
         )
 
 
+@api_view(["GET"])
+def notification_inbox_api(request):
+    """
+    Bandeja de notificaciones del usuario, paginada por keyset.
+    Query params: cursor (id de la última notificación), limit, unread=1.
+    """
+    user = request.user
+    if not user or not user.is_authenticated:
+        return Response({"error": "No autenticado"}, status=401)
+
+    try:
+        cursor = request.query_params.get("cursor")
+        limit = request.query_params.get("limit")
+        notifications = NotificationInbox.page(
+            user,
+            cursor=int(cursor) if cursor else None,
+            limit=int(limit) if limit else NotificationInbox.DEFAULT_LIMIT,
+            unread_only=request.query_params.get("unread") in ("1", "true"),
+        )
+    except ValueError:
+        return Response({"error": "Parámetros de paginación inválidos"}, status=400)
+
+    page_size = int(limit) if limit else NotificationInbox.DEFAULT_LIMIT
+    return Response(
+        {
+            "results": serialize_notifications(notifications),
+            "unread_count": NotificationInbox.unread_count(user),
+            "next_cursor": (
+                notifications[-1].id if len(notifications) >= page_size else None
+            ),
+        }
+    )
+
+
+@api_view(["GET"])
+def notification_unread_count_api(request):
+    """Contador de no leídas para el badge del header (cacheado)."""
+    user = request.user
+    if not user or not user.is_authenticated:
+        return Response({"error": "No autenticado"}, status=401)
+    return Response({"unread_count": NotificationInbox.unread_count(user)})
+
+
+@api_view(["POST"])
+def notification_mark_read_api(request):
+    """Marca como leídas las notificaciones `ids` (o todas si no se envían)."""
+    user = request.user
+    if not user or not user.is_authenticated:
+        return Response({"error": "No autenticado"}, status=401)
+
+    ids = request.data.get("ids")
+    if ids is not None and not isinstance(ids, list):
+        return Response({"error": "ids debe ser una lista"}, status=400)
+    try:
+        updated = NotificationInbox.mark_read(user, ids)
+    except (TypeError, ValueError):
+        return Response({"error": "ids inválidos"}, status=400)
+    return Response(
+        {"updated": updated, "unread_count": NotificationInbox.unread_count(user)}
+    )
+
+
 # PDF y Generación
 @api_view(["POST", "GET"])
 def generate_medical_report(request, pk):
@@ -2981,11 +2624,7 @@ def generate_medical_report(request, pk):
             doctor_specialties = [s.name for s in doctor.specialties.all()]
 
         audit_code = generate_audit_code(appointment, patient)
-        qr_img = qrcode.make(get_verification_url(audit_code))
-        buffer = BytesIO()
-        qr_img.save(buffer, "PNG")
-        qr_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
-        qr_code_url = f"data:image/png;base64,{qr_base64}"
+        qr_code_url = qr_data_uri(get_verification_url(audit_code), border=4)
 
         context = {
             "data": report,
@@ -3006,12 +2645,9 @@ def generate_medical_report(request, pk):
             "generated_at": timezone.now(),
         }
 
-        html_string = render_to_string(
-            "medical/documents/medical_report_universal.html", context
-        )
-        pdf_bytes = (
-            HTML(string=html_string, base_url=settings.MEDIA_ROOT).write_pdf() or b""
-        )
+        template_name = "medical/documents/medical_report_universal.html"
+        html_string = render_to_string(template_name, context)
+        pdf_bytes = PDFEngine.render_html(html_string, template_name=template_name)
 
         filename = f"medical_report_{appointment.id}_{report.id}_{audit_code}.pdf"
 
@@ -3054,6 +2690,8 @@ def generate_medical_report(request, pk):
 
         return response
 
+    except PDFEngineBusy as e:
+        return Response({"error": str(e)}, status=503)
     except Exception as e:
         logger.error(f"Error generando informe médico: {str(e)}")
         return Response({"error": str(e)}, status=500)
@@ -3082,14 +2720,17 @@ def generate_prescription_pdf(request, pk):
         # ✅ GENERACIÓN DE PDF (corregido)
         pdf_bytes, filename, audit_code = services.generate_generic_pdf(
             prescription,
-            "prescriptions",
+            "prescription",
             request.current_institution,  # <--- Opción C: Usar institución activa
+            use_cache=True,  # reimpresión sin cambios: PDF y código de la cache
         )
 
         response = HttpResponse(pdf_bytes, content_type="application/pdf")
         response["Content-Disposition"] = f'attachment; filename="{filename}"'
         return response
 
+    except PDFEngineBusy as e:
+        return Response({"error": str(e)}, status=503)
     except Exception as e:
         logger.error(f"Error generando PDF de receta: {str(e)}", exc_info=True)
         return Response({"error": "Error interno del servidor"}, status=500)
@@ -3118,14 +2759,17 @@ def generate_treatment_pdf(request, pk):
         # ✅ GENERACIÓN DE PDF (corregido)
         pdf_bytes, filename, audit_code = services.generate_generic_pdf(
             treatment,
-            "treatments",
+            "treatment",
             request.current_institution,  # <--- Opción C: Usar institución activa
+            use_cache=True,  # reimpresión sin cambios: PDF y código de la cache
         )
 
         response = HttpResponse(pdf_bytes, content_type="application/pdf")
         response["Content-Disposition"] = f'attachment; filename="{filename}"'
         return response
 
+    except PDFEngineBusy as e:
+        return Response({"error": str(e)}, status=503)
     except Exception as e:
         logger.error(f"Error generando PDF de tratamiento: {str(e)}", exc_info=True)
         return Response({"error": "Error interno del servidor"}, status=500)
@@ -3154,14 +2798,17 @@ def generate_referral_pdf(request, pk):
         # ✅ GENERACIÓN DE PDF (corregido)
         pdf_bytes, filename, audit_code = services.generate_generic_pdf(
             referral,
-            "referrals",
+            "medical_referral",
             request.current_institution,  # <--- Opción C: Usar institución activa
+            use_cache=True,  # reimpresión sin cambios: PDF y código de la cache
         )
 
         response = HttpResponse(pdf_bytes, content_type="application/pdf")
         response["Content-Disposition"] = f'attachment; filename="{filename}"'
         return response
 
+    except PDFEngineBusy as e:
+        return Response({"error": str(e)}, status=503)
     except Exception as e:
         logger.error(f"Error generando PDF de referencia: {str(e)}", exc_info=True)
         return Response({"error": "Error interno del servidor"}, status=500)
@@ -3192,14 +2839,6 @@ def generate_chargeorder_pdf(request, pk):
         paid_amount = sum(p.amount for p in payments)
         balance_due = charge_order.balance_due
 
-        # Generar código de auditoría
-        audit_code = generate_audit_code(charge_order.appointment, charge_order.patient)
-        qr_img = qrcode.make(get_verification_url(audit_code))
-        buffer = BytesIO()
-        qr_img.save(buffer, "PNG")
-        qr_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
-        qr_code_url = f"data:image/png;base64,{qr_base64}"
-
         METHOD_LABELS = {
             "cash": "Efectivo",
             "card": "Tarjeta / Punto de Venta",
@@ -3286,22 +2925,36 @@ def generate_chargeorder_pdf(request, pk):
             "total": str(charge_order.total),
             "paid_amount": str(paid_amount),
             "balance_due": str(balance_due),
-            "generated_at": timezone.now(),
-            "audit_code": audit_code,
-            "qr_code_url": qr_code_url,
             "status_label": status_label,
         }
+        template_name = "medical/documents/charge_order.html"
 
-        html_string = render_to_string("medical/documents/charge_order.html", context)
+        def render():
+            # Código de auditoría: solo si el contenido cambió (PDFCache)
+            audit_code = generate_audit_code(
+                charge_order.appointment, charge_order.patient
+            )
+            html_string = render_to_string(
+                template_name,
+                {
+                    **context,
+                    "generated_at": timezone.now(),
+                    "audit_code": audit_code,
+                    "qr_code_url": qr_data_uri(
+                        get_verification_url(audit_code), border=4
+                    ),
+                },
+            )
 
-        # DEBUG: Verificar que el HTML se renderizó
-        logger.info(f"[CHARGE_ORDER_PDF] HTML length: {len(html_string)} chars")
-        logger.info(f"[CHARGE_ORDER_PDF] HTML preview: {html_string[:200]}...")
+            # DEBUG: Verificar que el HTML se renderizó
+            logger.info(f"[CHARGE_ORDER_PDF] HTML length: {len(html_string)} chars")
+            logger.info(f"[CHARGE_ORDER_PDF] HTML preview: {html_string[:200]}...")
 
-        # Generar PDF con fallback
-        pdf_bytes = (
-            HTML(string=html_string, base_url=settings.MEDIA_ROOT).write_pdf() or b""
-        )
+            # Generar PDF con fallback
+            pdf_bytes = PDFEngine.render_html(html_string, template_name=template_name)
+            return pdf_bytes, f"ORD-{charge_order.id}.pdf", audit_code
+
+        pdf_bytes, filename, _ = PDFCache.get_or_render(template_name, context, render)
 
         # DEBUG: Verificar PDF
         logger.info(f"[CHARGE_ORDER_PDF] PDF length: {len(pdf_bytes)} bytes")
@@ -3314,10 +2967,11 @@ def generate_chargeorder_pdf(request, pk):
             return Response({"error": "Error generando PDF"}, status=500)
 
         response = HttpResponse(pdf_bytes, content_type="application/pdf")
-        filename = f"ORD-{charge_order.id}.pdf"
         response["Content-Disposition"] = f'attachment; filename="{filename}"'
         return response
 
+    except PDFEngineBusy as e:
+        return Response({"error": str(e)}, status=503)
     except Exception as e:
         logger.error(f"Error generando orden de cobro: {str(e)}")
         import traceback
@@ -3692,12 +3346,24 @@ def metrics_api(request):
 @api_view(["GET"])
 @permission_classes([conditional_permission()])
 def dashboard_summary_api(request):
+    """
+    Resumen del dashboard de la institución activa (request.current_institution:
+    X-Institution-ID o, sin header, la institución activa del doctor). Sin
+    institución responde 400: nunca devuelve totales globales. Cacheado por
+    DashboardEngine.
+    """
     start_date = request.query_params.get("start_date")
     end_date = request.query_params.get("end_date")
     range_param = request.query_params.get("range")
     currency = request.query_params.get("currency", "USD")
     status_param = request.query_params.get("status")
 
+    institution = getattr(request, "current_institution", None)
+    if institution is None:
+        return Response(
+            {"error": "No se pudo determinar la institución"}, status=400
+        )
+
     try:
         data = services.get_dashboard_summary_data(
             start_date=start_date,
@@ -3705,6 +3371,7 @@ def dashboard_summary_api(request):
             range_param=range_param,
             currency=currency,
             status_param=status_param,
+            institution_id=institution.pk,
         )
         return Response(data)
     except Exception as e:
@@ -3713,6 +3380,10 @@ def dashboard_summary_api(request):
 
 @api_view(["GET"])
 def patient_search_api(request):
+    """
+    Búsqueda de pacientes por nombre o cédula.
+    Usa el índice de búsqueda (search_document) con ranking por relevancia.
+    """
     q = request.query_params.get("q", "").strip()
     limit = int(request.query_params.get("limit", 10))
 
@@ -3720,34 +3391,9 @@ def patient_search_api(request):
         return Response({"results": [], "count": 0})
 
     try:
-        from django.db import connection
-
-        db_vendor = connection.vendor
-
-        words = q.split()
-        query = Q(active=True)
-
-        for word in words:
-            if db_vendor == "postgresql":
-                query &= (
-                    Q(first_name__unaccent__icontains=word)
-                    | Q(middle_name__unaccent__icontains=word)
-                    | Q(last_name__unaccent__icontains=word)
-                    | Q(second_last_name__unaccent__icontains=word)
-                    | Q(national_id__icontains=word)
-                )
-            else:
-                w = remove_accents(word).lower()
-                pattern = rf"(?i){re.escape(w)}"
-                query &= (
-                    Q(first_name__regex=pattern)
-                    | Q(middle_name__regex=pattern)
-                    | Q(last_name__regex=pattern)
-                    | Q(second_last_name__regex=pattern)
-                    | Q(national_id__icontains=word)
-                )
-
-        patients = Patient.objects.filter(query)[:limit]
+        patients = PatientSearchIndex.search(
+            q, Patient.objects.filter(active=True)
+        )[:limit]
 
         serializer = PatientListSerializer(patients, many=True)
         return Response({"results": serializer.data, "count": len(serializer.data)})
@@ -3898,6 +3544,18 @@ def waived_consultations_api(request):
         return Response({"error": str(e)}, status=500)
 
 
+def audit_page_response(data, limit=None):
+    """
+    Respuesta de una página de auditoría (lista de eventos). Si la página
+    está llena, el cursor de la siguiente va en el header X-Next-Cursor.
+    """
+    response = Response(data)
+    page_size = int(limit) if limit else services.AUDIT_DEFAULT_LIMIT
+    if isinstance(data, list) and data and len(data) >= page_size:
+        response["X-Next-Cursor"] = services.encode_audit_cursor(data[-1])
+    return response
+
+
 @api_view(["GET"])
 def audit_log_api(request):
     entity = request.query_params.get("entity")
@@ -3911,8 +3569,11 @@ def audit_log_api(request):
             entity_id=entity_id,
             patient_id=patient_id,
             limit=int(limit) if limit else None,
+            cursor=request.query_params.get("cursor"),
         )
-        return Response(data)
+        return audit_page_response(data, limit)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
     except Exception as e:
         return Response({"error": str(e)}, status=500)
 
@@ -3942,13 +3603,7 @@ def audit_by_patient(request, patient_id):
         return Response({"error": "ID de paciente inválido"}, status=400)
 
     if hasattr(user, "doctor_profile"):
-        doctor = user.doctor_profile
-        patient_ids = list(
-            DoctorPatientRelationship.objects.filter(
-                doctor=doctor, status="active"
-            ).values_list("patient_id", flat=True)
-        )
-        if target_id not in patient_ids:
+        if not PatientAccessScope.for_request(request).allows_as_doctor(target_id):
             return Response(
                 {"error": "No tienes acceso a los datos de este paciente"}, status=403
             )
@@ -3961,9 +3616,16 @@ def audit_by_patient(request, patient_id):
     else:
         return Response({"error": "No tienes acceso a este recurso"}, status=403)
 
+    limit = request.query_params.get("limit")
     try:
-        data = services.get_audit_logic(patient_id=patient_id)
-        return Response(data)
+        data = services.get_audit_logic(
+            patient_id=target_id,
+            limit=int(limit) if limit else None,
+            cursor=request.query_params.get("cursor"),
+        )
+        return audit_page_response(data, limit)
+    except ValueError as e:
+        return Response({"error": str(e)}, status=400)
     except Exception as e:
         return Response({"error": str(e)}, status=500)
 
@@ -4240,7 +3902,6 @@ def verify_weasyprint_output(request):
     """Endpoint que verifica qué produce WeasyPrint SIN errores de TypeScript"""
     try:
         import os
-        from weasyprint import HTML
         from django.template.loader import render_to_string
         from django.utils import timezone
         from typing import Dict, Any
@@ -4254,9 +3915,12 @@ def verify_weasyprint_output(request):
         print(f"🔍 [VERIFY] Template rendered: {len(html_string)} chars")
         print(f"🔍 [VERIFY] HTML preview: {html_string[:100]}...")
 
-        # 2. WeasyPrint generation
-        html_obj = HTML(string=html_string)
-        pdf_bytes = html_obj.write_pdf()
+        # 2. WeasyPrint generation (pool de procesos de PDFEngine)
+        pdf_bytes = PDFEngine.render_html(
+            html_string,
+            base_url="",
+            template_name="medical/documents/medical_report.html",
+        )
         print(f"🔍 [VERIFY] WeasyPrint called, type: {type(pdf_bytes)}")
 
         # 🔥 NUEVO: Verificación segura del valor None
@@ -4384,60 +4048,41 @@ def active_institution_with_metrics(request):
     range_param = request.GET.get("range", "day")
     currency = request.GET.get("currency", "USD")
 
-    # Calcular rango de fechas
-    now = timezone.now()
+    # Calcular rango de fechas (días locales, como los rollups)
+    today = timezone.localdate()
     if range_param == "day":
-        start_date = now.date()
-        end_date = now.date() + timedelta(days=1)
+        start_date = today
+        end_date = today + timedelta(days=1)
     elif range_param == "week":
-        start_date = now.date() - timedelta(days=7)
-        end_date = now.date() + timedelta(days=1)
+        start_date = today - timedelta(days=7)
+        end_date = today + timedelta(days=1)
     else:  # month
-        start_date = now.date() - timedelta(days=30)
-        end_date = now.date() + timedelta(days=1)
+        start_date = today - timedelta(days=30)
+        end_date = today + timedelta(days=1)
 
     # Métricas específicas para esta institución
     try:
-        # ✅ OPTIMIZADO: Una sola query con agregación condicional para citas
-        from django.db.models import Count, Case, When, Sum, Q
-
-        appointment_metrics = Appointment.objects.filter(
-            institution=active_inst
-        ).aggregate(
-            scheduled_count=Count(
-                Case(
-                    When(
-                        status="scheduled",
-                        appointment_date__gte=start_date,
-                        appointment_date__lt=end_date,
-                        then=1,
-                    )
-                )
-            ),
-            pending_count=Count(Case(When(status="pending", then=1))),
-            waiting_count=Count(Case(When(status="arrived", then=1))),
-            in_consultation_count=Count(Case(When(status="in_consultation", then=1))),
-            completed_count=Count(
-                Case(
-                    When(
-                        status="completed",
-                        appointment_date__gte=start_date,
-                        appointment_date__lt=end_date,
-                        then=1,
-                    )
-                )
-            ),
-        )
-
-        # ✅ OPTIMIZADO: Una sola query para métricas financieras
-        financial_metrics = ChargeOrder.objects.filter(
-            institution=active_inst, issued_at__gte=start_date, issued_at__lt=end_date
-        ).aggregate(
-            total_usd=Sum("total"),
-            exempted_count=Count(Case(When(status="waived", then=1))),
+        # Rollups diarios: estados actuales (histórico completo, una fila por
+        # día) y métricas del rango sin recorrer citas/órdenes/pagos
+        from .utils.rollups import DailyRollup
+
+        current = DailyRollup.totals(
+            "appointments_pending",
+            "appointments_arrived",
+            "appointments_in_consultation",
+            institution_id=active_inst.id,
+        )
+        in_range = DailyRollup.totals(
+            "appointments_completed",
+            "billed_total",
+            "waived_count",
+            "payments_count",
+            start=start_date,
+            end=end_date - timedelta(days=1),
+            institution_id=active_inst.id,
         )
 
-        total_usd = financial_metrics["total_usd"] or Decimal("0.00")
+        total_usd = in_range["billed_total"]
 
         # ✅ FIX: Obtener tasa BCV con manejo de errores mejorado
         # Esta función ahora solo usa cache, nunca hace scraping
@@ -4455,23 +4100,16 @@ def active_institution_with_metrics(request):
         else:
             total_amount = float(total_usd)
 
-        # ✅ Pagos confirmados
-        payments_count = Payment.objects.filter(
-            charge_order__institution=active_inst,
-            received_at__gte=start_date,
-            received_at__lt=end_date,
-            status="confirmed",
-        ).count()
-
         metrics = {
-            "scheduled_count": appointment_metrics["scheduled_count"],
-            "pending_count": appointment_metrics["pending_count"],
-            "waiting_count": appointment_metrics["waiting_count"],
-            "in_consultation_count": appointment_metrics["in_consultation_count"],
-            "completed_count": appointment_metrics["completed_count"],
+            # Appointment no tiene estado "scheduled" (siempre fue 0)
+            "scheduled_count": 0,
+            "pending_count": current["appointments_pending"],
+            "waiting_count": current["appointments_arrived"],
+            "in_consultation_count": current["appointments_in_consultation"],
+            "completed_count": in_range["appointments_completed"],
             "total_amount": float(total_amount),
-            "payments_count": payments_count,
-            "exempted_count": financial_metrics["exempted_count"],
+            "payments_count": in_range["payments_count"],
+            "exempted_count": in_range["waived_count"],
             "bcv_rate": bcv_rate,  # ✅ NUEVO: Incluir rate en respuesta
         }
 
@@ -4601,13 +4239,7 @@ def vital_signs_api(request, appointment_id):
     patient_id = appointment.patient_id
 
     if hasattr(user, "doctor_profile"):
-        doctor = user.doctor_profile
-        patient_ids = list(
-            DoctorPatientRelationship.objects.filter(
-                doctor=doctor, status="active"
-            ).values_list("patient_id", flat=True)
-        )
-        if patient_id not in patient_ids:
+        if not PatientAccessScope.for_request(request).allows_as_doctor(patient_id):
             return Response(
                 {"error": "No tienes acceso a los datos de este paciente"}, status=403
             )
@@ -4714,27 +4346,19 @@ def add_charge_order_items(request, appointment_id):
         items_data = request.data.get("items", [])
         if not items_data or len(items_data) == 0:
             return Response({"error": "No se proporcionaron items"}, status=400)
-        # Buscar orden activa existente (excluir void)
-        charge_order = (
-            ChargeOrder.objects.filter(appointment_id=appointment_id)
-            .exclude(status="void")
-            .order_by("-issued_at")
-            .first()
+        # Servicios del lote en una sola consulta
+        def as_service_id(value):
+            try:
+                return int(value)
+            except (TypeError, ValueError):
+                return None
+
+        services_by_id = DoctorService.objects.in_bulk(
+            {as_service_id(item_data.get("service_id")) for item_data in items_data}
+            - {None}
         )
-        # Si no existe orden activa, crear una nueva
-        if not charge_order:
-            charge_order = ChargeOrder.objects.create(
-                appointment=appointment,
-                patient=appointment.patient,
-                doctor=appointment.doctor,
-                institution=appointment.institution,
-                currency="USD",
-                status="open",
-                total=Decimal("0.00"),
-                balance_due=Decimal("0.00"),
-            )
-        # Agregar items a la orden
-        created_items = []
+        # Validar todos los items antes de escribir
+        new_items = []
         for item_data in items_data:
             # Validar service_id
             service_id = item_data.get("service_id")
@@ -4743,9 +4367,8 @@ def add_charge_order_items(request, appointment_id):
                     {"error": "service_id es requerido en cada item"}, status=400
                 )
             # Buscar servicio
-            try:
-                service = DoctorService.objects.get(id=service_id)
-            except DoctorService.DoesNotExist:
+            service = services_by_id.get(as_service_id(service_id))
+            if service is None:
                 return Response(
                     {"error": f"Servicio con ID {service_id} no existe"}, status=400
                 )
@@ -4756,7 +4379,10 @@ def add_charge_order_items(request, appointment_id):
                     status=400,
                 )
             # Validar que el servicio pertenezca a la institución de la cita
-            if service.institution and service.institution != appointment.institution:
+            if (
+                service.institution_id
+                and service.institution_id != appointment.institution_id
+            ):
                 return Response(
                     {
                         "error": f"Servicio con ID {service_id} no pertenece a la institución de la cita"
@@ -4788,19 +4414,37 @@ def add_charge_order_items(request, appointment_id):
                     },
                     status=400,
                 )
-            # Crear item con datos del servicio
-            item = ChargeItem.objects.create(
-                order=charge_order,
-                doctor_service=service,  # Vinculación al servicio
-                code=service.code,  # Código del servicio
-                description=service.name,  # Nombre del servicio
-                qty=qty,
-                unit_price=service.price_usd,  # Precio del servicio (no del payload)
-            )
-            created_items.append(item)
-        # Recalcular totales
-        charge_order.recalc_totals()
-        charge_order.save(update_fields=["total", "balance_due", "status"])
+            # Item con datos del servicio
+            new_items.append(
+                ChargeItem(
+                    doctor_service=service,  # Vinculación al servicio
+                    code=service.code,  # Código del servicio
+                    description=service.name,  # Nombre del servicio
+                    qty=qty,
+                    unit_price=service.price_usd,  # Precio del servicio, no del payload
+                )
+            )
+        # Buscar orden activa existente (excluir void)
+        charge_order = (
+            ChargeOrder.objects.filter(appointment_id=appointment_id)
+            .exclude(status="void")
+            .order_by("-issued_at")
+            .first()
+        )
+        # Si no existe orden activa, crear una nueva
+        if not charge_order:
+            charge_order = ChargeOrder.objects.create(
+                appointment=appointment,
+                patient=appointment.patient,
+                doctor=appointment.doctor,
+                institution=appointment.institution,
+                currency="USD",
+                status="open",
+                total=Decimal("0.00"),
+                balance_due=Decimal("0.00"),
+            )
+        # Insertar en lote y recalcular la orden una sola vez
+        created_items = charge_order.add_items(new_items)
         serializer = ChargeOrderSerializer(charge_order)
         return Response(serializer.data, status=200 if len(created_items) > 0 else 201)
     except Exception as e:
@@ -4886,13 +4530,7 @@ def clinical_note_api(request, appointment_id):
     patient_id = appointment.patient_id
 
     if hasattr(user, "doctor_profile"):
-        doctor = user.doctor_profile
-        patient_ids = list(
-            DoctorPatientRelationship.objects.filter(
-                doctor=doctor, status="active"
-            ).values_list("patient_id", flat=True)
-        )
-        if patient_id not in patient_ids:
+        if not PatientAccessScope.for_request(request).allows_as_doctor(patient_id):
             return Response(
                 {"error": "No tienes acceso a los datos de este paciente"}, status=403
             )
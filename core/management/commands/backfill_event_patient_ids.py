@@ -0,0 +1,82 @@
+# core/management/commands/backfill_event_patient_ids.py
+"""
+Completa Event.patient_id en eventos existentes.
+
+Los eventos nuevos lo reciben al escribirse (Event.assign_patient_ids);
+este comando cubre el histórico con UPDATE set-based por tipo de entidad,
+en lotes por rango de id para no bloquear la tabla.
+
+Uso:
+    python manage.py backfill_event_patient_ids
+    python manage.py backfill_event_patient_ids --batch-size 50000 --dry-run
+"""
+from django.apps import apps
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import F, Max, Min, OuterRef, Subquery
+
+from core.models import Event
+
+
+class Command(BaseCommand):
+    help = "Completa Event.patient_id en eventos existentes (por lotes)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=20000)
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Solo muestra cuántos eventos se procesarían",
+        )
+
+    def handle(self, *args, **options):
+        pending = Event.objects.filter(patient_id__isnull=True)
+        if options["dry_run"]:
+            for row in pending.values("entity").order_by("entity").distinct():
+                count = pending.filter(entity=row["entity"]).count()
+                self.stdout.write(f"{row['entity']}: {count}")
+            return
+
+        bounds = pending.aggregate(low=Min("id"), high=Max("id"))
+        if bounds["low"] is None:
+            self.stdout.write(self.style.SUCCESS("No hay eventos pendientes"))
+            return
+
+        batch_size = options["batch_size"]
+        for start in range(bounds["low"], bounds["high"] + 1, batch_size):
+            with transaction.atomic():
+                self._backfill_range(start, start + batch_size)
+            self.stdout.write(f"Eventos {start}-{start + batch_size - 1} procesados")
+
+        remaining = Event.objects.filter(patient_id__isnull=True).count()
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Backfill completado ({remaining} eventos sin paciente asociado)"
+            )
+        )
+
+    def _backfill_range(self, start, end):
+        chunk = Event.objects.filter(
+            patient_id__isnull=True, id__gte=start, id__lt=end
+        )
+        chunk.filter(entity="Patient").update(patient_id=F("entity_id"))
+
+        for entity, (model_name, field) in Event.PATIENT_LOOKUPS.items():
+            model = apps.get_model("core", model_name)
+            chunk.filter(entity=entity).update(
+                patient_id=Subquery(
+                    model.objects.filter(pk=OuterRef("entity_id")).values(field)[:1]
+                )
+            )
+
+        # Eventos legacy con el paciente en metadata
+        with_metadata = [
+            event
+            for event in chunk.filter(metadata__has_key="patient_id").only(
+                "id", "entity", "entity_id", "metadata", "patient_id"
+            )
+            if isinstance(event.metadata.get("patient_id"), int)
+        ]
+        for event in with_metadata:
+            event.patient_id = event.metadata["patient_id"]
+        Event.objects.bulk_update(with_metadata, ["patient_id"], batch_size=1000)
@@ -0,0 +1,105 @@
+# core/management/commands/bench_event_bus.py
+"""
+Benchmark del bus de eventos de auditoría (core/utils/events.py).
+
+Compara escritura por evento (un INSERT por log_event) vs. EventBus.batch()
+(bulk_create al salir del bloque) para N guardados de Appointment y para N
+llamadas directas a log_event(), ambos dentro de una transacción.
+
+Los datos se crean dentro de una transacción que se revierte al final.
+
+Uso:
+    python manage.py bench_event_bus --saves 10000
+"""
+import time
+from datetime import date
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+
+from core.models import Appointment, DoctorOperator, Event, InstitutionSettings, Patient
+from core.utils.events import EventBus, log_event
+
+
+class BenchmarkRollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Mide el throughput del bus de eventos de auditoría"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--saves", type=int, default=10000)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options["saves"])
+                raise BenchmarkRollback()
+        except BenchmarkRollback:
+            self.stdout.write("Datos de prueba revertidos.")
+
+    def _run(self, n):
+        user = get_user_model().objects.create_user("bench-events", password="x")
+        doctor = DoctorOperator.objects.create(user=user, full_name="Dr. Bench")
+        institution = InstitutionSettings.objects.create(
+            name="Bench", tax_id="J-00000000-0", phone="0", logo="logos/bench.png"
+        )
+        patient = Patient.objects.create(first_name="Bench", last_name="Eventos")
+        Appointment.objects.bulk_create(
+            [
+                Appointment(
+                    patient=patient,
+                    institution=institution,
+                    doctor=doctor,
+                    appointment_date=date(2025, 1, 1),
+                )
+                for _ in range(n)
+            ],
+            batch_size=1000,
+        )
+        appointments = list(Appointment.objects.filter(patient=patient))
+
+        def save_appointments():
+            for appointment in appointments:
+                appointment.save()
+
+        def log_events():
+            for i in range(n):
+                log_event("Bench", i, "create", actor="system")
+
+        for label, fn in (
+            (f"{n} Appointment.save()", save_appointments),
+            (f"{n} log_event()", log_events),
+        ):
+            legacy = self._measure(fn, transaction.atomic)
+            current = self._measure(fn, EventBus.batch)
+            self.stdout.write(
+                f"{label:<26} por evento: {legacy['seconds']:.2f}s "
+                f"({legacy['rate']:.0f} ev/s, {legacy['inserts']} INSERT) | "
+                f"batch(): {current['seconds']:.2f}s "
+                f"({current['rate']:.0f} ev/s, {current['inserts']} INSERT)"
+            )
+
+    def _measure(self, fn, block):
+        table = Event._meta.db_table
+        inserts = [0]
+
+        def count_inserts(execute, sql, params, many, context):
+            if sql.startswith(f'INSERT INTO "{table}"'):
+                inserts[0] += 1
+            return execute(sql, params, many, context)
+
+        before = Event.objects.count()
+        start = time.perf_counter()
+        with connection.execute_wrapper(count_inserts):
+            with block():
+                fn()
+        seconds = time.perf_counter() - start
+        written = Event.objects.count() - before
+        return {
+            "seconds": seconds,
+            "rate": written / seconds if seconds else 0,
+            "inserts": inserts[0],
+        }
@@ -0,0 +1,170 @@
+# core/management/commands/bench_event_serializer.py
+"""
+Micro-benchmark de serialización de eventos de auditoría.
+
+Compara, para N eventos con todas las combinaciones entity/action del
+registro (core/utils/event_presentation.py):
+- LegacyEventSerializer: el serializer anterior (if-chains por campo),
+  leído del historial de git (--legacy-rev)
+- EventSerializer actual (regla precompilada, sin SerializerMethodField)
+- render_events(): camino rápido sin maquinaria de DRF
+
+Verifica además que las tres salidas sean idénticas. Los eventos se crean
+dentro de una transacción que se revierte al final.
+
+Uso:
+    python manage.py bench_event_serializer --events 1000 --repeat 20
+    python manage.py bench_event_serializer --legacy-rev <commit>
+"""
+import ast
+import itertools
+import statistics
+import subprocess
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from rest_framework import serializers
+
+from core.models import Event
+from core.serializers import EventSerializer
+from core.utils.event_presentation import DESCRIPTIONS, TITLES, render_events
+
+
+SERIALIZERS_PATH = "core/serializers.py"
+
+
+class BenchmarkRollback(Exception):
+    pass
+
+
+def load_legacy_serializer(rev=None):
+    """
+    Carga el EventSerializer anterior (cadenas de if por campo) desde el
+    historial de git, sin mantener una copia en el árbol. Por defecto usa
+    el padre del último commit que tocó get_badge_action en serializers.py.
+    """
+    try:
+        if rev is None:
+            last = _git(
+                "log", "-n1", "--format=%H", "-G", "def get_badge_action",
+                "--", SERIALIZERS_PATH,
+            ).strip()
+            if not last:
+                raise CommandError("No se encontró el serializer anterior en git")
+            rev = f"{last}~1"
+        source = _git("show", f"{rev}:{SERIALIZERS_PATH}")
+    except (OSError, subprocess.CalledProcessError) as exc:
+        raise CommandError(f"No se pudo leer el serializer anterior: {exc}")
+
+    node = next(
+        (
+            n
+            for n in ast.parse(source).body
+            if isinstance(n, ast.ClassDef) and n.name == "EventSerializer"
+        ),
+        None,
+    )
+    if node is None:
+        raise CommandError(f"{rev} no define EventSerializer")
+    namespace = {"serializers": serializers, "Event": Event}
+    exec(compile(ast.Module(body=[node], type_ignores=[]), rev, "exec"), namespace)
+    return namespace["EventSerializer"]
+
+
+def _git(*args):
+    return subprocess.run(
+        ["git", *args],
+        cwd=settings.BASE_DIR,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+
+
+SAMPLE_METADATA = [
+    {},
+    {"reason": "Duplicada", "actor": "admin"},
+    {"amount": 25.5},
+    {"patient_id": 3, "doctor_id": 1, "appointment_id": 9},
+    {"full_name": "Ana Pérez"},
+    {"message": "Tasa BCV actualizada"},
+    {"foo": 1, "bar": 2, "baz": 3},
+]
+
+
+class Command(BaseCommand):
+    help = "Mide el tiempo de serialización de listas de eventos"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--events", type=int, default=1000)
+        parser.add_argument("--repeat", type=int, default=20)
+        parser.add_argument(
+            "--legacy-rev",
+            default=None,
+            help="Commit con el EventSerializer anterior (por defecto se busca)",
+        )
+
+    def handle(self, *args, **options):
+        legacy = load_legacy_serializer(options["legacy_rev"])
+        try:
+            with transaction.atomic():
+                self._run(legacy, options["events"], options["repeat"])
+                raise BenchmarkRollback()
+        except BenchmarkRollback:
+            self.stdout.write("Datos de prueba revertidos.")
+
+    def _run(self, legacy_serializer, n, repeat):
+        user = get_user_model().objects.create_user("bench-serializer", password="x")
+        keys = list(TITLES) + [k for k in DESCRIPTIONS if k[1]] + [
+            ("Payment", "update"),
+            ("Appointment", "delete"),
+            ("Patient", "historical_import"),
+            ("DoctorOperator", "update_profile"),
+        ]
+        combos = itertools.cycle(
+            itertools.product(keys, SAMPLE_METADATA, [None, user])
+        )
+        Event.objects.bulk_create(
+            [
+                Event(
+                    entity=entity,
+                    entity_id=i,
+                    action=action,
+                    metadata=metadata,
+                    actor_user=actor_user,
+                    actor_name="system",
+                    notify=bool(i % 2),
+                )
+                for i, ((entity, action), metadata, actor_user) in zip(range(n), combos)
+            ]
+        )
+        events = list(Event.objects.select_related("actor_user").order_by("id")[:n])
+
+        legacy_data = [dict(item) for item in legacy_serializer(events, many=True).data]
+        if [dict(item) for item in EventSerializer(events, many=True).data] != legacy_data:
+            raise CommandError("EventSerializer difiere del serializer anterior")
+        if render_events(events) != legacy_data:
+            raise CommandError("render_events() difiere del serializer anterior")
+
+        results = [
+            ("LegacyEventSerializer", lambda: legacy_serializer(events, many=True).data),
+            ("EventSerializer", lambda: EventSerializer(events, many=True).data),
+            ("render_events()", lambda: render_events(events)),
+        ]
+        baseline = None
+        for label, fn in results:
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                fn()
+                timings.append((time.perf_counter() - start) * 1000)
+            median = statistics.median(timings)
+            baseline = baseline or median
+            self.stdout.write(
+                f"{label:<22} {n} eventos: mediana={median:.2f}ms "
+                f"min={min(timings):.2f}ms ({baseline / median:.1f}x)"
+            )
+        self.stdout.write(self.style.SUCCESS("Salidas idénticas en los tres caminos"))
@@ -0,0 +1,137 @@
+# core/management/commands/bench_institution_middleware.py
+"""
+Benchmark del overhead de InstitutionPermissionMiddleware por request:
+implementación anterior (sin cache, escrituras síncronas) vs. actual
+(cache de permisos con AUTHORIZATION_CACHE_ENABLED, AuditLog síncrono y
+contador de accesos write-behind).
+
+Crea un doctor e institución de prueba dentro de una transacción que se
+revierte al final.
+
+Uso:
+    python manage.py bench_institution_middleware --requests 2000
+"""
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.http import HttpResponse
+from django.test import RequestFactory
+
+from core.middleware import InstitutionPermissionMiddleware
+from core.models import DoctorOperator, InstitutionSettings
+from core.permissions import ACCESS_COUNT_BUFFER, SmartInstitutionValidator
+
+
+class BenchmarkRollback(Exception):
+    pass
+
+
+def legacy_process_request(request):
+    """Réplica del middleware previo: sin cache y con escrituras en el request."""
+    institution_id = request.META["HTTP_X_INSTITUTION_ID"]
+    institution = InstitutionSettings.objects.get(id=institution_id)
+    request.current_institution = institution
+    doctor = getattr(request.user, "doctor_profile", None)
+    if doctor:
+        permission_info = SmartInstitutionValidator.get_permission_level(
+            doctor, institution
+        )
+        request.institution_permission = permission_info
+        if request.method in ["POST", "PUT", "PATCH"]:
+            from core.models import AuditLog
+
+            permission_info = SmartInstitutionValidator.get_permission_level(
+                doctor, institution
+            )
+            permission = permission_info["permission"]
+            permission.access_count += 1
+            permission.save(update_fields=["last_accessed", "access_count"])
+            AuditLog.objects.create(
+                user=doctor.user,
+                institution=institution,
+                action=f"{request.method} {request.path}"[:50],
+                access_level=permission_info["level"],
+                is_own_institution=permission_info["is_own"],
+                is_cross_institution=permission_info["is_cross"],
+            )
+
+
+class Command(BaseCommand):
+    help = "Mide el overhead por request de InstitutionPermissionMiddleware"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=2000)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options["requests"])
+                raise BenchmarkRollback()
+        except BenchmarkRollback:
+            self.stdout.write("Datos de prueba revertidos.")
+
+    def _run(self, n):
+        user = get_user_model().objects.create_user("bench-middleware", password="x")
+        doctor = DoctorOperator.objects.create(user=user, full_name="Dr. Bench")
+        institution = InstitutionSettings.objects.create(
+            name="Bench", tax_id="J-00000000-0", phone="0", logo="logos/bench.png"
+        )
+        doctor.institutions.add(institution)
+        cache.clear()
+
+        # El volcado se hace al final, en esta misma transacción (se revierte):
+        # el hilo de fondo usaría otra conexión y quedaría bloqueado por ella.
+        ACCESS_COUNT_BUFFER.flush_interval = 3600
+        ACCESS_COUNT_BUFFER.max_size = ACCESS_COUNT_BUFFER.max_pending = 2 * n + 10
+
+        middleware = InstitutionPermissionMiddleware(lambda r: HttpResponse())
+        factory = RequestFactory(HTTP_X_INSTITUTION_ID=str(institution.id))
+
+        def make(method):
+            request = getattr(factory, method)("/api/appointments/")
+            # Mismo objeto User en cada request (como lo deja AuthenticationMiddleware)
+            request.user = get_user_model().objects.get(pk=user.pk)
+            return request
+
+        for method in ("get", "post"):
+            legacy = self._measure(n, lambda: legacy_process_request(make(method)))
+            current = self._measure(
+                n, lambda: middleware.process_request(make(method))
+            )
+            self._report(method.upper(), legacy, current)
+
+        flushed = ACCESS_COUNT_BUFFER.flush()
+        self.stdout.write(f"Buffer volcado al final: {flushed} registros")
+
+    def _measure(self, n, fn):
+        fn()  # calentamiento (llena caches)
+        timings = []
+        queries = [0]
+
+        def count_queries(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_queries):
+            for _ in range(n):
+                start = time.perf_counter()
+                fn()
+                timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return {
+            "mean": statistics.mean(timings),
+            "p95": timings[max(0, int(len(timings) * 0.95) - 1)],
+            # Incluye el SELECT del usuario que hace make() en cada request
+            "queries": queries[0] / n,
+        }
+
+    def _report(self, method, legacy, current):
+        self.stdout.write(
+            f"{method:<5} antes: media={legacy['mean']:.3f}ms p95={legacy['p95']:.3f}ms "
+            f"queries={legacy['queries']:.1f} | después: media={current['mean']:.3f}ms "
+            f"p95={current['p95']:.3f}ms queries={current['queries']:.1f}"
+        )
@@ -0,0 +1,123 @@
+# core/management/commands/bench_institutional_report.py
+"""
+Benchmark de export_institutional_report (core/utils/institutional_report.py).
+
+Compara, para N filas serializadas:
+- legacy: un único Table de ReportLab con todas las filas (conversión
+  Decimal por fila y encabezado consultado en cada exportación)
+- InstitutionalReport: bloques de LongTable con encabezado repetido,
+  conversión en una pasada y encabezado cacheado
+
+Mide tiempo y, con --memory, el pico de memoria Python (tracemalloc, en
+una pasada aparte). No escribe en la base.
+
+Uso:
+    python manage.py bench_institutional_report --rows 50000 --memory
+    python manage.py bench_institutional_report --rows 50000 --skip-legacy
+"""
+import io
+import time
+import tracemalloc
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Callable, List, Tuple
+
+from django.core.management.base import BaseCommand
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.platypus import SimpleDocTemplate, Table, TableStyle
+
+from core.models import DoctorOperator, InstitutionSettings
+from core.utils.institutional_report import COLUMNS, InstitutionalReport
+
+
+def legacy_pdf(rows, rate, currency):
+    """Réplica de la versión anterior: Table único con todas las filas."""
+    InstitutionSettings.objects.first()
+    DoctorOperator.objects.first()
+    table_data = [COLUMNS]
+    for r in rows:
+        amount_dec = Decimal(str(r.get("amount") or "0"))
+        amount_val = (amount_dec * rate).quantize(Decimal("0.01"), ROUND_HALF_UP)
+        table_data.append(
+            [
+                str(r.get("id") or ""),
+                str(r.get("date"))[:10],
+                str(r.get("type") or ""),
+                str(r.get("entity") or ""),
+                str(r.get("status") or ""),
+                f"{float(amount_val):.2f}",
+                currency,
+            ]
+        )
+    table = Table(table_data, hAlign="LEFT")
+    table.setStyle(
+        TableStyle(
+            [
+                ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#003366")),
+                ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
+            ]
+        )
+    )
+    buffer = io.BytesIO()
+    SimpleDocTemplate(buffer, pagesize=letter).build([table])
+    return buffer
+
+
+class Command(BaseCommand):
+    help = "Mide tiempo y memoria del reporte institucional en PDF"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=50000)
+        parser.add_argument(
+            "--skip-legacy",
+            action="store_true",
+            help="No ejecutar la versión anterior (muy lenta con muchas filas)",
+        )
+        parser.add_argument(
+            "--memory",
+            action="store_true",
+            help="Medir también el pico de memoria (segunda pasada con tracemalloc)",
+        )
+
+    def handle(self, *args, **options):
+        n = options["rows"]
+        rows = [
+            {
+                "id": f"FIN-{i}",
+                "date": f"2025-{1 + i % 12:02d}-{1 + i % 28:02d}",
+                "type": "financial",
+                "entity": f"Servicio {i % 20}",
+                "status": "CONFIRMED",
+                "amount": 10 + (i % 500) / 4,
+            }
+            for i in range(n)
+        ]
+        rate = Decimal("36.50")
+
+        def chunked():
+            report = InstitutionalReport(rows, {}, "USD", "bench")
+            report.currency, report.rate = "VES", rate
+            return report.export("pdf")
+
+        cases: List[Tuple[str, Callable[[], object]]] = [
+            ("InstitutionalReport (LongTable)", chunked)
+        ]
+        if not options["skip_legacy"]:
+            cases.insert(
+                0, ("legacy (Table único)", lambda: legacy_pdf(rows, rate, "VES"))
+            )
+
+        for label, fn in cases:
+            # Tiempo sin tracemalloc (lo ralentiza varias veces); memoria aparte
+            started = time.perf_counter()
+            fn()
+            seconds = time.perf_counter() - started
+            peak_mb = None
+            if options["memory"]:
+                tracemalloc.start()
+                fn()
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+                peak_mb = peak / 1024 / 1024
+            memory = f", pico {peak_mb:.1f} MB" if peak_mb is not None else ""
+            self.stdout.write(f"{label:<34} {n} filas: {seconds:.2f}s{memory}")
@@ -0,0 +1,153 @@
+# core/management/commands/bench_patient_search.py
+"""
+Benchmark de búsqueda de pacientes: filtro legacy (OR de icontains por
+columna) vs. PatientSearchIndex, midiendo p50/p95 a distintos volúmenes.
+
+Los pacientes sintéticos se insertan dentro de una transacción que se
+revierte al final (salvo --keep).
+
+Uso:
+    python manage.py bench_patient_search --sizes 10000,100000,1000000
+"""
+import random
+import re
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Q
+
+from core.models import Patient
+from core.search import PatientSearchIndex
+from core.utils.search_normalize import normalize_token
+
+FIRST_NAMES = [
+    "José", "María", "Luis", "Ana", "Carlos", "Andrés", "Sofía", "Valentina",
+    "Jesús", "Ramón", "Inés", "Ángel", "Lucía", "Martín", "Gabriel", "Beatriz",
+]
+LAST_NAMES = [
+    "González", "Rodríguez", "Pérez", "Hernández", "García", "Martínez",
+    "López", "Díaz", "Sánchez", "Ramírez", "Núñez", "Muñoz", "Peña", "Briceño",
+]
+
+
+class BenchmarkRollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Mide latencia p50/p95 de la búsqueda de pacientes (legacy vs índice)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", default="10000,100000,1000000")
+        parser.add_argument("--queries", type=int, default=200)
+        parser.add_argument("--limit", type=int, default=10)
+        parser.add_argument("--keep", action="store_true", help="No revertir los datos")
+
+    def handle(self, *args, **options):
+        sizes = sorted(int(s) for s in options["sizes"].split(",") if s.strip())
+        self.rng = random.Random(42)
+        self.stdout.write(f"Motor: {connection.vendor}")
+
+        try:
+            with transaction.atomic():
+                seeded = 0
+                for size in sizes:
+                    seeded += self._seed(size - seeded, seeded)
+                    queries = self._sample_queries(options["queries"])
+                    legacy = self._measure(queries, options["limit"], self._legacy)
+                    indexed = self._measure(queries, options["limit"], self._indexed)
+                    self._report(size, legacy, indexed)
+                if not options["keep"]:
+                    raise BenchmarkRollback()
+        except BenchmarkRollback:
+            self.stdout.write("Datos sintéticos revertidos.")
+
+    def _seed(self, count, offset):
+        if count <= 0:
+            return 0
+        start = time.perf_counter()
+        batch = []
+        for i in range(offset, offset + count):
+            patient = Patient(
+                first_name=self.rng.choice(FIRST_NAMES),
+                middle_name=self.rng.choice(FIRST_NAMES),
+                last_name=self.rng.choice(LAST_NAMES),
+                second_last_name=self.rng.choice(LAST_NAMES),
+                national_id=f"8{i:010d}",
+            )
+            patient.search_document = patient.build_search_document()
+            batch.append(patient)
+            if len(batch) >= 5000:
+                Patient.objects.bulk_create(batch)
+                batch = []
+        if batch:
+            Patient.objects.bulk_create(batch)
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                cursor.execute("ANALYZE patients")
+        self.stdout.write(
+            f"  +{count} pacientes en {time.perf_counter() - start:.1f}s"
+        )
+        return count
+
+    def _sample_queries(self, n):
+        queries = []
+        for _ in range(n):
+            kind = self.rng.random()
+            if kind < 0.4:
+                queries.append(self.rng.choice(LAST_NAMES)[:5])
+            elif kind < 0.8:
+                queries.append(
+                    f"{self.rng.choice(FIRST_NAMES)} {self.rng.choice(LAST_NAMES)[:4]}"
+                )
+            else:
+                queries.append(f"8{self.rng.randint(0, 999):03d}")
+        return queries
+
+    def _legacy(self, q, limit):
+        query = Q(active=True)
+        for word in q.split():
+            if connection.vendor == "postgresql":
+                query &= (
+                    Q(first_name__unaccent__icontains=word)
+                    | Q(middle_name__unaccent__icontains=word)
+                    | Q(last_name__unaccent__icontains=word)
+                    | Q(second_last_name__unaccent__icontains=word)
+                    | Q(national_id__icontains=word)
+                )
+            else:
+                pattern = rf"(?i){re.escape(normalize_token(word))}"
+                query &= (
+                    Q(first_name__regex=pattern)
+                    | Q(middle_name__regex=pattern)
+                    | Q(last_name__regex=pattern)
+                    | Q(second_last_name__regex=pattern)
+                    | Q(national_id__icontains=word)
+                )
+        return list(Patient.objects.filter(query)[:limit])
+
+    def _indexed(self, q, limit):
+        return list(
+            PatientSearchIndex.search(q, Patient.objects.filter(active=True))[:limit]
+        )
+
+    def _measure(self, queries, limit, fn):
+        timings = []
+        for q in queries:
+            start = time.perf_counter()
+            fn(q, limit)
+            timings.append((time.perf_counter() - start) * 1000)
+        timings.sort()
+        return {
+            "p50": statistics.median(timings),
+            "p95": timings[max(0, int(len(timings) * 0.95) - 1)],
+        }
+
+    def _report(self, size, legacy, indexed):
+        self.stdout.write(
+            f"{size:>9} pacientes | legacy p50={legacy['p50']:.2f}ms "
+            f"p95={legacy['p95']:.2f}ms | índice p50={indexed['p50']:.2f}ms "
+            f"p95={indexed['p95']:.2f}ms"
+        )
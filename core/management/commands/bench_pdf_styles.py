@@ -0,0 +1,123 @@
+# core/management/commands/bench_pdf_styles.py
+"""
+Benchmark del CSS cacheado de WeasyPrint (core/utils/pdf_styles.py).
+
+Renderiza el HTML de prescription.html, treatment.html y medical_report.html
+(render_generic_html sobre una cita de prueba) y mide, por documento y en
+este proceso (sin pool), la conversión a PDF:
+- inline: <style> dentro del HTML, parseado en cada documento
+- cache: hojas CSS y FontConfiguration parseadas una vez por proceso
+
+Los datos se crean dentro de una transacción que se revierte al final.
+
+Uso:
+    python manage.py bench_pdf_styles
+    python manage.py bench_pdf_styles --iterations 50
+"""
+import statistics
+import time as clock
+from datetime import date
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import (
+    Appointment,
+    Diagnosis,
+    DoctorOperator,
+    InstitutionSettings,
+    MedicalReport,
+    Patient,
+    Prescription,
+    Treatment,
+)
+from core.services import generic_pdf_template, render_generic_html
+from core.utils import pdf_styles
+from core.utils.pdf_engine import _write_pdf
+from core.utils.pdf_styles import TemplateStyles
+
+
+class BenchmarkRollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Mide la conversión a PDF con CSS en línea vs. cacheado"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=20)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(max(1, options["iterations"]))
+                raise BenchmarkRollback()
+        except BenchmarkRollback:
+            self.stdout.write("Datos de prueba revertidos.")
+
+    def _seed(self):
+        user = get_user_model().objects.create_user("bench-pdf", password="x")
+        doctor = DoctorOperator.objects.create(user=user, full_name="Dr. Bench")
+        institution = InstitutionSettings.objects.create(
+            name="Bench PDF", tax_id="J-00000000-1", phone="0", logo=""
+        )
+        patient = Patient.objects.create(first_name="Paciente", last_name="Bench")
+        appointment = Appointment.objects.create(
+            patient=patient,
+            institution=institution,
+            doctor=doctor,
+            appointment_date=date.today(),
+        )
+        diagnosis = Diagnosis.objects.create(
+            appointment=appointment, icd_code="CA40", title="Neumonía"
+        )
+        return institution, {
+            "prescription": Prescription.objects.create(
+                diagnosis=diagnosis, medication_text="Amoxicilina 500 mg"
+            ),
+            "treatment": Treatment.objects.create(
+                diagnosis=diagnosis, plan="Reposo y control en 7 días"
+            ),
+            "medical_report": MedicalReport.objects.create(
+                appointment=appointment, patient=patient
+            ),
+        }
+
+    def _run(self, iterations):
+        institution, instances = self._seed()
+        base_url = str(settings.MEDIA_ROOT or "")
+        self.stdout.write(
+            f"{'plantilla':<42} {'inline ms/doc':>14} {'cache ms/doc':>13} "
+            f"{'1.º cache ms':>13}"
+        )
+        for category, instance in instances.items():
+            template_name = generic_pdf_template(category)
+            html, _, _ = render_generic_html(instance, category, institution)
+
+            inline = self._measure(lambda: _write_pdf(html, base_url), iterations)
+
+            # Cache en frío: el primer documento parsea las hojas
+            pdf_styles._stylesheets.clear()
+            TemplateStyles._blocks.pop(template_name, None)
+
+            def cached():
+                stripped, styles = TemplateStyles.split(template_name, html)
+                return _write_pdf(stripped, base_url, styles)
+
+            first = self._measure(cached, 1)
+            warm = self._measure(cached, iterations)
+            self.stdout.write(
+                f"{template_name:<42} {inline:>14.1f} {warm:>13.1f} {first:>13.1f}"
+            )
+
+    @staticmethod
+    def _measure(fn, iterations):
+        """Mediana en milisegundos por documento."""
+        samples = []
+        for _ in range(iterations):
+            started = clock.perf_counter()
+            fn()
+            samples.append((clock.perf_counter() - started) * 1000)
+        return statistics.median(samples)
@@ -0,0 +1,73 @@
+# core/management/commands/bench_qr.py
+"""
+Benchmark del QR de verificación de documentos (core/utils/qr.py).
+
+Mide, por QR, con URLs de verificación de códigos de auditoría distintos:
+- png: qrcode.QRCode(box_size=10) -> imagen PIL -> PNG -> base64 (anterior)
+- svg: matriz -> <path> SVG -> base64, sin cache
+- cache: mismo payload ya memoizado en qr_data_uri()
+
+Uso:
+    python manage.py bench_qr
+    python manage.py bench_qr --iterations 500
+"""
+import base64
+import hashlib
+import statistics
+import time as clock
+from io import BytesIO
+
+import qrcode
+from django.core.management.base import BaseCommand
+
+from core.utils.document_verification import get_verification_url
+from core.utils.qr import qr_data_uri
+
+
+def legacy_png_data_uri(payload: str) -> str:
+    qr = qrcode.QRCode(box_size=10, border=2)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    img_qr = qr.make_image(fill_color="black", back_color="white")
+    buffer = BytesIO()
+    img_qr.save(buffer, kind="PNG")
+    qr_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+    return f"data:image/png;base64,{qr_base64}"
+
+
+class Command(BaseCommand):
+    help = "Mide el QR de auditoría en PNG vs. SVG memoizado"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--iterations", type=int, default=200)
+
+    def handle(self, *args, **options):
+        iterations = max(1, options["iterations"])
+        payloads = [
+            get_verification_url(
+                hashlib.sha256(f"bench-qr-{i}".encode()).hexdigest()[:12].upper()
+            )
+            for i in range(iterations)
+        ]
+        qr_data_uri(payloads[0])
+
+        variants = [
+            ("png", legacy_png_data_uri, payloads),
+            ("svg", qr_data_uri.__wrapped__, payloads),
+            ("cache", qr_data_uri, [payloads[0]] * iterations),
+        ]
+        self.stdout.write(f"{'variante':<10} {'µs/QR':>10} {'bytes URI':>10}")
+        for name, fn, inputs in variants:
+            per_qr = self._measure(fn, inputs)
+            size = len(fn(payloads[0]))
+            self.stdout.write(f"{name:<10} {per_qr:>10.1f} {size:>10}")
+
+    @staticmethod
+    def _measure(fn, inputs):
+        """Mediana en microsegundos por QR."""
+        samples = []
+        for payload in inputs:
+            started = clock.perf_counter()
+            fn(payload)
+            samples.append((clock.perf_counter() - started) * 1_000_000)
+        return statistics.median(samples)
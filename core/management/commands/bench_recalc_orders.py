@@ -0,0 +1,170 @@
+# core/management/commands/bench_recalc_orders.py
+"""
+Benchmark de recalc_orders (core/utils/order_totals.py).
+
+Crea N órdenes (2 ítems cada una, la mitad con un pago confirmado) y
+desajusta el total guardado de un 10%. Compara:
+- legacy: recalc_totals() + save() por orden, sobre una muestra
+  (--legacy-sample) y extrapolado a N
+- OrderTotals: recálculo set-based de todas las órdenes
+
+Los datos se crean dentro de una transacción que se revierte al final.
+
+Uso:
+    python manage.py bench_recalc_orders
+    python manage.py bench_recalc_orders --orders 100000 --legacy-sample 2000
+"""
+import time as clock
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import F
+from django.db.models.functions import Mod
+from django.test import override_settings
+from django.utils import timezone
+
+from core.models import (
+    ChargeItem,
+    ChargeOrder,
+    DoctorOperator,
+    InstitutionSettings,
+    Patient,
+    Payment,
+)
+from core.utils.order_totals import OrderTotals
+
+BATCH_SIZE = 5000
+
+
+class BenchmarkRollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = "Mide recalc_orders (por orden vs. set-based)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--orders", type=int, default=1_000_000)
+        parser.add_argument("--legacy-sample", type=int, default=5000)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(max(1, options["orders"]), options["legacy_sample"])
+                raise BenchmarkRollback()
+        except BenchmarkRollback:
+            self.stdout.write("Datos de prueba revertidos.")
+
+    def _seed(self, n_orders):
+        user = get_user_model().objects.create_user("bench-recalc", password="x")
+        doctor = DoctorOperator.objects.create(user=user, full_name="Dr. Bench")
+        institutions = [
+            InstitutionSettings.objects.create(
+                name=f"Bench {i}",
+                tax_id=f"J-0000000{i}-1",
+                phone="0",
+                logo="logos/bench.png",
+            )
+            for i in range(4)
+        ]
+        patients = Patient.objects.bulk_create(
+            [Patient(first_name=f"Paciente{i}", last_name="Bench") for i in range(500)]
+        )
+        orders = ChargeOrder.objects.bulk_create(
+            (
+                ChargeOrder(
+                    patient=patients[i % len(patients)],
+                    institution=institutions[i % len(institutions)],
+                    doctor=doctor,
+                    total=Decimal("40.00"),
+                    balance_due=Decimal("0.00") if i % 2 else Decimal("40.00"),
+                    status="paid" if i % 2 else "open",
+                )
+                for i in range(n_orders)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        ChargeItem.objects.bulk_create(
+            (
+                ChargeItem(
+                    order=order,
+                    code="BENCH",
+                    unit_price=Decimal("20.00"),
+                    subtotal=Decimal("20.00"),
+                )
+                for order in orders
+                for _ in range(2)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        received = timezone.make_aware(
+            datetime.combine(timezone.localdate() - timedelta(days=1), time(10))
+        )
+        Payment.objects.bulk_create(
+            (
+                Payment(
+                    institution_id=order.institution_id,
+                    charge_order=order,
+                    amount=Decimal("40.00"),
+                    method="cash",
+                    status="confirmed",
+                    received_at=received,
+                )
+                for i, order in enumerate(orders)
+                if i % 2
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        # Un 10% con el total desajustado (ítems cargados sin recalcular)
+        ChargeOrder.objects.annotate(bucket=Mod("id", 10)).filter(bucket=0).update(
+            total=F("total") - Decimal("20.00")
+        )
+
+    def _run(self, n_orders, legacy_sample):
+        started = clock.perf_counter()
+        self._seed(n_orders)
+        self.stdout.write(
+            f"Datos: {n_orders} órdenes en {clock.perf_counter() - started:.1f}s"
+        )
+
+        sample = min(legacy_sample, n_orders)
+        if sample:
+            with transaction.atomic():
+                result = self._measure(lambda: self._legacy(sample))
+                transaction.set_rollback(True)
+            projected = result["seconds"] * n_orders / sample
+            self.stdout.write(
+                f"{'legacy (por orden)':<22} {sample} órdenes: "
+                f"{result['seconds']:.2f}s, {result['queries']} consultas "
+                f"(≈{projected:.0f}s para {n_orders})"
+            )
+
+        for label, dry_run in (("OrderTotals --dry-run", True), ("OrderTotals", False)):
+            result = self._measure(OrderTotals(dry_run=dry_run).run)
+            self.stdout.write(
+                f"{label:<22} {n_orders} órdenes: {result['seconds']:.2f}s, "
+                f"{result['queries']} consultas, "
+                f"{result['value'].changed} corregidas"
+            )
+
+    @staticmethod
+    def _legacy(sample):
+        for order in ChargeOrder.objects.order_by("pk")[:sample]:
+            order.recalc_totals()
+            order.save(update_fields=["total", "balance_due", "status"])
+
+    def _measure(self, fn):
+        queries = [0]
+
+        def count_queries(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        with override_settings(DEBUG=False), connection.execute_wrapper(count_queries):
+            started = clock.perf_counter()
+            value = fn()
+            seconds = clock.perf_counter() - started
+        return {"seconds": seconds, "queries": queries[0], "value": value}
@@ -0,0 +1,154 @@
+# core/management/commands/bench_report_export.py
+"""
+Benchmark de reports_export_api (core/utils/report_export.py).
+
+Compara, para un reporte CLINICAL de N citas:
+- legacy: lista de dicts desde instancias (N+1 en apt.patient / apt.doctor)
+  + Workbook normal en memoria
+- ReportExport en CSV (streaming) y en XLSX (write_only)
+
+Mide tiempo, consultas SQL y pico de memoria Python (tracemalloc). Los
+datos se crean dentro de una transacción que se revierte al final.
+
+Uso:
+    python manage.py bench_report_export --rows 50000
+"""
+import io
+import time
+import tracemalloc
+from datetime import date, timedelta
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import override_settings
+from openpyxl import Workbook
+
+from core.models import Appointment, DoctorOperator, InstitutionSettings, Patient
+from core.utils.report_export import ReportExport
+
+
+class BenchmarkRollback(Exception):
+    pass
+
+
+def legacy_clinical_export(start_date, end_date):
+    """Réplica de la versión anterior: lista completa + Workbook en memoria."""
+    appointments = Appointment.objects.filter(
+        status__in=["pending", "completed", "canceled"],
+        appointment_date__gte=start_date,
+        appointment_date__lte=end_date,
+    )
+    data = []
+    for apt in appointments:
+        data.append(
+            {
+                "ID": apt.id,
+                "Fecha de Cita": apt.appointment_date.strftime("%d/%m/%Y"),
+                "Paciente": apt.patient.full_name if apt.patient else "",
+                "Estado": apt.get_status_display() or "",
+                "Médico": apt.doctor.full_name if apt.doctor else "",
+            }
+        )
+    wb = Workbook()
+    ws = wb.active
+    assert ws is not None  # Workbook() siempre crea una hoja activa
+    if data:
+        ws.append(list(data[0].keys()))
+    for row in data:
+        ws.append(list(row.values()))
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer
+
+
+class Command(BaseCommand):
+    help = "Mide memoria y tiempo de la exportación de reportes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=20000)
+        parser.add_argument(
+            "--skip-legacy",
+            action="store_true",
+            help="No ejecutar la versión anterior (lenta con muchas filas)",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options["rows"], options["skip_legacy"])
+                raise BenchmarkRollback()
+        except BenchmarkRollback:
+            self.stdout.write("Datos de prueba revertidos.")
+
+    def _seed(self, n):
+        user = get_user_model().objects.create_user("bench-export", password="x")
+        doctor = DoctorOperator.objects.create(user=user, full_name="Dr. Bench")
+        institution = InstitutionSettings.objects.create(
+            name="Bench", tax_id="J-00000000-0", phone="0", logo="logos/bench.png"
+        )
+        patients = Patient.objects.bulk_create(
+            [Patient(first_name=f"Paciente{i}", last_name="Bench") for i in range(500)]
+        )
+        start = date(2025, 1, 1)
+        Appointment.objects.bulk_create(
+            (
+                Appointment(
+                    patient=patients[i % len(patients)],
+                    institution=institution,
+                    doctor=doctor,
+                    appointment_date=start + timedelta(days=i % 365),
+                    status="completed",
+                )
+                for i in range(n)
+            ),
+            batch_size=2000,
+        )
+        return start, start + timedelta(days=364)
+
+    def _run(self, n, skip_legacy):
+        start, end = self._seed(n)
+        export = ReportExport("CLINICAL", start_date=start, end_date=end)
+
+        def stream_csv():
+            size = 0
+            for line in export.csv_lines():
+                size += len(line)
+            return size
+
+        cases = [
+            ("ReportExport CSV", stream_csv),
+            ("ReportExport XLSX", lambda: export.write_xlsx(io.BytesIO())),
+        ]
+        if not skip_legacy:
+            cases.insert(
+                0,
+                ("legacy (lista + Workbook)", lambda: legacy_clinical_export(start, end)),
+            )
+
+        for label, fn in cases:
+            result = self._measure(fn)
+            self.stdout.write(
+                f"{label:<28} {n} filas: {result['seconds']:.2f}s, "
+                f"{result['queries']} consultas, pico {result['peak_mb']:.1f} MB"
+            )
+
+    def _measure(self, fn):
+        queries = [0]
+
+        def count_queries(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        with override_settings(DEBUG=False), connection.execute_wrapper(count_queries):
+            tracemalloc.start()
+            started = time.perf_counter()
+            fn()
+            seconds = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        return {
+            "seconds": seconds,
+            "queries": queries[0],
+            "peak_mb": peak / 1024 / 1024,
+        }
@@ -0,0 +1,215 @@
+# core/management/commands/bench_reports_api.py
+"""
+Benchmark de reports_api (core/utils/report_engine.py).
+
+Compara, para N ítems de cobro (4 por orden, 1-2 pagos confirmados por
+orden):
+- legacy: ChargeItem filtrado por order__payments__in / order__appointment__in
+  y agrupado a través del JOIN (cada ítem se repite una vez por pago)
+- ReportEngine: pagos e ítems agregados por separado y cruzados después
+
+Reporta tiempo, consultas SQL y el total de cada versión frente a lo
+realmente cobrado, para evidenciar el inflado por fan-out. Los datos se
+crean dentro de una transacción que se revierte al final.
+
+Uso:
+    python manage.py bench_reports_api
+    python manage.py bench_reports_api --items 200000
+"""
+import time as clock
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.db.models import Count, Sum
+from django.test import override_settings
+from django.utils import timezone
+
+from core.models import (
+    Appointment,
+    ChargeItem,
+    ChargeOrder,
+    DoctorOperator,
+    DoctorService,
+    InstitutionSettings,
+    Patient,
+    Payment,
+)
+from core.utils.report_engine import ReportEngine
+
+ITEMS_PER_ORDER = 4
+BATCH_SIZE = 5000
+
+
+class BenchmarkRollback(Exception):
+    pass
+
+
+def legacy_rows(start, end):
+    """Réplica de las consultas anteriores de reports_api (COMBINED)."""
+    rows = []
+    appointments = Appointment.objects.filter(
+        appointment_date__gte=start, appointment_date__lte=end
+    )
+    clinical = (
+        ChargeItem.objects.filter(order__appointment__in=appointments)
+        .values("doctor_service__name", "order__appointment__appointment_date")
+        .annotate(total_amount=Sum("subtotal"), count=Count("id"))
+        .order_by("-order__appointment__appointment_date")
+    )
+    rows += [float(item["total_amount"]) for item in clinical]
+
+    payments = Payment.objects.filter(
+        status="confirmed",
+        received_at__gte=timezone.make_aware(datetime.combine(start, time.min)),
+        received_at__lte=timezone.make_aware(datetime.combine(end, time.max)),
+    )
+    financial = (
+        ChargeItem.objects.filter(order__payments__in=payments)
+        .values("doctor_service__name", "order__payments__received_at__date")
+        .annotate(total_amount=Sum("subtotal"), count=Count("id"))
+        .order_by("-order__payments__received_at__date")
+    )
+    return rows, [float(item["total_amount"]) for item in financial]
+
+
+class Command(BaseCommand):
+    help = "Mide reports_api (fan-out anterior vs. agregados separados)"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--items", type=int, default=1_000_000)
+        parser.add_argument("--days", type=int, default=90)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                self._run(options["items"], max(1, options["days"]))
+                raise BenchmarkRollback()
+        except BenchmarkRollback:
+            self.stdout.write("Datos de prueba revertidos.")
+
+    def _seed(self, n_items, days):
+        user = get_user_model().objects.create_user("bench-reports", password="x")
+        doctor = DoctorOperator.objects.create(user=user, full_name="Dr. Bench")
+        institution = InstitutionSettings.objects.create(
+            name="Bench", tax_id="J-00000000-1", phone="0", logo="logos/bench.png"
+        )
+        services = DoctorService.objects.bulk_create(
+            [
+                DoctorService(doctor=doctor, code=f"BENCH-{i}", name=f"Servicio {i}")
+                for i in range(20)
+            ]
+        )
+        patients = Patient.objects.bulk_create(
+            [Patient(first_name=f"Paciente{i}", last_name="Bench") for i in range(500)]
+        )
+        start = date(2025, 1, 1)
+        n_orders = max(1, n_items // ITEMS_PER_ORDER)
+
+        appointments = Appointment.objects.bulk_create(
+            (
+                Appointment(
+                    patient=patients[i % len(patients)],
+                    institution=institution,
+                    doctor=doctor,
+                    appointment_date=start + timedelta(days=i % days),
+                    status="completed",
+                )
+                for i in range(n_orders)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        orders = ChargeOrder.objects.bulk_create(
+            (
+                ChargeOrder(
+                    appointment=appointment,
+                    patient_id=appointment.patient_id,
+                    institution=institution,
+                    doctor=doctor,
+                    total=Decimal("100.00"),
+                    status="paid",
+                )
+                for appointment in appointments
+            ),
+            batch_size=BATCH_SIZE,
+        )
+        ChargeItem.objects.bulk_create(
+            (
+                ChargeItem(
+                    order=order,
+                    code="BENCH",
+                    unit_price=Decimal("25.00"),
+                    subtotal=Decimal("25.00"),
+                    doctor_service=services[(i + j) % len(services)],
+                )
+                for i, order in enumerate(orders)
+                for j in range(ITEMS_PER_ORDER)
+            ),
+            batch_size=BATCH_SIZE,
+        )
+
+        def payments():
+            for i, (order, appointment) in enumerate(zip(orders, appointments)):
+                received = timezone.make_aware(
+                    datetime.combine(appointment.appointment_date, time(10))
+                )
+                # La mitad de las órdenes se paga en dos cuotas el mismo día
+                amounts = ("100.00",) if i % 2 else ("60.00", "40.00")
+                for amount in amounts:
+                    yield Payment(
+                        institution=institution,
+                        appointment=appointment,
+                        charge_order=order,
+                        amount=Decimal(amount),
+                        method="cash",
+                        status="confirmed",
+                        received_at=received,
+                    )
+
+        Payment.objects.bulk_create(payments(), batch_size=BATCH_SIZE)
+        return start, start + timedelta(days=days - 1)
+
+    def _run(self, n_items, days):
+        started = clock.perf_counter()
+        start, end = self._seed(n_items, days)
+        self.stdout.write(
+            f"Datos: {n_items} ítems en {clock.perf_counter() - started:.1f}s"
+        )
+
+        collected = Payment.objects.filter(status="confirmed").aggregate(
+            s=Sum("amount")
+        )["s"]
+        self.stdout.write(f"Cobrado real: {float(collected):,.2f}")
+
+        def engine():
+            rows = ReportEngine("COMBINED", start, end).rows()
+            clinical = [r["amount"] for r in rows if r["type"] == "clinical"]
+            financial = [r["amount"] for r in rows if r["type"] == "financial"]
+            return clinical, financial
+
+        for label, fn in (
+            ("legacy (JOIN con fan-out)", lambda: legacy_rows(start, end)),
+            ("ReportEngine", engine),
+        ):
+            result = self._measure(fn)
+            clinical, financial = result["value"]
+            self.stdout.write(
+                f"{label:<26} {result['seconds']:.2f}s, "
+                f"{result['queries']} consultas, "
+                f"clínico {sum(clinical):,.2f}, financiero {sum(financial):,.2f}"
+            )
+
+    def _measure(self, fn):
+        queries = [0]
+
+        def count_queries(execute, sql, params, many, context):
+            queries[0] += 1
+            return execute(sql, params, many, context)
+
+        with override_settings(DEBUG=False), connection.execute_wrapper(count_queries):
+            started = clock.perf_counter()
+            value = fn()
+            seconds = clock.perf_counter() - started
+        return {"seconds": seconds, "queries": queries[0], "value": value}
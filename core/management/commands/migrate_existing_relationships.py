@@ -6,6 +6,7 @@ from core.models import (
     Patient,
     InstitutionSettings,
 )
+from core.permissions import PatientAccessScope
 from django.contrib.auth.models import User
 
 
@@ -89,6 +90,9 @@ class Command(BaseCommand):
             DoctorPatientRelationship.objects.bulk_create(
                 relationships_to_create, ignore_conflicts=True
             )
+            # bulk_create no dispara señales: invalidar el cache de alcance
+            for doctor_id in {rel.doctor_id for rel in relationships_to_create}:
+                PatientAccessScope.invalidate_doctor(doctor_id)
             self.stdout.write(
                 self.style.SUCCESS(
                     f"✅ {len(relationships_to_create)} relaciones creadas"
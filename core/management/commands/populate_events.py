@@ -1,12 +1,18 @@
 from django.core.management.base import BaseCommand
 from core.models import Patient, Appointment, Payment
-from core.utils.events import log_event
+from core.utils.events import EventBus, log_event
 
 
 class Command(BaseCommand):
     help = "Poblar la tabla Event con registros históricos de pacientes, citas y pagos"
 
     def handle(self, *args, **options):
+        # Una sola transacción: los eventos se escriben en lote
+        with EventBus.batch():
+            created = self._populate()
+        self.stdout.write(self.style.SUCCESS(f"Se crearon {created} eventos históricos"))
+
+    def _populate(self):
         created = 0
 
         # Pacientes
@@ -29,5 +35,4 @@ class Command(BaseCommand):
                 metadata={"amount": float(payment.amount) if payment.amount is not None else 0.0}
             )
             created += 1
-
-        self.stdout.write(self.style.SUCCESS(f"Se crearon {created} eventos históricos"))
+        return created
@@ -0,0 +1,25 @@
+# core/management/commands/purge_report_jobs.py
+"""
+Elimina los reportes en segundo plano (ReportJob) antiguos y sus archivos
+locales en MEDIA. Pensado para ejecutarse a diario (cron).
+
+Uso:
+    python manage.py purge_report_jobs
+    python manage.py purge_report_jobs --days 3
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from core.utils.report_jobs import ReportJobs
+
+
+class Command(BaseCommand):
+    help = "Elimina reportes en segundo plano antiguos y sus archivos"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=7)
+
+    def handle(self, *args, **options):
+        deleted = ReportJobs.purge(timedelta(days=max(0, options["days"])))
+        self.stdout.write(self.style.SUCCESS(f"Reportes eliminados: {deleted}"))
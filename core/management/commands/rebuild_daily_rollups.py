@@ -0,0 +1,58 @@
+# core/management/commands/rebuild_daily_rollups.py
+"""
+Reconstruye los rollups diarios por institución (DailyInstitutionRollup).
+
+Los rollups se mantienen solos desde las señales; este comando cubre el
+histórico inicial y corrige desvíos por escrituras que no disparan señales
+(queryset.update(), bulk_create, cargas directas en la base).
+
+Uso:
+    python manage.py rebuild_daily_rollups
+    python manage.py rebuild_daily_rollups --start 2025-01-01 --end 2025-01-31
+    python manage.py rebuild_daily_rollups --institution 3 --chunk-days 7
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from core.utils.rollups import DailyRollup
+
+
+class Command(BaseCommand):
+    help = "Reconstruye los rollups diarios de los dashboards"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="Primer día (YYYY-MM-DD)")
+        parser.add_argument("--end", help="Último día (YYYY-MM-DD)")
+        parser.add_argument("--institution", type=int, action="append")
+        parser.add_argument("--chunk-days", type=int, default=31)
+
+    def handle(self, *args, **options):
+        bounds = DailyRollup.history_bounds()
+        if bounds is None:
+            self.stdout.write(self.style.SUCCESS("No hay datos para agregar"))
+            return
+
+        start = self._parse(options["start"]) or bounds[0]
+        end = self._parse(options["end"]) or bounds[1]
+        if start > end:
+            raise CommandError("--start debe ser anterior o igual a --end")
+
+        written = 0
+        for chunk_start, chunk_end, rows in DailyRollup.rebuild_range(
+            start, end, options["institution"], options["chunk_days"]
+        ):
+            written += rows
+            self.stdout.write(f"{chunk_start} → {chunk_end}: {rows} filas")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Rollups reconstruidos: {written} filas ({start} → {end})")
+        )
+
+    @staticmethod
+    def _parse(value):
+        if not value:
+            return None
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f"Fecha inválida: {value}")
+        return day
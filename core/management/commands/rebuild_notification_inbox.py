@@ -0,0 +1,42 @@
+# core/management/commands/rebuild_notification_inbox.py
+"""
+Llena la bandeja de notificaciones (Notification) con los eventos
+notify=True de los últimos N días. Idempotente: las notificaciones ya
+entregadas se ignoran.
+
+Uso:
+    python manage.py rebuild_notification_inbox --days 7
+"""
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.models import Event
+from core.utils.notifications import NotificationInbox
+
+
+class Command(BaseCommand):
+    help = "Entrega a la bandeja de notificaciones los eventos recientes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--days", type=int, default=7)
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        since = timezone.now() - timedelta(days=options["days"])
+        events = Event.objects.filter(notify=True, timestamp__gte=since).order_by("id")
+
+        delivered = 0
+        batch = []
+        for event in events.iterator(chunk_size=options["batch_size"]):
+            batch.append(event)
+            if len(batch) >= options["batch_size"]:
+                delivered += NotificationInbox.deliver(batch)
+                batch = []
+        if batch:
+            delivered += NotificationInbox.deliver(batch)
+
+        self.stdout.write(
+            self.style.SUCCESS(f"{delivered} notificaciones entregadas")
+        )
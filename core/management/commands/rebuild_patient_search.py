@@ -0,0 +1,28 @@
+# core/management/commands/rebuild_patient_search.py
+"""
+Recalcula Patient.search_document (índice de búsqueda de pacientes).
+
+search_document se mantiene solo desde Patient.save(); este comando corrige
+los pacientes escritos con bulk_create, queryset.update() o cargas
+directas en la base. Solo escribe los documentos que cambiaron.
+
+Uso:
+    python manage.py rebuild_patient_search
+    python manage.py rebuild_patient_search --batch-size 5000
+"""
+from django.core.management.base import BaseCommand
+
+from core.search import PatientSearchIndex
+
+
+class Command(BaseCommand):
+    help = "Recalcula el documento de búsqueda de los pacientes"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000)
+
+    def handle(self, *args, **options):
+        updated = PatientSearchIndex.rebuild(batch_size=max(1, options["batch_size"]))
+        self.stdout.write(
+            self.style.SUCCESS(f"Documentos de búsqueda actualizados: {updated}")
+        )
@@ -1,23 +1,79 @@
 # core/management/commands/recalc_orders.py
-from django.core.management.base import BaseCommand
-from core.models import ChargeOrder
+"""
+Recalcula total, saldo y estado de las órdenes de cobro (set-based, ver
+core/utils/order_totals.py). Solo escribe las órdenes que cambian.
+
+Uso:
+    python manage.py recalc_orders
+    python manage.py recalc_orders --dry-run -v 2
+    python manage.py recalc_orders --start 2025-01-01 --end 2025-01-31
+    python manage.py recalc_orders --institution 3 --institution 4 --workers 4
+"""
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_date
+
+from core.utils.order_totals import OrderTotals
+
+
 class Command(BaseCommand):
-    help = 'Recalcula totales de todas las órdenes de cobro'
+    help = "Recalcula totales de todas las órdenes de cobro"
+
+    def add_arguments(self, parser):
+        parser.add_argument("--start", help="Emitidas desde (YYYY-MM-DD)")
+        parser.add_argument("--end", help="Emitidas hasta (YYYY-MM-DD)")
+        parser.add_argument("--institution", type=int, action="append")
+        parser.add_argument(
+            "--chunk-size", type=int, default=OrderTotals.DEFAULT_CHUNK_SIZE
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=1,
+            help="Hilos en paralelo, una sede por hilo (no aplica en SQLite)",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="Solo muestra qué órdenes cambiarían",
+        )
+
     def handle(self, *args, **options):
-        orders = ChargeOrder.objects.all()
-        fixed = 0
-        
-        for order in orders:
-            old_total = order.total
-            order.recalc_totals()
-            order.save(update_fields=['total', 'balance_due', 'status'])
-            
-            if old_total != order.total:
-                fixed += 1
+        start = self._parse(options["start"])
+        end = self._parse(options["end"])
+        if start and end and start > end:
+            raise CommandError("--start debe ser anterior o igual a --end")
+
+        result = OrderTotals(
+            start=start,
+            end=end,
+            institution_ids=options["institution"],
+            chunk_size=options["chunk_size"],
+            dry_run=options["dry_run"],
+        ).run(workers=max(1, options["workers"]))
+
+        if options["verbosity"] >= 2:
+            for pk, (old_total, *_), (new_total, balance, status) in result.samples:
                 self.stdout.write(
-                    self.style.WARNING(f'Orden #{order.id}: ${old_total} → ${order.total}')
+                    self.style.WARNING(
+                        f"Orden #{pk}: ${old_total} → ${new_total} "
+                        f"(saldo {balance}, {status})"
+                    )
                 )
-        
+            if result.changed > len(result.samples):
+                self.stdout.write(f"... y {result.changed - len(result.samples)} más")
+
+        verb = "a corregir" if options["dry_run"] else "corregidas"
         self.stdout.write(
-            self.style.SUCCESS(f'\n✅ {fixed} órdenes corregidas de {orders.count()} totales')
-        )
\ No newline at end of file
+            self.style.SUCCESS(
+                f"✅ {result.changed} órdenes {verb} de {result.scanned} revisadas"
+            )
+        )
+
+    @staticmethod
+    def _parse(value):
+        if not value:
+            return None
+        day = parse_date(value)
+        if day is None:
+            raise CommandError(f"Fecha inválida: {value}")
+        return day
@@ -1,4 +1,6 @@
 # core/middleware.py (completo corregido)
+from django.conf import settings
+from django.core.cache import cache
 from django.utils.deprecation import MiddlewareMixin
 from django.http import HttpRequest, JsonResponse
 from .permissions import SmartInstitutionValidator
@@ -104,7 +106,18 @@ class JWTRoleValidationMiddleware(MiddlewareMixin):
 
 
 class InstitutionPermissionMiddleware(MiddlewareMixin):
-    """Middleware liviano para permisos institucionales"""
+    """
+    Middleware liviano para permisos institucionales.
+
+    - Con AUTHORIZATION_CACHE_ENABLED (cache compartido entre workers), la
+      institución y el nivel de permiso se leen del cache (invalidados por
+      señales en core/signals.py).
+    - El registro de accesos (AuditLog + contador) se encola en un buffer
+      write-behind y se escribe en lote fuera del request.
+    """
+
+    INSTITUTION_CACHE_PREFIX = "institution_settings"
+    INSTITUTION_CACHE_TIMEOUT = 300  # segundos
 
     def process_request(self, request: HttpRequest):
         # Extraer institución activa
@@ -113,7 +126,7 @@ class InstitutionPermissionMiddleware(MiddlewareMixin):
             return None
 
         try:
-            institution = InstitutionSettings.objects.get(id=institution_id)
+            institution = self.get_institution(institution_id)
             request.current_institution = institution
             request.current_institution_id = institution_id
 
@@ -121,8 +134,10 @@ class InstitutionPermissionMiddleware(MiddlewareMixin):
             if request.user.is_authenticated:
                 doctor = getattr(request.user, "doctor_profile", None)
                 if doctor:
-                    permission_info = SmartInstitutionValidator.get_permission_level(
-                        doctor, institution
+                    permission_info = (
+                        SmartInstitutionValidator.get_cached_permission_level(
+                            doctor, institution
+                        )
                     )
 
                     request.institution_permission = permission_info
@@ -134,6 +149,7 @@ class InstitutionPermissionMiddleware(MiddlewareMixin):
                             institution,
                             f"{request.method} {request.path}",
                             request,
+                            permission_info=permission_info,
                         )
 
         except InstitutionSettings.DoesNotExist:
@@ -148,6 +164,26 @@ class InstitutionPermissionMiddleware(MiddlewareMixin):
 
         return None
 
+    @classmethod
+    def institution_cache_key(cls, institution_id) -> str:
+        return f"{cls.INSTITUTION_CACHE_PREFIX}:{institution_id}"
+
+    @classmethod
+    def get_institution(cls, institution_id) -> InstitutionSettings:
+        """
+        InstitutionSettings por id. Solo se cachea con un cache compartido
+        (AUTHORIZATION_CACHE_ENABLED): con LocMemCache, guardar la
+        institución invalidaría únicamente al worker que la guardó.
+        """
+        if not getattr(settings, "AUTHORIZATION_CACHE_ENABLED", False):
+            return InstitutionSettings.objects.get(id=institution_id)
+        key = cls.institution_cache_key(institution_id)
+        institution = cache.get(key)
+        if institution is None:
+            institution = InstitutionSettings.objects.get(id=institution_id)
+            cache.set(key, institution, cls.INSTITUTION_CACHE_TIMEOUT)
+        return institution
+
     def _extract_institution_id(self, request: HttpRequest):
         """Extraer ID de institución de header o doctor activo"""
         # 1. Header (prioridad)
@@ -157,7 +193,7 @@ class InstitutionPermissionMiddleware(MiddlewareMixin):
         # 2. Doctor activo (fallback)
         if request.user.is_authenticated:
             doctor = getattr(request.user, "doctor_profile", None)
-            if doctor and doctor.active_institution:
-                return doctor.active_institution.id
+            if doctor and doctor.active_institution_id:
+                return doctor.active_institution_id
 
         return None
@@ -0,0 +1,96 @@
+# Generated by Django 5.2.7 on 2026-10-17 23:21
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+
+from core.utils.search_normalize import build_search_document
+
+SEARCH_FIELDS = (
+    "first_name",
+    "middle_name",
+    "last_name",
+    "second_last_name",
+    "national_id",
+)
+FTS_TABLE = "patients_search_fts"
+TRGM_INDEX = "patients_search_document_trgm"
+
+
+def populate_search_document(apps, schema_editor):
+    Patient = apps.get_model("core", "Patient")
+    batch = []
+    for patient in Patient.objects.only("id", *SEARCH_FIELDS).iterator(
+        chunk_size=2000
+    ):
+        patient.search_document = build_search_document(
+            *(getattr(patient, field) for field in SEARCH_FIELDS)
+        )
+        batch.append(patient)
+        if len(batch) >= 2000:
+            Patient.objects.bulk_update(batch, ["search_document"])
+            batch = []
+    if batch:
+        Patient.objects.bulk_update(batch, ["search_document"])
+
+
+def create_search_index(apps, schema_editor):
+    # El índice depende del motor, por eso no se declara en Meta.indexes:
+    # GIN/pg_trgm en PostgreSQL, tabla FTS5 + triggers en SQLite.
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {TRGM_INDEX} "
+            "ON patients USING gin (search_document gin_trgm_ops)"
+        )
+    elif vendor == "sqlite":
+        schema_editor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+            "search_document, content='patients', content_rowid='id')"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON patients BEGIN "
+            f"INSERT INTO {FTS_TABLE}(rowid, search_document) "
+            "VALUES (new.id, new.search_document); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON patients BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_document) "
+            "VALUES ('delete', old.id, old.search_document); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au "
+            "AFTER UPDATE OF search_document ON patients BEGIN "
+            f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, search_document) "
+            "VALUES ('delete', old.id, old.search_document); "
+            f"INSERT INTO {FTS_TABLE}(rowid, search_document) "
+            "VALUES (new.id, new.search_document); END"
+        )
+        schema_editor.execute(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')")
+
+
+def drop_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        schema_editor.execute(f"DROP INDEX IF EXISTS {TRGM_INDEX}")
+    elif vendor == "sqlite":
+        for suffix in ("ai", "ad", "au"):
+            schema_editor.execute(f"DROP TRIGGER IF EXISTS {FTS_TABLE}_{suffix}")
+        schema_editor.execute(f"DROP TABLE IF EXISTS {FTS_TABLE}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_add_responsible_payer_to_chargeorder'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='patient',
+            name='search_document',
+            field=models.TextField(blank=True, default='', editable=False, help_text='Nombres y cédula normalizados (sin acentos, minúsculas). Se calcula en save().'),
+        ),
+        TrigramExtension(),
+        migrations.RunPython(populate_search_document, migrations.RunPython.noop),
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 23:48
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_patient_search_document'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['appointment_date'], name='core_appoin_appoint_5d7cff_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='chargeorder',
+            index=models.Index(fields=['issued_at'], name='core_charge_issued__2545cc_idx'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:08
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_search_date_indexes'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='event',
+            name='patient_id',
+            field=models.IntegerField(blank=True, editable=False, help_text='Paciente relacionado (línea de tiempo de auditoría)', null=True),
+        ),
+        migrations.AddIndex(
+            model_name='event',
+            index=models.Index(fields=['patient_id', '-timestamp', '-id'], name='core_event_patient_4708c0_idx'),
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:17
+
+import django.db.models.deletion
+from decimal import Decimal
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0020_notification_inbox'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyInstitutionRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('appointments_total', models.PositiveIntegerField(default=0)),
+                ('appointments_pending', models.PositiveIntegerField(default=0)),
+                ('appointments_tentative', models.PositiveIntegerField(default=0)),
+                ('appointments_arrived', models.PositiveIntegerField(default=0)),
+                ('appointments_in_consultation', models.PositiveIntegerField(default=0)),
+                ('appointments_completed', models.PositiveIntegerField(default=0)),
+                ('appointments_canceled', models.PositiveIntegerField(default=0)),
+                ('appointments_rejected', models.PositiveIntegerField(default=0)),
+                ('orders_count', models.PositiveIntegerField(default=0)),
+                ('billed_total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('balance_due_total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('waived_count', models.PositiveIntegerField(default=0)),
+                ('waived_total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('void_count', models.PositiveIntegerField(default=0)),
+                ('payments_count', models.PositiveIntegerField(default=0)),
+                ('collected_total', models.DecimalField(decimal_places=2, default=Decimal('0.00'), max_digits=14)),
+                ('waiting_room_arrivals', models.PositiveIntegerField(default=0)),
+                ('waiting_room_waiting', models.PositiveIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('institution', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='daily_rollups', to='core.institutionsettings')),
+            ],
+            options={
+                'verbose_name': 'Resumen diario por institución',
+                'verbose_name_plural': 'Resúmenes diarios por institución',
+                'ordering': ['date'],
+                'indexes': [models.Index(fields=['date'], name='daily_rollup_date_idx')],
+                'constraints': [models.UniqueConstraint(fields=('institution', 'date'), name='unique_daily_rollup')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:32
+
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0022_report_job'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['status', 'received_at'], name='core_paymen_status_64b687_idx'),
+        ),
+    ]
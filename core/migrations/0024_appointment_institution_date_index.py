@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0023_payment_received_at_index'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='appointment',
+            index=models.Index(fields=['institution', 'appointment_date'], name='core_appoin_institu_8b2849_idx'),
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 5.2.7 on 2026-10-18 13:00
+
+from django.db import migrations
+
+from core.utils.rollups import DailyRollup
+
+
+def backfill_daily_rollups(apps, schema_editor):
+    # Carga el histórico de DailyInstitutionRollup (0021) con los modelos
+    # históricos. Equivale a `manage.py rebuild_daily_rollups`, que sigue
+    # siendo la forma de corregir desvíos posteriores.
+    bounds = DailyRollup.history_bounds(apps)
+    if bounds is None:
+        return
+    for _ in DailyRollup.rebuild_range(*bounds, apps=apps):
+        pass
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0025_event_timestamp_default'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_daily_rollups, migrations.RunPython.noop),
+    ]
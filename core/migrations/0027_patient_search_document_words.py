@@ -0,0 +1,46 @@
+# Generated by Django 5.2.7 on 2026-10-18 18:00
+
+from django.db import migrations
+
+from core.utils.search_normalize import build_search_document
+
+SEARCH_FIELDS = (
+    "first_name",
+    "middle_name",
+    "last_name",
+    "second_last_name",
+    "national_id",
+)
+
+
+def resplit_search_document(apps, schema_editor):
+    # build_search_document ahora separa también por puntuación
+    # ("garcia-lopez" -> "garcia lopez"). Los triggers de FTS5 (0017)
+    # reindexan las filas actualizadas.
+    Patient = apps.get_model("core", "Patient")
+    patients = Patient.objects.only("id", "search_document", *SEARCH_FIELDS)
+    batch = []
+    for patient in patients.iterator(chunk_size=2000):
+        document = build_search_document(
+            *(getattr(patient, field) for field in SEARCH_FIELDS)
+        )
+        if document == patient.search_document:
+            continue
+        patient.search_document = document
+        batch.append(patient)
+        if len(batch) >= 2000:
+            Patient.objects.bulk_update(batch, ["search_document"])
+            batch = []
+    if batch:
+        Patient.objects.bulk_update(batch, ["search_document"])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0026_backfill_daily_rollups'),
+    ]
+
+    operations = [
+        migrations.RunPython(resplit_search_document, migrations.RunPython.noop),
+    ]
@@ -11,7 +11,8 @@ from django.core.exceptions import ValidationError
 from simple_history.models import HistoricalRecords, HistoricalChanges
 from django.contrib.auth import get_user_model
 from django.core.validators import FileExtensionValidator
-from django.db.models import Sum
+from django.db.models import F, Sum
+from django.db.models.functions import Coalesce
 from decimal import Decimal
 from django.utils import timezone
 from django.apps import apps
@@ -31,6 +32,7 @@ from .choices import (
 import hashlib
 import uuid
 from datetime import date, timedelta
+from typing import Iterable, List
 
 
 def normalize_title_case(value):
@@ -352,12 +354,30 @@ class Patient(models.Model):
     genetic_predispositions = models.ManyToManyField(
         "GeneticPredisposition", blank=True, related_name="patients"
     )
+    # --- Búsqueda ---
+    # bulk_create y queryset.update() no pasan por save(): después de esas
+    # escrituras, PatientSearchIndex.rebuild() (comando rebuild_patient_search)
+    search_document = models.TextField(
+        blank=True,
+        default="",
+        editable=False,
+        help_text="Nombres y cédula normalizados (sin acentos, minúsculas). Se calcula en save().",
+    )
     # --- Metadatos y Auditoría ---
-    history = HistoricalRecords()
+    history = HistoricalRecords(excluded_fields=["search_document"])
     active = models.BooleanField(default=True)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Campos que alimentan search_document
+    SEARCH_DOCUMENT_FIELDS = (
+        "first_name",
+        "middle_name",
+        "last_name",
+        "second_last_name",
+        "national_id",
+    )
+
     class Meta:
         db_table = "patients"
         verbose_name = "Paciente"
@@ -459,8 +479,23 @@ class Patient(models.Model):
             )
             self.is_minor = age < 18
 
+        self.search_document = self.build_search_document()
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and set(update_fields) & set(
+            self.SEARCH_DOCUMENT_FIELDS
+        ):
+            kwargs["update_fields"] = set(update_fields) | {"search_document"}
+
         super().save(*args, **kwargs)
 
+    def build_search_document(self) -> str:
+        """Documento de búsqueda normalizado (usado también en bulk_create)."""
+        from core.utils.search_normalize import build_search_document
+
+        return build_search_document(
+            *(getattr(self, field) for field in self.SEARCH_DOCUMENT_FIELDS)
+        )
+
     def delete(self, *args, **kwargs):
         """Soft delete."""
         self.active = False
@@ -541,6 +576,59 @@ class Patient(models.Model):
                         )
 
 
+class AppointmentQuerySet(models.QuerySet):
+    PAID_STATUSES = ["confirmed", "completed"]
+
+    def with_financials(self):
+        """
+        Anota paid_total, balance_total y fully_paid en SQL con las mismas
+        reglas que total_paid(), balance_due() e is_fully_paid, que leen
+        estas anotaciones cuando están presentes (sin consultas por fila).
+
+        Las anotaciones son una foto del momento de la consulta: si luego se
+        crean o modifican pagos u órdenes de la cita, esos métodos siguen
+        devolviendo el valor anotado (refresh_from_db() no lo limpia). Usar
+        solo en lecturas; para leer el saldo tras escribir, volver a cargar
+        la cita sin with_financials().
+        """
+        if "paid_total" in self.query.annotations:
+            return self
+
+        money = models.DecimalField(max_digits=12, decimal_places=2)
+        zero = models.Value(Decimal("0.00"), output_field=money)
+
+        def sum_by_appointment(queryset, field):
+            return models.Subquery(
+                queryset.filter(appointment=models.OuterRef("pk"))
+                .order_by()
+                .values("appointment")
+                .annotate(total=Sum(field))
+                .values("total"),
+                output_field=money,
+            )
+
+        payments = Payment.objects.filter(status__in=self.PAID_STATUSES)
+        orders = ChargeOrder.objects.exclude(status="void")
+        return self.annotate(
+            paid_total=Coalesce(sum_by_appointment(payments, "amount"), zero),
+            orders_balance=sum_by_appointment(orders, "balance_due"),
+            balance_total=models.Case(
+                models.When(orders_balance__isnull=False, then=F("orders_balance")),
+                models.When(
+                    expected_amount__gt=F("paid_total"),
+                    then=F("expected_amount") - F("paid_total"),
+                ),
+                default=zero,
+                output_field=money,
+            ),
+            fully_paid=models.Case(
+                models.When(balance_total__lte=0, then=models.Value(True)),
+                default=models.Value(False),
+                output_field=models.BooleanField(),
+            ),
+        )
+
+
 class Appointment(models.Model):
     STATUS_CHOICES = [
         ("pending", "Pending"),
@@ -640,10 +728,17 @@ class Appointment(models.Model):
     )
     history = HistoricalRecords()
 
+    objects = AppointmentQuerySet.as_manager()
+
     class Meta:
         verbose_name = "Cita Médica"
         verbose_name_plural = "Citas Médicas"
         ordering = ["-appointment_date", "arrival_time"]
+        indexes = [
+            models.Index(fields=["appointment_date"]),
+            # Citas abiertas por institución (appointments_pending_api)
+            models.Index(fields=["institution", "appointment_date"]),
+        ]
 
     def __str__(self):
         return f"{self.patient} - {self.institution.name} - {self.appointment_date}"
@@ -655,19 +750,29 @@ class Appointment(models.Model):
         Calcula si la cita está pagada.
         Requerido por core.admin.AppointmentAdmin (list_display[8])
         """
+        # Anotado por Appointment.objects.with_financials()
+        fully_paid = getattr(self, "fully_paid", None)
+        if fully_paid is not None:
+            return fully_paid
         # Si no hay saldo pendiente, está totalmente pagada
         return self.balance_due() <= 0
 
     # --- FINANZAS POR SEDE ---
     def total_paid(self):
+        paid = getattr(self, "paid_total", None)
+        if paid is not None:
+            return paid
         # Filtramos pagos confirmados en esta cita
         # Usamos 'completed' o 'confirmed' según tu lógica de Payment.status
-        agg = self.payments.filter(status__in=["confirmed", "completed"]).aggregate(
-            total=Sum("amount")
-        )
+        agg = self.payments.filter(
+            status__in=AppointmentQuerySet.PAID_STATUSES
+        ).aggregate(total=Sum("amount"))
         return agg.get("total") or Decimal("0.00")
 
     def balance_due(self):
+        balance = getattr(self, "balance_total", None)
+        if balance is not None:
+            return balance
         # El balance es específico a la ChargeOrder de esta cita en esta sede
         orders = self.charge_orders.exclude(status="void")
         if orders.exists():
@@ -1395,6 +1500,7 @@ class Payment(models.Model):
         ordering = ["-created_at"]
         indexes = [
             models.Index(fields=["status", "created_at"]),
+            models.Index(fields=["status", "received_at"]),
             models.Index(fields=["doctor", "status"]),
             models.Index(fields=["charge_order", "status"]),
         ]
@@ -1445,7 +1551,9 @@ class Event(models.Model):
         ("critical", "Crítico"),
     ]
 
-    timestamp = models.DateTimeField(auto_now_add=True)
+    # Hora en que ocurrió el evento (log_event la fija al llamarse, no al
+    # escribir la fila)
+    timestamp = models.DateTimeField(default=timezone.now)
 
     # NUEVO: El evento ahora pertenece a un nodo.
     # Si es un evento global (ej: sistema), puede ser null.
@@ -1478,6 +1586,16 @@ class Event(models.Model):
         max_length=100, help_text="Ej: void, cancel, confirm_payment"
     )
 
+    # Paciente relacionado, desnormalizado al escribir (sin FK: el evento
+    # sobrevive al borrado del paciente). Ver assign_patient_ids() y el
+    # comando backfill_event_patient_ids.
+    patient_id = models.IntegerField(
+        null=True,
+        blank=True,
+        editable=False,
+        help_text="Paciente relacionado (línea de tiempo de auditoría)",
+    )
+
     metadata = models.JSONField(
         blank=True, null=True, help_text="Snapshot de datos relevantes en formato JSON"
     )
@@ -1501,8 +1619,61 @@ class Event(models.Model):
         indexes = [
             models.Index(fields=["institution", "severity"]),
             models.Index(fields=["entity", "entity_id"]),
+            # Línea de tiempo por paciente con paginación keyset
+            models.Index(fields=["patient_id", "-timestamp", "-id"]),
         ]
 
+    # Entidades cuyo paciente se resuelve por PK: entidad -> (modelo, campo)
+    PATIENT_LOOKUPS = {
+        "Appointment": ("Appointment", "patient_id"),
+        "ChargeOrder": ("ChargeOrder", "patient_id"),
+        "Payment": ("Payment", "charge_order__patient_id"),
+        "WaitingRoomEntry": ("WaitingRoomEntry", "patient_id"),
+        "MedicalDocument": ("MedicalDocument", "patient_id"),
+    }
+
+    @classmethod
+    def assign_patient_ids(cls, events):
+        """
+        Completa `patient_id` en los eventos que no lo tienen: una consulta
+        por tipo de entidad para todo el lote. También usa metadata["patient_id"].
+        """
+        pending = {}
+        for event in events:
+            if event.patient_id is not None:
+                continue
+            if event.entity == "Patient":
+                event.patient_id = event.entity_id
+                continue
+            metadata_patient = (event.metadata or {}).get("patient_id")
+            if isinstance(metadata_patient, int):
+                event.patient_id = metadata_patient
+                continue
+            if event.entity in cls.PATIENT_LOOKUPS and event.entity_id is not None:
+                pending.setdefault(event.entity, []).append(event)
+
+        for entity, entity_events in pending.items():
+            model_name, field = cls.PATIENT_LOOKUPS[entity]
+            model = apps.get_model("core", model_name)
+            patient_by_id = dict(
+                model.objects.filter(
+                    pk__in={event.entity_id for event in entity_events}
+                ).values_list("pk", field)
+            )
+            for event in entity_events:
+                event.patient_id = patient_by_id.get(event.entity_id)
+        return events
+
+    def save(self, *args, **kwargs):
+        adding = self._state.adding
+        if adding and self.patient_id is None:
+            Event.assign_patient_ids([self])
+        super().save(*args, **kwargs)
+        if adding and self.notify:
+            from core.utils.notifications import NotificationInbox
+
+            NotificationInbox.deliver([self])
+
     def __str__(self):
         actor = self.actor_user or self.actor_name or "System"
         return f"[{self.severity}] {self.entity} #{self.entity_id} - {self.action} by {actor}"
@@ -1514,6 +1685,182 @@ class Event(models.Model):
         return tags.get(self.severity, "gray")
 
 
+class Notification(models.Model):
+    """
+    Bandeja de notificaciones por usuario: se llena al escribir eventos con
+    notify=True (ver core/utils/notifications.NotificationInbox).
+    """
+
+    user = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name="notifications",
+    )
+    event = models.ForeignKey(
+        Event, on_delete=models.CASCADE, related_name="notifications"
+    )
+    # Copia de event.timestamp para filtrar sin JOIN
+    created_at = models.DateTimeField(default=timezone.now)
+    is_read = models.BooleanField(default=False)
+    read_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Notificación"
+        verbose_name_plural = "Notificaciones"
+        ordering = ["-id"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["user", "event"], name="unique_notification_per_user_event"
+            ),
+        ]
+        indexes = [
+            # Bandeja paginada por keyset (id descendente)
+            models.Index(fields=["user", "-id"], name="notification_inbox_idx"),
+            # Contador de no leídas
+            models.Index(
+                fields=["user"],
+                condition=models.Q(is_read=False),
+                name="notification_unread_idx",
+            ),
+        ]
+
+    def __str__(self):
+        return f"Notification {self.event_id} -> {self.user_id}"
+
+
+class DailyInstitutionRollup(models.Model):
+    """
+    Resumen diario pre-agregado por institución para los dashboards.
+
+    Se mantiene incrementalmente desde Appointment, ChargeOrder, Payment y
+    WaitingRoomEntry (ver core/utils/rollups.DailyRollup) y se reconstruye
+    con `manage.py rebuild_daily_rollups`.
+
+    Día de cada fuente: Appointment.appointment_date, ChargeOrder.issued_at,
+    Payment.received_at y WaitingRoomEntry.arrival_time (hora local).
+    Los conteos por estado reflejan el estado ACTUAL de cada registro.
+    """
+
+    institution = models.ForeignKey(
+        "InstitutionSettings",
+        on_delete=models.CASCADE,
+        related_name="daily_rollups",
+    )
+    date = models.DateField()
+
+    # --- Citas por estado ---
+    appointments_total = models.PositiveIntegerField(default=0)
+    appointments_pending = models.PositiveIntegerField(default=0)
+    appointments_tentative = models.PositiveIntegerField(default=0)
+    appointments_arrived = models.PositiveIntegerField(default=0)
+    appointments_in_consultation = models.PositiveIntegerField(default=0)
+    appointments_completed = models.PositiveIntegerField(default=0)
+    appointments_canceled = models.PositiveIntegerField(default=0)
+    appointments_rejected = models.PositiveIntegerField(default=0)
+
+    # --- Órdenes de cobro (sin anuladas) ---
+    orders_count = models.PositiveIntegerField(default=0)
+    billed_total = models.DecimalField(
+        max_digits=14, decimal_places=2, default=Decimal("0.00")
+    )
+    balance_due_total = models.DecimalField(
+        max_digits=14, decimal_places=2, default=Decimal("0.00")
+    )
+    waived_count = models.PositiveIntegerField(default=0)
+    waived_total = models.DecimalField(
+        max_digits=14, decimal_places=2, default=Decimal("0.00")
+    )
+    void_count = models.PositiveIntegerField(default=0)
+
+    # --- Pagos confirmados ---
+    payments_count = models.PositiveIntegerField(default=0)
+    collected_total = models.DecimalField(
+        max_digits=14, decimal_places=2, default=Decimal("0.00")
+    )
+
+    # --- Sala de espera ---
+    waiting_room_arrivals = models.PositiveIntegerField(default=0)
+    waiting_room_waiting = models.PositiveIntegerField(default=0)
+
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        verbose_name = "Resumen diario por institución"
+        verbose_name_plural = "Resúmenes diarios por institución"
+        ordering = ["date"]
+        constraints = [
+            models.UniqueConstraint(
+                fields=["institution", "date"], name="unique_daily_rollup"
+            ),
+        ]
+        indexes = [
+            models.Index(fields=["date"], name="daily_rollup_date_idx"),
+        ]
+
+    def __str__(self):
+        return f"Rollup {self.institution_id} {self.date}"
+
+
+class ReportJob(models.Model):
+    """
+    Generación de reportes en segundo plano (ver core/utils/report_jobs.py).
+
+    El cliente crea el job, consulta su estado por uuid y descarga el
+    artefacto al terminar. Las solicitudes idénticas (mismo fingerprint)
+    dentro de la ventana de deduplicación reutilizan el mismo job.
+    """
+
+    KIND_CHOICES = [
+        ("export", "Exportación de reportes"),
+        ("institutional", "Reporte institucional"),
+    ]
+    STATUS_CHOICES = [
+        ("pending", "Pendiente"),
+        ("running", "En proceso"),
+        ("done", "Completado"),
+        ("failed", "Fallido"),
+    ]
+
+    uuid = models.UUIDField(default=uuid.uuid4, unique=True, editable=False)
+    kind = models.CharField(max_length=20, choices=KIND_CHOICES)
+    params = models.JSONField(default=dict, blank=True)
+    # sha256 de (kind, params normalizados, usuario)
+    fingerprint = models.CharField(max_length=64)
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default="pending")
+
+    # --- Artefacto ---
+    file = models.FileField(upload_to="reports/%Y/%m/", null=True, blank=True)
+    file_url = models.URLField(max_length=500, blank=True, default="")
+    filename = models.CharField(max_length=255, blank=True, default="")
+    content_type = models.CharField(max_length=100, blank=True, default="")
+    size = models.PositiveBigIntegerField(default=0)
+    error = models.TextField(blank=True, default="")
+
+    requested_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="report_jobs",
+    )
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        verbose_name = "Reporte en segundo plano"
+        verbose_name_plural = "Reportes en segundo plano"
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(
+                fields=["fingerprint", "-created_at"], name="report_job_dedup_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"ReportJob {self.uuid} ({self.kind}, {self.status})"
+
+
 # Nuevo modelo para documentos clínicos
 User = get_user_model()
 
@@ -1806,6 +2153,7 @@ class ChargeOrder(models.Model):
             models.Index(fields=["institution", "status"]),
             models.Index(fields=["doctor", "status"]),
             models.Index(fields=["responsible_payer", "status"]),
+            models.Index(fields=["issued_at"]),
         ]
         verbose_name = "Orden de Cobro"
         verbose_name_plural = "Órdenes de Cobro"
@@ -1831,18 +2179,60 @@ class ChargeOrder(models.Model):
     def recalc_totals(self):
         items_sum = self.items.aggregate(s=Sum("subtotal")).get("s") or Decimal("0.00")
         self.total = items_sum
+        self._apply_confirmed_payments()
+
+    def _apply_confirmed_payments(self):
+        """Saldo y estado a partir de self.total y los pagos confirmados."""
         confirmed_payments = self.payments.filter(status="confirmed").aggregate(
             s=Sum("amount")
         ).get("s") or Decimal("0.00")
-        self.balance_due = max(self.total - confirmed_payments, Decimal("0.00"))
-        if self.status in ["void", "waived"]:
-            return
-        if self.balance_due <= 0 and self.total > 0:
-            self.status = "paid"
-        elif confirmed_payments > 0:
-            self.status = "partially_paid"
-        else:
-            self.status = "open"
+        self.balance_due, self.status = self.derive_balance(
+            self.total, confirmed_payments, self.status
+        )
+
+    @staticmethod
+    def derive_balance(total, confirmed_payments, status):
+        """(balance_due, status) de una orden según su total y lo confirmado."""
+        balance_due = max(total - confirmed_payments, Decimal("0.00"))
+        if status in ["void", "waived"]:
+            return balance_due, status
+        if balance_due <= 0 and total > 0:
+            return balance_due, "paid"
+        if confirmed_payments > 0:
+            return balance_due, "partially_paid"
+        return balance_due, "open"
+
+    def add_items(self, items: Iterable["ChargeItem"]) -> List["ChargeItem"]:
+        """
+        Agrega ítems en lote con un número fijo de consultas.
+
+        Con la fila de la orden bloqueada (select_for_update): un INSERT
+        (bulk_create), el total se ajusta con un delta F("total") + suma de
+        subtotales y saldo/estado se recalculan una sola vez (un guardado y
+        un registro de historial). ChargeItem.save() recalcula la orden
+        completa por cada ítem.
+        """
+        items = list(items)
+        if not items:
+            return []
+        for item in items:
+            item.order = self
+            item.subtotal = item.calc_subtotal()
+        added = sum((item.subtotal for item in items), Decimal("0.00"))
+
+        with transaction.atomic():
+            locked = (
+                ChargeOrder.objects.select_for_update()
+                .only("total", "status")
+                .get(pk=self.pk)
+            )
+            created = ChargeItem.objects.bulk_create(items)
+            ChargeOrder.objects.filter(pk=self.pk).update(total=F("total") + added)
+            self.total = locked.total + added
+            self.status = locked.status
+            self._apply_confirmed_payments()
+            self.save(update_fields=["balance_due", "status", "updated_at"])
+        return created
 
     def clean(self):
         if self.status == "paid" and self.balance_due != Decimal("0.00"):
@@ -1871,6 +2261,7 @@ class ChargeOrder(models.Model):
                 "reason": reason,
                 "institution": self.institution.name,
             },
+            institution_id=self.institution_id,
             severity="critical",
             notify=True,
         )
@@ -1907,8 +2298,11 @@ class ChargeItem(models.Model):
     def __str__(self):
         return f"{self.description or self.code} (x{self.qty})"
 
+    def calc_subtotal(self) -> Decimal:
+        return (self.qty or Decimal("0")) * (self.unit_price or Decimal("0"))
+
     def save(self, *args, **kwargs):
-        self.subtotal = (self.qty or Decimal("0")) * (self.unit_price or Decimal("0"))
+        self.subtotal = self.calc_subtotal()
         super().save(*args, **kwargs)
         self.order.recalc_totals()
         self.order.save(update_fields=["total", "balance_due", "status"])
@@ -1,17 +1,22 @@
 # core/permissions.py
 import logging
+from django.conf import settings
 from django.utils import timezone
 from datetime import timedelta
 from django.http import HttpRequest
 from rest_framework import permissions
+from django.core.cache import cache
+from django.db.models import F, Q
 from .models import (
     InstitutionPermission,
     InstitutionSettings,
     DoctorOperator,
+    DoctorPatientRelationship,
     PatientFamilyLink,
     PatientUser,
 )
 from typing import Dict, Any, Optional
+from core.utils.write_buffer import WriteBehindBuffer
 
 logger = logging.getLogger(__name__)
 
@@ -39,6 +44,142 @@ def can_access_patient(patient_user: PatientUser, target_patient_id: int) -> boo
     return has_link
 
 
+class PatientAccessScope:
+    """
+    Alcance de pacientes accesibles para un usuario:
+    - Doctores: DoctorPatientRelationship activa
+    - Pacientes: PatientFamilyLink activa o ellos mismos
+
+    Para filtrar querysets se usa una subconsulta (el conjunto nunca se
+    materializa en Python). Para chequeos de pertenencia el conjunto de ids
+    se memoiza dentro del request y, con AUTHORIZATION_CACHE_ENABLED (cache
+    compartido), también entre requests (invalidado por señales).
+
+    Uso:
+        scope = PatientAccessScope.for_request(request)
+        qs = scope.filter_queryset(Appointment.objects.all())
+        if not scope.allows(patient_id): ...
+    """
+
+    CACHE_PREFIX = "patient_access_scope"
+    CACHE_TIMEOUT = 300  # segundos
+    REQUEST_ATTR = "_patient_access_scope"
+
+    def __init__(self, user):
+        self.user = user
+        authenticated = bool(user and user.is_authenticated)
+        self.doctor = getattr(user, "doctor_profile", None) if authenticated else None
+        self.patient_user = (
+            getattr(user, "patient_profile", None) if authenticated else None
+        )
+        self._allowed_ids = None
+        self._membership: Dict[int, bool] = {}
+
+    @classmethod
+    def for_request(cls, request) -> "PatientAccessScope":
+        """Instancia única por request (compartida entre DRF y middleware)."""
+        http_request = getattr(request, "_request", request)
+        scope = getattr(http_request, cls.REQUEST_ATTR, None)
+        if scope is None or scope.user is not request.user:
+            scope = cls(request.user)
+            setattr(http_request, cls.REQUEST_ATTR, scope)
+        return scope
+
+    # --- Subconsultas ---
+    def doctor_patient_ids(self):
+        return DoctorPatientRelationship.objects.filter(
+            doctor=self.doctor, status="active"
+        ).values("patient_id")
+
+    def family_patient_ids(self):
+        return PatientFamilyLink.objects.filter(
+            patient_user=self.patient_user, status="active"
+        ).values("patient_id")
+
+    def filter_queryset(self, queryset, field: str = "patient_id"):
+        """Filtra `queryset` por el alcance del usuario (doctor tiene prioridad)."""
+        if self.doctor:
+            return queryset.filter(**{f"{field}__in": self.doctor_patient_ids()})
+        if self.patient_user:
+            return queryset.filter(
+                Q(**{f"{field}__in": self.family_patient_ids()})
+                | Q(**{field: self.patient_user.patient_id})
+            )
+        return queryset.none()
+
+    def filter_doctor_queryset(self, queryset, field: str = "patient_id"):
+        """Igual que filter_queryset pero solo por relación doctor-paciente."""
+        if not self.doctor:
+            return queryset.none()
+        return queryset.filter(**{f"{field}__in": self.doctor_patient_ids()})
+
+    # --- Pertenencia ---
+    def allows(self, patient_id) -> bool:
+        """True si el usuario (doctor o paciente) puede acceder al paciente."""
+        try:
+            patient_id = int(patient_id)
+        except (ValueError, TypeError):
+            return False
+        if patient_id not in self._membership:
+            doctor_ids, family_ids = self._get_allowed_ids()
+            self._membership[patient_id] = (
+                patient_id in doctor_ids or patient_id in family_ids
+            )
+        return self._membership[patient_id]
+
+    def allows_as_doctor(self, patient_id) -> bool:
+        """True solo si existe DoctorPatientRelationship activa."""
+        try:
+            patient_id = int(patient_id)
+        except (ValueError, TypeError):
+            return False
+        return patient_id in self._get_allowed_ids()[0]
+
+    def _get_allowed_ids(self):
+        if self._allowed_ids is None:
+            doctor_ids = frozenset()
+            family_ids = frozenset()
+            if self.doctor:
+                doctor_ids = self._cached_ids(
+                    self.doctor_cache_key(self.doctor.pk),
+                    self.doctor_patient_ids().values_list("patient_id", flat=True),
+                )
+            if self.patient_user:
+                family_ids = self._cached_ids(
+                    self.patient_user_cache_key(self.patient_user.pk),
+                    self.family_patient_ids().values_list("patient_id", flat=True),
+                ) | {self.patient_user.patient_id}
+            self._allowed_ids = (doctor_ids, family_ids)
+        return self._allowed_ids
+
+    @classmethod
+    def _cached_ids(cls, key, queryset) -> frozenset:
+        if not getattr(settings, "AUTHORIZATION_CACHE_ENABLED", False):
+            return frozenset(queryset)
+        ids = cache.get(key)
+        if ids is None:
+            ids = frozenset(queryset)
+            cache.set(key, ids, cls.CACHE_TIMEOUT)
+        return ids
+
+    # --- Invalidación (ver core/signals.py) ---
+    @classmethod
+    def doctor_cache_key(cls, doctor_id) -> str:
+        return f"{cls.CACHE_PREFIX}:doctor:{doctor_id}"
+
+    @classmethod
+    def patient_user_cache_key(cls, patient_user_id) -> str:
+        return f"{cls.CACHE_PREFIX}:patient_user:{patient_user_id}"
+
+    @classmethod
+    def invalidate_doctor(cls, doctor_id):
+        cache.delete(cls.doctor_cache_key(doctor_id))
+
+    @classmethod
+    def invalidate_patient_user(cls, patient_user_id):
+        cache.delete(cls.patient_user_cache_key(patient_user_id))
+
+
 class HasPatientFamilyLinkOrSelf(permissions.BasePermission):
     """
     Permiso que verifica que el usuario tiene PatientFamilyLink activa
@@ -230,41 +371,108 @@ class SmartInstitutionValidator:
             "permission": permission,
         }
 
+    # --- Cache de nivel de permiso por (usuario, institución) ---
+    CACHE_PREFIX = "institution_permission"
+    CACHE_TIMEOUT = 300  # segundos
+
+    @classmethod
+    def _cache_key(cls, user_id, institution_id) -> str:
+        version = cache.get(f"{cls.CACHE_PREFIX}:version:{user_id}", 0)
+        return f"{cls.CACHE_PREFIX}:{user_id}:{institution_id}:{version}"
+
+    @classmethod
+    def get_cached_permission_level(
+        cls, doctor: DoctorOperator, institution: InstitutionSettings
+    ) -> Dict[str, Any]:
+        """
+        Igual que get_permission_level() pero cacheado por (usuario, institución)
+        si AUTHORIZATION_CACHE_ENABLED (cache compartido entre workers).
+        El resultado no incluye la instancia `permission`, solo `permission_id`.
+        Los accesos de emergencia se cachean como máximo hasta su expiración.
+        """
+        use_cache = getattr(settings, "AUTHORIZATION_CACHE_ENABLED", False)
+        key = cls._cache_key(doctor.user_id, institution.pk)
+        info = cache.get(key) if use_cache else None
+        if info is not None:
+            return info
+
+        info = SmartInstitutionValidator.get_permission_level(doctor, institution)
+        permission = info.pop("permission", None)
+        info["permission_id"] = permission.pk if permission else None
+        if not use_cache:
+            return info
+
+        timeout = cls.CACHE_TIMEOUT
+        if info.get("expires_at"):
+            remaining = (info["expires_at"] - timezone.now()).total_seconds()
+            timeout = max(0, min(timeout, int(remaining)))
+        if timeout:
+            # get_permission_level() puede crear/renovar el permiso (post_save
+            # incrementa la versión): se recalcula la clave antes de guardar
+            cache.set(cls._cache_key(doctor.user_id, institution.pk), info, timeout)
+        return info
+
+    @classmethod
+    def invalidate_user(cls, user_id):
+        """Invalida todos los niveles cacheados de un usuario (ver core/signals.py)."""
+        version_key = f"{cls.CACHE_PREFIX}:version:{user_id}"
+        cache.set(version_key, cache.get(version_key, 0) + 1, None)
+
     @staticmethod
     def log_access(
         doctor: DoctorOperator,
         institution: InstitutionSettings,
         action: str,
         request=None,
+        permission_info: Optional[Dict[str, Any]] = None,
     ):
-        permission_info = SmartInstitutionValidator.get_permission_level(
-            doctor, institution
-        )
-
-        permission_obj = permission_info.get("permission")
-        if permission_obj:
-            permission_obj.last_accessed = timezone.now()
-            permission_obj.access_count += 1
-            permission_obj.save(update_fields=["last_accessed", "access_count"])
-
+        """
+        Registra el acceso. El AuditLog se escribe en el request (traza de
+        acceso a datos médicos: no puede perderse); solo el contador del
+        permiso (access_count / last_accessed) va al buffer write-behind.
+        """
         from .models import AuditLog
 
+        if permission_info is None:
+            permission_info = SmartInstitutionValidator.get_cached_permission_level(
+                doctor, institution
+            )
+
+        now = timezone.now()
         try:
             AuditLog.objects.create(
-                user=doctor.user,
+                user_id=doctor.user_id,
                 institution=institution,
-                action=action,
+                action=action[:50],
                 access_level=permission_info["level"],
                 is_own_institution=permission_info["is_own"],
                 is_cross_institution=permission_info["is_cross"],
                 ip_address=get_client_ip(request) if request else None,
                 user_agent=get_user_agent(request) if request else "",
-                timestamp=timezone.now(),
             )
         except Exception:
             logger.info(f"Audit: {doctor.full_name} - {action} - {institution.name}")
 
+        if permission_info.get("permission_id"):
+            ACCESS_COUNT_BUFFER.add((permission_info["permission_id"], now))
+
         if permission_info.get("is_cross"):
             logger.info(
                 f"EMERGENCY ACCESS: Dr {doctor.full_name} accessing {institution.name}"
             )
+
+
+def flush_access_counts(records):
+    """Vuelca contadores de acceso: un UPDATE con F() por permiso."""
+    increments: Dict[int, Any] = {}
+    for permission_id, accessed_at in records:
+        count, last = increments.get(permission_id, (0, accessed_at))
+        increments[permission_id] = (count + 1, max(last, accessed_at))
+
+    for permission_id, (count, last) in increments.items():
+        InstitutionPermission.objects.filter(pk=permission_id).update(
+            access_count=F("access_count") + count, last_accessed=last
+        )
+
+
+ACCESS_COUNT_BUFFER = WriteBehindBuffer("institution-access", flush_access_counts)
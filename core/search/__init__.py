@@ -0,0 +1,8 @@
+# core/search/__init__.py
+"""
+Subsistema de búsqueda de MEDOPZ.
+"""
+from .patient_index import PatientSearchIndex
+from .engine import GlobalSearchEngine
+
+__all__ = ["PatientSearchIndex", "GlobalSearchEngine"]
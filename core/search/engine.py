@@ -0,0 +1,153 @@
+# core/search/engine.py
+"""
+Motor de búsqueda global (pacientes, citas y órdenes de cobro).
+
+La consulta se clasifica con parse_search_query() y cada clase se resuelve
+con búsquedas indexadas:
+- TEXT/CEDULA/EMAIL: los pacientes se resuelven UNA sola vez; citas y
+  órdenes se buscan luego por `patient_id__in` (índices de FK).
+- NUMBER: igualdad por PK de cita/orden; sin "#", además pacientes por
+  prefijo de cédula.
+- DATE: igualdad sobre appointment_date / rango sobre issued_at.
+"""
+import logging
+from typing import Any, Dict, List
+
+from django.db.models import Q
+
+from . import query_parser
+from .patient_index import PatientSearchIndex
+from .query_parser import ParsedQuery, parse_search_query
+
+logger = logging.getLogger(__name__)
+
+
+class GlobalSearchEngine:
+    """
+    Una consulta por entidad:
+    1. ids de pacientes (índice de búsqueda, ordenados por relevancia)
+    2. pacientes de la página (por PK)
+    3. citas por patient_id__in / PK / fecha
+    4. órdenes de cobro por patient_id__in / PK / fecha
+
+    `patient_scope` (queryset o lista de ids de pacientes) restringe todas
+    las búsquedas a los pacientes permitidos.
+    """
+
+    DEFAULT_LIMIT = 5
+    # Máximo de pacientes usados para buscar citas/órdenes relacionadas
+    MAX_PATIENT_IDS = 200
+
+    @classmethod
+    def search(cls, query: str, limit: int = DEFAULT_LIMIT) -> Dict[str, List[Any]]:
+        from core.models import Patient
+
+        parsed = parse_search_query(query)
+        if parsed.is_empty:
+            return {"patients": [], "appointments": [], "orders": []}
+
+        patient_ids = cls._resolve_patient_ids(parsed)
+
+        page_ids = patient_ids[:limit]
+        patients_by_id = Patient.objects.in_bulk(page_ids)
+        patients = [patients_by_id[pk] for pk in page_ids if pk in patients_by_id]
+
+        return {
+            "patients": patients,
+            "appointments": cls._appointments(parsed, patient_ids, limit),
+            "orders": cls._orders(parsed, patient_ids, limit),
+        }
+
+    @classmethod
+    def search_appointments(
+        cls, query: str, limit: int = DEFAULT_LIMIT, patient_scope=None
+    ) -> List[Any]:
+        parsed = parse_search_query(query)
+        if parsed.is_empty:
+            return []
+        patient_ids = cls._resolve_patient_ids(parsed, patient_scope)
+        return cls._appointments(parsed, patient_ids, limit, patient_scope)
+
+    @classmethod
+    def search_orders(
+        cls, query: str, limit: int = DEFAULT_LIMIT, patient_scope=None
+    ) -> List[Any]:
+        parsed = parse_search_query(query)
+        if parsed.is_empty:
+            return []
+        patient_ids = cls._resolve_patient_ids(parsed, patient_scope)
+        return cls._orders(parsed, patient_ids, limit, patient_scope)
+
+    @classmethod
+    def _resolve_patient_ids(
+        cls, parsed: ParsedQuery, patient_scope=None
+    ) -> List[int]:
+        """
+        Ids de los pacientes activos coincidentes, ordenados por relevancia.
+        El filtro `active` va antes del corte a MAX_PATIENT_IDS: los
+        inactivos no ocupan cupo.
+        """
+        from core.models import Patient
+
+        queryset = Patient.objects.filter(active=True)
+        if patient_scope is not None:
+            queryset = queryset.filter(id__in=patient_scope)
+
+        if parsed.kind == query_parser.TEXT:
+            queryset = PatientSearchIndex.search(parsed.text, queryset)
+        elif parsed.national_id:
+            # CEDULA, o NUMBER corto como prefijo de cédula
+            queryset = queryset.filter(
+                national_id__startswith=parsed.national_id
+            ).order_by("national_id")
+        elif parsed.kind == query_parser.EMAIL:
+            queryset = queryset.filter(email__icontains=parsed.text)
+        else:
+            return []
+
+        return list(queryset.values_list("id", flat=True)[: cls.MAX_PATIENT_IDS])
+
+    @classmethod
+    def _appointments(cls, parsed, patient_ids, limit, patient_scope=None):
+        from core.models import Appointment
+
+        conditions = Q()
+        if patient_ids:
+            conditions |= Q(patient_id__in=patient_ids)
+        if parsed.number is not None:
+            conditions |= Q(pk=parsed.number)
+        if parsed.date is not None:
+            conditions |= Q(appointment_date=parsed.date)
+        if not conditions:
+            return []
+
+        queryset = Appointment.objects.filter(conditions)
+        if patient_scope is not None:
+            queryset = queryset.filter(patient_id__in=patient_scope)
+        return list(
+            queryset.select_related("patient", "doctor", "institution", "note")
+            .order_by("-appointment_date")[:limit]
+        )
+
+    @classmethod
+    def _orders(cls, parsed, patient_ids, limit, patient_scope=None):
+        from core.models import ChargeOrder
+
+        conditions = Q()
+        if patient_ids:
+            conditions |= Q(patient_id__in=patient_ids)
+        if parsed.number is not None:
+            conditions |= Q(pk=parsed.number) | Q(appointment_id=parsed.number)
+        if parsed.date is not None:
+            start, end = parsed.datetime_range()
+            conditions |= Q(issued_at__gte=start, issued_at__lt=end)
+        if not conditions:
+            return []
+
+        queryset = ChargeOrder.objects.filter(conditions)
+        if patient_scope is not None:
+            queryset = queryset.filter(patient_id__in=patient_scope)
+        return list(
+            queryset.select_related("appointment", "patient", "institution", "doctor")
+            .order_by("-issued_at")[:limit]
+        )
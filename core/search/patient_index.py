@@ -0,0 +1,171 @@
+# core/search/patient_index.py
+"""
+Índice de búsqueda de pacientes.
+
+Cada Patient guarda un `search_document` precomputado (nombres + cédula,
+sin acentos y en minúsculas). Sobre esa columna:
+- PostgreSQL: índice GIN pg_trgm (LIKE '%token%' usa el índice).
+- SQLite (dev): tabla virtual FTS5 sincronizada por triggers.
+Ambos índices se crean en la migración 0017_patient_search_document.
+
+Los dos motores usan la misma semántica: cada token debe ser prefijo de
+alguna palabra del documento (FTS5 "token"*, LIKE '% token%'), así una
+consulta retorna los mismos pacientes en desarrollo y en producción. Para
+que las palabras sean las mismas, documento y consulta se separan con
+search_words(), que corta en todo lo que no sea letra o dígito como el
+tokenizer unicode61 de FTS5: "García-López" se guarda como "garcia lopez"
+y "lopez" lo encuentra en ambos motores.
+
+search_document se calcula en Patient.save(): bulk_create y
+queryset.update() no lo actualizan. Después de esas escrituras hay que
+llamar a PatientSearchIndex.rebuild() (comando rebuild_patient_search).
+"""
+import logging
+from typing import List, Optional
+
+from django.db import connections
+from django.db.models import Case, F, FloatField, QuerySet, Value, When
+from django.db.models.expressions import RawSQL
+
+from core.utils.search_normalize import search_words
+
+logger = logging.getLogger(__name__)
+
+
+class PatientSearchIndex:
+    """
+    Búsqueda de pacientes por nombre/cédula con ranking por relevancia.
+
+    Todas las palabras de la consulta deben ser prefijo de alguna palabra
+    del documento (AND). Las palabras exactas puntúan más alto.
+    """
+
+    FTS_TABLE = "patients_search_fts"
+    TRGM_INDEX = "patients_search_document_trgm"
+
+    # Puntaje por token: palabra exacta o prefijo de palabra
+    EXACT_WEIGHT = 2.0
+    PREFIX_WEIGHT = 1.0
+
+    _fts_available = {}
+
+    @staticmethod
+    def tokenize(query: str) -> List[str]:
+        """Normaliza y separa la consulta del usuario en tokens."""
+        return search_words(query or "")
+
+    @classmethod
+    def search(cls, query: str, queryset: Optional[QuerySet] = None) -> QuerySet:
+        """
+        Retorna `queryset` filtrado por la consulta, anotado con `search_rank`
+        y ordenado por relevancia descendente.
+        """
+        from core.models import Patient
+
+        patients = Patient.objects.all() if queryset is None else queryset
+
+        tokens = cls.tokenize(query)
+        if not tokens:
+            return patients.none()
+
+        vendor = connections[patients.db].vendor
+        if vendor == "sqlite" and cls.fts_available(patients.db):
+            patients = cls._search_fts(patients, tokens)
+        else:
+            patients = cls._search_document(patients, tokens, vendor)
+
+        return patients.order_by("-search_rank", "last_name", "first_name", "id")
+
+    @classmethod
+    def fts_available(cls, alias: str = "default") -> bool:
+        """Indica si la tabla FTS5 existe en la base de datos (cacheado por proceso)."""
+        if alias not in cls._fts_available:
+            with connections[alias].cursor() as cursor:
+                tables = connections[alias].introspection.table_names(cursor)
+            cls._fts_available[alias] = cls.FTS_TABLE in tables
+            if not cls._fts_available[alias]:
+                logger.warning(
+                    f"PatientSearchIndex: tabla {cls.FTS_TABLE} no existe, usando LIKE"
+                )
+        return cls._fts_available[alias]
+
+    @classmethod
+    def rank_expression(cls, tokens: List[str]):
+        """
+        Relevancia común a todos los motores: por cada token suma
+        palabra exacta > prefijo de palabra.
+        """
+        rank = Value(0.0, output_field=FloatField())
+        for token in tokens:
+            rank = rank + Case(
+                When(
+                    search_document__contains=f" {token} ",
+                    then=Value(cls.EXACT_WEIGHT),
+                ),
+                default=Value(cls.PREFIX_WEIGHT),
+                output_field=FloatField(),
+            )
+        return rank
+
+    @classmethod
+    def _search_document(cls, queryset: QuerySet, tokens: List[str], vendor: str):
+        """
+        Filtro LIKE '% token%' sobre search_document (PostgreSQL con índice
+        trigram, o cualquier otro motor como fallback). El espacio inicial
+        del documento limita la coincidencia a prefijos de palabra, igual
+        que FTS5.
+        """
+        for token in tokens:
+            queryset = queryset.filter(search_document__contains=f" {token}")
+
+        rank = cls.rank_expression(tokens)
+        if vendor == "postgresql":
+            from django.contrib.postgres.search import TrigramWordSimilarity
+
+            rank = rank + TrigramWordSimilarity(" ".join(tokens), F("search_document"))
+
+        return queryset.annotate(search_rank=rank)
+
+    @classmethod
+    def _search_fts(cls, queryset: QuerySet, tokens: List[str]):
+        """
+        Consulta FTS5 por prefijos ("token"*). La subconsulta no es correlacionada:
+        SQLite la evalúa una sola vez.
+        """
+        match = " ".join('"{}"*'.format(token.replace('"', '""')) for token in tokens)
+        matched_ids = RawSQL(
+            f"SELECT rowid FROM {cls.FTS_TABLE} WHERE {cls.FTS_TABLE} MATCH %s",
+            (match,),
+        )
+        return queryset.filter(id__in=matched_ids).annotate(
+            search_rank=cls.rank_expression(tokens)
+        )
+
+    @classmethod
+    def rebuild(
+        cls, queryset: Optional[QuerySet] = None, batch_size: int = 1000
+    ) -> int:
+        """
+        Recalcula search_document de los pacientes cuyo documento quedó
+        desactualizado (bulk_create, queryset.update(), cargas directas).
+        Retorna cuántos se corrigieron.
+        """
+        from core.models import Patient
+
+        patients = Patient.objects.all() if queryset is None else queryset
+
+        stale = []
+        updated = 0
+        fields = ["id", "search_document", *Patient.SEARCH_DOCUMENT_FIELDS]
+        for patient in patients.only(*fields).iterator(chunk_size=batch_size):
+            document = patient.build_search_document()
+            if document == patient.search_document:
+                continue
+            patient.search_document = document
+            stale.append(patient)
+            if len(stale) >= batch_size:
+                updated += Patient.objects.bulk_update(stale, ["search_document"])
+                stale = []
+        if stale:
+            updated += Patient.objects.bulk_update(stale, ["search_document"])
+        return updated
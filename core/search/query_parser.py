@@ -0,0 +1,124 @@
+# core/search/query_parser.py
+"""
+Clasificación de la consulta del buscador.
+
+En lugar de castear PKs y fechas a texto (`id__icontains`,
+`appointment_date__icontains`), la entrada se clasifica y cada clase se
+resuelve con búsquedas por igualdad o rango sobre columnas indexadas:
+
+- CEDULA: "V-12.345.678", "E12345678", "12345678" (5+ dígitos)
+- NUMBER: número de orden/cita: "123", "#123". Sin "#", también busca
+          cédulas que empiezan por esos dígitos (búsqueda parcial)
+- DATE:   "2025-10-18", "18-10-2025", "18/10/2025"
+- EMAIL:  contiene "@"
+- TEXT:   cualquier otra cosa (nombres, vía índice de pacientes)
+"""
+import re
+from datetime import date, datetime, time, timedelta
+from typing import Optional, Tuple
+
+from django.utils import timezone
+
+CEDULA = "cedula"
+NUMBER = "number"
+DATE = "date"
+EMAIL = "email"
+TEXT = "text"
+
+# El parámetro ParsedQuery(date=...) oculta la clase en su propia firma
+Date = date
+
+# La cédula tiene mínimo 5 dígitos (Patient.national_id)
+CEDULA_MIN_DIGITS = 5
+
+_CEDULA_RE = re.compile(
+    r"^(?P<prefix>[VEJG])?\s*-?\s*(?P<digits>\d{1,3}(?:\.\d{3})+|\d+)$",
+    re.IGNORECASE,
+)
+_NUMBER_RE = re.compile(r"^#\s*(?P<number>\d+)$")
+_ISO_DATE_RE = re.compile(r"^(?P<y>\d{4})-(?P<m>\d{1,2})-(?P<d>\d{1,2})$")
+_DMY_DATE_RE = re.compile(r"^(?P<d>\d{1,2})[-/](?P<m>\d{1,2})[-/](?P<y>\d{4})$")
+
+
+class ParsedQuery:
+    """Resultado de parse_search_query()."""
+
+    __slots__ = ("raw", "kind", "text", "number", "national_id", "date")
+
+    def __init__(
+        self,
+        raw: str,
+        kind: str,
+        text: str = "",
+        number: Optional[int] = None,
+        national_id: Optional[str] = None,
+        date: Optional[Date] = None,
+    ):
+        self.raw = raw
+        self.kind = kind
+        self.text = text
+        self.number = number
+        self.national_id = national_id
+        self.date = date
+
+    @property
+    def is_empty(self) -> bool:
+        return not self.raw
+
+    def datetime_range(self) -> Tuple[datetime, datetime]:
+        """Rango [inicio, fin) del día consultado, con zona horaria."""
+        if self.date is None:
+            raise ValueError("La consulta no es una fecha")
+        start = timezone.make_aware(datetime.combine(self.date, time.min))
+        return start, start + timedelta(days=1)
+
+    def __repr__(self):
+        return f"ParsedQuery(kind={self.kind!r}, raw={self.raw!r})"
+
+
+def _parse_date(value: str) -> Optional[date]:
+    match = _ISO_DATE_RE.match(value) or _DMY_DATE_RE.match(value)
+    if not match:
+        return None
+    try:
+        return date(int(match["y"]), int(match["m"]), int(match["d"]))
+    except ValueError:
+        return None
+
+
+def parse_search_query(raw: str) -> ParsedQuery:
+    """
+    Clasifica la consulta del usuario.
+    Un número de 5+ dígitos se trata como cédula, pero conserva `number`
+    para que también se resuelva como PK de cita/orden. Uno más corto es
+    NUMBER y conserva `national_id` como prefijo de cédula.
+    """
+    raw = (raw or "").strip()
+    if not raw:
+        return ParsedQuery(raw, TEXT)
+
+    parsed_date = _parse_date(raw)
+    if parsed_date:
+        return ParsedQuery(raw, DATE, date=parsed_date)
+
+    match = _NUMBER_RE.match(raw)
+    if match:
+        return ParsedQuery(raw, NUMBER, number=int(match["number"]))
+
+    match = _CEDULA_RE.match(raw)
+    if match:
+        digits = match["digits"].replace(".", "")
+        is_formatted = bool(match["prefix"]) or "." in match["digits"]
+        if is_formatted or len(digits) >= CEDULA_MIN_DIGITS:
+            return ParsedQuery(
+                raw,
+                CEDULA,
+                national_id=digits,
+                number=None if is_formatted else int(digits),
+            )
+        return ParsedQuery(raw, NUMBER, number=int(digits), national_id=digits)
+
+    if "@" in raw:
+        return ParsedQuery(raw, EMAIL, text=raw)
+
+    return ParsedQuery(raw, TEXT, text=raw)
@@ -64,6 +64,7 @@ from .models import (
     DoctorPatientRelationship,
     PatientFamilyLink,
     PatientUser,
+    ReportJob,
 )
 from .choices import (
     UNIT_CHOICES,
@@ -76,12 +77,15 @@ from datetime import date
 from typing import Optional, Any, cast
 from decimal import Decimal, InvalidOperation
 from django.db import models
+from django.urls import reverse
 from django.utils import timezone
 
 # from typing import Dict, Any, cast, Optional, List
 from typing import Optional, Any, Dict, List, cast
 import hashlib
 
+from core.utils.event_presentation import render_event, render_events
+
 
 # --- Pacientes ---
 class GeneticPredispositionSerializer(serializers.ModelSerializer):
@@ -1199,14 +1203,26 @@ class MedicalDocumentWriteSerializer(serializers.ModelSerializer):
 
 
 # --- Eventos (auditoría) ---
+class EventListSerializer(serializers.ListSerializer):
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.manager.BaseManager) else data
+        return render_events(iterable)
+
+
 class EventSerializer(serializers.ModelSerializer):
-    title = serializers.SerializerMethodField()
-    description = serializers.SerializerMethodField()
-    category = serializers.SerializerMethodField()
-    action_label = serializers.SerializerMethodField()
-    action_href = serializers.SerializerMethodField()
-    badge_action = serializers.SerializerMethodField()
-    actor = serializers.SerializerMethodField()  # ✅ CORREGIDO: Ahora usa get_actor()
+    """
+    Los campos enriquecidos salen del registro de core/utils/event_presentation
+    (una regla precompilada por entity+action). Para listas de solo lectura
+    usar render_events(), que evita la maquinaria de campos de DRF.
+    """
+
+    title = serializers.CharField(read_only=True)
+    description = serializers.CharField(read_only=True)
+    category = serializers.CharField(read_only=True)
+    action_label = serializers.CharField(read_only=True)
+    action_href = serializers.CharField(read_only=True, allow_null=True)
+    badge_action = serializers.CharField(read_only=True)
+    actor = serializers.CharField(read_only=True)  # actor_user o actor_name
 
     class Meta:
         model = Event
@@ -1228,176 +1244,10 @@ class EventSerializer(serializers.ModelSerializer):
             "action_href",
             "badge_action",  # 🔹 Incluido en la respuesta
         ]
+        list_serializer_class = EventListSerializer
 
-    # 🆕 MEJORADO: Títulos más descriptivos para notificaciones
-    def get_title(self, obj):
-        # === CHARGE ORDER ===
-        if obj.entity == "ChargeOrder" and obj.action == "void":
-            return f"Orden #{obj.entity_id} anulada"
-        if obj.entity == "ChargeOrder" and obj.action == "void_by_appointment_cancel":
-            return f"Orden #{obj.entity_id} anulada por cancelación"
-        if obj.entity == "ChargeOrder" and obj.action == "waive":
-            return f"Orden #{obj.entity_id} exonerada"
-        if obj.entity == "ChargeOrder" and obj.action == "create":
-            return f"Orden #{obj.entity_id} creada"
-
-        # === PAYMENT ===
-        if obj.entity == "Payment" and obj.action == "create":
-            return "Pago confirmado"
-        if obj.entity == "Payment" and obj.action == "confirm":
-            return "Pago verificado"
-        if obj.entity == "Payment" and obj.action == "reverse":
-            return f"Pago #{obj.entity_id} reversado"
-
-        # === APPOINTMENT ===
-        if obj.entity == "Appointment" and obj.action == "create":
-            return f"Cita #{obj.entity_id} creada"
-        if obj.entity == "Appointment" and obj.action == "update":
-            return "Cita actualizada"
-        if obj.entity == "Appointment" and obj.action == "cancel":
-            return f"Cita #{obj.entity_id} cancelada"
-        if obj.entity == "Appointment" and obj.action == "canceled":
-            return f"Cita #{obj.entity_id} cancelada"
-        if obj.entity == "Appointment" and obj.action == "completed":
-            return f"Cita #{obj.entity_id} completada"
-        if obj.entity == "Appointment" and obj.action == "arrived":
-            return f"Paciente llegó a cita #{obj.entity_id}"
-
-        # === WAITING ROOM ===
-        if obj.entity == "WaitingRoom" and obj.action == "delete":
-            return "Paciente retirado de sala de espera"
-        if obj.entity == "WaitingRoomEntry" and obj.action == "patient_arrived":
-            return "Paciente llegó a la sala de espera"
-        if obj.entity == "WaitingRoomEntry" and obj.action == "create":
-            return "Paciente agregado a sala de espera"
-
-        # === PATIENT ===
-        if obj.entity == "Patient" and obj.action == "create":
-            return "Paciente registrado"
-        if obj.entity == "Patient" and obj.action == "update":
-            return "Datos del paciente actualizados"
-
-        # Fallback genérico
-        return f"{obj.entity} {obj.action}"
-
-    # 🆕 MEJORADO: Descripciones con metadata relevante
-    def get_description(self, obj):
-        # === CHARGE ORDER ===
-        if obj.entity == "ChargeOrder" and obj.action in [
-            "void",
-            "void_by_appointment_cancel",
-            "waive",
-        ]:
-            reason = ""
-            actor = ""
-            if obj.metadata:
-                reason = obj.metadata.get("reason", "Anulación manual")
-                actor = obj.metadata.get("actor", "Sistema")
-            if reason and actor:
-                return f"Razón: {reason} | Por: {actor}"
-            elif reason:
-                return f"Razón: {reason}"
-            return f"Orden #{obj.entity_id} procesada"
-
-        if obj.entity == "ChargeOrder":
-            return f"Orden #{obj.entity_id}"
-
-        # === PAYMENT ===
-        if obj.entity == "Payment":
-            amount = ""
-            if obj.metadata:
-                amount = obj.metadata.get("amount", "")
-            return (
-                f"Monto: ${amount}" if amount else f"Pago #{obj.entity_id} registrado"
-            )
-
-        # === APPOINTMENT ===
-        if obj.entity == "Appointment":
-            if obj.metadata:
-                patient_id = obj.metadata.get("patient_id", "")
-                doctor_id = obj.metadata.get("doctor_id", "")
-                return f"ID Paciente: {patient_id} | ID Médico: {doctor_id}"
-            return f"Cita #{obj.entity_id}"
-
-        # === WAITING ROOM ===
-        if obj.entity == "WaitingRoomEntry" and obj.action == "patient_arrived":
-            pid = obj.metadata.get("patient_id") if obj.metadata else None
-            aid = obj.metadata.get("appointment_id") if obj.metadata else None
-            return f"Paciente #{pid} con cita #{aid}"
-
-        # === PATIENT ===
-        if obj.entity == "Patient" and obj.action == "create":
-            if obj.metadata:
-                full_name = obj.metadata.get("full_name", "")
-                return (
-                    f"Nombre: {full_name}" if full_name else "Nuevo paciente registrado"
-                )
-            return "Nuevo paciente"
-
-        # Metadata genérico
-        if obj.metadata:
-            # Intentar mostrar información relevante del metadata
-            if "message" in obj.metadata:
-                return obj.metadata.get("message", "")
-            # Mostrar las primeras 2 claves del metadata
-            keys = list(obj.metadata.keys())[:2]
-            parts = [f"{k}: {obj.metadata[k]}" for k in keys]
-            return " | ".join(parts)
-
-        return ""
-
-    def get_category(self, obj):
-        # Normaliza entity+action como clave única
-        return f"{obj.entity.lower()}.{obj.action.lower()}"
-
-    def get_action_label(self, obj):
-        if obj.entity == "Payment":
-            return "Ver pago"
-        if obj.entity == "ChargeOrder":
-            return "Ver orden"
-        if obj.entity == "Appointment":
-            return "Ver cita"
-        if obj.entity == "WaitingRoomEntry":
-            return "Ver sala de espera"
-        if obj.entity == "WaitingRoom":
-            return "Ver sala de espera"
-        if obj.entity == "Patient":
-            return "Ver paciente"
-        return "Ver detalle"
-
-    # 🆕 MEJORADO: action_href correcto para cada entidad
-    def get_action_href(self, obj):
-        if obj.entity == "Payment":
-            return f"/payments/{obj.entity_id}"
-        if obj.entity == "ChargeOrder":
-            return f"/payments/{obj.entity_id}"
-        if obj.entity == "Appointment":
-            return f"/appointments?view={obj.entity_id}"  # ✅ CORREGIDO
-        if obj.entity == "Patient":
-            return f"/patients/{obj.entity_id}"
-        if obj.entity == "WaitingRoom":
-            return "/waitingroom"
-        if obj.entity == "WaitingRoomEntry":
-            return "/waitingroom"
-        return None
-
-    def get_badge_action(self, obj):
-        # 🔹 Normaliza para NotificationBadge
-        if obj.action in ["create", "update", "delete"]:
-            return obj.action
-        if obj.action in ["void", "waive", "cancel", "canceled"]:
-            return "delete"
-        if obj.action in ["confirm", "completed", "patient_arrived"]:
-            return "create"
-        if obj.entity == "WaitingRoomEntry" and obj.action == "patient_arrived":
-            return "create"
-        return "other"
-
-    def get_actor(self, obj):
-        # ✅ CORREGIDO: Combina actor_user y actor_name
-        if obj.actor_user:
-            return str(obj.actor_user)
-        return obj.actor_name or "System"
+    def to_representation(self, instance):
+        return render_event(instance)
 
 
 class InstitutionSettingsSerializer(serializers.ModelSerializer):
@@ -2053,7 +1903,7 @@ class AppointmentSerializer(serializers.ModelSerializer):
                 tentative_time=appointment.tentative_time,
             )
 
-            total_amount = Decimal("0.00")
+            new_items = []
             for service in services_data:
                 doctor_service_id = service.get("doctor_service_id")
                 qty = service.get("qty", 1)
@@ -2086,18 +1936,21 @@ class AppointmentSerializer(serializers.ModelSerializer):
                             )
                         )
 
-                    item = ChargeItem.objects.create(
-                        order=charge_order,
-                        doctor_service=doctor_service,
-                        code=code,
-                        description=description,
-                        qty=Decimal(str(qty)),
-                        unit_price=unit_price,
+                    new_items.append(
+                        ChargeItem(
+                            doctor_service=doctor_service,
+                            code=code,
+                            description=description,
+                            qty=Decimal(str(qty)),
+                            unit_price=unit_price,
+                        )
                     )
-                    total_amount += item.subtotal
 
-            charge_order.recalc_totals()
-            charge_order.save(update_fields=["total", "balance_due", "status"])
+            # Un INSERT y un recálculo de la orden para todo el lote
+            created_items = charge_order.add_items(new_items)
+            total_amount = sum(
+                (item.subtotal for item in created_items), Decimal("0.00")
+            )
 
             appointment.expected_amount = charge_order.total
             appointment.save(update_fields=["expected_amount"])
@@ -5039,3 +4892,35 @@ class PatientFamilyLinkWriteSerializer(serializers.ModelSerializer):
         patient_user = PatientUser.objects.get(user=user)
         validated_data["patient_user"] = patient_user
         return super().create(validated_data)
+
+
+class ReportJobSerializer(serializers.ModelSerializer):
+    """Estado de un reporte en segundo plano (polling del cliente)."""
+
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportJob
+        fields = [
+            "uuid",
+            "kind",
+            "status",
+            "filename",
+            "content_type",
+            "size",
+            "error",
+            "created_at",
+            "started_at",
+            "finished_at",
+            "download_url",
+        ]
+        read_only_fields = fields
+
+    def get_download_url(self, obj):
+        if obj.status != "done":
+            return None
+        if obj.file_url:
+            return obj.file_url
+        url = reverse("report-job-download-api", args=[obj.uuid])
+        request = self.context.get("request")
+        return request.build_absolute_uri(url) if request else url
@@ -1,22 +1,31 @@
 import os
 import io
-from io import BytesIO
 import re
 import time
-import base64
 import hashlib
 import logging
 import tempfile
 import traceback
-import calendar
-from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from decimal import Decimal, InvalidOperation
 from datetime import datetime, date, timedelta
 from typing import Dict, Any, cast, Optional, List, Tuple, Union
+from concurrent.futures import ThreadPoolExecutor
 
 # from PIL import Image as PILImage
 from reportlab.platypus import Image as RLImage
-from core.utils.r2_storage import get_r2_client, upload_medical_document
+from core.utils.r2_storage import (
+    R2StorageClient,
+    get_r2_client,
+    upload_medical_document,
+)
 from core.utils.document_verification import get_verification_url
+from core.utils.event_presentation import render_events
+from core.utils.institutional_report import InstitutionalReport
+from core.utils.pdf_cache import PDFCache
+from core.utils.pdf_engine import PDFEngine
+from core.utils.qr import qr_data_uri
+from core.utils.dashboard import DashboardEngine
+from core.utils.rollups import DailyRollup
 
 # 2. Django Core
 from django.conf import settings
@@ -25,9 +34,17 @@ from django.core.files.base import ContentFile
 from django.core.paginator import Paginator
 from django.core.exceptions import ValidationError
 from django.db import transaction
-from django.db.models import Count, Sum, Q, F, Value, CharField
+from django.db.models import (
+    Count,
+    Sum,
+    Q,
+    F,
+    Value,
+    CharField,
+    Subquery,
+    Prefetch,
+)
 from django.db.models.functions import (
-    TruncDate,
     TruncMonth,
     TruncWeek,
     Coalesce,
@@ -38,32 +55,18 @@ from django.http import JsonResponse, FileResponse, HttpResponse, HttpRequest
 from django.shortcuts import get_object_or_404
 from django.template.loader import render_to_string
 from django.utils import timezone
-from django.utils.dateparse import parse_date
 from django.utils.timezone import now, localdate, make_aware
 
 # 3. Herramientas de Terceros (Scraping, QR, Excel)
 import requests
-import qrcode
 from bs4 import BeautifulSoup
 from playwright.sync_api import sync_playwright
-from weasyprint import HTML
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill
+from openpyxl.styles import Alignment, PatternFill
 from openpyxl.worksheet.worksheet import Worksheet
 from openpyxl.drawing.image import Image as XLImage
 
 # 4. ReportLab (Motor de PDF para Reportes Estructurados)
-from reportlab.lib.pagesizes import letter
-from reportlab.lib import colors
-from reportlab.platypus import (
-    SimpleDocTemplate,
-    Table,
-    TableStyle,
-    Paragraph,
-    Spacer,
-    Image as RLImage,
-)
-from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.platypus import Image as RLImage
 
 # 5. Django Rest Framework (DRF)
 # Solo lo mínimo necesario para tipos en la capa de servicios
@@ -82,7 +85,6 @@ from .models import (
     Diagnosis,
     Treatment,
     Prescription,
-    ChargeOrder,
     ChargeItem,
     InstitutionSettings,
     DoctorOperator,
@@ -113,6 +115,7 @@ from .models import (
     VitalSigns,
     ClinicalNote,
     DoctorPaymentConfig,
+    ChargeOrder,
 )
 
 # 7. Serializadores Locales
@@ -209,10 +212,7 @@ def get_patient_serialized(patient) -> dict:
 
 
 def make_qr_data_uri(payload: str) -> str:
-    img = qrcode.make(payload)
-    buf = BytesIO()
-    img.save(buf, "PNG")
-    return f"data:image/png;base64,{base64.b64encode(buf.getvalue()).decode('utf-8')}"
+    return qr_data_uri(payload, border=4)
 
 
 def safe_json(value):
@@ -338,103 +338,28 @@ def get_bcv_rate():
 
 
 def get_dashboard_summary_data(
-    start_date=None, end_date=None, range_param=None, currency="USD", status_param=None
+    start_date=None,
+    end_date=None,
+    range_param=None,
+    currency="USD",
+    status_param=None,
+    institution_id=None,
 ):
     """
     Músculo estadístico de Medopz.
     Calcula finanzas, citas y tendencias sin depender de la capa web.
+    Delega en DashboardEngine (core/utils/dashboard.py): rollups diarios,
+    alcance por institución y cache con invalidación por eventos.
     """
-    today = localdate()
-
-    # --- 1. Lógica de Fechas (Independiente) ---
-    def parse_d(d):
-        try:
-            return parse_date(str(d)) if d else None
-        except:
-            return None
-
-    if range_param == "day":
-        start = end = today
-    elif range_param == "week":
-        start = today - timedelta(days=today.weekday())
-        end = start + timedelta(days=6)
-    elif range_param == "month":
-        start = today.replace(day=1)
-        end = date(
-            today.year, today.month, calendar.monthrange(today.year, today.month)[1]
-        )
-    else:
-        start = parse_d(start_date) or (today - timedelta(days=6))
-        end = parse_d(end_date) or today
-
-    # --- 2. Finanzas (Agregaciones) ---
-    orders_qs = ChargeOrder.objects.exclude(status="void")
-    total_amount = orders_qs.aggregate(s=Sum("total")).get("s") or Decimal("0")
-    confirmed_amount = Payment.objects.filter(status="confirmed").aggregate(
-        s=Sum("amount")
-    ).get("s") or Decimal("0")
-    balance_due = orders_qs.aggregate(s=Sum("balance_due")).get("s") or Decimal("0")
-
-    waived_qs = ChargeOrder.objects.filter(status="waived")
-
-    # --- 3. Clínico-operativo ---
-    appt_qs = Appointment.objects.filter(appointment_date__range=(start, end))
-    if status_param:
-        appt_qs = appt_qs.filter(status=status_param)
-
-    # --- 4. Tendencias (QuerySets optimizados) ---
-    appt_trend = list(
-        Appointment.objects.filter(
-            appointment_date__range=(start, end), status="completed"
-        )
-        .annotate(date=TruncDate("appointment_date"))
-        .values("date")
-        .annotate(value=Count("id"))
-        .order_by("date")
+    return DashboardEngine.summary(
+        institution_id=institution_id,
+        start_date=start_date,
+        end_date=end_date,
+        range_param=range_param,
+        currency=currency,
+        status_param=status_param,
     )
 
-    pay_trend = list(
-        Payment.objects.filter(
-            status="confirmed", received_at__date__range=(start, end)
-        )
-        .annotate(date=TruncDate("received_at"))
-        .values("date")
-        .annotate(value=Sum("amount"))
-        .order_by("date")
-    )
-
-    # --- 5. Tasa BCV (Usando el servicio interno si existe o el Cache) ---
-    latest_rate = BCVRateCache.objects.order_by("-created_at").first()
-    rate_val = float(latest_rate.value) if latest_rate else 1.0
-
-    def convert(amount):
-        return float(amount) * rate_val if currency == "VES" else float(amount)
-
-    # --- Payload Final ---
-    return {
-        "total_patients": Patient.objects.count(),
-        "total_appointments": appt_qs.count(),
-        "completed_appointments": appt_qs.filter(status="completed").count(),
-        "pending_appointments": appt_qs.filter(status="pending").count(),
-        "active_consultations": appt_qs.filter(status="in_consultation").count(),
-        "waiting_room_count": WaitingRoomEntry.objects.filter(
-            arrival_time__date__range=(start, end), status="waiting"
-        ).count(),
-        "total_payments_amount": convert(confirmed_amount),
-        "financial_balance": convert(max(total_amount - balance_due, Decimal("0"))),
-        "appointments_trend": [
-            {"date": str(r["date"]), "value": int(r["value"])} for r in appt_trend
-        ],
-        "payments_trend": [
-            {"date": str(r["date"]), "value": float(r["value"])} for r in pay_trend
-        ],
-        "bcv_rate": {
-            "value": rate_val,
-            "unit": "VES_per_USD",
-            "is_fallback": latest_rate is None,
-        },
-    }
-
 
 def get_daily_appointments() -> List[Dict[str, Any]]:
     today = localdate()
@@ -457,7 +382,8 @@ def get_current_consultation() -> Optional[Dict[str, Any]]:
     OPTIMIZADO: Usa prefetch_related para evitar N+1 queries en serializer.
     """
     appointment = (
-        Appointment.objects.filter(status="in_consultation")
+        Appointment.objects.with_financials()
+        .filter(status="in_consultation")
         .select_related(
             "patient",
             "institution",
@@ -549,152 +475,10 @@ def export_institutional_report(
     """
     SERVICIO: Genera el archivo binario (PDF o Excel) para exportaciones institucionales.
     Garantiza un retorno de (buffer, content_type, filename).
+    El render vive en core/utils/institutional_report.py.
     """
-    inst = InstitutionSettings.objects.first()
-    doc_op = DoctorOperator.objects.first()
-
-    # 1. Obtener tasa si es necesario
-    rate = Decimal("1.0")
-    if target_currency == "VES":
-        # Asegúrate de que get_bcv_rate esté accesible o importada
-        from .services import get_bcv_rate
-
-        rate = get_bcv_rate()
-
-    # 2. Preparar especialidades
-    specialty_str = ""
-    if doc_op and hasattr(doc_op, "specialties"):
-        try:
-            specialty_str = ", ".join([str(s) for s in doc_op.specialties.all()])
-        except Exception:
-            specialty_str = "No especificadas"
-
-    buffer = io.BytesIO()
-
-    # --- LÓGICA PDF ---
-    if export_format == "pdf":
-        doc = SimpleDocTemplate(buffer, pagesize=letter)
-        elements = []
-        styles = getSampleStyleSheet()
-
-        if inst:
-            elements.append(Paragraph(f"<b>{inst.name or ''}</b>", styles["Title"]))
-            elements.append(
-                Paragraph(f"Dirección: {inst.address or ''}", styles["Normal"])
-            )
-            elements.append(
-                Paragraph(
-                    f"Tel: {inst.phone or ''} • RIF: {inst.tax_id or ''}",
-                    styles["Normal"],
-                )
-            )
-            elements.append(Spacer(1, 12))
-
-        if doc_op:
-            elements.append(
-                Paragraph(
-                    f"Médico operador: {doc_op.full_name or ''} • Colegiado: {doc_op.agregado_id or ''} • {specialty_str}",
-                    styles["Normal"],
-                )
-            )
-            elements.append(Spacer(1, 8))
-
-        elements.append(Paragraph("<b>Reporte Institucional</b>", styles["Heading2"]))
-        elements.append(Paragraph(f"Filtros: {str(filters)}", styles["Normal"]))
-        elements.append(Paragraph(f"Tasa aplicada: {rate} Bs/USD", styles["Italic"]))
-        elements.append(Spacer(1, 12))
-
-        table_data = [["ID", "Fecha", "Tipo", "Entidad", "Estado", "Monto", "Moneda"]]
-        for r in data_serialized:
-            raw_date = r.get("date")
-            date_str = str(raw_date)[:10] if raw_date else ""
-
-            amount_dec = Decimal(str(r.get("amount") or "0"))
-            amount_val = (amount_dec * rate).quantize(Decimal("0.01"), ROUND_HALF_UP)
-
-            table_data.append(
-                [
-                    str(r.get("id") or ""),
-                    date_str,
-                    str(r.get("type") or ""),
-                    str(r.get("entity") or ""),
-                    str(r.get("status") or ""),
-                    f"{float(amount_val):.2f}",
-                    target_currency,
-                ]
-            )
-
-        table = Table(table_data, hAlign="LEFT")
-        table.setStyle(
-            TableStyle(
-                [
-                    ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#003366")),
-                    ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
-                    ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
-                    ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
-                ]
-            )
-        )
-        elements.append(table)
-
-        elements.append(Spacer(1, 24))
-        elements.append(Paragraph(f"Generado por: {user_name}", styles["Normal"]))
-        elements.append(
-            Paragraph(
-                f"Fecha: {timezone.now().strftime('%Y-%m-%d %H:%M')}", styles["Normal"]
-            )
-        )
-
-        doc.build(elements)
-        buffer.seek(0)
-        return buffer, "application/pdf", "reporte.pdf"
-
-    # --- LÓGICA EXCEL ---
-    elif export_format == "excel":
-        wb = Workbook()
-        # 🔹 CAST para que Pylance reconozca ws como Worksheet y no como None
-        from openpyxl.worksheet.worksheet import Worksheet
-
-        ws = cast(Worksheet, wb.active)
-
-        ws.title = "Reporte"
-
-        if inst:
-            # Acceso directo por celda tipado
-            ws["A1"] = str(inst.name)
-            ws["A1"].font = Font(bold=True, size=14)
-
-        ws.append(["ID", "Fecha", "Tipo", "Entidad", "Estado", "Monto", "Moneda"])
-
-        for r in data_serialized:
-            raw_date = r.get("date")
-            amount_dec = Decimal(str(r.get("amount") or "0"))
-            amount_val = float(
-                (amount_dec * rate).quantize(Decimal("0.01"), ROUND_HALF_UP)
-            )
-
-            ws.append(
-                [
-                    str(r.get("id") or ""),
-                    str(raw_date)[:10] if raw_date else "",
-                    str(r.get("type") or ""),
-                    str(r.get("entity") or ""),
-                    str(r.get("status") or ""),
-                    amount_val,
-                    target_currency,
-                ]
-            )
-
-        wb.save(buffer)
-        buffer.seek(0)
-        return (
-            buffer,
-            "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-            "reporte.xlsx",
-        )
-
-    # Si llegamos aquí sin retorno, lanzamos error para que la vista no reciba None
-    raise ValueError(f"Formato de exportación no soportado: {export_format}")
+    report = InstitutionalReport(data_serialized, filters, target_currency, user_name)
+    return report.export(export_format)
 
 
 def generate_pdf_from_html(html: str, filename: str = "informe.pdf") -> File:
@@ -703,11 +487,9 @@ def generate_pdf_from_html(html: str, filename: str = "informe.pdf") -> File:
     - Usa archivo temporal seguro.
     - Compatible con MedicalDocument.file.
     """
-    from weasyprint import HTML
-
     with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
-        # Renderizar PDF desde HTML
-        HTML(string=html).write_pdf(tmp.name)
+        # Renderizar PDF desde HTML (pool de procesos de PDFEngine)
+        tmp.write(PDFEngine.render_html(html))
         tmp.seek(0)
         # Retornar como File listo para guardar
         return File(tmp, name=filename)
@@ -727,11 +509,7 @@ def generate_pdf_document(category: str, queryset, appointment):
     # Generar audit code y QR
     audit_code = generate_audit_code(appointment, patient)
     qr_payload = f"Consulta:{appointment.id}|Category:{category}|Audit:{audit_code}"
-    qr_img = qrcode.make(qr_payload)
-    buffer = BytesIO()
-    qr_img.save(buffer, "PNG")
-    qr_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
-    qr_code_url = f"data:image/png;base64,{qr_base64}"
+    qr_code_url = qr_data_uri(qr_payload, border=4)
 
     # Helper defensivo
     def safe(val, default=""):
@@ -872,7 +650,7 @@ def generate_pdf_document(category: str, queryset, appointment):
     }
 
     html_string = render_to_string(tpl, context)
-    pdf_bytes = HTML(string=html_string, base_url=settings.MEDIA_ROOT).write_pdf()
+    pdf_bytes = PDFEngine.render_html(html_string, template_name=tpl)
 
     # ✅ Devuelve siempre un tuple (pdf_file, audit_code)
     return ContentFile(
@@ -880,6 +658,21 @@ def generate_pdf_document(category: str, queryset, appointment):
     ), audit_code
 
 
+AUDIT_DEFAULT_LIMIT = 50
+
+
+def encode_audit_cursor(event: Dict[str, Any]) -> str:
+    """Cursor keyset a partir del último evento (serializado) de una página."""
+    return str(event["id"])
+
+
+def decode_audit_cursor(cursor: str) -> int:
+    try:
+        return int(cursor)
+    except (TypeError, ValueError):
+        raise ValueError("Cursor de paginación inválido")
+
+
 def get_audit_logic(
     entity: Optional[str] = None,
     entity_id: Optional[Union[int, str]] = None,
@@ -887,113 +680,25 @@ def get_audit_logic(
     limit: Optional[int] = None,
     split_by_category: bool = False,
     filters: Optional[Dict[str, Any]] = None,
+    cursor: Optional[str] = None,
 ) -> Any:
     """
     SERVICIO MAESTRO DE AUDITORÍA: Centraliza 7 métodos en uno solo.
     Devuelve datos puros (dicts/lists), sin Response ni Request.
 
-    ✅ FIX: Ahora busca eventos relacionados con el paciente a través de:
-    - Patient (entity_id == patient_id)
-    - Appointment (appointment.patient_id == patient_id)
-    - ChargeOrder (charge_order.patient_id == patient_id)
-    - Payment (payment.appointment.patient_id == patient_id)
-    - WaitingRoomEntry (waiting_room_entry.patient_id == patient_id)
-    """
-    from .serializers import EventSerializer
-    from .models import Appointment, ChargeOrder, Payment, WaitingRoomEntry
+    Eventos de un paciente: Event.patient_id (desnormalizado al escribir,
+    ver Event.assign_patient_ids) cubre Patient, Appointment, ChargeOrder,
+    Payment, WaitingRoomEntry y metadata["patient_id"]; es un solo rango
+    sobre el índice (patient_id, -timestamp, -id).
 
+    `cursor` (id del último evento de la página previa) pagina por keyset
+    sobre (timestamp, id).
+    """
     # 1. Base Query optimizada
-    qs = Event.objects.all().order_by("-timestamp")
-    # 2. Filtros de Identidad (Búsqueda mejorada por patient_id)
+    qs = Event.objects.all().order_by("-timestamp", "-id")
+    # 2. Filtros de Identidad
     if patient_id:
-        patient_id_int = int(patient_id)
-
-        # Obtener IDs de entidades relacionadas con este paciente
-        related_entity_ids = []
-
-        # A) El paciente mismo (entity=Patient, entity_id=patient_id)
-        patient_event_ids = list(
-            Event.objects.filter(
-                entity="Patient", entity_id=patient_id_int
-            ).values_list("id", flat=True)
-        )
-        related_entity_ids.extend(patient_event_ids)
-
-        # B) Citas del paciente
-        appointment_ids = list(
-            Appointment.objects.filter(patient_id=patient_id_int).values_list(
-                "id", flat=True
-            )
-        )
-
-        if appointment_ids:
-            # Citas directas
-            appointment_event_ids = list(
-                Event.objects.filter(
-                    entity="Appointment", entity_id__in=appointment_ids
-                ).values_list("id", flat=True)
-            )
-            related_entity_ids.extend(appointment_event_ids)
-
-            # C) Órdenes de cargo del paciente
-            charge_order_ids = list(
-                ChargeOrder.objects.filter(patient_id=patient_id_int).values_list(
-                    "id", flat=True
-                )
-            )
-
-            if charge_order_ids:
-                charge_order_event_ids = list(
-                    Event.objects.filter(
-                        entity="ChargeOrder", entity_id__in=charge_order_ids
-                    ).values_list("id", flat=True)
-                )
-                related_entity_ids.extend(charge_order_event_ids)
-
-                # D) Pagos relacionados con esas órdenes de cargo
-                payment_ids = list(
-                    Payment.objects.filter(
-                        charge_order_id__in=charge_order_ids
-                    ).values_list("id", flat=True)
-                )
-
-                if payment_ids:
-                    payment_event_ids = list(
-                        Event.objects.filter(
-                            entity="Payment", entity_id__in=payment_ids
-                        ).values_list("id", flat=True)
-                    )
-                    related_entity_ids.extend(payment_event_ids)
-
-            # E) Entradas en sala de espera del paciente
-            waiting_room_ids = list(
-                WaitingRoomEntry.objects.filter(patient_id=patient_id_int).values_list(
-                    "id", flat=True
-                )
-            )
-
-            if waiting_room_ids:
-                waiting_event_ids = list(
-                    Event.objects.filter(
-                        entity="WaitingRoomEntry", entity_id__in=waiting_room_ids
-                    ).values_list("id", flat=True)
-                )
-                related_entity_ids.extend(waiting_event_ids)
-
-        # F) Búsqueda legacy en metadata (por si hay eventos con patient_id en metadata)
-        metadata_events = Event.objects.filter(
-            metadata__contains={"patient_id": patient_id_int}
-        ).values_list("id", flat=True)
-        related_entity_ids.extend(list(metadata_events))
-
-        # Aplicar filtro: cualquier evento relacionado con el paciente
-        if related_entity_ids:
-            # Eliminar duplicados
-            unique_ids = list(set(related_entity_ids))
-            qs = qs.filter(id__in=unique_ids)
-        else:
-            # Si no hay eventos relacionados, devolver vacío
-            qs = qs.none()
+        qs = qs.filter(patient_id=int(patient_id))
 
     # 3. Filtros originales
     if entity:
@@ -1020,10 +725,10 @@ def get_audit_logic(
         ]
 
         return {
-            "clinical_events": EventSerializer(clinical, many=True).data,
-            "financial_events": EventSerializer(financial, many=True).data,
-            "general_events": EventSerializer(general, many=True).data,
-            "all_events": EventSerializer(qs[:30], many=True).data,
+            "clinical_events": render_events(clinical),
+            "financial_events": render_events(financial),
+            "general_events": render_events(general),
+            "all_events": render_events(qs[:30]),
         }
     # 6. Dashboard Estadístico (Totalizaciones)
     if filters and filters.get("dashboard_stats"):
@@ -1037,12 +742,15 @@ def get_audit_logic(
             ),
         }
     # 7. Retorno Simple (con o sin límite)
-    if limit:
-        qs = qs[:limit]
-    else:
-        qs = qs[:50]  # Límite por defecto
+    if cursor:
+        # (timestamp, id) < los del evento cursor; el timestamp exacto se lee
+        # por PK en la misma consulta (la API lo serializa sin microsegundos)
+        pk = decode_audit_cursor(cursor)
+        last = Subquery(Event.objects.filter(pk=pk).values("timestamp")[:1])
+        qs = qs.filter(Q(timestamp__lt=last) | Q(timestamp=last, id__lt=pk))
+    qs = qs[: limit or AUDIT_DEFAULT_LIMIT]
 
-    return cast(List[Dict[str, Any]], EventSerializer(qs, many=True).data)
+    return render_events(qs)
 
 
 def get_payment_summary() -> List[Dict[str, Any]]:
@@ -1070,6 +778,127 @@ def get_waitingroom_today_data():
     )
 
 
+OPEN_APPOINTMENT_STATUSES = ["pending", "scheduled", "arrived", "in_consultation"]
+OPEN_APPOINTMENTS_DEFAULT_LIMIT = 100
+OPEN_APPOINTMENTS_MAX_LIMIT = 500
+
+
+def encode_open_appointments_cursor(row: Dict[str, Any]) -> str:
+    """Cursor keyset (fecha de cita, id) a partir de la última fila de una página."""
+    return f"{row['appointment_date']}_{row['id']}"
+
+
+def decode_open_appointments_cursor(cursor: str) -> Tuple[date, int]:
+    try:
+        raw_date, raw_id = cursor.split("_")
+        return date.fromisoformat(raw_date), int(raw_id)
+    except (AttributeError, TypeError, ValueError):
+        raise ValueError("Cursor de paginación inválido")
+
+
+def get_open_appointments(
+    institution_id: Union[int, str],
+    limit: Optional[int] = None,
+    cursor: Optional[str] = None,
+) -> List[Dict[str, Any]]:
+    """
+    Citas abiertas de la institución (sala de espera) con su resumen
+    financiero, más recientes primero. Sin limit ni cursor se devuelven
+    todas; con alguno de los dos, se pagina por keyset (limit por defecto
+    OPEN_APPOINTMENTS_DEFAULT_LIMIT).
+
+    Tres consultas por página sin importar su tamaño: citas, órdenes no
+    anuladas y pagos confirmados (Prefetch con queryset filtrado; antes
+    .exclude()/.filter() sobre la relación ignoraban el prefetch y cada cita
+    costaba dos consultas más).
+    """
+    if limit is not None or cursor:
+        limit = min(
+            limit or OPEN_APPOINTMENTS_DEFAULT_LIMIT, OPEN_APPOINTMENTS_MAX_LIMIT
+        )
+        if limit < 1:
+            raise ValueError("limit debe ser positivo")
+
+    qs = Appointment.objects.filter(
+        institution_id=institution_id, status__in=OPEN_APPOINTMENT_STATUSES
+    )
+    if cursor:
+        cursor_date, cursor_id = decode_open_appointments_cursor(cursor)
+        qs = qs.filter(
+            Q(appointment_date__lt=cursor_date)
+            | Q(appointment_date=cursor_date, id__lt=cursor_id)
+        )
+
+    confirmed_payments = Payment.objects.filter(status="confirmed").order_by("id")
+    open_orders = ChargeOrder.objects.exclude(status="void").prefetch_related(
+        Prefetch("payments", queryset=confirmed_payments, to_attr="confirmed_payments")
+    )
+    appointments = (
+        qs.select_related("patient")
+        .prefetch_related(
+            Prefetch("charge_orders", queryset=open_orders, to_attr="open_orders")
+        )
+        .order_by("-appointment_date", "-id")
+    )
+    if limit is not None:
+        appointments = appointments[:limit]
+    return [_open_appointment_row(appt) for appt in appointments]
+
+
+def _open_appointment_row(appt: Appointment) -> Dict[str, Any]:
+    # Orden principal: la más reciente no anulada (ordering -issued_at)
+    co = appt.open_orders[0] if appt.open_orders else None
+
+    expected = float(co.total if co else (appt.expected_amount or 0))
+    payments = []
+    total_paid = 0.0
+    for p in co.confirmed_payments if co else []:
+        payment_amount = float(p.amount or 0)
+        total_paid += payment_amount
+        payments.append(
+            {
+                "id": p.id,
+                "amount": payment_amount,
+                "method": p.method,
+                "reference_number": p.reference_number,
+                "received_at": p.received_at.isoformat() if p.received_at else None,
+            }
+        )
+
+    if total_paid >= expected and expected > 0:
+        financial_status = "paid"
+    elif total_paid > 0:
+        financial_status = "partially_paid"
+    else:
+        financial_status = "pending"
+
+    return {
+        "id": appt.id,
+        "appointment_date": appt.appointment_date.isoformat(),
+        "appointment_type": appt.appointment_type,
+        "status": appt.status,
+        "expected_amount": str(expected),
+        "patient": {
+            "id": appt.patient.id,
+            "full_name": appt.patient.full_name,
+            "national_id": appt.patient.national_id,
+            "phone_number": appt.patient.phone_number,
+        },
+        "financial_summary": {
+            "expected": expected,
+            "paid": total_paid,
+            "balance_due": expected - total_paid,
+            "status": financial_status,
+        },
+        "payments": payments,
+        "charge_order": (
+            {"id": co.id, "status": co.status, "total_amount": expected}
+            if co
+            else None
+        ),
+    }
+
+
 def get_pending_appointments():
     # Mueve aquí la lógica de cálculo de saldo que estaba en la vista
     appointments = Appointment.objects.select_related("patient").prefetch_related(
@@ -1190,6 +1019,7 @@ def create_medical_document_from_pdf(
         action=f"generate_{category}",
         actor=str(user),
         metadata={"appointment_id": appointment.id, "category": category},
+        institution_id=appointment.institution_id,
         severity="info",
         notify=True,
     )
@@ -1207,10 +1037,7 @@ def build_referral_pdf(referral, user) -> Tuple[bytes, str]:
         "institution": InstitutionSettings.objects.first(),
     }
     html_string = render_to_string("pdf/referral.html", context)
-    # Pylance fix: or b"" garantiza que siempre sea bytes
-    pdf_bytes = (
-        HTML(string=html_string, base_url=settings.MEDIA_ROOT).write_pdf() or b""
-    )
+    pdf_bytes = PDFEngine.render_html(html_string, template_name="pdf/referral.html")
     filename = f"referral_{referral.id}.pdf"
     return pdf_bytes, filename
 
@@ -1230,11 +1057,7 @@ def build_chargeorder_pdf(charge_order, user) -> Tuple[bytes, str, str]:
     qr_payload = (
         f"Consulta:{appointment.id}|ChargeOrder:{charge_order.id}|Audit:{audit_code}"
     )
-    qr_img = qrcode.make(qr_payload)
-    buffer = BytesIO()
-    qr_img.save(buffer, "PNG")
-    qr_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
-    qr_code_url = f"data:image/png;base64,{qr_base64}"
+    qr_code_url = qr_data_uri(qr_payload, border=4)
 
     context = {
         "charge_order": charge_order,
@@ -1248,8 +1071,8 @@ def build_chargeorder_pdf(charge_order, user) -> Tuple[bytes, str, str]:
     }
 
     html_string = render_to_string("pdf/charge_order.html", context)
-    pdf_bytes = (
-        HTML(string=html_string, base_url=settings.MEDIA_ROOT).write_pdf() or b""
+    pdf_bytes = PDFEngine.render_html(
+        html_string, template_name="pdf/charge_order.html"
     )
     filename = f"chargeorder_{charge_order.id}.pdf"
 
@@ -1342,11 +1165,85 @@ def lock_consultation_integrity(appointment_id: int):
     return note
 
 
+GENERIC_PDF_TEMPLATES = {
+    "prescription": "documents/prescription.html",
+    "treatment": "documents/treatment.html",
+    "medical_referral": "medical/documents/medical_referral.html",
+    "medical_test_order": "documents/medical_test_order.html",
+    "medical_report": "medical/documents/medical_report.html",
+    "charge_order": "medical/documents/charge_order.html",
+}
+PRESCRIPTION_BUNDLE_TEMPLATE = "documents/prescription_bundle.html"
+TREATMENT_BUNDLE_TEMPLATE = "documents/treatment_bundle.html"
+
+
+def generic_pdf_template(category: str) -> str:
+    return GENERIC_PDF_TEMPLATES.get(category, "pdf/generic_medical_doc.html")
+
+
 def generate_generic_pdf(
-    instance: Any, category: str, institution: InstitutionSettings
+    instance: Any,
+    category: str,
+    institution: InstitutionSettings,
+    use_cache: bool = False,
 ) -> Tuple[bytes, str, str]:
     """
     Fábrica universal de PDFs médicos con QR de auditoría.
+    Retorna (pdf_bytes, filename, audit_code).
+
+    Con use_cache, si el contenido no cambió desde la última emisión se
+    retorna ese mismo PDF (y su código de auditoría) desde PDFCache.
+    """
+    template_name = generic_pdf_template(category)
+    context = generic_pdf_context(instance, category, institution)
+
+    def render():
+        html_string, filename, audit_code = render_generic_html(
+            instance, category, institution, context=context
+        )
+        pdf_bytes = PDFEngine.render_html(html_string, template_name=template_name)
+        return pdf_bytes, filename, audit_code
+
+    if not use_cache:
+        return render()
+    return PDFCache.get_or_render(template_name, context, render)
+
+
+def render_generic_html(
+    instance: Any,
+    category: str,
+    institution: InstitutionSettings,
+    context: Optional[Dict[str, Any]] = None,
+) -> Tuple[str, str, str]:
+    """
+    HTML de generate_generic_pdf, sin convertir a PDF, con un código de
+    auditoría nuevo. Retorna (html, filename, audit_code).
+    """
+    if context is None:
+        context = generic_pdf_context(instance, category, institution)
+    audit = document_audit_fields(f"{category}-{instance.id}")
+    html_string = render_to_string(generic_pdf_template(category), {**context, **audit})
+    filename = f"{category}_{instance.id}_{audit['audit_code']}.pdf"
+    return html_string, filename, audit["audit_code"]
+
+
+def document_audit_fields(raw_prefix: str) -> Dict[str, Any]:
+    """Código de auditoría nuevo, su QR de verificación y la fecha de emisión."""
+    raw_code = f"{raw_prefix}-{timezone.now().timestamp()}"
+    audit_code = hashlib.sha256(raw_code.encode()).hexdigest()[:12].upper()
+    return {
+        "audit_code": audit_code,
+        "qr_code_url": qr_data_uri(get_verification_url(audit_code)),
+        "generated_at": timezone.now(),
+    }
+
+
+def generic_pdf_context(
+    instance: Any, category: str, institution: InstitutionSettings
+) -> Dict[str, Any]:
+    """
+    Contexto de plantilla de generate_generic_pdf, sin los campos de
+    auditoría (document_audit_fields).
     Soporta: prescription, treatment, medical_referral, medical_test_order.
 
     ✅ FASE 1: Context completamente enriquecido con TODOS los datos necesarios.
@@ -1378,34 +1275,10 @@ def generate_generic_pdf(
     # institution = institution  # ✅ Ahora (el parámetro de la función)
 
     # ========================================
-    # 2. CÓDIGO DE AUDITORÍA Y QR
+    # 2. CÓDIGO DE AUDITORÍA Y QR: document_audit_fields
+    # 3. PLANTILLA: generic_pdf_template
     # ========================================
 
-    raw_code = f"{category}-{instance.id}-{timezone.now().timestamp()}"
-    audit_code = hashlib.sha256(raw_code.encode()).hexdigest()[:12].upper()
-    qr = qrcode.QRCode(box_size=10, border=2)
-    qr.add_data(get_verification_url(audit_code))
-    qr.make(fit=True)
-    img_qr = qr.make_image(fill_color="black", back_color="white")
-
-    buffer = BytesIO()
-    img_qr.save(buffer, kind="PNG")
-    qr_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
-
-    # ========================================
-    # 3. SELECCIÓN DE PLANTILLA
-    # ========================================
-
-    template_map = {
-        "prescription": "documents/prescription.html",
-        "treatment": "documents/treatment.html",
-        "medical_referral": "medical/documents/medical_referral.html",
-        "medical_test_order": "documents/medical_test_order.html",
-        "medical_report": "medical/documents/medical_report.html",
-        "charge_order": "medical/documents/charge_order.html",
-    }
-    template_path = template_map.get(category, "pdf/generic_medical_doc.html")
-
     # ========================================
     # 4. HELPERS DE FORMATEO
     # ========================================
@@ -1593,9 +1466,6 @@ def generate_generic_pdf(
             "appointment": appointment_data,
             "referring_doctor": referring_doctor_data,
             "institution": institution,  # ✅ Usa el parámetro
-            "audit_code": audit_code,
-            "qr_code_url": f"data:image/png;base64,{qr_base64}",
-            "generated_at": timezone.now(),
             "required_specialties": required_specialties,
             "referred_to_doctor": referred_to_doctor_name,
             "referred_to_institution": getattr(
@@ -1670,9 +1540,6 @@ def generate_generic_pdf(
             "appointment": appointment_data,
             "doctor": prescribing_doctor_data,
             "institution": institution,  # ✅ Usa el parámetro
-            "audit_code": audit_code,
-            "qr_code_url": f"data:image/png;base64,{qr_base64}",
-            "generated_at": timezone.now(),
             "medication_name": medication_name,
             "items": items_data,
         }
@@ -1715,9 +1582,6 @@ def generate_generic_pdf(
             "appointment": appointment_data,
             "doctor": treating_doctor_data,
             "institution": institution,  # ✅ Usa el parámetro
-            "audit_code": audit_code,
-            "qr_code_url": f"data:image/png;base64,{qr_base64}",
-            "generated_at": timezone.now(),
             "items": items_data,
         }
 
@@ -1837,9 +1701,6 @@ def generate_generic_pdf(
             "appointment": appointment_data,
             "doctor": ordering_doctor_data,
             "institution": institution,  # ✅ Usa el parámetro
-            "audit_code": audit_code,
-            "qr_code_url": f"data:image/png;base64,{qr_base64}",
-            "generated_at": timezone.now(),
             "test_type_display": test_type_display,
             "urgency_display": format_urgency(getattr(instance, "urgency", None)),
             "status_display": format_status(getattr(instance, "status", None)),
@@ -1857,24 +1718,9 @@ def generate_generic_pdf(
             "appointment": appointment_data,
             "doctor": doctor,
             "institution": institution,  # ✅ Usa el parámetro
-            "audit_code": audit_code,
-            "qr_code_url": f"data:image/png;base64,{qr_base64}",
-            "generated_at": timezone.now(),
         }
 
-    # ========================================
-    # 8. RENDERIZAR PDF
-    # ========================================
-
-    html_string = render_to_string(template_path, context)
-
-    pdf_bytes = (
-        HTML(string=html_string, base_url=settings.MEDIA_ROOT).write_pdf() or b""
-    )
-
-    filename = f"{category}_{instance.id}_{audit_code}.pdf"
-
-    return pdf_bytes, filename, audit_code
+    return context
 
 
 def generate_prescription_bundle(
@@ -1883,10 +1729,21 @@ def generate_prescription_bundle(
     """
     ✅ NUEVO: Genera un PDF consolidado con todas las prescripciones.
     """
+    html_content, filename, audit_code = render_prescription_bundle_html(
+        prescriptions, appointment
+    )
+    pdf_bytes = PDFEngine.render_html(
+        html_content, template_name=PRESCRIPTION_BUNDLE_TEMPLATE
+    )
+    return pdf_bytes, filename, audit_code
+
+
+def render_prescription_bundle_html(
+    prescriptions: List[Any], appointment
+) -> Tuple[str, str, str]:
+    """HTML de generate_prescription_bundle. Retorna (html, filename, audit_code)."""
     from django.template.loader import render_to_string
     from django.conf import settings
-    import qrcode
-    from io import BytesIO
     import hashlib
     from django.utils import timezone
     from core.models import InstitutionSettings
@@ -1901,13 +1758,7 @@ def generate_prescription_bundle(
     audit_code = hashlib.sha256(raw_code.encode()).hexdigest()[:12].upper()
 
     # QR
-    qr = qrcode.QRCode(box_size=10, border=2)
-    qr.add_data(get_verification_url(audit_code))
-    qr.make(fit=True)
-    img_qr = qr.make_image(fill_color="black", back_color="white")
-    buffer = BytesIO()
-    img_qr.save(buffer, kind="PNG")
-    qr_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+    qr_code_url = qr_data_uri(get_verification_url(audit_code))
 
     # ✅ Construir lista de items con toda la información
     items_data = []
@@ -2035,21 +1886,16 @@ def generate_prescription_bundle(
         "doctor": doctor_data,
         "institution": institution,
         "audit_code": audit_code,
-        "qr_code_url": f"data:image/png;base64,{qr_base64}",
+        "qr_code_url": qr_code_url,
         "generated_at": timezone.now(),
         "items": items_data,
     }
 
-    html_content = render_to_string("documents/prescription_bundle.html", context)
-
-    # Generar PDF con WeasyPrint
-    from weasyprint import HTML
-
-    pdf_bytes = HTML(string=html_content, base_url=settings.MEDIA_ROOT).write_pdf()
+    html_content = render_to_string(PRESCRIPTION_BUNDLE_TEMPLATE, context)
 
     filename = f"prescriptions_bundle_{appointment.id}_{audit_code}.pdf"
 
-    return pdf_bytes, filename, audit_code
+    return html_content, filename, audit_code
 
 
 def generate_treatment_bundle(
@@ -2058,10 +1904,21 @@ def generate_treatment_bundle(
     """
     ✅ NUEVO: Genera un PDF consolidado con todos los tratamientos.
     """
+    html_content, filename, audit_code = render_treatment_bundle_html(
+        treatments, appointment
+    )
+    pdf_bytes = PDFEngine.render_html(
+        html_content, template_name=TREATMENT_BUNDLE_TEMPLATE
+    )
+    return pdf_bytes, filename, audit_code
+
+
+def render_treatment_bundle_html(
+    treatments: List[Any], appointment
+) -> Tuple[str, str, str]:
+    """HTML de generate_treatment_bundle. Retorna (html, filename, audit_code)."""
     from django.template.loader import render_to_string
     from django.conf import settings
-    import qrcode
-    from io import BytesIO
     import hashlib
     from django.utils import timezone
     from core.models import InstitutionSettings
@@ -2076,13 +1933,7 @@ def generate_treatment_bundle(
     audit_code = hashlib.sha256(raw_code.encode()).hexdigest()[:12].upper()
 
     # QR
-    qr = qrcode.QRCode(box_size=10, border=2)
-    qr.add_data(get_verification_url(audit_code))
-    qr.make(fit=True)
-    img_qr = qr.make_image(fill_color="black", back_color="white")
-    buffer = BytesIO()
-    img_qr.save(buffer, kind="PNG")
-    qr_base64 = base64.b64encode(buffer.getvalue()).decode("utf-8")
+    qr_code_url = qr_data_uri(get_verification_url(audit_code))
 
     # ✅ Construir lista de items
     items_data = []
@@ -2182,251 +2033,312 @@ def generate_treatment_bundle(
         "doctor": doctor_data,
         "institution": institution,
         "audit_code": audit_code,
-        "qr_code_url": f"data:image/png;base64,{qr_base64}",
+        "qr_code_url": qr_code_url,
         "generated_at": timezone.now(),
         "items": items_data,
     }
 
-    html_content = render_to_string("documents/treatment_bundle.html", context)
+    html_content = render_to_string(TREATMENT_BUNDLE_TEMPLATE, context)
 
-    # Generar PDF con WeasyPrint
-    from weasyprint import HTML
+    filename = f"treatments_bundle_{appointment.id}_{audit_code}.pdf"
 
-    pdf_bytes = HTML(string=html_content, base_url=settings.MEDIA_ROOT).write_pdf()
+    return html_content, filename, audit_code
 
-    filename = f"treatments_bundle_{appointment.id}_{audit_code}.pdf"
 
-    return pdf_bytes, filename, audit_code
+BULK_DOC_IO_WORKERS = 4  # hilos para storage local + R2
 
 
-def bulk_generate_appointment_docs(appointment, user, request=None) -> Dict[str, Any]:
+def _appointment_doc_jobs(appointment, errors: List[Dict[str, Any]]):
     """
-    Genera automáticamente todos los documentos PDF de una cita.
-    Implementación ELITE: Consolida múltiples prescripciones/tratamientos en un solo documento.
+    Etapa 1 de bulk_generate_appointment_docs: HTML de cada documento.
+    Las plantillas y consultas corren en este hilo; los errores se anotan
+    en `errors` y el documento se omite.
     """
-    generated_files = []
-    errors = []
-    base_url = request.build_absolute_uri("/") if request else ""
-    r2_client = get_r2_client()
-    r2_enabled = settings.R2_ENABLED and r2_client is not None
-
     from core.models import Prescription, Treatment
 
-    prescriptions = (
-        Prescription.objects.filter(diagnosis__appointment=appointment)
-        .select_related("medication_catalog", "diagnosis")
-        .prefetch_related("components")
-    )
-
-    treatments = Treatment.objects.filter(
-        diagnosis__appointment=appointment
-    ).select_related("diagnosis")
+    jobs = []
 
-    # ✅ NUEVO: Generador consolidado para prescripciones
-    if prescriptions.exists():
+    def add(category, item_id, template_name, render, describe):
         try:
-            # ✅ LÓGICA ELITE: Si hay más de 1 prescripción, generar bundle
-            prescription_list = list(prescriptions)
-
-            if len(prescription_list) == 1:
-                # Comportamiento original: 1 documento por prescripción
-                pdf_bytes, filename, audit_code = generate_generic_pdf(
-                    prescription_list[0], "prescription", appointment.institution
-                )
-                description = f"Receta: {prescription_list[0].medication_catalog.name if prescription_list[0].medication_catalog else prescription_list[0].medication_text or 'Medicamento'}"
-            else:
-                # ✅ NUEVO: Generar documento consolidado
-                pdf_bytes, filename, audit_code = generate_prescription_bundle(
-                    prescription_list, appointment
-                )
-                description = (
-                    f"Recetas Consolidadas ({len(prescription_list)} medicamentos)"
-                )
-
-            # Crear documento en BD
-            doc = MedicalDocument.objects.create(
-                patient=appointment.patient,
-                appointment=appointment,
-                doctor=appointment.doctor,
-                institution=appointment.institution,
-                generated_by=user,
-                category="prescription",
-                audit_code=audit_code,
-                origin_panel="bulk_generator",
-                description=description,
-            )
-            doc.file.save(filename, ContentFile(pdf_bytes))
-
-            if r2_enabled:
-                r2_url = upload_medical_document(pdf_bytes, "prescription", filename)
-                if r2_url:
-                    doc.file_url = r2_url
-                    doc.save(update_fields=["file_url"])
-
-            generated_files.append(
+            html, filename, audit_code = render()
+            jobs.append(
                 {
-                    "id": doc.id,
-                    "category": "prescription",
-                    "title": filename,
+                    "category": category,
+                    "item_id": item_id,
+                    "template_name": template_name,
+                    "html": html,
                     "filename": filename,
                     "audit_code": audit_code,
-                    "file_url": doc.file_url or f"{base_url}{doc.file.url}"
-                    if doc.file
-                    else None,
-                    "description": description,
+                    "description": describe(),
                 }
             )
-
         except Exception as e:
-            errors.append(
-                {"category": "prescription", "item_id": None, "error": str(e)}
-            )
+            errors.append({"category": category, "item_id": item_id, "error": str(e)})
 
-    # ✅ NUEVO: Generador consolidado para tratamientos
-    if treatments.exists():
-        try:
-            # ✅ LÓGICA ELITE: Si hay más de 1 tratamiento, generar bundle
-            treatment_list = list(treatments)
+    prescription_list = list(
+        Prescription.objects.filter(diagnosis__appointment=appointment)
+        .select_related("medication_catalog", "diagnosis")
+        .prefetch_related("components")
+    )
+    # ✅ LÓGICA ELITE: Si hay más de 1 prescripción, generar bundle
+    if len(prescription_list) == 1:
+        pres = prescription_list[0]
+        add(
+            "prescription",
+            None,
+            generic_pdf_template("prescription"),
+            lambda: render_generic_html(pres, "prescription", appointment.institution),
+            lambda: "Receta: "
+            + (
+                pres.medication_catalog.name
+                if pres.medication_catalog
+                else pres.medication_text or "Medicamento"
+            ),
+        )
+    elif prescription_list:
+        add(
+            "prescription",
+            None,
+            PRESCRIPTION_BUNDLE_TEMPLATE,
+            lambda: render_prescription_bundle_html(prescription_list, appointment),
+            lambda: f"Recetas Consolidadas ({len(prescription_list)} medicamentos)",
+        )
 
-            if len(treatment_list) == 1:
-                # Comportamiento original: 1 documento por tratamiento
-                pdf_bytes, filename, audit_code = generate_generic_pdf(
-                    treatment_list[0], "treatment", appointment.institution
-                )
-                title = (
-                    treatment_list[0].plan or treatment_list[0].title or "Tratamiento"
-                )
-                description = f"Tratamiento: {title[:100]}"
-            else:
-                # ✅ NUEVO: Generar documento consolidado
-                pdf_bytes, filename, audit_code = generate_treatment_bundle(
-                    treatment_list, appointment
-                )
-                description = (
-                    f"Tratamientos Consolidados ({len(treatment_list)} planes)"
-                )
+    treatment_list = list(
+        Treatment.objects.filter(diagnosis__appointment=appointment).select_related(
+            "diagnosis"
+        )
+    )
+    # ✅ LÓGICA ELITE: Si hay más de 1 tratamiento, generar bundle
+    if len(treatment_list) == 1:
+        treatment = treatment_list[0]
+        add(
+            "treatment",
+            None,
+            generic_pdf_template("treatment"),
+            lambda: render_generic_html(
+                treatment, "treatment", appointment.institution
+            ),
+            lambda: "Tratamiento: "
+            + (treatment.plan or treatment.title or "Tratamiento")[:100],
+        )
+    elif treatment_list:
+        add(
+            "treatment",
+            None,
+            TREATMENT_BUNDLE_TEMPLATE,
+            lambda: render_treatment_bundle_html(treatment_list, appointment),
+            lambda: f"Tratamientos Consolidados ({len(treatment_list)} planes)",
+        )
 
-            # Crear documento en BD
-            doc = MedicalDocument.objects.create(
-                patient=appointment.patient,
-                appointment=appointment,
-                doctor=appointment.doctor,
-                institution=appointment.institution,
-                generated_by=user,
-                category="treatment",
-                audit_code=audit_code,
-                origin_panel="bulk_generator",
-                description=description,
-            )
-            doc.file.save(filename, ContentFile(pdf_bytes))
+    # Referencias y exámenes: un documento por ítem
+    for referral in (
+        appointment.referrals.all()
+        .select_related("diagnosis")
+        .prefetch_related("specialties")
+    ):
+        add(
+            "medical_referral",
+            referral.id,
+            generic_pdf_template("medical_referral"),
+            lambda: render_generic_html(
+                referral, "medical_referral", appointment.institution
+            ),
+            lambda: _referral_description(referral),
+        )
+    for test in appointment.medical_tests.all():
+        add(
+            "medical_test_order",
+            test.id,
+            generic_pdf_template("medical_test_order"),
+            lambda: render_generic_html(
+                test, "medical_test_order", appointment.institution
+            ),
+            lambda: "Orden de Examen: "
+            + (
+                test.get_test_type_display()
+                if hasattr(test, "get_test_type_display")
+                else getattr(test, "test_type", "Examen")
+            ),
+        )
+    return jobs
 
-            if r2_enabled:
-                r2_url = upload_medical_document(pdf_bytes, "treatment", filename)
-                if r2_url:
-                    doc.file_url = r2_url
-                    doc.save(update_fields=["file_url"])
 
-            generated_files.append(
-                {
-                    "id": doc.id,
-                    "category": "treatment",
-                    "title": filename,
-                    "filename": filename,
-                    "audit_code": audit_code,
-                    "file_url": doc.file_url or f"{base_url}{doc.file.url}"
-                    if doc.file
-                    else None,
-                    "description": description,
-                }
-            )
+def _referral_description(item) -> str:
+    specialties = (
+        [s.name for s in item.specialties.all()[:3]]
+        if hasattr(item, "specialties")
+        else []
+    )
+    referred_to = (
+        item.referred_to_doctor.full_name
+        if hasattr(item, "referred_to_doctor") and item.referred_to_doctor
+        else ""
+    )
+    if specialties:
+        return f"Referencia: {', '.join(specialties)}"
+    if referred_to:
+        return f"Referencia a: {referred_to}"
+    return "Referencia Médica"
 
-        except Exception as e:
-            errors.append({"category": "treatment", "item_id": None, "error": str(e)})
 
-    # ✅ Mantener otros generadores (referencias, exámenes) - sin cambios
-    other_generators = {
-        "medical_referral": appointment.referrals.all()
-        .select_related("diagnosis")
-        .prefetch_related("specialties"),
-        "medical_test_order": appointment.medical_tests.all(),
+def _store_document_pdf(pdf_bytes: bytes, category: str, filename: str, r2: bool):
+    """
+    Etapa 3 (en un hilo, sin consultas): escribe el PDF en el storage de
+    MedicalDocument.file y lo sube a R2. Retorna los campos del documento
+    que MedicalDocument.save() habría calculado.
+    """
+    field = MedicalDocument._meta.get_field("file")
+    name = field.storage.save(
+        field.generate_filename(None, filename),
+        ContentFile(pdf_bytes),
+        max_length=field.max_length,
+    )
+    return {
+        "file": name,
+        "file_url": (
+            upload_medical_document(pdf_bytes, category, filename) if r2 else None
+        ),
+        "size_bytes": len(pdf_bytes),
+        "checksum_sha256": hashlib.sha256(pdf_bytes).hexdigest(),
     }
 
-    for category, queryset in other_generators.items():
-        for item in queryset:
-            try:
-                pdf_bytes, filename, audit_code = generate_generic_pdf(
-                    item, category, appointment.institution
-                )
 
-                # Descripciones específicas por categoría
-                if category == "medical_referral":
-                    specialties = (
-                        [s.name for s in item.specialties.all()[:3]]
-                        if hasattr(item, "specialties")
-                        else []
-                    )
-                    referred_to = (
-                        item.referred_to_doctor.full_name
-                        if hasattr(item, "referred_to_doctor")
-                        and item.referred_to_doctor
-                        else ""
-                    )
-                    description = (
-                        f"Referencia: {', '.join(specialties)}"
-                        if specialties
-                        else f"Referencia a: {referred_to}"
-                        if referred_to
-                        else "Referencia Médica"
-                    )
-                else:
-                    test_type = (
-                        item.get_test_type_display()
-                        if hasattr(item, "get_test_type_display")
-                        else getattr(item, "test_type", "Examen")
-                    )
-                    description = f"Orden de Examen: {test_type}"
-
-                doc = MedicalDocument.objects.create(
-                    patient=appointment.patient,
-                    appointment=appointment,
-                    doctor=appointment.doctor,
-                    institution=appointment.institution,
-                    generated_by=user,
-                    category=category,
-                    audit_code=audit_code,
-                    origin_panel="bulk_generator",
-                    description=description,
-                )
-                doc.file.save(filename, ContentFile(pdf_bytes))
+def _discard_document_files(
+    stored_fields: List[Dict[str, Any]], r2_client: Optional[R2StorageClient] = None
+):
+    """
+    Borra del storage (y de R2, si hay cliente) los archivos de documentos
+    cuyo registro no llegó a crearse, para no dejar PDFs huérfanos. Nunca
+    lanza: corre mientras se maneja el error original.
+    """
+    storage = MedicalDocument._meta.get_field("file").storage
+    for fields in stored_fields:
+        try:
+            storage.delete(fields["file"])
+        except Exception as e:
+            logger.warning(f"No se pudo borrar el PDF huérfano {fields['file']}: {e}")
 
-                if r2_enabled:
-                    r2_url = upload_medical_document(pdf_bytes, category, filename)
-                    if r2_url:
-                        doc.file_url = r2_url
-                        doc.save(update_fields=["file_url"])
+        url = fields.get("file_url")
+        if r2_client is None or not url:
+            continue
+        r2_prefix = f"{r2_client.public_url_base}/"
+        if not url.startswith(r2_prefix):
+            continue
+        try:
+            r2_client.delete_file(url[len(r2_prefix) :])
+        except Exception as e:
+            logger.warning(f"No se pudo borrar de R2 el PDF huérfano {url}: {e}")
 
-                generated_files.append(
-                    {
-                        "id": doc.id,
-                        "category": category,
-                        "title": filename,
-                        "filename": filename,
-                        "audit_code": audit_code,
-                        "file_url": doc.file_url or f"{base_url}{doc.file.url}"
-                        if doc.file
-                        else None,
-                        "description": description,
-                    }
-                )
 
-            except Exception as e:
-                errors.append(
-                    {
-                        "category": category,
-                        "item_id": getattr(item, "id", None),
-                        "error": str(e),
-                    }
+def bulk_generate_appointment_docs(appointment, user, request=None) -> Dict[str, Any]:
+    """
+    Genera automáticamente todos los documentos PDF de una cita.
+    Implementación ELITE: Consolida múltiples prescripciones/tratamientos en un solo documento.
+
+    Pipeline (la latencia es la del documento más lento, no la suma):
+        1. HTML de cada documento (_appointment_doc_jobs)
+        2. Todos los PDFs a la vez en el pool de PDFEngine
+        3. Storage local y subida a R2 en paralelo (hilos)
+        4. Un solo bulk_create de MedicalDocument (si falla, se borran los
+           archivos de la etapa 3)
+    """
+    errors: List[Dict[str, Any]] = []
+    base_url = request.build_absolute_uri("/") if request else ""
+    r2_client = get_r2_client()
+    r2_enabled = settings.R2_ENABLED and r2_client is not None
+
+    def fail(job, e):
+        errors.append(
+            {"category": job["category"], "item_id": job["item_id"], "error": str(e)}
+        )
+
+    jobs = _appointment_doc_jobs(appointment, errors)
+
+    # 2. PDFs: se encolan todos antes de esperar el primero
+    pending = []
+    for job in jobs:
+        try:
+            future = PDFEngine.submit(
+                job.pop("html"), template_name=job["template_name"]
+            )
+            pending.append((job, future))
+        except Exception as e:
+            fail(job, e)
+    rendered = []
+    for job, future in pending:
+        try:
+            rendered.append((job, PDFEngine.result(future)))
+        except Exception as e:
+            fail(job, e)
+
+    # 3. Archivos
+    stored = []
+    if rendered:
+        with ThreadPoolExecutor(
+            max_workers=min(BULK_DOC_IO_WORKERS, len(rendered)),
+            thread_name_prefix="appointment-docs",
+        ) as pool:
+            futures = [
+                (
+                    job,
+                    pool.submit(
+                        _store_document_pdf,
+                        pdf_bytes,
+                        job["category"],
+                        job["filename"],
+                        r2_enabled,
+                    ),
                 )
+                for job, pdf_bytes in rendered
+            ]
+            for job, future in futures:
+                try:
+                    stored.append((job, future.result()))
+                except Exception as e:
+                    fail(job, e)
+
+    # 4. Registros (bulk_create no pasa por save(): los metadatos que este
+    # calcula vienen de la etapa 3 y doctor/sede de la cita)
+    docs = [
+        MedicalDocument(
+            patient_id=appointment.patient_id,
+            appointment=appointment,
+            doctor_id=appointment.doctor_id,
+            institution_id=appointment.institution_id,
+            generated_by=user,
+            category=job["category"],
+            audit_code=job["audit_code"],
+            origin_panel="bulk_generator",
+            description=job["description"],
+            **fields,
+        )
+        for job, fields in stored
+    ]
+    try:
+        MedicalDocument.objects.bulk_create(docs)
+    except Exception as e:
+        for job, _ in stored:
+            fail(job, e)
+        _discard_document_files(
+            [fields for _, fields in stored], r2_client if r2_enabled else None
+        )
+        docs, stored = [], []
+
+    generated_files = [
+        {
+            "id": doc.id,
+            "category": job["category"],
+            "title": job["filename"],
+            "filename": job["filename"],
+            "audit_code": job["audit_code"],
+            "file_url": doc.file_url or f"{base_url}{doc.file.url}"
+            if doc.file
+            else None,
+            "description": job["description"],
+        }
+        for doc, (job, _) in zip(docs, stored)
+    ]
 
     return {
         "status": "success" if not errors else "partial_success",
@@ -2466,14 +2378,12 @@ def get_advanced_metrics() -> Dict[str, Any]:
             "patientGrowth": round(growth, 2),
             "pendingPayments": Payment.objects.filter(status="pending").count(),
         },
-        "appointmentVolume": list(
-            Appointment.objects.filter(
-                appointment_date__range=[today - timedelta(days=7), today]
+        "appointmentVolume": [
+            {"appointment_date": day, "count": count}
+            for day, count in DailyRollup.series(
+                "appointments_total", start=today - timedelta(days=7), end=today
             )
-            .values("appointment_date")
-            .annotate(count=Count("id"))
-            .order_by("appointment_date")
-        ),
+        ],
     }
 
 
@@ -1,9 +1,26 @@
-from django.db.models.signals import post_save, post_delete
+from django.core.cache import cache
+from django.core.exceptions import ObjectDoesNotExist
+from django.db.models.signals import pre_save, post_save, post_delete, m2m_changed
 from django.dispatch import receiver
 from django.utils import timezone
 from simple_history.signals import pre_create_historical_record
-from .models import Appointment, Payment, Patient, WaitingRoomEntry
+from .models import (
+    Appointment,
+    Payment,
+    Patient,
+    WaitingRoomEntry,
+    DoctorPatientRelationship,
+    PatientFamilyLink,
+    DoctorOperator,
+    InstitutionPermission,
+    InstitutionSettings,
+    BCVRateCache,
+)
+from .permissions import PatientAccessScope, SmartInstitutionValidator
 from core.utils.events import log_event
+from core.utils.dashboard import DashboardEngine
+from core.utils.institutional_report import ReportHeader
+from core.utils.rollups import DAY_FIELDS, DailyRollup, rollups_refreshed
 import logging
 
 logger = logging.getLogger("audit")
@@ -13,7 +30,15 @@ logger = logging.getLogger("audit")
 @receiver(post_save, sender=Appointment)
 def appointment_created_or_updated(sender, instance, created, **kwargs):
     if created:
-        log_event("Appointment", instance.id, "create", actor="system", notify=True)
+        log_event(
+            "Appointment",
+            instance.id,
+            "create",
+            actor="system",
+            notify=True,
+            patient_id=instance.patient_id,
+            institution_id=instance.institution_id,
+        )
         logger.info(f"Appointment {instance.id} created")
         if instance.status == "pending":  # ✅ Sin filtro de fecha
             WaitingRoomEntry.objects.get_or_create(
@@ -29,7 +54,15 @@ def appointment_created_or_updated(sender, instance, created, **kwargs):
                 f"WaitingRoomEntry creado automáticamente (pending/scheduled) para Appointment {instance.id}"
             )
     else:
-        log_event("Appointment", instance.id, "update", actor="system", notify=True)
+        log_event(
+            "Appointment",
+            instance.id,
+            "update",
+            actor="system",
+            notify=True,
+            patient_id=instance.patient_id,
+            institution_id=instance.institution_id,
+        )
         logger.info(f"Appointment {instance.id} updated")
         if instance.status == "arrived":
             try:
@@ -63,7 +96,15 @@ def appointment_created_or_updated(sender, instance, created, **kwargs):
 
 @receiver(post_delete, sender=Appointment)
 def appointment_deleted(sender, instance, **kwargs):
-    log_event("Appointment", instance.id, "delete", actor="system", notify=True)
+    log_event(
+        "Appointment",
+        instance.id,
+        "delete",
+        actor="system",
+        notify=True,
+        patient_id=instance.patient_id,
+        institution_id=instance.institution_id,
+    )
     logger.info(f"Appointment {instance.id} deleted")
     try:
         WaitingRoomEntry.objects.filter(appointment=instance).delete()
@@ -75,6 +116,13 @@ def appointment_deleted(sender, instance, **kwargs):
 
 
 # --- Payment ---
+def _payment_patient_id(payment):
+    try:
+        return payment.charge_order.patient_id
+    except ObjectDoesNotExist:
+        return None
+
+
 @receiver(post_save, sender=Payment)
 def payment_created_or_updated(sender, instance, created, **kwargs):
     amount_value = float(instance.amount) if instance.amount is not None else None
@@ -88,6 +136,7 @@ def payment_created_or_updated(sender, instance, created, **kwargs):
             actor="system",
             metadata={"amount": amount_value},
             notify=True,
+            institution_id=instance.institution_id,
         )
         logger.info(f"Payment {instance.id} created")
     else:
@@ -98,6 +147,7 @@ def payment_created_or_updated(sender, instance, created, **kwargs):
             actor="system",
             metadata={"amount": amount_value},
             notify=True,
+            institution_id=instance.institution_id,
         )
         logger.info(f"Payment {instance.id} updated")
 
@@ -112,6 +162,9 @@ def payment_deleted(sender, instance, **kwargs):
         actor="system",
         metadata={"amount": amount_value},
         notify=True,
+        # El pago ya no existe al escribir el evento: se resuelve aquí
+        patient_id=_payment_patient_id(instance),
+        institution_id=instance.institution_id,
     )
     logger.info(f"Payment {instance.id} deleted")
 
@@ -134,6 +187,108 @@ def patient_deleted(sender, instance, **kwargs):
     logger.info(f"Patient {instance.id} deleted")
 
 
+# --- Alcance de acceso: invalidar cache de ids de pacientes ---
+@receiver(post_save, sender=DoctorPatientRelationship)
+@receiver(post_delete, sender=DoctorPatientRelationship)
+def doctor_patient_relationship_changed(sender, instance, **kwargs):
+    PatientAccessScope.invalidate_doctor(instance.doctor_id)
+
+
+@receiver(post_save, sender=PatientFamilyLink)
+@receiver(post_delete, sender=PatientFamilyLink)
+def patient_family_link_changed(sender, instance, **kwargs):
+    PatientAccessScope.invalidate_patient_user(instance.patient_user_id)
+
+
+# --- Permisos institucionales: invalidar cache del middleware ---
+@receiver(post_save, sender=InstitutionSettings)
+@receiver(post_delete, sender=InstitutionSettings)
+def institution_settings_changed(sender, instance, **kwargs):
+    from .middleware import InstitutionPermissionMiddleware
+
+    cache.delete(InstitutionPermissionMiddleware.institution_cache_key(instance.pk))
+
+
+@receiver(post_save, sender=InstitutionPermission)
+@receiver(post_delete, sender=InstitutionPermission)
+def institution_permission_changed(sender, instance, **kwargs):
+    SmartInstitutionValidator.invalidate_user(instance.user_id)
+
+
+@receiver(m2m_changed, sender=DoctorOperator.institutions.through)
+def doctor_institutions_changed(sender, instance, action, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if isinstance(instance, DoctorOperator):
+        SmartInstitutionValidator.invalidate_user(instance.user_id)
+    else:
+        # Cambio desde el lado de la institución (institution.operators.add(...))
+        for user_id in DoctorOperator.objects.filter(
+            pk__in=kwargs.get("pk_set") or []
+        ).values_list("user_id", flat=True):
+            SmartInstitutionValidator.invalidate_user(user_id)
+
+
+# --- Rollups diarios para dashboards ---
+def rollup_capture(sender, instance, using, update_fields=None, **kwargs):
+    DailyRollup.capture(sender, instance, using, update_fields)
+
+
+def rollup_saved(sender, instance, using, **kwargs):
+    DailyRollup.track(sender, instance, using)
+
+
+def rollup_deleted(sender, instance, using, **kwargs):
+    DailyRollup.track(sender, instance, using, deleted=True)
+
+
+for _model in DAY_FIELDS:
+    pre_save.connect(
+        rollup_capture, sender=_model, dispatch_uid=f"rollup_capture_{_model.__name__}"
+    )
+    post_save.connect(
+        rollup_saved, sender=_model, dispatch_uid=f"rollup_save_{_model.__name__}"
+    )
+    post_delete.connect(
+        rollup_deleted, sender=_model, dispatch_uid=f"rollup_delete_{_model.__name__}"
+    )
+
+
+# --- Dashboard: invalidar cache al cambiar rollups, tasa o padrón ---
+@receiver(rollups_refreshed)
+def dashboard_rollups_refreshed(sender, institution_ids, **kwargs):
+    if institution_ids is None:
+        institution_ids = InstitutionSettings.objects.values_list("id", flat=True)
+    DashboardEngine.invalidate(institution_ids)
+
+
+@receiver(post_save, sender=BCVRateCache)
+def dashboard_rate_changed(sender, instance, **kwargs):
+    DashboardEngine.invalidate_rates()
+
+
+@receiver(post_save, sender=Patient)
+@receiver(post_delete, sender=Patient)
+def dashboard_patients_changed(sender, instance, created=True, **kwargs):
+    if created:
+        DashboardEngine.invalidate()
+
+
+# --- Reporte institucional: encabezado cacheado ---
+@receiver(post_save, sender=InstitutionSettings)
+@receiver(post_delete, sender=InstitutionSettings)
+@receiver(post_save, sender=DoctorOperator)
+@receiver(post_delete, sender=DoctorOperator)
+def report_header_changed(sender, instance, **kwargs):
+    ReportHeader.invalidate()
+
+
+@receiver(m2m_changed, sender=DoctorOperator.specialties.through)
+def report_header_specialties_changed(sender, action, **kwargs):
+    if action.startswith("post_"):
+        ReportHeader.invalidate()
+
+
 # --- Patient: sincronizar predisposiciones genéticas en histórico ---
 @receiver(pre_create_historical_record, sender=Patient)
 def update_genetic_predispositions(sender, **kwargs):
@@ -42,3 +42,11 @@ def scrape_bcv_rate(self):
         logger.info(f"Tasa BCV actualizada: {rate}")
     except Exception as e:
         logger.error(f"Error scraping BCV: {e}")
+
+
+@shared_task(bind=True, ignore_result=True)
+def render_report_job(self, job_id):
+    """Genera el artefacto de un ReportJob (ver core/utils/report_jobs.py)."""
+    from core.utils.report_jobs import ReportJobs
+
+    ReportJobs.run(job_id)
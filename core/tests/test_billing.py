@@ -0,0 +1,336 @@
+import io
+from datetime import date
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from core.models import (
+    Appointment,
+    ChargeItem,
+    ChargeOrder,
+    DoctorOperator,
+    DoctorService,
+    InstitutionSettings,
+    Patient,
+    Payment,
+)
+from core import services
+from core.utils.order_totals import OrderTotals
+
+
+class OpenAppointmentsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user("open-doctor", password="x")
+        doctor = DoctorOperator.objects.create(user=cls.user, full_name="Dr. Sala")
+        cls.institution = InstitutionSettings.objects.create(
+            name="Clínica Sala", tax_id="J-44444444-4", phone="0212", logo="logos/s.png"
+        )
+        cls.patient = Patient.objects.create(first_name="Eva", last_name="Paz")
+        cls.appointments = [
+            Appointment.objects.create(
+                patient=cls.patient,
+                institution=cls.institution,
+                doctor=doctor,
+                appointment_date=date(2025, 10, 1 + i // 2),
+                expected_amount=Decimal("40"),
+                status="scheduled",
+            )
+            for i in range(5)
+        ]
+        Appointment.objects.create(
+            patient=cls.patient,
+            institution=cls.institution,
+            doctor=doctor,
+            appointment_date=date(2025, 10, 9),
+            status="completed",
+        )
+
+        appt = cls.appointments[0]
+        ChargeOrder.objects.create(
+            appointment=appt,
+            patient=cls.patient,
+            institution=cls.institution,
+            total=Decimal("500"),
+            status="void",
+        )
+        cls.order = ChargeOrder.objects.create(
+            appointment=appt,
+            patient=cls.patient,
+            institution=cls.institution,
+            total=Decimal("80"),
+        )
+        for amount, status in (
+            ("30", "confirmed"),
+            ("20", "confirmed"),
+            ("9", "pending"),
+        ):
+            Payment.objects.create(
+                institution=cls.institution,
+                appointment=appt,
+                charge_order=cls.order,
+                amount=Decimal(amount),
+                method="cash",
+                status=status,
+            )
+
+    def test_financial_summary_uses_filtered_prefetch(self):
+        with self.assertNumQueries(3):
+            rows = services.get_open_appointments(self.institution.pk)
+        self.assertEqual(len(rows), 5)
+
+        row = next(r for r in rows if r["id"] == self.appointments[0].pk)
+        self.assertEqual(row["charge_order"]["id"], self.order.pk)
+        self.assertEqual(
+            row["financial_summary"],
+            {
+                "expected": 80.0,
+                "paid": 50.0,
+                "balance_due": 30.0,
+                "status": "partially_paid",
+            },
+        )
+        self.assertEqual([p["amount"] for p in row["payments"]], [30.0, 20.0])
+
+        plain = next(r for r in rows if r["id"] == self.appointments[1].pk)
+        self.assertIsNone(plain["charge_order"])
+        self.assertEqual(plain["financial_summary"]["expected"], 40.0)
+
+    def test_api_pages_with_cursor_header(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = reverse("appointments-pending-api")
+        headers = {"X-Institution-ID": str(self.institution.pk)}
+
+        ids, cursor = [], None
+        while True:
+            params = {"limit": 2, **({"cursor": cursor} if cursor else {})}
+            response = client.get(url, params, headers=headers)
+            self.assertEqual(response.status_code, 200)
+            ids += [row["id"] for row in response.json()]
+            cursor = response.headers.get("X-Next-Cursor")
+            if not cursor:
+                break
+
+        expected = sorted(
+            self.appointments, key=lambda a: (a.appointment_date, a.pk), reverse=True
+        )
+        self.assertEqual(ids, [a.pk for a in expected])
+
+        response = client.get(url, {"cursor": "basura"}, headers=headers)
+        self.assertEqual(response.status_code, 400)
+
+        # Sin limit ni cursor (useAppointmentsPending): todas, sin cursor
+        with mock.patch.object(services, "OPEN_APPOINTMENTS_DEFAULT_LIMIT", 2):
+            response = client.get(url, headers=headers)
+        self.assertEqual(len(response.json()), len(self.appointments))
+        self.assertNotIn("X-Next-Cursor", response.headers)
+
+
+class ChargeOrderAddItemsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user("items-doctor", password="x")
+        doctor = DoctorOperator.objects.create(user=cls.user, full_name="Dr. Lote")
+        cls.institution = InstitutionSettings.objects.create(
+            name="Clínica Lote", tax_id="J-66666666-6", phone="0212", logo="logos/l.png"
+        )
+        cls.patient = Patient.objects.create(first_name="Luis", last_name="Rey")
+        cls.appointment = Appointment.objects.create(
+            patient=cls.patient,
+            institution=cls.institution,
+            doctor=doctor,
+            appointment_date=date(2025, 11, 3),
+        )
+        cls.service = DoctorService.objects.create(
+            doctor=doctor, code="SUT", name="Sutura", price_usd=Decimal("12.50")
+        )
+        cls.inactive = DoctorService.objects.create(
+            doctor=doctor, code="OLD", name="Viejo", is_active=False
+        )
+
+    def new_order(self):
+        return ChargeOrder.objects.create(
+            appointment=self.appointment,
+            patient=self.patient,
+            institution=self.institution,
+        )
+
+    def items(self, n):
+        return [
+            ChargeItem(code=f"I{i}", qty=Decimal("2"), unit_price=Decimal("5.00"))
+            for i in range(n)
+        ]
+
+    def test_batch_costs_fixed_queries_and_matches_full_recalc(self):
+        def add(n):
+            order = self.new_order()
+            with CaptureQueriesContext(connection) as ctx:
+                created = order.add_items(self.items(n))
+            return order, created, len(ctx.captured_queries)
+
+        _, _, few = add(2)
+        order, created, many = add(20)
+        self.assertEqual(few, many)
+        self.assertEqual(len(created), 20)
+
+        Payment.objects.create(
+            institution=self.institution,
+            appointment=self.appointment,
+            charge_order=order,
+            amount=Decimal("50"),
+            method="cash",
+            status="confirmed",
+        )
+        order.add_items(self.items(1))
+        stored = ChargeOrder.objects.get(pk=order.pk)
+        self.assertEqual(
+            (stored.total, stored.balance_due, stored.status),
+            (Decimal("210.00"), Decimal("160.00"), "partially_paid"),
+        )
+        stored.recalc_totals()
+        self.assertEqual(
+            (stored.total, stored.balance_due), (order.total, order.balance_due)
+        )
+        self.assertEqual(stored.history.first().total, Decimal("210.00"))
+
+    def test_endpoint_validates_before_writing(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        url = reverse("add-charge-order-items", args=[self.appointment.pk])
+
+        response = client.post(
+            url,
+            {
+                "items": [
+                    {"service_id": self.service.pk},
+                    {"service_id": self.inactive.pk},
+                ]
+            },
+            format="json",
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(
+            ChargeOrder.objects.filter(appointment=self.appointment).exists()
+        )
+
+        response = client.post(
+            url,
+            {"items": [{"service_id": str(self.service.pk), "qty": 2}] * 3},
+            format="json",
+        )
+        self.assertEqual(response.status_code, 200)
+        order = ChargeOrder.objects.get(appointment=self.appointment)
+        self.assertEqual(order.items.count(), 3)
+        self.assertEqual((order.total, order.status), (Decimal("75.00"), "open"))
+
+
+class RecalcOrdersTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        patient = Patient.objects.create(first_name="Sara", last_name="Gil")
+        cls.institutions = [
+            InstitutionSettings.objects.create(
+                name=f"Sede {i}",
+                tax_id=f"J-7777777{i}-7",
+                phone="0",
+                logo="logos/r.png",
+            )
+            for i in range(2)
+        ]
+        cls.orders = []
+        for i in range(6):
+            order = ChargeOrder.objects.create(
+                patient=patient, institution=cls.institutions[i % 2]
+            )
+            order.add_items(
+                [ChargeItem(code="X", qty=Decimal("1"), unit_price=Decimal("30.00"))]
+            )
+            cls.orders.append(order)
+        Payment.objects.create(
+            institution=cls.institutions[0],
+            charge_order=cls.orders[0],
+            amount=Decimal("10"),
+            method="cash",
+            status="confirmed",
+        )
+        ChargeOrder.objects.filter(pk=cls.orders[4].pk).update(status="waived")
+        # Escrituras que no recalculan: ítem en lote y totales desajustados
+        ChargeItem.objects.bulk_create(
+            [ChargeItem(order=cls.orders[2], code="Y", unit_price=5, subtotal=5)]
+        )
+        ChargeOrder.objects.filter(pk__in=[o.pk for o in cls.orders[3:]]).update(
+            total=Decimal("0.00")
+        )
+
+    def stored(self):
+        return {
+            pk: (total, balance, status)
+            for pk, total, balance, status in ChargeOrder.objects.values_list(
+                "pk", "total", "balance_due", "status"
+            )
+        }
+
+    def expected(self):
+        expected = {}
+        for order in ChargeOrder.objects.all():
+            order.recalc_totals()
+            expected[order.pk] = (order.total, order.balance_due, order.status)
+        return expected
+
+    def test_dry_run_reports_without_writing(self):
+        before = self.stored()
+        out = io.StringIO()
+        call_command("recalc_orders", "--dry-run", "-v", "2", stdout=out)
+        self.assertEqual(self.stored(), before)
+        self.assertIn("5 órdenes a corregir de 6 revisadas", out.getvalue())
+
+    def test_set_based_matches_recalc_totals_with_fixed_queries(self):
+        history_before = ChargeOrder.history.count()
+        started = timezone.now()
+        with override_settings(DAILY_ROLLUPS_ENABLED=False):
+            # Por bloque: savepoint, lectura, ítems, pagos, UPDATE, lectura e
+            # INSERT del historial y release (2 bloques); más la lectura final
+            # vacía con su savepoint
+            with self.assertNumQueries(2 * 8 + 3):
+                result = OrderTotals(chunk_size=3).run()
+        self.assertEqual((result.scanned, result.changed), (6, 5))
+        self.assertEqual(self.stored(), self.expected())
+        self.assertEqual(self.stored()[self.orders[4].pk][2], "waived")
+
+        # updated_at e historial de las órdenes corregidas
+        changed = ChargeOrder.objects.filter(updated_at__gte=started)
+        self.assertEqual(changed.count(), 5)
+        records = ChargeOrder.history.filter(history_change_reason="recalc_orders")
+        self.assertEqual(ChargeOrder.history.count() - history_before, 5)
+        self.assertEqual(
+            {(r.id, r.total, r.history_type) for r in records},
+            {(o.pk, o.total, "~") for o in changed},
+        )
+
+    def test_institution_filter(self):
+        call_command(
+            "recalc_orders",
+            "--institution",
+            str(self.institutions[1].pk),
+            stdout=io.StringIO(),
+        )
+        stored, expected = self.stored(), self.expected()
+        # Todas las órdenes de la sede 0 quedaron desajustadas en el fixture
+        for order in self.orders:
+            fixed = order.institution_id == self.institutions[1].pk
+            self.assertEqual(stored[order.pk] == expected[order.pk], fixed)
+
+        # Lo que ejecuta cada hilo con --workers: una sede
+
+        result = OrderTotals().recalc(self.institutions[0].pk)
+        self.assertEqual((result.scanned, result.changed), (3, 3))
+        self.assertEqual(self.stored(), self.expected())
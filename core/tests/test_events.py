@@ -0,0 +1,286 @@
+import io
+from datetime import date, timedelta
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from core.models import (
+    Appointment,
+    ChargeOrder,
+    DoctorOperator,
+    DoctorPatientRelationship,
+    Event,
+    InstitutionSettings,
+    Notification,
+    Patient,
+)
+from core import services
+from core.serializers import EventSerializer
+from core.utils.events import EventBus, log_event
+from core.utils.notifications import NotificationInbox
+
+
+class EventBusTests(TestCase):
+    def test_events_follow_their_transaction_and_savepoints(self):
+        with transaction.atomic():
+            log_event("Patient", 1, "create")
+            self.assertEqual(Event.objects.count(), 1)
+            try:
+                with transaction.atomic():
+                    log_event("Patient", 2, "create")
+                    raise ValueError
+            except ValueError:
+                pass
+            log_event("Patient", 3, "create")
+        self.assertEqual(
+            sorted(Event.objects.values_list("entity_id", flat=True)), [1, 3]
+        )
+
+    def test_batch_writes_events_in_one_insert(self):
+        with CaptureQueriesContext(connection) as queries:
+            with EventBus.batch():
+                for i in range(5):
+                    log_event("Patient", i, "create", actor="system")
+                self.assertEqual(Event.objects.count(), 0)
+        inserts = [
+            q for q in queries if q["sql"].startswith('INSERT INTO "core_event"')
+        ]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(Event.objects.filter(entity="Patient").count(), 5)
+
+    def test_failed_batch_discards_its_events(self):
+        with self.assertRaises(RuntimeError):
+            with EventBus.batch():
+                log_event("Patient", 1, "create")
+                raise RuntimeError()
+        self.assertFalse(Event.objects.exists())
+
+    def test_repeated_updates_are_all_kept_with_occurrence_time(self):
+        first = timezone.now() - timedelta(minutes=5)
+        with EventBus.batch():
+            with mock.patch("core.utils.events.timezone.now", return_value=first):
+                log_event("Payment", 7, "update", metadata={"amount": 1.0})
+            log_event("Payment", 7, "update", metadata={"amount": 2.0})
+        events = list(Event.objects.order_by("id"))
+        self.assertEqual(
+            [e.metadata for e in events], [{"amount": 1.0}, {"amount": 2.0}]
+        )
+        self.assertEqual(events[0].timestamp, first)
+        self.assertGreater(events[1].timestamp, first)
+
+    @override_settings(EVENT_BUS_ENABLED=False)
+    def test_synchronous_fallback(self):
+        log_event("Patient", 1, "create")
+        self.assertEqual(Event.objects.count(), 1)
+
+
+class EventBusAutocommitTests(TransactionTestCase):
+    def test_event_is_committed_before_log_event_returns(self):
+        self.assertFalse(connection.in_atomic_block)
+        log_event("Patient", 1, "create", metadata={"source": "autocommit"})
+
+        # Otra conexión (otro worker) ya ve la fila
+        connection.close()
+        event = Event.objects.get(entity="Patient", entity_id=1)
+        self.assertEqual(event.metadata, {"source": "autocommit"})
+        self.assertLess(timezone.now() - event.timestamp, timedelta(seconds=5))
+
+
+class PatientAuditTrailTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create_user("audit-doctor", password="x")
+        institution = InstitutionSettings.objects.create(
+            name="Clínica Audit",
+            tax_id="J-22222222-2",
+            phone="0212",
+            logo="logos/a.png",
+        )
+        doctor = DoctorOperator.objects.create(user=user, full_name="Dr. Audit")
+        cls.patient = Patient.objects.create(first_name="Rosa", last_name="Mora")
+        cls.other = Patient.objects.create(first_name="Juan", last_name="Luna")
+        cls.appointment = Appointment.objects.create(
+            patient=cls.patient,
+            institution=institution,
+            doctor=doctor,
+            appointment_date=date(2025, 10, 18),
+        )
+        cls.order = ChargeOrder.objects.create(
+            appointment=cls.appointment, patient=cls.patient, institution=institution
+        )
+        # Eventos de las señales del fixture
+        Event.objects.all().delete()
+
+    def test_patient_id_is_assigned_when_events_are_written(self):
+        with EventBus.batch():
+            log_event("Appointment", self.appointment.pk, "update")
+            log_event("ChargeOrder", self.order.pk, "void")
+            log_event("Patient", self.patient.pk, "update")
+            log_event("Patient", self.other.pk, "update")
+        Event.objects.create(
+            entity="ChargeOrder", entity_id=self.order.pk, action="waive"
+        )
+
+        self.assertEqual(Event.objects.filter(patient_id=self.patient.pk).count(), 4)
+        self.assertEqual(Event.objects.filter(patient_id=self.other.pk).count(), 1)
+
+    def test_timeline_is_one_query_with_keyset_pages(self):
+        Event.objects.bulk_create(
+            Event(
+                entity="Patient",
+                entity_id=self.patient.pk,
+                action=f"a{i}",
+                patient_id=self.patient.pk,
+            )
+            for i in range(5)
+        )
+        Event.objects.create(entity="Patient", entity_id=self.other.pk, action="x")
+
+        with self.assertNumQueries(1):
+            first = services.get_audit_logic(patient_id=self.patient.pk, limit=3)
+        cursor = services.encode_audit_cursor(first[-1])
+        second = services.get_audit_logic(
+            patient_id=self.patient.pk, limit=3, cursor=cursor
+        )
+
+        ids = [e["id"] for e in first + second]
+        self.assertEqual(len(ids), 5)
+        self.assertEqual(len(set(ids)), 5)
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+        with self.assertRaises(ValueError):
+            services.get_audit_logic(patient_id=self.patient.pk, cursor="basura")
+
+    def test_backfill_command(self):
+        Event.objects.bulk_create(
+            [
+                Event(
+                    entity="Appointment", entity_id=self.appointment.pk, action="update"
+                ),
+                Event(entity="Patient", entity_id=self.other.pk, action="update"),
+                Event(
+                    entity="Legacy",
+                    entity_id=1,
+                    action="x",
+                    metadata={"patient_id": self.patient.pk},
+                ),
+            ]
+        )
+        call_command("backfill_event_patient_ids", batch_size=2, stdout=io.StringIO())
+        self.assertEqual(
+            set(Event.objects.values_list("entity", "patient_id")),
+            {
+                ("Appointment", self.patient.pk),
+                ("Patient", self.other.pk),
+                ("Legacy", self.patient.pk),
+            },
+        )
+
+
+class NotificationInboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = InstitutionSettings.objects.create(
+            name="Clínica Inbox",
+            tax_id="J-33333333-3",
+            phone="0212",
+            logo="logos/n.png",
+        )
+        cls.user = get_user_model().objects.create_user("inbox-doctor", password="x")
+        cls.other_user = get_user_model().objects.create_user(
+            "inbox-other", password="x"
+        )
+        doctor = DoctorOperator.objects.create(user=cls.user, full_name="Dr. Inbox")
+        cls.other_doctor = DoctorOperator.objects.create(
+            user=cls.other_user, full_name="Dr. Otro"
+        )
+        doctor.institutions.add(cls.institution)
+        cls.patient = Patient.objects.create(first_name="Eva", last_name="Sol")
+        DoctorPatientRelationship.objects.create(
+            doctor=cls.other_doctor, patient=cls.patient
+        )
+        Notification.objects.all().delete()
+
+    def setUp(self):
+        cache.clear()
+
+    def event(self, entity_id=1, **kwargs):
+        return Event.objects.create(
+            entity="Payment",
+            entity_id=entity_id,
+            action="confirm",
+            institution=self.institution,
+            notify=True,
+            **kwargs,
+        )
+
+    def test_recipients_are_scoped_to_institution_or_patient(self):
+        institution_id = self.institution.pk
+        log_event("Payment", 1, "confirm", notify=True, institution_id=institution_id)
+        log_event("Patient", self.patient.pk, "update", notify=True)
+        log_event("Patient", self.patient.pk, "create")
+        # Sin institución ni paciente: no se notifica a nadie
+        log_event("BCVRateCache", 0, "missing_rate", notify=True)
+
+        def inbox(user):
+            notifications = Notification.objects.filter(user=user)
+            return list(notifications.values_list("event__entity", flat=True))
+
+        self.assertEqual(inbox(self.user), ["Payment"])
+        self.assertEqual(inbox(self.other_user), ["Patient"])
+
+    def test_unread_badge_is_cached_and_invalidated(self):
+        self.event(1)
+        self.assertEqual(NotificationInbox.unread_count(self.user), 1)
+        with self.assertNumQueries(0):
+            self.assertEqual(NotificationInbox.unread_count(self.user), 1)
+
+        self.event(2)
+        self.assertEqual(NotificationInbox.unread_count(self.user), 2)
+
+        NotificationInbox.mark_read(self.user)
+        self.assertEqual(NotificationInbox.unread_count(self.user), 0)
+
+    def test_keyset_pages(self):
+        for i in range(5):
+            self.event(i)
+        first = NotificationInbox.page(self.user, limit=3)
+        second = NotificationInbox.page(self.user, cursor=first[-1].id, limit=3)
+        ids = [n.id for n in first + second]
+        self.assertEqual(len(set(ids)), 5)
+        self.assertEqual(ids, sorted(ids, reverse=True))
+
+
+class EventPresentationTests(SimpleTestCase):
+    def render(self, **kwargs):
+        return EventSerializer(Event(id=1, entity_id=7, **kwargs)).data
+
+    def test_registered_rules(self):
+        data = self.render(
+            entity="ChargeOrder", action="void", metadata={"reason": "Duplicada"}
+        )
+        self.assertEqual(data["title"], "Orden #7 anulada")
+        self.assertEqual(data["description"], "Razón: Duplicada | Por: Sistema")
+        self.assertEqual(data["action_href"], "/payments/7")
+        self.assertEqual(data["badge_action"], "delete")
+        self.assertEqual(data["category"], "chargeorder.void")
+
+    def test_fallbacks(self):
+        data = self.render(
+            entity="Custom{x}",
+            action="Sync",
+            metadata={"message": "hola"},
+            actor_name="",
+        )
+        self.assertEqual(data["title"], "Custom{x} Sync")
+        self.assertEqual(data["description"], "hola")
+        self.assertEqual(data["action_label"], "Ver detalle")
+        self.assertIsNone(data["action_href"])
+        self.assertEqual(data["badge_action"], "other")
+        self.assertEqual(data["actor"], "System")
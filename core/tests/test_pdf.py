@@ -0,0 +1,337 @@
+import hashlib
+import os
+import re
+import tempfile
+from datetime import date
+from unittest import mock
+from urllib.parse import unquote
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.template.loader import render_to_string
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from core.models import (
+    Appointment,
+    Diagnosis,
+    DoctorOperator,
+    InstitutionSettings,
+    MedicalDocument,
+    Patient,
+    Prescription,
+    Treatment,
+)
+from core import services
+from core.utils import pdf_styles
+from core.utils.pdf_cache import PDFCache
+from core.utils.pdf_engine import PDFEngine, PDFEngineBusy, PDFRenderTimeout
+from core.utils.pdf_styles import TemplateStyles
+from core.utils.qr import qr_data_uri, qr_svg
+
+
+class PDFEngineTests(SimpleTestCase):
+    def tearDown(self):
+        PDFEngine.shutdown()
+
+    @override_settings(PDF_ENGINE_WORKERS=0)
+    def test_inline_rendering_without_pool(self):
+        self.assertTrue(PDFEngine.render_html("<p>Hola</p>").startswith(b"%PDF"))
+        self.assertIsNone(PDFEngine._executor)
+
+    @override_settings(PDF_ENGINE_WORKERS=1, PDF_ENGINE_MAX_PENDING=2)
+    def test_pool_rendering_timeout_and_back_pressure(self):
+        # El primer trabajo espera el arranque del proceso: no está listo ya
+        with self.assertRaises(PDFRenderTimeout):
+            PDFEngine.render_html("<p>Uno</p>", timeout=0.001)
+        pdf = PDFEngine.render_html("<p>Dos</p>", timeout=60)
+        self.assertTrue(pdf.startswith(b"%PDF"))
+
+        _, slots = PDFEngine._get_pool()
+        for _ in range(2):
+            slots.acquire()
+        try:
+            with override_settings(PDF_ENGINE_QUEUE_TIMEOUT=0):
+                with self.assertRaises(PDFEngineBusy):
+                    PDFEngine.render_html("<p>Tres</p>")
+        finally:
+            for _ in range(2):
+                slots.release()
+
+
+@override_settings(PDF_ENGINE_WORKERS=0, R2_ENABLED=False)
+class BulkAppointmentDocsTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user("docs-doctor", password="x")
+        doctor = DoctorOperator.objects.create(user=cls.user, full_name="Dr. Docs")
+        institution = InstitutionSettings.objects.create(
+            name="Clínica Docs", tax_id="J-88888888-8", phone="0", logo="logos/d.png"
+        )
+        patient = Patient.objects.create(first_name="Rosa", last_name="Paz")
+        cls.appointment = Appointment.objects.create(
+            patient=patient,
+            institution=institution,
+            doctor=doctor,
+            appointment_date=date(2025, 11, 5),
+        )
+        diagnosis = Diagnosis.objects.create(
+            appointment=cls.appointment, icd_code="CA40", title="Neumonía"
+        )
+        for name in ("Amoxicilina", "Paracetamol"):
+            Prescription.objects.create(diagnosis=diagnosis, medication_text=name)
+        Treatment.objects.create(diagnosis=diagnosis, plan="Reposo relativo")
+
+    def setUp(self):
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        self.enterContext(override_settings(MEDIA_ROOT=media.name))
+
+    def test_documents_rendered_stored_and_bulk_created(self):
+        manager = MedicalDocument.objects
+        with mock.patch.object(
+            PDFEngine, "submit", wraps=PDFEngine.submit
+        ) as submit, mock.patch.object(
+            manager, "bulk_create", wraps=manager.bulk_create
+        ) as bulk_create:
+            result = services.bulk_generate_appointment_docs(
+                self.appointment, self.user
+            )
+
+        self.assertEqual(result["status"], "success", result["errors"])
+        self.assertEqual(submit.call_count, 2)
+        bulk_create.assert_called_once()
+        self.assertEqual(
+            [d["category"] for d in result["documents"]], ["prescription", "treatment"]
+        )
+        self.assertEqual(
+            result["documents"][0]["description"],
+            "Recetas Consolidadas (2 medicamentos)",
+        )
+
+        docs = MedicalDocument.objects.filter(appointment=self.appointment)
+        self.assertEqual(docs.count(), 2)
+        for doc in docs:
+            content = doc.file.read()
+            doc.file.close()
+            self.assertTrue(content.startswith(b"%PDF"))
+            self.assertEqual(doc.size_bytes, len(content))
+            self.assertEqual(doc.checksum_sha256, hashlib.sha256(content).hexdigest())
+            self.assertEqual(doc.doctor_id, self.appointment.doctor_id)
+            self.assertEqual(doc.institution_id, self.appointment.institution_id)
+
+    def test_failed_document_is_reported_and_others_saved(self):
+        # Un solo tratamiento: va por render_generic_html; las recetas, en bundle
+        with mock.patch.object(
+            services, "render_generic_html", side_effect=RuntimeError("plantilla rota")
+        ):
+            result = services.bulk_generate_appointment_docs(
+                self.appointment, self.user
+            )
+
+        self.assertEqual(result["status"], "partial_success")
+        self.assertEqual(result["errors"][0]["category"], "treatment")
+        self.assertEqual([d["category"] for d in result["documents"]], ["prescription"])
+
+    def test_failed_bulk_create_discards_stored_files(self):
+        with mock.patch.object(
+            MedicalDocument.objects, "bulk_create", side_effect=RuntimeError("db")
+        ):
+            result = services.bulk_generate_appointment_docs(
+                self.appointment, self.user
+            )
+
+        self.assertEqual(result["total_generated"], 0)
+        self.assertEqual(len(result["errors"]), 2)
+        self.assertFalse(MedicalDocument.objects.filter(appointment=self.appointment))
+        leftovers = [files for _, _, files in os.walk(settings.MEDIA_ROOT) if files]
+        self.assertEqual(leftovers, [])
+
+    def test_discard_without_r2_client_or_with_failing_r2_never_raises(self):
+        stored = [{"file": "documents/x.pdf", "file_url": "https://r2.test/a/x.pdf"}]
+        services._discard_document_files(stored, None)
+
+        r2_client = mock.Mock(public_url_base="https://r2.test")
+        r2_client.delete_file.side_effect = RuntimeError("r2")
+        with self.assertLogs("core.services", "WARNING"):
+            services._discard_document_files(stored, r2_client)
+        r2_client.delete_file.assert_called_once_with("a/x.pdf")
+
+
+class PDFStylesTests(SimpleTestCase):
+    TEMPLATE = "documents/prescription.html"
+
+    def setUp(self):
+        TemplateStyles._blocks.clear()
+        pdf_styles._stylesheets.clear()
+
+    def test_split_moves_static_style_blocks_out_of_html(self):
+        html = render_to_string(self.TEMPLATE, {})
+        stripped, styles = TemplateStyles.split(self.TEMPLATE, html)
+        assert styles is not None
+        key, texts = styles
+
+        self.assertIn("<style>", html)
+        self.assertNotIn("<style", stripped)
+        self.assertIn("@page", texts[0])
+        self.assertEqual(key[0], self.TEMPLATE)
+        # Mismo CSS, misma clave: el proceso del pool reutiliza las hojas
+        self.assertEqual(TemplateStyles.split(self.TEMPLATE, html)[1], styles)
+
+    def test_templated_style_blocks_stay_inline(self):
+        source = "<style>body { color: {{ color }}; }</style><p>x</p>"
+        template = mock.Mock()
+        template.template.source = source
+        with mock.patch("core.utils.pdf_styles.get_template", return_value=template):
+            html, styles = TemplateStyles.split("x.html", source)
+        self.assertEqual(html, source)
+        self.assertIsNone(styles)
+
+    def test_css_that_would_change_cascade_stays_inline(self):
+        # Las hojas movidas tienen origen de usuario: !important o CSS de autor
+        # restante cambiarían la cascada respecto del CSS en línea
+        style = "<style>p { color: red; }</style>"
+        cases = {
+            "important": ("<style>p { color: red ! important; }</style>", ""),
+            "included_style": (style, "<style>p { color: blue; }</style>"),
+            "link": (style, '<link rel="stylesheet" href="x.css">'),
+        }
+        for name, (source, rendered_extra) in cases.items():
+            with self.subTest(name):
+                TemplateStyles._blocks.clear()
+                template = mock.Mock()
+                template.template.source = source
+                rendered = source + rendered_extra + "<p>x</p>"
+                with mock.patch(
+                    "core.utils.pdf_styles.get_template", return_value=template
+                ):
+                    html, styles = TemplateStyles.split("x.html", rendered)
+                self.assertEqual(html, rendered)
+                self.assertIsNone(styles)
+
+    @override_settings(PDF_ENGINE_WORKERS=0)
+    def test_stylesheets_and_fonts_parsed_once_per_process(self):
+        import weasyprint
+
+        with mock.patch.object(weasyprint, "CSS", wraps=weasyprint.CSS) as css:
+            for _ in range(3):
+                pdf = PDFEngine.render(self.TEMPLATE, {})
+        self.assertTrue(pdf.startswith(b"%PDF"))
+        css.assert_called_once()
+        self.assertIs(css.call_args.kwargs["font_config"], pdf_styles.font_config())
+
+
+@override_settings(PDF_ENGINE_WORKERS=0, PDF_CACHE_MAX_BYTES=250)
+class PDFCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create_user("cache-doctor", password="x")
+        doctor = DoctorOperator.objects.create(user=user, full_name="Dr. Cache")
+        cls.institution = InstitutionSettings.objects.create(
+            name="Clínica Cache", tax_id="J-99999999-9", phone="0", logo="logos/c.png"
+        )
+        appointment = Appointment.objects.create(
+            patient=Patient.objects.create(first_name="Ana", last_name="Sol"),
+            institution=cls.institution,
+            doctor=doctor,
+            appointment_date=date(2025, 11, 6),
+        )
+        diagnosis = Diagnosis.objects.create(
+            appointment=appointment, icd_code="CA40", title="Neumonía"
+        )
+        cls.prescription = Prescription.objects.create(
+            diagnosis=diagnosis, medication_text="Amoxicilina"
+        )
+
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        self.enterContext(override_settings(PDF_CACHE_DIR=cache_dir.name))
+
+    def generate(self):
+        return services.generate_generic_pdf(
+            self.prescription, "prescription", self.institution, use_cache=True
+        )
+
+    def test_reprint_reuses_pdf_and_audit_code(self):
+        first = self.generate()
+        with mock.patch.object(services, "document_audit_fields") as mint:
+            with mock.patch.object(PDFEngine, "render_html") as render:
+                self.assertEqual(self.generate(), first)
+        render.assert_not_called()
+        mint.assert_not_called()
+
+    def test_prescription_view_reprints_from_cache(self):
+        client = APIClient()
+        client.force_authenticate(self.prescription.diagnosis.appointment.doctor.user)
+        url = reverse("generate-prescription-pdf", args=[self.prescription.pk])
+        headers = {"X-Institution-ID": str(self.institution.pk)}
+
+        first = client.get(url, headers=headers)
+        self.assertEqual(first.status_code, 200)
+        self.assertTrue(
+            first["Content-Disposition"].startswith(
+                'attachment; filename="prescription_'
+            )
+        )
+        with mock.patch.object(PDFEngine, "render_html") as render:
+            again = client.get(url, headers=headers)
+        render.assert_not_called()
+        self.assertEqual(again.content, first.content)
+        self.assertEqual(again["Content-Disposition"], first["Content-Disposition"])
+
+    def test_changed_content_mints_new_document(self):
+        _, _, audit_code = self.generate()
+        self.prescription.indications = "Tomar con abundante agua"
+        self.prescription.save()
+
+        _, filename, new_code = self.generate()
+        self.assertNotEqual(new_code, audit_code)
+        self.assertIn(new_code, filename)
+        self.assertEqual(self.generate()[2], new_code)
+
+    def test_least_recently_used_entries_evicted(self):
+        pdf = b"%PDF" + b"x" * 96
+        PDFCache.put("aa01", pdf, "a.pdf", "A")
+        PDFCache.put("bb02", pdf, "b.pdf", "B")
+        os.utime(PDFCache._paths("aa01")[0], (1000, 1000))
+        os.utime(PDFCache._paths("bb02")[0], (2000, 2000))
+
+        self.assertEqual(PDFCache.get("aa01"), (pdf, "a.pdf", "A"))  # toca "aa01"
+        PDFCache.put("cc03", pdf, "c.pdf", "C")
+
+        self.assertIsNone(PDFCache.get("bb02"))
+        self.assertIsNotNone(PDFCache.get("aa01"))
+        self.assertIsNotNone(PDFCache.get("cc03"))
+
+
+class QRCodeTests(SimpleTestCase):
+    def setUp(self):
+        qr_data_uri.cache_clear()
+
+    def test_svg_path_reproduces_qr_matrix(self):
+        import qrcode
+
+        payload = "https://example.com/verify/ABC123DEF456"
+        qr = qrcode.QRCode(border=2)
+        qr.add_data(payload)
+        qr.make(fit=True)
+        expected = qr.get_matrix()
+
+        svg = qr_svg(payload)
+        drawn = [[False] * len(expected) for _ in expected]
+        for x, y, n in re.findall(r"M(\d+),(\d+)\.5h(\d+)", svg):
+            for dx in range(int(n)):
+                drawn[int(y)][int(x) + dx] = True
+        self.assertEqual(drawn, expected)
+
+    def test_data_uri_is_svg_and_memoized(self):
+        uri = qr_data_uri("Audit:ABC123")
+        prefix = "data:image/svg+xml,"
+        self.assertTrue(uri.startswith(prefix))
+        self.assertIn("<path", unquote(uri[len(prefix) :]))
+
+        self.assertEqual(qr_data_uri("Audit:ABC123"), uri)
+        self.assertEqual(qr_data_uri.cache_info().hits, 1)
+        self.assertNotEqual(qr_data_uri("Audit:XYZ789"), uri)
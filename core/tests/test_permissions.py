@@ -0,0 +1,146 @@
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+
+from core.models import (
+    DoctorOperator,
+    AuditLog,
+    DoctorPatientRelationship,
+    InstitutionPermission,
+    InstitutionSettings,
+    Patient,
+)
+from core.middleware import InstitutionPermissionMiddleware
+from core.permissions import (
+    ACCESS_COUNT_BUFFER,
+    PatientAccessScope,
+    SmartInstitutionValidator,
+)
+
+
+class PatientAccessScopeTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user("scope-doctor", password="x")
+        cls.doctor = DoctorOperator.objects.create(user=cls.user, full_name="Dr. Scope")
+        cls.own = Patient.objects.create(first_name="Luis", last_name="Díaz")
+        cls.other = Patient.objects.create(first_name="Inés", last_name="Peña")
+        DoctorPatientRelationship.objects.create(doctor=cls.doctor, patient=cls.own)
+
+    def setUp(self):
+        cache.clear()
+
+    def test_filter_queryset_uses_subquery(self):
+        scope = PatientAccessScope(self.user)
+        queryset = scope.filter_queryset(Patient.objects.all(), field="id")
+        self.assertIn("doctor_patient_relationships", str(queryset.query))
+        self.assertEqual(list(queryset), [self.own])
+
+    @override_settings(AUTHORIZATION_CACHE_ENABLED=True)
+    def test_membership_is_memoized_and_cached(self):
+        scope = PatientAccessScope(self.user)
+        self.assertTrue(scope.allows(self.own.pk))
+        with self.assertNumQueries(0):
+            self.assertFalse(scope.allows(self.other.pk))
+            self.assertTrue(scope.allows_as_doctor(self.own.pk))
+
+        # Otro request: el conjunto sale del cache
+        with self.assertNumQueries(0):
+            self.assertTrue(PatientAccessScope(self.user).allows(self.own.pk))
+
+    @override_settings(AUTHORIZATION_CACHE_ENABLED=False)
+    def test_ids_not_cached_across_requests_without_shared_cache(self):
+        self.assertTrue(PatientAccessScope(self.user).allows(self.own.pk))
+        key = PatientAccessScope.doctor_cache_key(self.doctor.pk)
+        self.assertIsNone(cache.get(key))
+
+        # Revocación hecha por otro worker (sin señal en este proceso)
+        DoctorPatientRelationship.objects.filter(doctor=self.doctor).update(
+            status="inactive"
+        )
+        self.assertFalse(PatientAccessScope(self.user).allows(self.own.pk))
+
+    @override_settings(AUTHORIZATION_CACHE_ENABLED=True)
+    def test_relationship_changes_invalidate_cache(self):
+        self.assertFalse(PatientAccessScope(self.user).allows(self.other.pk))
+        relationship = DoctorPatientRelationship.objects.create(
+            doctor=self.doctor, patient=self.other
+        )
+        self.assertTrue(PatientAccessScope(self.user).allows(self.other.pk))
+
+        relationship.status = "inactive"
+        relationship.save()
+        self.assertFalse(PatientAccessScope(self.user).allows(self.other.pk))
+
+
+class InstitutionPermissionCacheTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user("inst-doctor", password="x")
+        cls.doctor = DoctorOperator.objects.create(user=cls.user, full_name="Dr. Inst")
+        cls.institution = InstitutionSettings.objects.create(
+            name="Clínica Inst", tax_id="J-11111111-1", phone="0212", logo="logos/i.png"
+        )
+        cls.doctor.institutions.add(cls.institution)
+
+    def setUp(self):
+        cache.clear()
+
+    @override_settings(AUTHORIZATION_CACHE_ENABLED=True)
+    def test_permission_level_is_cached_until_permission_changes(self):
+        info = SmartInstitutionValidator.get_cached_permission_level(
+            self.doctor, self.institution
+        )
+        self.assertEqual(info["level"], "full_access")
+        self.assertNotIn("permission", info)
+        with self.assertNumQueries(0):
+            SmartInstitutionValidator.get_cached_permission_level(
+                self.doctor, self.institution
+            )
+
+        permission = InstitutionPermission.objects.get(pk=info["permission_id"])
+        permission.save()
+        with self.assertNumQueries(2):
+            SmartInstitutionValidator.get_cached_permission_level(
+                self.doctor, self.institution
+            )
+
+    def test_institution_cached_only_with_shared_cache(self):
+        key = InstitutionPermissionMiddleware.institution_cache_key(self.institution.pk)
+        with override_settings(AUTHORIZATION_CACHE_ENABLED=False):
+            InstitutionPermissionMiddleware.get_institution(self.institution.pk)
+            self.assertIsNone(cache.get(key))
+
+            # Cambio hecho por otro worker (sin señal en este proceso)
+            InstitutionSettings.objects.filter(pk=self.institution.pk).update(
+                name="Clínica Renombrada"
+            )
+            institution = InstitutionPermissionMiddleware.get_institution(
+                self.institution.pk
+            )
+            self.assertEqual(institution.name, "Clínica Renombrada")
+
+        with override_settings(AUTHORIZATION_CACHE_ENABLED=True):
+            InstitutionPermissionMiddleware.get_institution(self.institution.pk)
+            with self.assertNumQueries(0):
+                InstitutionPermissionMiddleware.get_institution(self.institution.pk)
+
+    def test_audit_log_is_synchronous_and_counter_is_buffered(self):
+        ACCESS_COUNT_BUFFER.flush()
+        # Sin hilo de fondo: el volcado se hace explícitamente con flush()
+        with mock.patch.object(ACCESS_COUNT_BUFFER, "_ensure_thread"):
+            with override_settings(WRITE_BEHIND_ENABLED=True):
+                for _ in range(3):
+                    SmartInstitutionValidator.log_access(
+                        self.doctor, self.institution, "POST /api/appointments/"
+                    )
+        self.assertEqual(AuditLog.objects.filter(user=self.user).count(), 3)
+        permission = InstitutionPermission.objects.get(user=self.user)
+        self.assertEqual(permission.access_count, 0)
+
+        self.assertEqual(ACCESS_COUNT_BUFFER.flush(), 3)
+        permission.refresh_from_db()
+        self.assertEqual(permission.access_count, 3)
+        self.assertIsNotNone(permission.last_accessed)
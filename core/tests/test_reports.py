@@ -0,0 +1,558 @@
+import io
+import tempfile
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from openpyxl import load_workbook
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from core.models import (
+    Appointment,
+    BCVRateCache,
+    ChargeItem,
+    ChargeOrder,
+    DoctorOperator,
+    DoctorService,
+    DoctorPatientRelationship,
+    InstitutionSettings,
+    Patient,
+    Payment,
+    ReportJob,
+)
+from core import services
+from core.api_views import AppointmentViewSet
+from core.permissions import PatientAccessScope
+from core.utils.institutional_report import (
+    InstitutionalReport,
+    ReportHeader,
+    convert_amounts,
+)
+from core.utils.pdf import appointment_report_totals, render_pdf_appointments
+from core.utils.report_engine import ReportEngine
+from core.utils.report_export import ReportExport
+from core.utils.report_jobs import ReportJobs
+
+
+class ReportExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user("export-doctor", password="x")
+        doctor = DoctorOperator.objects.create(user=cls.user, full_name="Dr. Export")
+        cls.institution, other_institution = (
+            InstitutionSettings.objects.create(
+                name=name, tax_id=tax_id, phone="0212", logo="logos/e.png"
+            )
+            for name, tax_id in (
+                ("Clínica Export", "J-77777777-7"),
+                ("Clínica Ajena", "J-78787878-7"),
+            )
+        )
+        for i, first_name in enumerate(["Ana", "Bea", "Ceci"]):
+            patient = Patient.objects.create(first_name=first_name, last_name="Díaz")
+            DoctorPatientRelationship.objects.create(doctor=doctor, patient=patient)
+            Appointment.objects.create(
+                patient=patient,
+                institution=cls.institution,
+                doctor=doctor,
+                appointment_date=date(2025, 8, 1 + i),
+                status="completed",
+            )
+        # Fuera del alcance: otra institución y un paciente sin relación
+        Appointment.objects.create(
+            patient=patient,
+            institution=other_institution,
+            doctor=doctor,
+            appointment_date=date(2025, 8, 1),
+            status="completed",
+        )
+        Appointment.objects.create(
+            patient=Patient.objects.create(first_name="Dora", last_name="Luna"),
+            institution=cls.institution,
+            doctor=doctor,
+            appointment_date=date(2025, 8, 2),
+            status="completed",
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def get(self, params):
+        return self.client.get(
+            reverse("reports-export-api"),
+            params,
+            HTTP_X_INSTITUTION_ID=str(self.institution.pk),
+        )
+
+    def test_clinical_rows_come_from_one_projection_query(self):
+        export = ReportExport(
+            "CLINICAL",
+            start_date="2025-08-01",
+            end_date="2025-08-02",
+            institution_id=self.institution.pk,
+            scope=PatientAccessScope(self.user),
+        )
+        with self.assertNumQueries(1):
+            rows = list(export.rows())
+        self.assertEqual(
+            [row[1:] for row in rows],
+            [
+                ["01/08/2025", "Ana Díaz", "Completed", "Dr. Export"],
+                ["02/08/2025", "Bea Díaz", "Completed", "Dr. Export"],
+            ],
+        )
+
+    def test_export_without_patient_scope_is_empty(self):
+        export = ReportExport("CLINICAL", institution_id=self.institution.pk)
+        self.assertEqual(list(export.rows()), [])
+
+    def test_csv_is_streamed(self):
+        response = self.get({"type": "CLINICAL", "format": "csv"})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        lines = b"".join(response.streaming_content).decode("utf-8-sig").splitlines()
+        self.assertEqual(lines[0], "ID,Fecha de Cita,Paciente,Estado,Médico")
+        self.assertEqual(len(lines), 4)
+
+    def test_excel_is_written_in_write_only_mode(self):
+        response = self.get({"type": "COMBINED"})
+        self.assertEqual(response.status_code, 200)
+        sheet = load_workbook(io.BytesIO(b"".join(response.streaming_content))).active
+        assert sheet is not None
+        self.assertEqual(sheet.max_row, 4)
+        self.assertEqual(sheet["B2"].value, "Cita")
+
+    def test_invalid_parameters_return_400(self):
+        self.assertEqual(self.get({"type": "OTHER"}).status_code, 400)
+        self.assertEqual(self.get({"start_date": "ayer"}).status_code, 400)
+        response = self.client.get(reverse("reports-export-api"), {"type": "CLINICAL"})
+        self.assertEqual(response.status_code, 400)
+
+
+@override_settings(MEDIA_ROOT=tempfile.mkdtemp(), R2_ENABLED=False)
+@mock.patch.object(ReportJobs, "enqueue", ReportJobs.run)
+class ReportJobTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user("job-doctor", password="x")
+        doctor = DoctorOperator.objects.create(user=cls.user, full_name="Dr. Job")
+        cls.institution = InstitutionSettings.objects.create(
+            name="Clínica Job", tax_id="J-66666666-6", phone="0212", logo="logos/j.png"
+        )
+        patient = Patient.objects.create(first_name="Ana", last_name="Díaz")
+        DoctorPatientRelationship.objects.create(doctor=doctor, patient=patient)
+        Appointment.objects.create(
+            patient=patient,
+            institution=cls.institution,
+            doctor=doctor,
+            appointment_date=date(2025, 8, 1),
+            status="completed",
+        )
+        cls.params = {
+            "type": "CLINICAL",
+            "format": "csv",
+            "start_date": "2025-08-01",
+            "institution_id": cls.institution.pk,
+        }
+
+    def submit(self):
+        return ReportJobs.submit("export", dict(self.params), user=self.user)
+
+    def test_submit_runs_after_commit_and_stores_artifact(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            job, reused = self.submit()
+        self.assertFalse(reused)
+        job.refresh_from_db()
+        self.assertEqual(job.status, "done")
+        self.assertEqual(job.filename, "reporte_clinical_2025-08-01.csv")
+        with job.file.open("rb") as fileobj:
+            lines = fileobj.read().decode("utf-8-sig").splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertEqual(job.size, job.file.size)
+
+    def test_identical_requests_reuse_the_job(self):
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            first, _ = self.submit()
+            second, reused = self.submit()
+        self.assertTrue(reused)
+        self.assertEqual(first.pk, second.pk)
+        self.assertEqual(len(callbacks), 1)
+
+        ReportJob.objects.filter(pk=first.pk).update(status="failed")
+        third, reused = self.submit()
+        self.assertFalse(reused)
+        self.assertNotEqual(third.pk, first.pk)
+
+        # Otro usuario con los mismos parámetros no comparte el job
+        other = get_user_model().objects.create_user("job-other", password="x")
+        fourth, reused = ReportJobs.submit("export", dict(self.params), user=other)
+        self.assertFalse(reused)
+        self.assertNotEqual(fourth.fingerprint, third.fingerprint)
+
+    @override_settings(REPORT_JOBS_STALE_SECONDS=60)
+    def test_stale_jobs_are_failed_and_not_reused(self):
+        job, _ = self.submit()
+        ReportJob.objects.filter(pk=job.pk).update(
+            status="running", started_at=timezone.now() - timedelta(minutes=5)
+        )
+        retry, reused = self.submit()
+        self.assertFalse(reused)
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+        self.assertEqual(job.error, "Tiempo de generación excedido")
+        self.assertEqual(retry.status, "pending")
+
+    def test_render_errors_mark_the_job_failed(self):
+        job, _ = self.submit()
+        with mock.patch.object(ReportJobs, "render", side_effect=RuntimeError("boom")):
+            ReportJobs.run(job.pk)
+        job.refresh_from_db()
+        self.assertEqual(job.status, "failed")
+        self.assertEqual(job.error, "boom")
+        self.assertIsNone(ReportJobs.run(job.pk))
+
+    def test_api_submit_poll_and_download(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse("report-jobs-api"),
+                {"kind": "export", **self.params, "institution_id": 0},
+                format="json",
+                HTTP_X_INSTITUTION_ID=str(self.institution.pk),
+            )
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(response.json()["reused"])
+
+        job_uuid = response.json()["uuid"]
+        detail = self.client.get(reverse("report-job-detail-api", args=[job_uuid]))
+        self.assertEqual(detail.json()["status"], "done")
+
+        download = self.client.get(detail.json()["download_url"])
+        self.assertEqual(download.status_code, 200)
+        self.assertIn(b"Ana D", b"".join(download.streaming_content))
+
+        # Otro usuario no ve ni descarga el job
+        other = get_user_model().objects.create_user("job-intruder", password="x")
+        self.client.force_authenticate(other)
+        detail_url = reverse("report-job-detail-api", args=[job_uuid])
+        self.assertEqual(self.client.get(detail_url).status_code, 404)
+        download_url = detail.json()["download_url"]
+        self.assertEqual(self.client.get(download_url).status_code, 404)
+
+        invalid = self.client.post(
+            reverse("report-jobs-api"),
+            {"kind": "export", "format": "pdf"},
+            format="json",
+            HTTP_X_INSTITUTION_ID=str(self.institution.pk),
+        )
+        self.assertEqual(invalid.status_code, 400)
+
+    def test_api_accepts_form_encoded_bodies(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        response = client.post(
+            reverse("report-jobs-api"),
+            {"kind": "export", "type": "CLINICAL", "format": "csv"},
+            HTTP_X_INSTITUTION_ID=str(self.institution.pk),
+        )
+        self.assertEqual(response.status_code, 202)
+        job = ReportJob.objects.get(uuid=response.json()["uuid"])
+        self.assertEqual(job.params["type"], "CLINICAL")
+        self.assertEqual(job.params["format"], "csv")
+
+
+class ReportEngineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model().objects.create_user("report-doctor", password="x")
+        doctor = DoctorOperator.objects.create(user=cls.user, full_name="Dr. Report")
+        cls.institution = InstitutionSettings.objects.create(
+            name="Clínica Report",
+            tax_id="J-55555555-5",
+            phone="0212",
+            logo="logos/r.png",
+        )
+        consult = DoctorService.objects.create(
+            doctor=doctor, code="CONS", name="Consulta"
+        )
+        echo = DoctorService.objects.create(doctor=doctor, code="ECO", name="Eco")
+        patient = Patient.objects.create(first_name="Ana", last_name="Díaz")
+
+        def order(day, *items):
+            appointment = Appointment.objects.create(
+                patient=patient,
+                institution=cls.institution,
+                doctor=doctor,
+                appointment_date=day,
+                status="completed",
+            )
+            charge_order = ChargeOrder.objects.create(
+                appointment=appointment, patient=patient, institution=cls.institution
+            )
+            for service, price in items:
+                ChargeItem.objects.create(
+                    order=charge_order,
+                    code=service.code,
+                    unit_price=Decimal(price),
+                    doctor_service=service,
+                )
+            return charge_order
+
+        cls.full = order(date(2025, 9, 1), (consult, "30"), (echo, "70"))
+        cls.split = order(date(2025, 9, 3), (consult, "30"), (echo, "70"))
+        # Dos pagos el mismo día: antes duplicaban los ítems de la orden
+        cls.pay(cls.full, "40", date(2025, 9, 2))
+        cls.pay(cls.full, "60", date(2025, 9, 2))
+        # Pago parcial en dos días y uno fuera del rango consultado
+        cls.pay(cls.split, "40", date(2025, 9, 4))
+        cls.pay(cls.split, "50", date(2025, 9, 5))
+        cls.pay(cls.split, "10", date(2025, 9, 20))
+        cls.pay(cls.split, "99", date(2025, 9, 4), status="pending")
+
+    @classmethod
+    def pay(cls, order, amount, day, status="confirmed"):
+        Payment.objects.create(
+            institution=cls.institution,
+            charge_order=order,
+            amount=Decimal(amount),
+            method="cash",
+            status=status,
+            received_at=timezone.make_aware(datetime.combine(day, time(10))),
+        )
+
+    @staticmethod
+    def amounts(rows):
+        return [(row["date"], row["entity"], row["amount"]) for row in rows]
+
+    def test_financial_rows_are_not_multiplied_by_payments(self):
+        engine = ReportEngine("FINANCIAL", "2025-09-01", "2025-09-10")
+        with self.assertNumQueries(1):
+            rows = engine.rows()
+        self.assertEqual(
+            self.amounts(rows),
+            [
+                ("2025-09-05", "Consulta", 15.0),
+                ("2025-09-05", "Eco", 35.0),
+                ("2025-09-04", "Consulta", 12.0),
+                ("2025-09-04", "Eco", 28.0),
+                ("2025-09-02", "Consulta", 30.0),
+                ("2025-09-02", "Eco", 70.0),
+            ],
+        )
+        self.assertEqual(sum(row["amount"] for row in rows), 190.0)
+
+    def test_clinical_rows_group_items_by_appointment_date(self):
+        engine = ReportEngine("CLINICAL", "2025-09-02", "2025-09-10")
+        with self.assertNumQueries(1):
+            rows = engine.rows()
+        self.assertEqual(
+            self.amounts(rows),
+            [("2025-09-03", "Consulta", 30.0), ("2025-09-03", "Eco", 70.0)],
+        )
+
+    def test_api_combined_report_and_invalid_dates(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+        url = reverse("reports-api")
+        response = self.client.get(
+            url,
+            {"type": "combined", "start_date": "2025-09-01", "end_date": "2025-09-02"},
+        )
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [(row["date"], row["type"]) for row in response.json()],
+            [
+                ("2025-09-02", "financial"),
+                ("2025-09-02", "financial"),
+                ("2025-09-01", "clinical"),
+                ("2025-09-01", "clinical"),
+            ],
+        )
+        self.assertEqual(self.client.get(url, {"start_date": "ayer"}).status_code, 400)
+
+
+class InstitutionalReportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.institution = InstitutionSettings.objects.create(
+            name="Clínica Informe",
+            tax_id="J-44444444-4",
+            phone="0212",
+            logo="logos/i.png",
+        )
+        BCVRateCache.objects.create(date=date(2025, 9, 1), value=Decimal("36.5"))
+        cls.rows = [
+            {
+                "id": f"FIN-{i}",
+                "date": "2025-09-01T10:00:00",
+                "type": "financial",
+                "entity": "Consulta",
+                "status": "CONFIRMED",
+                "amount": 2.5,
+            }
+            for i in range(5)
+        ]
+
+    def setUp(self):
+        cache.clear()
+
+    def test_amounts_are_converted_in_one_pass(self):
+        amounts = convert_amounts(
+            [{"amount": "1.005"}, {"amount": 2.5}, {"amount": None}], Decimal("36.5")
+        )
+        self.assertEqual(amounts, [Decimal("36.68"), Decimal("91.25"), Decimal("0.00")])
+
+    def test_header_is_cached_until_settings_change(self):
+        self.assertEqual(ReportHeader.get()["institution"]["name"], "Clínica Informe")
+        with self.assertNumQueries(0):
+            ReportHeader.get()
+        self.institution.name = "Clínica Renombrada"
+        self.institution.save()
+        self.assertEqual(
+            ReportHeader.get()["institution"]["name"], "Clínica Renombrada"
+        )
+
+    def test_pdf_table_is_split_in_aligned_chunks(self):
+        report = InstitutionalReport(self.rows, {}, "VES", "tester")
+        report.CHUNK_ROWS = 2
+        tables = report.table_chunks()
+        self.assertEqual([len(table._cellvalues) for table in tables], [3, 3, 2])
+        self.assertEqual(len({tuple(table._colWidths) for table in tables}), 1)
+        self.assertEqual(tables[0]._cellvalues[1][5], "91.25")
+
+        buffer, content_type, filename = report.export("pdf")
+        self.assertEqual(content_type, "application/pdf")
+        self.assertTrue(buffer.getvalue().startswith(b"%PDF"))
+
+    def test_excel_export(self):
+        buffer, _, filename = services.export_institutional_report(
+            self.rows, "excel", {}, "VES", "tester"
+        )
+        sheet = load_workbook(buffer).active
+        assert sheet is not None
+        self.assertEqual(filename, "reporte.xlsx")
+        self.assertEqual(sheet["A1"].value, "Clínica Informe")
+        self.assertEqual(sheet["B3"].value, "2025-09-01")
+        self.assertEqual(sheet["F3"].value, 91.25)
+        self.assertEqual(sheet.max_row, 7)
+
+        with self.assertRaises(ValueError):
+            services.export_institutional_report(self.rows, "csv", {}, "USD", "")
+
+
+class AppointmentPdfReportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create_user("pdf-doctor", password="x")
+        doctor = DoctorOperator.objects.create(user=user, full_name="Dr. Pdf")
+        institution = InstitutionSettings.objects.create(
+            name="Clínica Pdf", tax_id="J-33333333-3", phone="0212", logo="logos/p.png"
+        )
+        patient = Patient.objects.create(first_name="Ana", last_name="Díaz")
+
+        def appointment(expected):
+            return Appointment.objects.create(
+                patient=patient,
+                institution=institution,
+                doctor=doctor,
+                appointment_date=date(2025, 9, 1),
+                expected_amount=Decimal(expected),
+            )
+
+        def pay(appt, order, amount, status="confirmed"):
+            Payment.objects.create(
+                institution=institution,
+                appointment=appt,
+                charge_order=order,
+                amount=Decimal(amount),
+                method="cash",
+                status=status,
+            )
+
+        # Con orden: el saldo sale de la orden (no anulada)
+        with_order = appointment("50")
+        order = ChargeOrder.objects.create(
+            appointment=with_order,
+            patient=patient,
+            institution=institution,
+            total=Decimal("80"),
+            balance_due=Decimal("30"),
+        )
+        pay(with_order, order, "50")
+        # Sin orden propia: saldo = esperado - pagado
+        without_order = appointment("40")
+        other = ChargeOrder.objects.create(patient=patient, institution=institution)
+        pay(without_order, other, "15")
+        pay(without_order, other, "99", status="pending")
+        # Sobrepagada: el saldo no baja de cero
+        appointment("0")
+
+    def test_annotations_match_instance_methods(self):
+        with self.assertNumQueries(1):
+            annotated = list(Appointment.objects.with_financials().order_by("pk"))
+        for appt, plain in zip(annotated, Appointment.objects.order_by("pk")):
+            with self.assertNumQueries(0):
+                paid, balance = appt.total_paid(), appt.balance_due()
+                fully_paid = appt.is_fully_paid
+            self.assertEqual(paid, plain.total_paid())
+            self.assertEqual(balance, plain.balance_due())
+            self.assertEqual(fully_paid, plain.is_fully_paid)
+        self.assertEqual(
+            [appt.is_fully_paid for appt in annotated], [False, False, True]
+        )
+
+    def test_viewset_annotates_only_retrieve(self):
+        request = Request(APIRequestFactory().get("/"))
+        request.user = get_user_model().objects.create_superuser("fin-admin")
+        cases = (("list", False), ("update", False), ("retrieve", True))
+        for action, annotated in cases:
+            view = AppointmentViewSet(action=action, request=request, format_kwarg=None)
+            annotations = view.get_queryset().query.annotations
+            self.assertEqual("balance_total" in annotations, annotated, action)
+
+    def test_admin_changelist_does_not_query_per_row(self):
+        admin_user = get_user_model().objects.create_superuser(
+            "pdf-admin", password="x"
+        )
+        self.client.force_login(admin_user)
+        url = reverse("admin:core_appointment_changelist")
+
+        def changelist_queries(params=None):
+            with CaptureQueriesContext(connection) as ctx:
+                response = self.client.get(url, params or {})
+            self.assertEqual(response.status_code, 200)
+            return len(ctx.captured_queries)
+
+        baseline = changelist_queries()
+        appointment = Appointment.objects.all()[0]
+        for _ in range(3):
+            appointment.pk = None
+            appointment.save()
+        self.assertEqual(changelist_queries(), baseline)
+
+        response = self.client.get(url, {"balance_due": "no_balance"})
+        self.assertEqual(len(response.context["cl"].result_list), 4)
+
+    def test_report_uses_a_constant_number_of_queries(self):
+        self.assertEqual(
+            appointment_report_totals(Appointment.objects.all()),
+            {
+                "count": 3,
+                "expected": Decimal("90.00"),
+                "paid": Decimal("65.00"),
+                "balance": Decimal("55.00"),
+            },
+        )
+        with self.assertNumQueries(2):
+            pdf = render_pdf_appointments(Appointment.objects.all(), None)
+        self.assertTrue(pdf.startswith(b"%PDF"))
@@ -0,0 +1,275 @@
+import io
+from datetime import date, datetime, time
+from decimal import Decimal
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TestCase
+from django.urls import reverse
+from django.utils import timezone
+
+from core.models import (
+    Appointment,
+    ChargeOrder,
+    DailyInstitutionRollup,
+    DoctorOperator,
+    InstitutionSettings,
+    Patient,
+    Payment,
+)
+from core import services
+from core.utils.dashboard import DashboardEngine
+from core.utils.rollups import DailyRollup
+
+
+class DailyRollupTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create_user("rollup-doctor", password="x")
+        cls.institution = InstitutionSettings.objects.create(
+            name="Clínica Rollup",
+            tax_id="J-44444444-4",
+            phone="0212",
+            logo="logos/r.png",
+        )
+        cls.doctor = DoctorOperator.objects.create(user=user, full_name="Dr. Rollup")
+        cls.patient = Patient.objects.create(first_name="Luis", last_name="Paz")
+
+    def setUp(self):
+        cache.clear()
+
+    def appointment(self, day, status="pending"):
+        return Appointment.objects.create(
+            patient=self.patient,
+            institution=self.institution,
+            doctor=self.doctor,
+            appointment_date=day,
+            status=status,
+        )
+
+    def rollups(self, day):
+        return DailyInstitutionRollup.objects.filter(
+            institution=self.institution, date=day
+        )
+
+    def rollup(self, day) -> DailyInstitutionRollup:
+        return self.rollups(day).get()
+
+    def test_rows_follow_saves_moves_and_deletes(self):
+        day, other_day = date(2025, 3, 10), date(2025, 3, 11)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                done = self.appointment(day, status="completed")
+                moved = self.appointment(day)
+                order = ChargeOrder.objects.create(
+                    appointment=done,
+                    patient=self.patient,
+                    institution=self.institution,
+                    total=Decimal("40.00"),
+                    balance_due=Decimal("15.00"),
+                )
+                Payment.objects.create(
+                    institution=self.institution,
+                    appointment=done,
+                    charge_order=order,
+                    amount=Decimal("25.00"),
+                    method="cash",
+                    status="confirmed",
+                    received_at=timezone.make_aware(datetime.combine(day, time(10))),
+                )
+
+        row = self.rollup(day)
+        self.assertEqual(row.appointments_total, 2)
+        self.assertEqual(row.appointments_completed, 1)
+        self.assertEqual(row.appointments_pending, 1)
+        self.assertEqual(row.payments_count, 1)
+        self.assertEqual(row.collected_total, Decimal("25.00"))
+        billed = self.rollup(timezone.localdate(order.issued_at))
+        self.assertEqual(billed.billed_total, Decimal("40.00"))
+        self.assertEqual(billed.balance_due_total, Decimal("15.00"))
+
+        # Reprogramar recalcula el día anterior y el nuevo
+        with self.captureOnCommitCallbacks(execute=True):
+            moved.appointment_date = other_day
+            moved.save()
+        self.assertEqual(self.rollup(day).appointments_total, 1)
+        self.assertEqual(self.rollup(other_day).appointments_pending, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            moved.delete()
+        self.assertFalse(self.rollups(other_day).exists())
+
+    def test_rollback_discards_pending_days(self):
+        with self.assertRaises(RuntimeError):
+            with self.captureOnCommitCallbacks(execute=True):
+                with transaction.atomic():
+                    self.appointment(date(2025, 4, 1))
+                    raise RuntimeError()
+        self.assertFalse(DailyInstitutionRollup.objects.exists())
+
+    def test_rebuild_matches_incremental_rows(self):
+        days = [date(2025, 5, d) for d in (1, 1, 2, 5)]
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                for i, day in enumerate(days):
+                    self.appointment(day, status="completed" if i % 2 else "canceled")
+        fields = [
+            "date",
+            "appointments_total",
+            "appointments_completed",
+            "appointments_canceled",
+        ]
+        incremental = list(DailyInstitutionRollup.objects.values(*fields))
+
+        DailyInstitutionRollup.objects.all().delete()
+        call_command("rebuild_daily_rollups", stdout=io.StringIO())
+        self.assertEqual(
+            list(DailyInstitutionRollup.objects.values(*fields)), incremental
+        )
+        self.assertEqual(len(incremental), 3)
+
+    def test_saves_that_do_not_touch_tracked_fields_skip_refresh(self):
+        appointment = self.appointment(date(2025, 3, 20))
+        with mock.patch.object(DailyRollup, "refresh") as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                appointment.notes = "control"
+                appointment.save(update_fields=["notes"])
+                appointment.save()
+        refresh.assert_not_called()
+
+        # Instancia diferida: el día sale del valor anterior leído en pre_save
+        deferred = Appointment.objects.only("id", "status").get(pk=appointment.pk)
+        deferred.status = "completed"
+        with mock.patch.object(DailyRollup, "refresh") as refresh:
+            with self.captureOnCommitCallbacks(execute=True):
+                deferred.save()
+        keys, models = refresh.call_args.args
+        self.assertIn((self.institution.id, date(2025, 3, 20)), keys)
+        self.assertIn(Appointment, models)
+
+    def test_backfill_migration_uses_historical_models(self):
+        from django.apps import apps
+        from importlib import import_module
+
+        migration = import_module("core.migrations.0026_backfill_daily_rollups")
+        self.appointment(date(2025, 3, 25), status="completed")
+        DailyInstitutionRollup.objects.all().delete()
+
+        migration.backfill_daily_rollups(apps, None)
+        row = self.rollup(date(2025, 3, 25))
+        self.assertEqual(row.appointments_completed, 1)
+
+    def test_dashboard_summary_reads_rollups(self):
+        day = date(2025, 6, 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.appointment(day, status="completed")
+                self.appointment(day, status="in_consultation")
+
+        data = services.get_dashboard_summary_data(start_date=day, end_date=day)
+        self.assertEqual(data["total_appointments"], 2)
+        self.assertEqual(data["completed_appointments"], 1)
+        self.assertEqual(data["active_consultations"], 1)
+        self.assertEqual(
+            data["appointments_trend"], [{"date": "2025-06-02", "value": 1}]
+        )
+
+        data = services.get_dashboard_summary_data(
+            start_date=day, end_date=day, status_param="completed"
+        )
+        self.assertEqual(data["total_appointments"], 1)
+        self.assertEqual(data["active_consultations"], 0)
+        self.assertEqual(
+            DailyRollup.totals("appointments_total")["appointments_total"], 2
+        )
+
+
+class DashboardEngineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create_user("dash-doctor", password="x")
+        cls.doctor = DoctorOperator.objects.create(user=user, full_name="Dr. Dash")
+        cls.main, cls.branch = (
+            InstitutionSettings.objects.create(
+                name=name, tax_id=tax_id, phone="0212", logo="logos/d.png"
+            )
+            for name, tax_id in (
+                ("Sede Centro", "J-55555555-5"),
+                ("Sede Este", "J-66666666-6"),
+            )
+        )
+        cls.patient = Patient.objects.create(first_name="Ana", last_name="Ríos")
+        cls.day = date(2025, 7, 1)
+
+    def setUp(self):
+        cache.clear()
+
+    def book(self, institution, status="completed"):
+        with self.captureOnCommitCallbacks(execute=True):
+            Appointment.objects.create(
+                patient=self.patient,
+                institution=institution,
+                doctor=self.doctor,
+                appointment_date=self.day,
+                status=status,
+            )
+
+    def summary(self, institution=None):
+        return DashboardEngine.summary(
+            institution_id=institution.pk if institution else None,
+            start_date=self.day,
+            end_date=self.day,
+        )
+
+    def test_counters_are_scoped_to_institution(self):
+        self.book(self.main)
+        self.book(self.main, status="pending")
+        self.book(self.branch)
+
+        main = self.summary(self.main)
+        self.assertEqual(main["total_appointments"], 2)
+        self.assertEqual(main["completed_appointments"], 1)
+        self.assertEqual(main["pending_appointments"], 1)
+        self.assertEqual(main["total_patients"], 1)
+        self.assertEqual(self.summary(self.branch)["total_appointments"], 1)
+        self.assertEqual(self.summary()["total_appointments"], 3)
+
+    def test_cached_until_rollups_change(self):
+        self.book(self.main)
+        with self.assertNumQueries(4):
+            self.summary(self.main)
+        with self.assertNumQueries(0):
+            self.assertEqual(self.summary(self.main)["total_appointments"], 1)
+
+        self.book(self.main)
+        self.assertEqual(self.summary(self.main)["total_appointments"], 2)
+
+    def test_api_is_scoped_to_current_institution(self):
+        self.book(self.main)
+        self.book(self.main)
+        self.book(self.branch)
+        self.client.force_login(self.doctor.user)
+        url = reverse("dashboard-summary-api")
+        url += f"?start_date={self.day}&end_date={self.day}"
+        response = self.client.get(url, HTTP_X_INSTITUTION_ID=str(self.branch.pk))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["total_appointments"], 1)
+        self.assertEqual(
+            self.client.get(url, HTTP_X_INSTITUTION_ID="x").status_code, 400
+        )
+
+        # Sin header ni institución activa no hay totales globales
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+        # Sin header: institución activa del doctor
+        user = get_user_model().objects.create_user("dash-active", password="x")
+        DoctorOperator.objects.create(
+            user=user, full_name="Dr. Activa", active_institution=self.main
+        )
+        self.client.force_login(user)
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()["total_appointments"], 2)
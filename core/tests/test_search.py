@@ -0,0 +1,192 @@
+from datetime import date
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.test import SimpleTestCase, TestCase
+
+from core.models import (
+    Appointment,
+    ChargeOrder,
+    DoctorOperator,
+    InstitutionSettings,
+    Patient,
+)
+from core.search import GlobalSearchEngine, PatientSearchIndex
+from core.search import query_parser
+from core.search.query_parser import parse_search_query
+
+
+class SearchQueryParserTests(SimpleTestCase):
+    def test_cedula_with_prefix_and_dots(self):
+        for raw in ["V-12.345.678", "v12345678", "E 12345678", "12.345.678"]:
+            parsed = parse_search_query(raw)
+            self.assertEqual(parsed.kind, query_parser.CEDULA, raw)
+            self.assertEqual(parsed.national_id, "12345678")
+            self.assertIsNone(parsed.number)
+
+    def test_plain_long_number_is_cedula_and_number(self):
+        parsed = parse_search_query("12345678")
+        self.assertEqual(parsed.kind, query_parser.CEDULA)
+        self.assertEqual(parsed.national_id, "12345678")
+        self.assertEqual(parsed.number, 12345678)
+
+    def test_order_or_appointment_number(self):
+        for raw, number in [("#42", 42), ("# 1234", 1234)]:
+            parsed = parse_search_query(raw)
+            self.assertEqual(parsed.kind, query_parser.NUMBER, raw)
+            self.assertEqual(parsed.number, number)
+            self.assertIsNone(parsed.national_id)
+
+    def test_short_number_is_also_cedula_prefix(self):
+        for raw, number in [("42", 42), ("9999", 9999)]:
+            parsed = parse_search_query(raw)
+            self.assertEqual(parsed.kind, query_parser.NUMBER, raw)
+            self.assertEqual(parsed.number, number)
+            self.assertEqual(parsed.national_id, raw)
+
+    def test_iso_and_dmy_dates(self):
+        for raw in ["2025-10-18", "18-10-2025", "18/10/2025"]:
+            parsed = parse_search_query(raw)
+            self.assertEqual(parsed.kind, query_parser.DATE, raw)
+            self.assertEqual(parsed.date, date(2025, 10, 18))
+
+    def test_invalid_date_is_not_a_date(self):
+        self.assertNotEqual(parse_search_query("2025-13-40").kind, query_parser.DATE)
+        self.assertNotEqual(parse_search_query("31-02-2025").kind, query_parser.DATE)
+
+    def test_date_range_covers_one_day(self):
+        start, end = parse_search_query("2025-10-18").datetime_range()
+        self.assertEqual((end - start).days, 1)
+        self.assertIsNotNone(start.tzinfo)
+
+    def test_email(self):
+        parsed = parse_search_query("ana@example.com")
+        self.assertEqual(parsed.kind, query_parser.EMAIL)
+
+    def test_free_text(self):
+        for raw in ["José Pérez", "gonz", "maria 12"]:
+            parsed = parse_search_query(raw)
+            self.assertEqual(parsed.kind, query_parser.TEXT, raw)
+            self.assertEqual(parsed.text, raw)
+
+    def test_empty(self):
+        self.assertTrue(parse_search_query("   ").is_empty)
+
+
+class GlobalSearchEngineTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = get_user_model().objects.create_user("doctor", password="x")
+        cls.institution = InstitutionSettings.objects.create(
+            name="Clínica Test", tax_id="J-00000000-0", phone="0212", logo="logos/x.png"
+        )
+        cls.doctor = DoctorOperator.objects.create(user=user, full_name="Dr. Test")
+        cls.jose = Patient.objects.create(
+            first_name="José", last_name="Pérez", national_id="12345678"
+        )
+        cls.ana = Patient.objects.create(
+            first_name="Ana", last_name="Gómez", national_id="87654321"
+        )
+        cls.appt_jose = Appointment.objects.create(
+            patient=cls.jose,
+            institution=cls.institution,
+            doctor=cls.doctor,
+            appointment_date=date(2025, 10, 18),
+        )
+        cls.appt_ana = Appointment.objects.create(
+            patient=cls.ana,
+            institution=cls.institution,
+            doctor=cls.doctor,
+            appointment_date=date(2025, 10, 20),
+        )
+        cls.order_ana = ChargeOrder.objects.create(
+            appointment=cls.appt_ana, patient=cls.ana, institution=cls.institution
+        )
+
+    def test_text_query_resolves_patients(self):
+        results = GlobalSearchEngine.search("jose perez")
+        self.assertEqual(results["patients"], [self.jose])
+        self.assertEqual(results["appointments"], [self.appt_jose])
+        self.assertEqual(results["orders"], [])
+
+    def test_cedula_query(self):
+        results = GlobalSearchEngine.search("V-87.654.321")
+        self.assertEqual(results["patients"], [self.ana])
+        self.assertEqual(results["orders"], [self.order_ana])
+
+    def test_short_number_matches_cedula_prefix(self):
+        results = GlobalSearchEngine.search("8765")
+        self.assertEqual(results["patients"], [self.ana])
+        self.assertIn(self.order_ana, results["orders"])
+
+    def test_number_query_uses_primary_keys(self):
+        results = GlobalSearchEngine.search(f"#{self.order_ana.pk}")
+        self.assertIn(self.order_ana, results["orders"])
+        self.assertEqual(results["patients"], [])
+
+        orders = GlobalSearchEngine.search_orders(str(self.appt_ana.pk))
+        self.assertIn(self.order_ana, orders)
+
+    def test_date_query(self):
+        appointments = GlobalSearchEngine.search_appointments("18-10-2025")
+        self.assertEqual(appointments, [self.appt_jose])
+
+    def test_inactive_patients_do_not_use_the_id_cap(self):
+        Patient.objects.create(
+            first_name="José", last_name="Pérez", national_id="12345670", active=False
+        )
+        with mock.patch.object(GlobalSearchEngine, "MAX_PATIENT_IDS", 1):
+            results = GlobalSearchEngine.search("V-1234567")
+        self.assertEqual(results["patients"], [self.jose])
+        self.assertEqual(results["appointments"], [self.appt_jose])
+
+    def test_patient_scope_is_enforced(self):
+        scope = [self.jose.pk]
+        self.assertEqual(
+            GlobalSearchEngine.search_appointments("20/10/2025", patient_scope=scope),
+            [],
+        )
+        self.assertEqual(
+            GlobalSearchEngine.search_orders("ana", patient_scope=scope), []
+        )
+
+
+class PatientSearchIndexTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.jose = Patient.objects.create(
+            first_name="José", last_name="Pérez", national_id="12345678"
+        )
+
+    def search(self, query):
+        return list(PatientSearchIndex.search(query))
+
+    def test_tokens_match_word_prefixes_only(self):
+        self.assertEqual(self.search("per jo"), [self.jose])
+        self.assertEqual(self.search("1234"), [self.jose])
+        # Mitad de palabra o de cédula: mismo resultado que FTS5
+        self.assertEqual(self.search("erez"), [])
+        self.assertEqual(self.search("5678"), [])
+
+    def test_punctuation_splits_words_like_fts5(self):
+        hyphenated = Patient.objects.create(
+            first_name="María", last_name="García-López", national_id="V-23456789"
+        )
+        self.assertEqual(hyphenated.search_document, " maria garcia lopez 23456789 ")
+        for query in ("lopez", "garcia-lopez", "garcía lóp", "23456789"):
+            with self.subTest(query):
+                self.assertEqual(self.search(query), [hyphenated])
+                # El fallback LIKE retorna lo mismo que el índice FTS5
+                tokens = PatientSearchIndex.tokenize(query)
+                like = PatientSearchIndex._search_document(
+                    Patient.objects.all(), tokens, "sqlite"
+                )
+                self.assertEqual(list(like), [hyphenated])
+
+    def test_rebuild_fixes_documents_written_without_save(self):
+        Patient.objects.filter(pk=self.jose.pk).update(last_name="Ramírez")
+        self.assertEqual(self.search("ramirez"), [])
+
+        self.assertEqual(PatientSearchIndex.rebuild(), 1)
+        self.assertEqual(self.search("ramirez"), [self.jose])
+        self.assertEqual(PatientSearchIndex.rebuild(), 0)
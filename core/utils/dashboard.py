@@ -0,0 +1,221 @@
+# core/utils/dashboard.py
+"""
+Motor del dashboard principal (dashboard_summary_api).
+
+- Alcance: institución de X-Institution-ID; sin ella, todas las sedes.
+- Cálculo: sobre los rollups diarios (core/utils/rollups.py), con UNA
+  consulta de agregación condicional para los contadores (histórico y
+  rango a la vez) y otra para las tendencias por día.
+- Cache por (institución, rango, moneda, estado) con TTL corto; se invalida
+  por versión cuando cambian los rollups de la institución, la tasa BCV o
+  el padrón de pacientes (receptores en core/signals.py).
+"""
+import calendar
+from datetime import date, timedelta
+from decimal import Decimal
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+from django.core.cache import cache
+from django.db.models import Q, Sum
+from django.utils.dateparse import parse_date
+from django.utils.timezone import localdate
+
+from core.models import Appointment, BCVRateCache, Patient
+from core.utils.rollups import METRIC_FIELDS, DailyRollup
+
+# Estados con contador propio en el payload
+STATUS_COUNTERS = {
+    "completed_appointments": "completed",
+    "pending_appointments": "pending",
+    "active_consultations": "in_consultation",
+}
+
+
+class DashboardEngine:
+    CACHE_PREFIX = "dashboard_summary"
+    CACHE_TIMEOUT = 60  # segundos; la invalidación por eventos es la vía principal
+    ALL_SCOPE = "all"
+    RATES_SCOPE = "rates"
+
+    # --- Cache ---
+    @classmethod
+    def _version_key(cls, scope) -> str:
+        return f"{cls.CACHE_PREFIX}:version:{scope}"
+
+    @classmethod
+    def cache_key(cls, institution_id, start, end, currency, status) -> str:
+        scope = institution_id or cls.ALL_SCOPE
+        versions = cache.get_many(
+            [cls._version_key(scope), cls._version_key(cls.RATES_SCOPE)]
+        )
+        return ":".join(
+            str(part)
+            for part in (
+                cls.CACHE_PREFIX,
+                scope,
+                start,
+                end,
+                currency,
+                status or "",
+                versions.get(cls._version_key(scope), 0),
+                versions.get(cls._version_key(cls.RATES_SCOPE), 0),
+            )
+        )
+
+    @classmethod
+    def _bump(cls, scopes: Iterable):
+        for scope in scopes:
+            key = cls._version_key(scope)
+            cache.set(key, cache.get(key, 0) + 1, None)
+
+    @classmethod
+    def invalidate(cls, institution_ids: Iterable[int] = ()):
+        """Invalida el dashboard de esas instituciones y el global."""
+        cls._bump([*set(institution_ids), cls.ALL_SCOPE])
+
+    @classmethod
+    def invalidate_rates(cls):
+        """La tasa BCV afecta a todos los montos convertidos."""
+        cls._bump([cls.RATES_SCOPE])
+
+    # --- Rango ---
+    @staticmethod
+    def resolve_range(start_date=None, end_date=None, range_param=None) -> Tuple[date, date]:
+        today = localdate()
+
+        def parse_d(d):
+            try:
+                return parse_date(str(d)) if d else None
+            except ValueError:
+                return None
+
+        if range_param == "day":
+            return today, today
+        if range_param == "week":
+            start = today - timedelta(days=today.weekday())
+            return start, start + timedelta(days=6)
+        if range_param == "month":
+            last_day = calendar.monthrange(today.year, today.month)[1]
+            return today.replace(day=1), today.replace(day=last_day)
+        return (
+            parse_d(start_date) or (today - timedelta(days=6)),
+            parse_d(end_date) or today,
+        )
+
+    # --- Lectura ---
+    @classmethod
+    def summary(
+        cls,
+        institution_id: Optional[int] = None,
+        start_date=None,
+        end_date=None,
+        range_param=None,
+        currency="USD",
+        status_param=None,
+    ) -> Dict[str, Any]:
+        start, end = cls.resolve_range(start_date, end_date, range_param)
+        key = cls.cache_key(institution_id, start, end, currency, status_param)
+        data = cache.get(key)
+        if data is None:
+            data = cls.compute(institution_id, start, end, currency, status_param)
+            cache.set(key, data, cls.CACHE_TIMEOUT)
+        return data
+
+    @classmethod
+    def compute(
+        cls,
+        institution_id: Optional[int],
+        start: date,
+        end: date,
+        currency="USD",
+        status_param=None,
+    ) -> Dict[str, Any]:
+        rollups = DailyRollup.queryset(institution_id=institution_id)
+        in_range = Q(date__range=(start, end))
+
+        # Contadores del rango: con filtro de estado solo cuenta ese estado
+        status_field = f"appointments_{status_param}" if status_param else None
+        if status_field and status_field not in METRIC_FIELDS:
+            status_field = None
+        range_fields = {"waiting_room_waiting": "waiting_room_waiting"}
+        if not status_param:
+            range_fields["total_appointments"] = "appointments_total"
+        elif status_field:
+            range_fields["total_appointments"] = status_field
+        for counter, status in STATUS_COUNTERS.items():
+            if not status_param or status == status_param:
+                range_fields[counter] = f"appointments_{status}"
+
+        # --- 1. Contadores: una sola agregación condicional ---
+        totals = rollups.aggregate(
+            billed_total=Sum("billed_total"),
+            balance_due_total=Sum("balance_due_total"),
+            collected_total=Sum("collected_total"),
+            **{
+                counter: Sum(field, filter=in_range)
+                for counter, field in range_fields.items()
+            },
+        )
+
+        # --- 2. Tendencias por día ---
+        trend = (
+            rollups.filter(in_range)
+            .values("date")
+            .annotate(
+                completed=Sum("appointments_completed"),
+                collected=Sum("collected_total"),
+            )
+            .order_by("date")
+        )
+        appointments_trend, payments_trend = [], []
+        for row in trend:
+            if row["completed"]:
+                appointments_trend.append(
+                    {"date": str(row["date"]), "value": int(row["completed"])}
+                )
+            if row["collected"]:
+                payments_trend.append(
+                    {"date": str(row["date"]), "value": float(row["collected"])}
+                )
+
+        # --- 3. Pacientes (atendidos en la sede, o padrón global) ---
+        if institution_id:
+            total_patients = (
+                Appointment.objects.filter(institution_id=institution_id)
+                .values("patient_id")
+                .distinct()
+                .count()
+            )
+        else:
+            total_patients = Patient.objects.count()
+
+        # --- 4. Tasa BCV ---
+        latest_rate = BCVRateCache.objects.order_by("-created_at").first()
+        rate_val = float(latest_rate.value) if latest_rate else 1.0
+
+        def convert(amount):
+            return float(amount) * rate_val if currency == "VES" else float(amount)
+
+        def count(name):
+            return int(totals.get(name) or 0)
+
+        billed = totals["billed_total"] or Decimal("0")
+        balance_due = totals["balance_due_total"] or Decimal("0")
+        return {
+            "institution_id": institution_id,
+            "total_patients": total_patients,
+            "total_appointments": count("total_appointments"),
+            "completed_appointments": count("completed_appointments"),
+            "pending_appointments": count("pending_appointments"),
+            "active_consultations": count("active_consultations"),
+            "waiting_room_count": count("waiting_room_waiting"),
+            "total_payments_amount": convert(totals["collected_total"] or Decimal("0")),
+            "financial_balance": convert(max(billed - balance_due, Decimal("0"))),
+            "appointments_trend": appointments_trend,
+            "payments_trend": payments_trend,
+            "bcv_rate": {
+                "value": rate_val,
+                "unit": "VES_per_USD",
+                "is_fallback": latest_rate is None,
+            },
+        }
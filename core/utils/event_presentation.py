@@ -0,0 +1,245 @@
+# core/utils/event_presentation.py
+"""
+Presentación de eventos de auditoría (título, descripción, categoría,
+etiqueta/enlace de acción y badge) basada en tablas.
+
+Cada (entity, action) se resuelve UNA vez a una regla precompilada
+(plantillas + función de descripción) que se cachea; por fila solo se
+formatean las plantillas. EventSerializer y render_events() comparten esta
+lógica, así la salida es idéntica en ambos caminos.
+"""
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+from django.conf import settings
+from django.utils import timezone
+from rest_framework import ISO_8601
+from rest_framework.settings import api_settings
+
+# --- Títulos por (entity, action); placeholders: {id} ---
+TITLES: Dict[Tuple[str, str], str] = {
+    # ChargeOrder
+    ("ChargeOrder", "void"): "Orden #{id} anulada",
+    ("ChargeOrder", "void_by_appointment_cancel"): "Orden #{id} anulada por cancelación",
+    ("ChargeOrder", "waive"): "Orden #{id} exonerada",
+    ("ChargeOrder", "create"): "Orden #{id} creada",
+    # Payment
+    ("Payment", "create"): "Pago confirmado",
+    ("Payment", "confirm"): "Pago verificado",
+    ("Payment", "reverse"): "Pago #{id} reversado",
+    # Appointment
+    ("Appointment", "create"): "Cita #{id} creada",
+    ("Appointment", "update"): "Cita actualizada",
+    ("Appointment", "cancel"): "Cita #{id} cancelada",
+    ("Appointment", "canceled"): "Cita #{id} cancelada",
+    ("Appointment", "completed"): "Cita #{id} completada",
+    ("Appointment", "arrived"): "Paciente llegó a cita #{id}",
+    # Sala de espera
+    ("WaitingRoom", "delete"): "Paciente retirado de sala de espera",
+    ("WaitingRoomEntry", "patient_arrived"): "Paciente llegó a la sala de espera",
+    ("WaitingRoomEntry", "create"): "Paciente agregado a sala de espera",
+    # Patient
+    ("Patient", "create"): "Paciente registrado",
+    ("Patient", "update"): "Datos del paciente actualizados",
+}
+
+ACTION_LABELS: Dict[str, str] = {
+    "Payment": "Ver pago",
+    "ChargeOrder": "Ver orden",
+    "Appointment": "Ver cita",
+    "WaitingRoomEntry": "Ver sala de espera",
+    "WaitingRoom": "Ver sala de espera",
+    "Patient": "Ver paciente",
+}
+DEFAULT_ACTION_LABEL = "Ver detalle"
+
+ACTION_HREFS: Dict[str, str] = {
+    "Payment": "/payments/{id}",
+    "ChargeOrder": "/payments/{id}",
+    "Appointment": "/appointments?view={id}",
+    "Patient": "/patients/{id}",
+    "WaitingRoom": "/waitingroom",
+    "WaitingRoomEntry": "/waitingroom",
+}
+
+# Normalización para NotificationBadge
+BADGE_ACTIONS: Dict[str, str] = {
+    "create": "create",
+    "update": "update",
+    "delete": "delete",
+    "void": "delete",
+    "waive": "delete",
+    "cancel": "delete",
+    "canceled": "delete",
+    "confirm": "create",
+    "completed": "create",
+    "patient_arrived": "create",
+}
+
+
+# --- Descripciones (dependen de metadata) ---
+def _describe_generic(entity_id, metadata) -> str:
+    if metadata:
+        if "message" in metadata:
+            return metadata.get("message", "")
+        keys = list(metadata.keys())[:2]
+        return " | ".join(f"{k}: {metadata[k]}" for k in keys)
+    return ""
+
+
+def _describe_charge_order_reason(entity_id, metadata) -> str:
+    reason = ""
+    actor = ""
+    if metadata:
+        reason = metadata.get("reason", "Anulación manual")
+        actor = metadata.get("actor", "Sistema")
+    if reason and actor:
+        return f"Razón: {reason} | Por: {actor}"
+    elif reason:
+        return f"Razón: {reason}"
+    return f"Orden #{entity_id} procesada"
+
+
+def _describe_charge_order(entity_id, metadata) -> str:
+    return f"Orden #{entity_id}"
+
+
+def _describe_payment(entity_id, metadata) -> str:
+    amount = metadata.get("amount", "") if metadata else ""
+    return f"Monto: ${amount}" if amount else f"Pago #{entity_id} registrado"
+
+
+def _describe_appointment(entity_id, metadata) -> str:
+    if metadata:
+        patient_id = metadata.get("patient_id", "")
+        doctor_id = metadata.get("doctor_id", "")
+        return f"ID Paciente: {patient_id} | ID Médico: {doctor_id}"
+    return f"Cita #{entity_id}"
+
+
+def _describe_patient_arrived(entity_id, metadata) -> str:
+    pid = metadata.get("patient_id") if metadata else None
+    aid = metadata.get("appointment_id") if metadata else None
+    return f"Paciente #{pid} con cita #{aid}"
+
+
+def _describe_patient_created(entity_id, metadata) -> str:
+    if metadata:
+        full_name = metadata.get("full_name", "")
+        return f"Nombre: {full_name}" if full_name else "Nuevo paciente registrado"
+    return "Nuevo paciente"
+
+
+Describer = Callable[[Any, Optional[dict]], str]
+
+# (entity, action) tiene prioridad sobre (entity, None)
+DESCRIPTIONS: Dict[Tuple[str, Optional[str]], Describer] = {
+    ("ChargeOrder", "void"): _describe_charge_order_reason,
+    ("ChargeOrder", "void_by_appointment_cancel"): _describe_charge_order_reason,
+    ("ChargeOrder", "waive"): _describe_charge_order_reason,
+    ("ChargeOrder", None): _describe_charge_order,
+    ("Payment", None): _describe_payment,
+    ("Appointment", None): _describe_appointment,
+    ("WaitingRoomEntry", "patient_arrived"): _describe_patient_arrived,
+    ("Patient", "create"): _describe_patient_created,
+}
+
+
+class EventRule:
+    """Regla precompilada para un (entity, action)."""
+
+    __slots__ = ("title", "describe", "category", "action_label", "action_href", "badge_action")
+
+    def __init__(self, entity: str, action: str):
+        self.title = TITLES.get((entity, action)) or f"{entity} {action}".replace(
+            "{", "{{"
+        ).replace("}", "}}")
+        self.describe = (
+            DESCRIPTIONS.get((entity, action))
+            or DESCRIPTIONS.get((entity, None))
+            or _describe_generic
+        )
+        self.category = f"{entity.lower()}.{action.lower()}"
+        self.action_label = ACTION_LABELS.get(entity, DEFAULT_ACTION_LABEL)
+        self.action_href = ACTION_HREFS.get(entity)
+        self.badge_action = BADGE_ACTIONS.get(action, "other")
+
+
+_RULES: Dict[Tuple[str, str], EventRule] = {}
+
+
+def get_rule(entity: str, action: str) -> EventRule:
+    rule = _RULES.get((entity, action))
+    if rule is None:
+        rule = _RULES[(entity, action)] = EventRule(entity, action)
+    return rule
+
+
+def present(entity: str, action: str, entity_id, metadata) -> Dict[str, Any]:
+    """Campos enriquecidos de un evento (una resolución de regla por fila)."""
+    rule = get_rule(entity, action)
+    return {
+        "title": rule.title.format(id=entity_id),
+        "description": rule.describe(entity_id, metadata),
+        "category": rule.category,
+        "action_label": rule.action_label,
+        "action_href": (
+            rule.action_href.format(id=entity_id) if rule.action_href else None
+        ),
+        "badge_action": rule.badge_action,
+    }
+
+
+def timestamp_formatter() -> Callable[[Any], Optional[str]]:
+    """
+    Equivalente a serializers.DateTimeField().to_representation, pero con
+    la zona horaria y el formato resueltos una sola vez por lista.
+    """
+    output_format = api_settings.DATETIME_FORMAT
+    tz = timezone.get_current_timezone() if settings.USE_TZ else None
+
+    def format_timestamp(value):
+        if not value:
+            return None
+        if output_format is None or isinstance(value, str):
+            return value
+        if tz is not None and timezone.is_aware(value):
+            value = value.astimezone(tz)
+        if output_format.lower() == ISO_8601:
+            value = value.isoformat()
+            if value.endswith("+00:00"):
+                value = value[:-6] + "Z"
+            return value
+        return value.strftime(output_format)
+
+    return format_timestamp
+
+
+def render_event(event, format_timestamp=None) -> Dict[str, Any]:
+    """Representación de un Event, idéntica a EventSerializer."""
+    if format_timestamp is None:
+        format_timestamp = timestamp_formatter()
+    actor_user = event.actor_user if event.actor_user_id else None
+    data = {
+        "id": event.id,
+        "timestamp": format_timestamp(event.timestamp),
+        "actor": str(actor_user) if actor_user else (event.actor_name or "System"),
+        "entity": event.entity,
+        "entity_id": event.entity_id,
+        "action": event.action,
+        "metadata": event.metadata,
+        "severity": event.severity,
+        "notify": event.notify,
+    }
+    data.update(present(event.entity, event.action, event.entity_id, event.metadata))
+    return data
+
+
+def render_events(events: Iterable) -> List[Dict[str, Any]]:
+    """
+    Camino rápido para listas de solo lectura: sin maquinaria de campos de
+    DRF. Si recibe un queryset, carga actor_user con select_related.
+    """
+    if hasattr(events, "select_related"):
+        events = events.select_related("actor_user")
+    format_timestamp = timestamp_formatter()
+    return [render_event(event, format_timestamp) for event in events]
@@ -1,15 +1,114 @@
+"""
+Bus de eventos de auditoría.
+
+log_event() escribe el evento en el momento, en la transacción en curso:
+si la transacción (o el savepoint) se revierte, el evento se revierte con
+ella; en autocommit queda confirmado al retornar. La hora del evento
+(`timestamp`) se fija al llamar a log_event(), no al escribir.
+
+Para cargas masivas (importaciones, comandos), EventBus.batch() abre un
+bloque atómico y acumula los eventos del bloque para escribirlos con
+bulk_create al salir (o cada MAX_BATCH_EVENTS). Si el bloque falla, los
+eventos se descartan junto con sus datos.
+
+Con EVENT_BUS_ENABLED = False, log_event() usa Event.objects.create (sin
+bulk_create; útil para comparar en benchmarks).
+"""
+import logging
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, List
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, transaction
+from django.utils import timezone
+
 from core.models import Event
+from core.utils.notifications import NotificationInbox
+
+logger = logging.getLogger(__name__)
+
+
+def write_events(events: List[Dict[str, Any]], using: str = DEFAULT_DB_ALIAS) -> int:
+    """Escribe un lote de eventos con bulk_create. Retorna la cantidad escrita."""
+    objs = Event.assign_patient_ids([Event(**event) for event in events])
+    Event.objects.using(using).bulk_create(objs, batch_size=EventBus.BULK_BATCH_SIZE)
+    NotificationInbox.deliver(objs)
+    return len(objs)
+
+
+class EventBus:
+    # Eventos máximos retenidos por EventBus.batch(); al superarlo se
+    # escriben dentro del mismo bloque atómico
+    MAX_BATCH_EVENTS = 2000
+    BULK_BATCH_SIZE = 500
+
+    _local = threading.local()
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return getattr(settings, "EVENT_BUS_ENABLED", True)
+
+    @classmethod
+    def publish(cls, event: Dict[str, Any], using: str = DEFAULT_DB_ALIAS):
+        if not cls.enabled():
+            Event.objects.using(using).create(**event)
+            return
+
+        batch = getattr(cls._local, "batch", None)
+        if batch is None or batch["using"] != using:
+            write_events([event], using)
+            return
+
+        batch["events"].append(event)
+        if len(batch["events"]) >= cls.MAX_BATCH_EVENTS:
+            cls._flush(batch)
+
+    @classmethod
+    @contextmanager
+    def batch(cls, using: str = DEFAULT_DB_ALIAS):
+        """
+        Bloque atómico cuyos eventos se escriben en lote al salir.
+        Anidado, reutiliza el lote exterior.
+
+        Un savepoint interno que se revierte y cuyo error se captura dentro
+        del bloque no descarta sus eventos ya acumulados: usar solo donde los
+        errores se propagan (importaciones, comandos).
+        """
+        if getattr(cls._local, "batch", None) is not None:
+            with transaction.atomic(using=using):
+                yield
+            return
+
+        batch = {"using": using, "events": []}
+        cls._local.batch = batch
+        try:
+            with transaction.atomic(using=using):
+                yield
+                cls._flush(batch)
+        finally:
+            cls._local.batch = None
+
+    @staticmethod
+    def _flush(batch: Dict[str, Any]):
+        events, batch["events"] = batch["events"], []
+        if events:
+            write_events(events, batch["using"])
+
+
 def log_event(
-    entity: str, 
-    entity_id: int, 
-    action: str, 
-    actor: str = "", 
+    entity: str,
+    entity_id: int,
+    action: str,
+    actor: str = "",
     metadata: dict | None = None,
-    notify: bool = False
+    notify: bool = False,
+    patient_id: int | None = None,
+    institution_id: int | None = None,
 ):
     """
-    Registra un evento de auditoría en la base de datos.
-    
+    Registra un evento de auditoría (ver EventBus).
+
     Args:
         entity (str): Nombre de la entidad (ej. "Patient", "Appointment", "Payment").
         entity_id (int): ID del objeto relacionado.
@@ -17,12 +116,22 @@ def log_event(
         actor (str): Usuario o sistema que ejecuta la acción.
         metadata (dict): Información adicional opcional.
         notify (bool): Si True, el evento se muestra como notificación.
+        patient_id (int): Paciente relacionado; si se omite se resuelve al
+            escribir (Event.assign_patient_ids).
+        institution_id (int): Institución del evento. Define quién recibe la
+            notificación (ver NotificationInbox); sin ella se notifica a los
+            médicos del paciente.
     """
-    Event.objects.create(
-        entity=entity,
-        entity_id=entity_id,
-        action=action,
-        actor_name=actor,
-        metadata=metadata or {},
-        notify=notify
-    )
\ No newline at end of file
+    EventBus.publish(
+        {
+            "entity": entity,
+            "entity_id": entity_id,
+            "action": action,
+            "actor_name": actor,
+            "metadata": metadata or {},
+            "notify": notify,
+            "patient_id": patient_id,
+            "institution_id": institution_id,
+            "timestamp": timezone.now(),
+        }
+    )
@@ -0,0 +1,269 @@
+# core/utils/institutional_report.py
+"""
+Exportación institucional (export_institutional_report) en PDF o Excel.
+
+- Encabezado: datos de la institución y del médico operador en cache
+  (ReportHeader), invalidado desde core/signals.py al cambiar
+  InstitutionSettings, DoctorOperator o sus especialidades.
+- Montos: conversión de moneda en una sola pasada con la tasa y el
+  contexto Decimal resueltos una vez (las filas llegan serializadas desde
+  el cliente, no hay consulta sobre la que convertir en la base).
+- PDF: la tabla se parte en bloques fijos de LongTable con el encabezado
+  repetido y anchos de columna calculados una vez; un único Table con
+  todas las filas hacía que ReportLab recalculara el resto de la tabla en
+  cada salto de página.
+- Excel: openpyxl en modo write_only.
+"""
+import io
+from decimal import ROUND_HALF_UP, Decimal, localcontext
+from typing import Any, Dict, Iterable, Iterator, List, Tuple
+
+from django.core.cache import cache
+from django.utils import timezone
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import letter
+from reportlab.lib.styles import getSampleStyleSheet
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.platypus import (
+    LongTable,
+    Paragraph,
+    SimpleDocTemplate,
+    Spacer,
+    TableStyle,
+)
+
+from core.models import DoctorOperator, InstitutionSettings
+from core.utils.report_export import XLSX_CONTENT_TYPE
+
+COLUMNS = ["ID", "Fecha", "Tipo", "Entidad", "Estado", "Monto", "Moneda"]
+CENTS = Decimal("0.01")
+CELL_FONT_SIZE = 10  # tamaño por defecto de las celdas de Table
+CELL_PADDING = 12  # LEFTPADDING + RIGHTPADDING por defecto
+
+TABLE_STYLE = TableStyle(
+    [
+        ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#003366")),
+        ("TEXTCOLOR", (0, 0), (-1, 0), colors.white),
+        ("GRID", (0, 0), (-1, -1), 0.5, colors.grey),
+        ("FONTNAME", (0, 0), (-1, 0), "Helvetica-Bold"),
+    ]
+)
+
+
+class ReportHeader:
+    """Contexto de encabezado (institución + médico operador) cacheado."""
+
+    CACHE_KEY = "institutional_report:header"
+    CACHE_TIMEOUT = 60 * 60
+
+    @classmethod
+    def get(cls) -> Dict[str, Any]:
+        header = cache.get(cls.CACHE_KEY)
+        if header is None:
+            header = cls.build()
+            cache.set(cls.CACHE_KEY, header, cls.CACHE_TIMEOUT)
+        return header
+
+    @classmethod
+    def invalidate(cls):
+        cache.delete(cls.CACHE_KEY)
+
+    @staticmethod
+    def build() -> Dict[str, Any]:
+        inst = InstitutionSettings.objects.first()
+        doc_op = DoctorOperator.objects.first()
+
+        specialty_str = ""
+        if doc_op:
+            try:
+                specialty_str = ", ".join(str(s) for s in doc_op.specialties.all())
+            except Exception:
+                specialty_str = "No especificadas"
+
+        return {
+            "institution": (
+                {
+                    "name": inst.name or "",
+                    "address": inst.address or "",
+                    "phone": inst.phone or "",
+                    "tax_id": inst.tax_id or "",
+                }
+                if inst
+                else None
+            ),
+            "doctor": (
+                {
+                    "full_name": doc_op.full_name or "",
+                    "agregado_id": doc_op.agregado_id or "",
+                    "specialties": specialty_str,
+                }
+                if doc_op
+                else None
+            ),
+        }
+
+
+def convert_amounts(rows: Iterable[Dict[str, Any]], rate) -> List[Decimal]:
+    """Convierte y redondea a céntimos todos los montos en una pasada."""
+    rate = Decimal(str(rate))
+    zero = Decimal("0")
+    with localcontext() as ctx:
+        ctx.rounding = ROUND_HALF_UP
+        quantize = Decimal.quantize
+        return [
+            quantize(Decimal(str(r.get("amount") or zero)) * rate, CENTS)
+            for r in rows
+        ]
+
+
+class InstitutionalReport:
+    CHUNK_ROWS = 250  # filas por bloque de LongTable
+    FORMATS = ("pdf", "excel")
+
+    def __init__(
+        self,
+        data_serialized: List[Dict[str, Any]],
+        filters: Any = None,
+        target_currency: str = "USD",
+        user_name: str = "",
+    ):
+        self.data = data_serialized
+        self.filters = filters
+        self.currency = target_currency
+        self.user_name = user_name
+        self.rate = Decimal("1.0")
+        if target_currency == "VES":
+            from core.services import get_bcv_rate
+
+            self.rate = get_bcv_rate()
+
+    def rows(self) -> Iterator[list]:
+        """Filas de la tabla; el monto queda como Decimal ya convertido."""
+        amounts = convert_amounts(self.data, self.rate)
+        for r, amount in zip(self.data, amounts):
+            raw_date = r.get("date")
+            yield [
+                str(r.get("id") or ""),
+                str(raw_date)[:10] if raw_date else "",
+                str(r.get("type") or ""),
+                str(r.get("entity") or ""),
+                str(r.get("status") or ""),
+                amount,
+                self.currency,
+            ]
+
+    def export(self, export_format: str) -> Tuple[io.BytesIO, str, str]:
+        buffer = io.BytesIO()
+        if export_format == "pdf":
+            self.write_pdf(buffer)
+            result = (buffer, "application/pdf", "reporte.pdf")
+        elif export_format == "excel":
+            self.write_xlsx(buffer)
+            result = (buffer, XLSX_CONTENT_TYPE, "reporte.xlsx")
+        else:
+            raise ValueError(f"Formato de exportación no soportado: {export_format}")
+        buffer.seek(0)
+        return result
+
+    # --- PDF ---
+    def table_chunks(self) -> List[LongTable]:
+        rows = []
+        for row in self.rows():
+            row[5] = f"{row[5]:.2f}"
+            rows.append(row)
+        # Anchos comunes a todos los bloques (alineados entre sí y sin que
+        # cada bloque vuelva a medir todas sus celdas)
+        col_widths = self._col_widths(rows)
+        return [
+            self._table(rows[i : i + self.CHUNK_ROWS], col_widths)
+            for i in range(0, max(len(rows), 1), self.CHUNK_ROWS)
+        ]
+
+    @staticmethod
+    def _col_widths(rows: List[list]) -> List[float]:
+        widths = []
+        for i, title in enumerate(COLUMNS):
+            longest = max((row[i] for row in rows), key=len, default="")
+            widths.append(
+                max(
+                    stringWidth(title, "Helvetica-Bold", CELL_FONT_SIZE),
+                    stringWidth(longest, "Helvetica", CELL_FONT_SIZE),
+                )
+                + CELL_PADDING
+            )
+        return widths
+
+    @staticmethod
+    def _table(rows: List[list], col_widths: List[float]) -> LongTable:
+        table = LongTable(
+            [COLUMNS, *rows], colWidths=col_widths, hAlign="LEFT", repeatRows=1
+        )
+        table.setStyle(TABLE_STYLE)
+        return table
+
+    def write_pdf(self, fileobj):
+        header = ReportHeader.get()
+        styles = getSampleStyleSheet()
+        elements: List[Any] = []
+
+        inst = header["institution"]
+        if inst:
+            elements.append(Paragraph(f"<b>{inst['name']}</b>", styles["Title"]))
+            elements.append(
+                Paragraph(f"Dirección: {inst['address']}", styles["Normal"])
+            )
+            elements.append(
+                Paragraph(
+                    f"Tel: {inst['phone']} • RIF: {inst['tax_id']}", styles["Normal"]
+                )
+            )
+            elements.append(Spacer(1, 12))
+
+        doc_op = header["doctor"]
+        if doc_op:
+            elements.append(
+                Paragraph(
+                    f"Médico operador: {doc_op['full_name']} • "
+                    f"Colegiado: {doc_op['agregado_id']} • {doc_op['specialties']}",
+                    styles["Normal"],
+                )
+            )
+            elements.append(Spacer(1, 8))
+
+        elements.append(Paragraph("<b>Reporte Institucional</b>", styles["Heading2"]))
+        elements.append(Paragraph(f"Filtros: {str(self.filters)}", styles["Normal"]))
+        elements.append(
+            Paragraph(f"Tasa aplicada: {self.rate} Bs/USD", styles["Italic"])
+        )
+        elements.append(Spacer(1, 12))
+
+        elements.extend(self.table_chunks())
+
+        elements.append(Spacer(1, 24))
+        elements.append(Paragraph(f"Generado por: {self.user_name}", styles["Normal"]))
+        elements.append(
+            Paragraph(
+                f"Fecha: {timezone.now().strftime('%Y-%m-%d %H:%M')}", styles["Normal"]
+            )
+        )
+        SimpleDocTemplate(fileobj, pagesize=letter).build(elements)
+
+    # --- Excel ---
+    def write_xlsx(self, fileobj):
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Reporte")
+
+        inst = ReportHeader.get()["institution"]
+        if inst:
+            title = WriteOnlyCell(ws, value=str(inst["name"]))
+            title.font = Font(bold=True, size=14)
+            ws.append([title])
+
+        ws.append(COLUMNS)
+        for row in self.rows():
+            row[5] = float(row[5])
+            ws.append(row)
+        wb.save(fileobj)
@@ -0,0 +1,145 @@
+# core/utils/notifications.py
+"""
+Bandeja de notificaciones materializada.
+
+Los eventos con notify=True se entregan a la tabla Notification al
+escribirse (EventBus / Event.save), una fila por destinatario:
+- evento con institución: médicos que operan en esa institución
+- evento sin institución pero con paciente: médicos con relación activa
+  (DoctorPatientRelationship) con ese paciente
+- sin institución ni paciente: no se notifica a nadie (nunca a todos los
+  médicos del sistema: filtraría actividad entre instituciones)
+
+La lectura (bandeja, contador de no leídas) sale de índices por usuario
+en lugar de recalcularse desde el log de auditoría; el contador del badge
+se cachea y se invalida al entregar o marcar como leídas.
+"""
+import logging
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from django.core.cache import cache
+from django.utils import timezone
+
+from core.models import DoctorOperator, DoctorPatientRelationship, Event, Notification
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationInbox:
+    CACHE_PREFIX = "notification_unread"
+    CACHE_TIMEOUT = 300  # segundos
+    DEFAULT_LIMIT = 20
+    MAX_LIMIT = 100
+
+    @classmethod
+    def unread_cache_key(cls, user_id) -> str:
+        return f"{cls.CACHE_PREFIX}:{user_id}"
+
+    # --- Escritura ---
+    @classmethod
+    def deliver(cls, events: Iterable[Event]) -> int:
+        """Crea las notificaciones de los eventos notify=True. Retorna cuántas."""
+        events = [event for event in events if event.notify and event.pk]
+        if not events:
+            return 0
+
+        recipients = cls._recipients(events)
+        notifications = [
+            Notification(
+                user_id=user_id,
+                event_id=event.pk,
+                created_at=event.timestamp or timezone.now(),
+            )
+            for event in events
+            for user_id in cls._event_recipients(event, recipients)
+        ]
+        if not notifications:
+            return 0
+
+        Notification.objects.bulk_create(
+            notifications, batch_size=1000, ignore_conflicts=True
+        )
+        cache.delete_many(
+            [cls.unread_cache_key(user_id) for user_id in {n.user_id for n in notifications}]
+        )
+        return len(notifications)
+
+    @staticmethod
+    def _event_recipients(event: Event, recipients) -> Set[int]:
+        institutions, patients = recipients
+        if event.institution_id:
+            return institutions.get(event.institution_id, set())
+        if event.patient_id:
+            return patients.get(event.patient_id, set())
+        return set()
+
+    @classmethod
+    def _recipients(
+        cls, events: List[Event]
+    ) -> Tuple[Dict[int, Set[int]], Dict[int, Set[int]]]:
+        """
+        Usuarios destinatarios por institución y por paciente (solo para los
+        eventos sin institución). Una consulta por cada tipo.
+        """
+        by_institution: Dict[int, Set[int]] = {}
+        by_patient: Dict[int, Set[int]] = {}
+        institution_ids = {e.institution_id for e in events if e.institution_id}
+        patient_ids = {
+            e.patient_id for e in events if not e.institution_id and e.patient_id
+        }
+        if institution_ids:
+            memberships = DoctorOperator.institutions.through.objects.filter(
+                institutionsettings_id__in=institution_ids
+            ).values_list("institutionsettings_id", "doctoroperator__user_id")
+            for institution_id, user_id in memberships:
+                by_institution.setdefault(institution_id, set()).add(user_id)
+        if patient_ids:
+            relationships = DoctorPatientRelationship.objects.filter(
+                patient_id__in=patient_ids, status="active"
+            ).values_list("patient_id", "doctor__user_id")
+            for patient_id, user_id in relationships:
+                by_patient.setdefault(patient_id, set()).add(user_id)
+        return by_institution, by_patient
+
+    # --- Lectura ---
+    @classmethod
+    def page(
+        cls,
+        user,
+        cursor: Optional[int] = None,
+        limit: int = DEFAULT_LIMIT,
+        unread_only: bool = False,
+        since=None,
+    ) -> List[Notification]:
+        """
+        Página de la bandeja, más recientes primero. `cursor` es el id de la
+        última notificación de la página anterior (keyset sobre el índice).
+        """
+        qs = Notification.objects.filter(user=user)
+        if unread_only:
+            qs = qs.filter(is_read=False)
+        if since is not None:
+            qs = qs.filter(created_at__gte=since)
+        if cursor:
+            qs = qs.filter(id__lt=cursor)
+        limit = max(1, min(int(limit), cls.MAX_LIMIT))
+        return list(qs.select_related("event", "event__actor_user").order_by("-id")[:limit])
+
+    @classmethod
+    def unread_count(cls, user) -> int:
+        key = cls.unread_cache_key(user.pk)
+        count = cache.get(key)
+        if count is None:
+            count = Notification.objects.filter(user=user, is_read=False).count()
+            cache.set(key, count, cls.CACHE_TIMEOUT)
+        return count
+
+    @classmethod
+    def mark_read(cls, user, ids: Optional[Iterable[int]] = None) -> int:
+        """Marca como leídas las notificaciones indicadas (o todas)."""
+        qs = Notification.objects.filter(user=user, is_read=False)
+        if ids is not None:
+            qs = qs.filter(id__in=list(ids))
+        updated = qs.update(is_read=True, read_at=timezone.now())
+        cache.delete(cls.unread_cache_key(user.pk))
+        return updated
@@ -0,0 +1,231 @@
+# core/utils/order_totals.py
+"""
+Recalculo set-based de ChargeOrder.total / balance_due / status
+(manage.py recalc_orders).
+
+Las órdenes se recorren por keyset (id) en bloques. Por bloque:
+    1. valores guardados de las órdenes del bloque
+    2. suma de ítems por orden (una consulta agrupada)
+    3. suma de pagos confirmados por orden (una consulta agrupada)
+y solo las órdenes cuyo total, saldo o estado difieren se escriben, con
+un UPDATE ... FROM (VALUES ...) por lote (Postgres y SQLite >= 3.33;
+bulk_update arma un CASE por fila y campo que cuesta más que la consulta).
+La regla de saldo/estado es ChargeOrder.derive_balance, la misma de
+recalc_totals(); antes eran 3 consultas y un guardado por orden.
+
+La escritura directa no dispara señales: el mismo UPDATE fija updated_at,
+el historial (simple_history) se escribe por lote con bulk_history_create
+y los rollups diarios de los días afectados se recalculan al final
+(DailyRollup.refresh).
+"""
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+from django.db import connection, connections, transaction
+from django.db.models import Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+from core.models import ChargeItem, ChargeOrder, Payment
+from core.utils.rollups import DailyRollup
+
+logger = logging.getLogger(__name__)
+
+ZERO = Decimal("0.00")
+FIELDS = ["total", "balance_due", "status"]
+WRITE_BATCH = 1000  # filas por UPDATE (4 parámetros por fila)
+HISTORY_CHANGE_REASON = "recalc_orders"
+
+
+@dataclass
+class RecalcResult:
+    scanned: int = 0
+    changed: int = 0
+    # (pk, (total, saldo, estado) guardados, recalculados), hasta MAX_SAMPLES
+    samples: List[Tuple[int, tuple, tuple]] = field(default_factory=list)
+    rollup_keys: Set[Tuple[int, date]] = field(default_factory=set)
+
+    MAX_SAMPLES = 50
+
+    def add_change(self, pk: int, stored: tuple, computed: tuple):
+        self.changed += 1
+        if len(self.samples) < self.MAX_SAMPLES:
+            self.samples.append((pk, stored, computed))
+
+    def merge(self, other: "RecalcResult"):
+        self.scanned += other.scanned
+        self.changed += other.changed
+        self.samples += other.samples[: self.MAX_SAMPLES - len(self.samples)]
+        self.rollup_keys |= other.rollup_keys
+
+
+class OrderTotals:
+    DEFAULT_CHUNK_SIZE = 5000
+
+    def __init__(
+        self,
+        start: Optional[date] = None,
+        end: Optional[date] = None,
+        institution_ids: Optional[Iterable[int]] = None,
+        chunk_size: int = DEFAULT_CHUNK_SIZE,
+        dry_run: bool = False,
+    ):
+        self.filters = {}
+        if start:
+            self.filters["issued_at__gte"] = self._start_of(start)
+        if end:
+            self.filters["issued_at__lt"] = self._start_of(end + timedelta(days=1))
+        if institution_ids:
+            self.filters["institution_id__in"] = list(institution_ids)
+        self.chunk_size = max(1, chunk_size)
+        self.dry_run = dry_run
+
+    @staticmethod
+    def _start_of(day: date) -> datetime:
+        return timezone.make_aware(datetime.combine(day, time.min))
+
+    def orders(self):
+        return ChargeOrder.objects.filter(**self.filters)
+
+    def institution_ids(self) -> List[int]:
+        return list(
+            self.orders().order_by().values_list("institution_id", flat=True).distinct()
+        )
+
+    # --- Ejecución ---
+    def run(self, workers: int = 1) -> RecalcResult:
+        """Recalcula el alcance completo; con workers > 1, una sede por hilo."""
+        if workers > 1 and connection.vendor == "sqlite":
+            logger.warning("OrderTotals: SQLite no admite escrituras en paralelo")
+            workers = 1
+
+        result = RecalcResult()
+        if workers > 1:
+            with ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="recalc-orders"
+            ) as pool:
+                for partial in pool.map(self._run_in_thread, self.institution_ids()):
+                    result.merge(partial)
+        else:
+            result = self.recalc()
+
+        if result.rollup_keys:
+            DailyRollup.refresh(result.rollup_keys)
+        return result
+
+    def _run_in_thread(self, institution_id: int) -> RecalcResult:
+        try:
+            return self.recalc(institution_id)
+        finally:
+            # Conexiones propias del hilo del pool
+            connections.close_all()
+
+    def recalc(self, institution_id: Optional[int] = None) -> RecalcResult:
+        filters = dict(self.filters)
+        if institution_id is not None:
+            filters["institution_id"] = institution_id
+        result = RecalcResult()
+        last_id = 0
+        while True:
+            with transaction.atomic():
+                chunk = self._stored(filters, last_id)
+                if not chunk:
+                    return result
+                self._recalc_chunk(chunk, filters, result)
+            last_id = chunk[-1][0]
+
+    # --- Bloques ---
+    def _stored(self, filters: dict, last_id: int) -> List[tuple]:
+        qs = ChargeOrder.objects.filter(**filters, pk__gt=last_id).order_by("pk")
+        if not self.dry_run:
+            qs = qs.select_for_update()
+        return list(qs.values_list("pk", *FIELDS)[: self.chunk_size])
+
+    @staticmethod
+    def _sums(
+        model, order_field: str, amount_field: str, low, high, filters, **extra
+    ) -> Dict[int, Decimal]:
+        """Suma de amount_field por orden para las órdenes del bloque."""
+        scope = {f"{order_field}__{k}": v for k, v in filters.items()}
+        rows = (
+            model.objects.filter(
+                **{f"{order_field}_id__gte": low, f"{order_field}_id__lte": high},
+                **scope,
+                **extra,
+            )
+            .values_list(f"{order_field}_id")
+            .annotate(s=Sum(amount_field))
+            .order_by()
+        )
+        return {order_id: amount or ZERO for order_id, amount in rows}
+
+    def _recalc_chunk(self, chunk: List[tuple], filters: dict, result: RecalcResult):
+        low, high = chunk[0][0], chunk[-1][0]
+        items = self._sums(ChargeItem, "order", "subtotal", low, high, filters)
+        paid = self._sums(
+            Payment, "charge_order", "amount", low, high, filters, status="confirmed"
+        )
+
+        changed = []
+        for pk, total, balance_due, status in chunk:
+            new_total = items.get(pk, ZERO)
+            new_balance, new_status = ChargeOrder.derive_balance(
+                new_total, paid.get(pk, ZERO), status
+            )
+            stored = (total, balance_due, status)
+            computed = (new_total, new_balance, new_status)
+            if stored != computed:
+                result.add_change(pk, stored, computed)
+                changed.append((pk, *computed))
+
+        result.scanned += len(chunk)
+        if changed and not self.dry_run:
+            for i in range(0, len(changed), WRITE_BATCH):
+                batch = changed[i : i + WRITE_BATCH]
+                self._write(batch)
+                if DailyRollup.enabled():
+                    result.rollup_keys.update(self._rollup_keys(batch))
+
+    @staticmethod
+    def _rollup_keys(rows: List[tuple]):
+        """(institución, día de emisión) de las órdenes escritas."""
+        return (
+            ChargeOrder.objects.filter(
+                pk__in=[row[0] for row in rows], issued_at__isnull=False
+            )
+            .values_list("institution_id", TruncDate("issued_at"))
+            .order_by()
+            .distinct()
+        )
+
+    @staticmethod
+    def _write(rows: List[tuple]):
+        """
+        Escribe (pk, total, saldo, estado) de varias órdenes en un UPDATE y
+        registra su historial (un SELECT y un INSERT por lote).
+        """
+        now = timezone.now()
+        qn = connection.ops.quote_name
+        table = qn(ChargeOrder._meta.db_table)
+        values = ", ".join(["(%s, %s, %s, %s)"] * len(rows))
+        sql = (
+            f"UPDATE {table} SET {qn('total')} = v.column2, "
+            f"{qn('balance_due')} = v.column3, {qn('status')} = v.column4, "
+            f"{qn('updated_at')} = %s "
+            f"FROM (VALUES {values}) AS v WHERE {table}.{qn('id')} = v.column1"
+        )
+        params = [connection.ops.adapt_datetimefield_value(now)]
+        params += [value for row in rows for value in row]
+        with connection.cursor() as cursor:
+            cursor.execute(sql, params)
+
+        ChargeOrder.history.bulk_history_create(
+            list(ChargeOrder.objects.filter(pk__in=[row[0] for row in rows])),
+            update=True,
+            default_change_reason=HISTORY_CHANGE_REASON,
+            default_date=now,
+        )
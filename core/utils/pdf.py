@@ -1,10 +1,31 @@
 import io
+from decimal import Decimal
 from reportlab.pdfgen import canvas
 from reportlab.lib.pagesizes import A4
 from reportlab.lib.units import cm
+from django.db.models import Count, DecimalField, Sum, Value
+from django.db.models.functions import Coalesce
 from django.http import HttpResponse
 
+ZERO = Value(Decimal("0.00"), output_field=DecimalField(max_digits=12, decimal_places=2))
+
+
+def appointment_report_totals(queryset):
+    """Totales generales del reporte en una sola agregación."""
+    return queryset.with_financials().aggregate(
+        count=Count("pk"),
+        expected=Coalesce(Sum("expected_amount"), ZERO),
+        paid=Coalesce(Sum("paid_total"), ZERO),
+        balance=Coalesce(Sum("balance_total"), ZERO),
+    )
+
+
 def render_pdf_appointments(queryset, logo_path):
+    """
+    Reporte de citas en PDF. Los montos salen de
+    Appointment.objects.with_financials(): una consulta para los totales y
+    otra para las filas, sin importar cuántas citas haya.
+    """
     buffer = io.BytesIO()
     c = canvas.Canvas(buffer, pagesize=A4)
     width, height = A4
@@ -25,15 +46,13 @@ def render_pdf_appointments(queryset, logo_path):
     c.drawCentredString(width/2, height-2*cm, "Reporte de Citas")
 
     # 🔹 Totales
-    total_expected = sum([a.expected_amount for a in queryset])
-    total_paid = sum([a.total_paid() for a in queryset])
-    total_balance = sum([a.balance_due() for a in queryset])
+    totals = appointment_report_totals(queryset)
 
     c.setFont("Helvetica", 11)
-    c.drawString(2*cm, height-4*cm, f"Total citas: {queryset.count()}")
-    c.drawString(2*cm, height-4.7*cm, f"Monto esperado: {total_expected:.2f}")
-    c.drawString(2*cm, height-5.4*cm, f"Total pagado: {total_paid:.2f}")
-    c.drawString(2*cm, height-6.1*cm, f"Saldo pendiente: {total_balance:.2f}")
+    c.drawString(2*cm, height-4*cm, f"Total citas: {totals['count']}")
+    c.drawString(2*cm, height-4.7*cm, f"Monto esperado: {totals['expected']:.2f}")
+    c.drawString(2*cm, height-5.4*cm, f"Total pagado: {totals['paid']:.2f}")
+    c.drawString(2*cm, height-6.1*cm, f"Saldo pendiente: {totals['balance']:.2f}")
 
     # 🔹 Tabla de detalle (simplificada)
     y = height-7.5*cm
@@ -47,7 +66,8 @@ def render_pdf_appointments(queryset, logo_path):
 
     c.setFont("Helvetica", 8)
     y -= 0.5*cm
-    for appt in queryset:
+    rows = queryset.with_financials().select_related("patient")
+    for appt in rows.iterator(chunk_size=2000):
         if y < 3*cm:  # salto de página
             c.showPage()
             y = height-3*cm
@@ -56,7 +76,7 @@ def render_pdf_appointments(queryset, logo_path):
         c.drawString(8*cm, y, appt.appointment_date.strftime("%Y-%m-%d"))
         c.drawString(12*cm, y, appt.status)
         c.drawRightString(16.5*cm, y, f"{appt.expected_amount:.2f}")
-        c.drawRightString(18.5*cm, y, f"{appt.total_paid():.2f}")
+        c.drawRightString(18.5*cm, y, f"{appt.paid_total:.2f}")
         y -= 0.5*cm
 
     c.showPage()
@@ -0,0 +1,224 @@
+# core/utils/pdf_cache.py
+"""
+Cache en disco de PDFs renderizados, direccionada por contenido.
+
+La clave es un sha256 de:
+- la versión de la plantilla (digest de su fuente) y PDFCache.VERSION
+- el contexto normalizado, sin los campos de auditoría (código, QR y
+  fecha de generación, ver AUDIT_FIELDS)
+
+Si el contenido del documento no cambió, la reimpresión es una lectura de
+archivo y conserva el código de auditoría con el que se emitió; el render
+(y el código nuevo) solo ocurre cuando la clave cambia.
+
+Normalización: dicts, listas y QuerySets se recorren; una instancia de
+modelo aporta sus campos concretos y las relaciones ya cargadas (el
+contexto de los documentos se arma accediendo a ellas). Un valor que no
+se sabe normalizar usa repr(): en el peor caso, un fallo de cache.
+
+Almacenamiento: PDF_CACHE_DIR/<ab>/<clave>.pdf + <clave>.json (nombre y
+código de auditoría). LRU por mtime: cada acierto toca el archivo y cada
+escritura desaloja los menos usados hasta bajar de PDF_CACHE_MAX_BYTES.
+PDF_CACHE_MAX_BYTES = 0 desactiva la cache.
+"""
+import hashlib
+import json
+import logging
+import os
+import tempfile
+from datetime import date, datetime, time
+from decimal import Decimal
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Tuple
+from uuid import UUID
+
+from django.conf import settings
+from django.db.models import Model, QuerySet
+from django.db.models.fields.files import FieldFile
+from django.template.loader import get_template
+
+logger = logging.getLogger(__name__)
+
+# (pdf_bytes, filename, audit_code)
+CachedPDF = Tuple[bytes, str, str]
+
+AUDIT_FIELDS = ("audit_code", "qr_code_url", "generated_at")
+
+
+def normalize(value: Any, depth: int = 0) -> Any:
+    """Contexto de plantilla -> estructura JSON estable."""
+    if value is None or isinstance(value, (str, bool, int, float)):
+        return value
+    if isinstance(value, (Decimal, UUID)):
+        return str(value)
+    if isinstance(value, (datetime, date, time)):
+        return value.isoformat()
+    if isinstance(value, FieldFile):
+        return value.name or ""
+    if isinstance(value, dict):
+        return {str(k): normalize(v, depth) for k, v in value.items()}
+    if isinstance(value, (list, tuple, QuerySet)):
+        return [normalize(v, depth) for v in value]
+    if isinstance(value, Model):
+        return _normalize_instance(value, depth)
+    return repr(value)
+
+
+def _normalize_instance(instance: Model, depth: int) -> Dict[str, Any]:
+    data = {"_model": instance._meta.label}
+    for field in instance._meta.concrete_fields:
+        data[field.attname] = normalize(field.value_from_object(instance), depth)
+        # Relaciones ya cargadas (select_related o accedidas al armar el
+        # contexto); las demás quedan representadas por su id
+        if field.is_relation and depth < 2 and field.is_cached(instance):
+            data[field.name] = normalize(getattr(instance, field.name), depth + 1)
+    return data
+
+
+class PDFCache:
+    VERSION = 1  # subir si cambia el armado del contexto fuera de la plantilla
+    DEFAULT_MAX_BYTES = 512 * 1024 * 1024
+    EVICT_TO = 0.9  # al desalojar, bajar al 90% del máximo
+
+    _template_digests: Dict[str, str] = {}
+
+    # --- API ---
+    @classmethod
+    def enabled(cls) -> bool:
+        return bool(cls._dir()) and cls.max_bytes() > 0
+
+    @classmethod
+    def max_bytes(cls) -> int:
+        return getattr(settings, "PDF_CACHE_MAX_BYTES", cls.DEFAULT_MAX_BYTES)
+
+    @classmethod
+    def get_or_render(
+        cls,
+        template_name: str,
+        context: Dict[str, Any],
+        render: Callable[[], CachedPDF],
+    ) -> CachedPDF:
+        """
+        PDF cacheado para (plantilla, contexto) o render() si no existe.
+        El contexto no lleva los campos de auditoría: render() los agrega.
+        """
+        if not cls.enabled():
+            return render()
+        key = cls.key(template_name, context)
+        cached = cls.get(key)
+        if cached is not None:
+            return cached
+
+        result = render()
+        cls.put(key, *result)
+        return result
+
+    @classmethod
+    def key(cls, template_name: str, context: Dict[str, Any]) -> str:
+        data = {k: v for k, v in context.items() if k not in AUDIT_FIELDS}
+        payload = json.dumps(
+            [
+                cls.VERSION,
+                template_name,
+                cls._template_digest(template_name),
+                normalize(data),
+            ],
+            sort_keys=True,
+            separators=(",", ":"),
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    @classmethod
+    def get(cls, key: str) -> Optional[CachedPDF]:
+        pdf_path, meta_path = cls._paths(key)
+        try:
+            meta = json.loads(meta_path.read_text(encoding="utf-8"))
+            pdf_bytes = pdf_path.read_bytes()
+            os.utime(pdf_path)  # LRU
+        except (OSError, ValueError):
+            return None
+        return pdf_bytes, meta["filename"], meta["audit_code"]
+
+    @classmethod
+    def put(cls, key: str, pdf_bytes: bytes, filename: str, audit_code: str):
+        if not pdf_bytes or not pdf_bytes.startswith(b"%PDF"):
+            return
+        pdf_path, meta_path = cls._paths(key)
+        try:
+            pdf_path.parent.mkdir(parents=True, exist_ok=True)
+            meta = json.dumps({"filename": filename, "audit_code": audit_code})
+            cls._write_atomic(meta_path, meta.encode("utf-8"))
+            # El .pdf va último: su presencia marca la entrada completa
+            cls._write_atomic(pdf_path, pdf_bytes)
+            cls.evict()
+        except OSError as e:
+            logger.warning(f"PDFCache: no se pudo guardar {key} ({e})")
+
+    @classmethod
+    def evict(cls):
+        """Desaloja las entradas menos usadas hasta bajar del máximo."""
+        entries: List[Tuple[float, int, Path]] = []
+        total = 0
+        for pdf_path in Path(cls._dir()).glob("*/*.pdf"):
+            try:
+                stat = pdf_path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, pdf_path))
+            total += stat.st_size
+        if total <= cls.max_bytes():
+            return
+
+        target = cls.max_bytes() * cls.EVICT_TO
+        for _, size, pdf_path in sorted(entries):
+            for path in (pdf_path, pdf_path.with_suffix(".json")):
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass
+            total -= size
+            if total <= target:
+                break
+
+    @classmethod
+    def clear(cls):
+        for path in Path(cls._dir()).glob("*/*"):
+            try:
+                path.unlink()
+            except FileNotFoundError:
+                pass
+
+    # --- Internos ---
+    @staticmethod
+    def _dir() -> str:
+        return str(getattr(settings, "PDF_CACHE_DIR", "") or "")
+
+    @classmethod
+    def _paths(cls, key: str) -> Tuple[Path, Path]:
+        base = Path(cls._dir()) / key[:2] / key
+        return base.with_suffix(".pdf"), base.with_suffix(".json")
+
+    @staticmethod
+    def _write_atomic(path: Path, data: bytes):
+        fd, tmp = tempfile.mkstemp(dir=path.parent, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmp, path)
+        except BaseException:
+            try:
+                os.unlink(tmp)
+            except FileNotFoundError:
+                pass
+            raise
+
+    @classmethod
+    def _template_digest(cls, template_name: str) -> str:
+        digest = cls._template_digests.get(template_name)
+        if digest is None:
+            source = get_template(template_name).template.source
+            digest = hashlib.sha256(source.encode()).hexdigest()
+            # En DEBUG las plantillas se editan en caliente
+            if not settings.DEBUG:
+                cls._template_digests[template_name] = digest
+        return digest
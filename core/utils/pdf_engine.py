@@ -0,0 +1,228 @@
+# core/utils/pdf_engine.py
+"""
+Motor de PDF (WeasyPrint) en un pool de procesos.
+
+WeasyPrint es CPU-bound y retiene el GIL cientos de milisegundos por
+página: convertido dentro del request, un paquete de documentos frenaba
+los demás requests del mismo worker. Aquí:
+
+- La plantilla Django se renderiza en el proceso del request (el contexto
+  trae instancias de modelos y relaciones perezosas que no deben cruzar
+  procesos); al pool solo viaja el HTML y vuelven los bytes del PDF.
+- ProcessPoolExecutor "caliente": los procesos se crean con spawn (sin
+  heredar conexiones ni hilos) y cargan WeasyPrint al arrancar.
+- Back-pressure: como máximo PDF_ENGINE_MAX_PENDING trabajos en curso o en
+  cola por proceso web; si no hay cupo en PDF_ENGINE_QUEUE_TIMEOUT segundos
+  se lanza PDFEngineBusy en lugar de encolar sin límite.
+- Cada trabajo espera su resultado como máximo PDF_ENGINE_TIMEOUT segundos
+  (PDFRenderTimeout). El proceso sigue ocupado hasta terminar ese render y
+  su cupo se libera entonces.
+- Con template_name, el CSS de la plantilla (si puede moverse sin cambiar
+  la cascada) y la FontConfiguration se parsean una vez por proceso
+  (core/utils/pdf_styles.py).
+- submit()/result() permiten encolar varios documentos y esperarlos
+  juntos (bulk_generate_appointment_docs).
+- PDF_ENGINE_WORKERS = 0 convierte en el mismo proceso (sin pool).
+"""
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.template.loader import render_to_string
+
+from core.utils.pdf_styles import Styles, TemplateStyles, font_config, stylesheets
+
+logger = logging.getLogger(__name__)
+
+
+class PDFRenderError(Exception):
+    """Error al convertir HTML a PDF."""
+
+
+class PDFEngineBusy(PDFRenderError):
+    """No hay cupo en el pool de PDF (back-pressure)."""
+
+
+class PDFRenderTimeout(PDFRenderError):
+    """El PDF no estuvo listo a tiempo."""
+
+
+# --- Proceso del pool ---
+def _warm_worker():
+    """Inicializador: carga WeasyPrint (y las fuentes) una vez por proceso."""
+    try:
+        _write_pdf("<p></p>", None)
+    except Exception as e:
+        logger.warning(f"PDFEngine: no se pudo precalentar el proceso ({e})")
+
+
+def _write_pdf(
+    html: str, base_url: Optional[str], styles: Optional[Styles] = None
+) -> bytes:
+    from weasyprint import HTML
+
+    document = HTML(string=html, base_url=base_url)
+    if styles is None:
+        return document.write_pdf() or b""
+    # Hojas con origen de usuario: ver las condiciones en pdf_styles.py
+    return (
+        document.write_pdf(
+            stylesheets=stylesheets(styles, base_url), font_config=font_config()
+        )
+        or b""
+    )
+
+
+class PDFEngine:
+    DEFAULT_WORKERS = 2
+    DEFAULT_TIMEOUT = 60
+    DEFAULT_MAX_PENDING = 8
+    DEFAULT_QUEUE_TIMEOUT = 5
+
+    _executor: Optional[ProcessPoolExecutor] = None
+    _slots: Optional[threading.BoundedSemaphore] = None
+    _lock = threading.Lock()
+
+    @staticmethod
+    def _setting(name: str, default):
+        return getattr(settings, name, default)
+
+    @classmethod
+    def workers(cls) -> int:
+        return cls._setting("PDF_ENGINE_WORKERS", cls.DEFAULT_WORKERS)
+
+    # --- API ---
+    @classmethod
+    def render(
+        cls,
+        template_name: str,
+        context: Dict[str, Any],
+        base_url: Optional[str] = None,
+        timeout: Optional[float] = None,
+    ) -> bytes:
+        """Renderiza la plantilla y la convierte a PDF. Retorna los bytes."""
+        html = render_to_string(template_name, context)
+        return cls.render_html(
+            html, base_url=base_url, timeout=timeout, template_name=template_name
+        )
+
+    @classmethod
+    def render_html(
+        cls,
+        html: str,
+        base_url: Optional[str] = None,
+        timeout: Optional[float] = None,
+        template_name: Optional[str] = None,
+        country_code: Optional[str] = None,
+    ) -> bytes:
+        """
+        Convierte HTML a PDF en el pool. Retorna los bytes.
+        Con template_name, el CSS de la plantilla se toma de la cache de
+        hojas de estilo (core/utils/pdf_styles.py).
+        """
+        future = cls.submit(
+            html,
+            base_url=base_url,
+            template_name=template_name,
+            country_code=country_code,
+        )
+        return cls.result(future, timeout=timeout)
+
+    @classmethod
+    def submit(
+        cls,
+        html: str,
+        base_url: Optional[str] = None,
+        template_name: Optional[str] = None,
+        country_code: Optional[str] = None,
+    ) -> Future:
+        """
+        Encola la conversión sin esperarla (varios documentos a la vez).
+        Retorna un Future; los bytes se obtienen con PDFEngine.result().
+        """
+        if base_url is None:
+            base_url = str(settings.MEDIA_ROOT or "")
+        styles = None
+        if template_name:
+            html, styles = TemplateStyles.split(template_name, html, country_code)
+        if cls.workers() <= 0:
+            future = Future()
+            try:
+                future.set_result(_write_pdf(html, base_url, styles))
+            except Exception as e:
+                future.set_exception(e)
+            return future
+
+        executor, slots = cls._get_pool()
+        queue_timeout = cls._setting(
+            "PDF_ENGINE_QUEUE_TIMEOUT", cls.DEFAULT_QUEUE_TIMEOUT
+        )
+        if not slots.acquire(timeout=queue_timeout):
+            raise PDFEngineBusy("El generador de PDF está ocupado, intente de nuevo")
+
+        try:
+            future = executor.submit(_write_pdf, html, base_url, styles)
+        except (BrokenProcessPool, RuntimeError) as e:
+            slots.release()
+            cls._reset(executor)
+            raise PDFRenderError(f"Pool de PDF no disponible: {e}")
+
+        def done(f: Future):
+            slots.release()
+            if not f.cancelled() and isinstance(f.exception(), BrokenProcessPool):
+                cls._discard(executor)
+
+        future.add_done_callback(done)
+        return future
+
+    @classmethod
+    def result(cls, future: Future, timeout: Optional[float] = None) -> bytes:
+        """Espera el PDF de un trabajo encolado con submit()."""
+        timeout = timeout or cls._setting("PDF_ENGINE_TIMEOUT", cls.DEFAULT_TIMEOUT)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise PDFRenderTimeout("El PDF tardó demasiado en generarse")
+        except BrokenProcessPool as e:
+            raise PDFRenderError(f"Un proceso de PDF terminó inesperadamente: {e}")
+
+    # --- Pool ---
+    @classmethod
+    def _get_pool(cls) -> Tuple[ProcessPoolExecutor, threading.BoundedSemaphore]:
+        with cls._lock:
+            if cls._executor is None or cls._slots is None:
+                cls._executor = ProcessPoolExecutor(
+                    max_workers=cls.workers(),
+                    mp_context=multiprocessing.get_context("spawn"),
+                    initializer=_warm_worker,
+                )
+                cls._slots = threading.BoundedSemaphore(
+                    cls._setting("PDF_ENGINE_MAX_PENDING", cls.DEFAULT_MAX_PENDING)
+                )
+            return cls._executor, cls._slots
+
+    @classmethod
+    def _discard(cls, executor: ProcessPoolExecutor):
+        """Olvida un pool roto; el siguiente trabajo crea uno nuevo."""
+        with cls._lock:
+            if cls._executor is executor:
+                cls._executor = None
+                cls._slots = None
+
+    @classmethod
+    def _reset(cls, executor: ProcessPoolExecutor):
+        cls._discard(executor)
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    @classmethod
+    def shutdown(cls):
+        with cls._lock:
+            executor, cls._executor, cls._slots = cls._executor, None, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
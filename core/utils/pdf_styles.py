@@ -0,0 +1,161 @@
+# core/utils/pdf_styles.py
+"""
+Hojas de estilo de los PDF de WeasyPrint, parseadas una vez por proceso.
+
+Las plantillas de documentos traen su CSS en bloques <style> estáticos:
+dentro de HTML(string=...) WeasyPrint los volvía a parsear (y a resolver
+fuentes) en cada documento. Ahora:
+
+- Lado del request (TemplateStyles.split): los bloques <style> de cada
+  plantilla se leen del fuente una vez y se quitan del HTML renderizado;
+  viajan al pool de PDFEngine como (clave, textos CSS).
+- Lado del proceso del pool (stylesheets / font_config): los CSS(...) y
+  una FontConfiguration compartida se construyen una vez por clave y se
+  reutilizan en cada write_pdf(stylesheets=..., font_config=...).
+
+La clave es (plantilla, país, digest del CSS): editar el CSS de una
+plantilla no reutiliza hojas viejas.
+
+WeasyPrint aplica las hojas de write_pdf(stylesheets=...) con origen de
+usuario, no de autor: sus reglas normales pierden ante cualquier CSS de
+autor que quede en el documento (pero siguen ganando al CSS por defecto
+y perdiendo ante los atributos style=, como en línea), y sus reglas
+!important ganan incluso a los atributos style=. Para que el resultado
+sea el mismo que con el CSS en línea, split() solo mueve los bloques si:
+- ninguno usa sintaxis de plantilla,
+- ninguno (ni el CSS del país) usa !important, y
+- el HTML no conserva otro CSS de autor (<style> de plantillas incluidas,
+  <link rel="stylesheet">).
+En otro caso todo queda en línea.
+"""
+import hashlib
+import logging
+import re
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+from django.conf import settings
+from django.template.loader import get_template
+
+logger = logging.getLogger(__name__)
+
+STYLE_BLOCK = re.compile(r"<style[^>]*>(.*?)</style>", re.IGNORECASE | re.DOTALL)
+TEMPLATE_SYNTAX = ("{{", "{%")
+IMPORTANT = re.compile(r"!\s*important", re.IGNORECASE)
+AUTHOR_CSS = re.compile(r"<style[\s>]|<link[^>]*stylesheet", re.IGNORECASE)
+
+# (clave, textos CSS) que PDFEngine envía al proceso del pool
+Styles = Tuple[Tuple[str, str, str], Tuple[str, ...]]
+
+
+class TemplateStyles:
+    """Bloques <style> estáticos por plantilla y CSS por país (en memoria)."""
+
+    _blocks: Dict[str, Tuple[Tuple[str, str], ...]] = {}
+    _css_files: Dict[str, str] = {}
+
+    @classmethod
+    def blocks(cls, template_name: str) -> Tuple[Tuple[str, str], ...]:
+        """(etiqueta completa, CSS) de cada bloque <style> de la plantilla."""
+        blocks = cls._blocks.get(template_name)
+        if blocks is None:
+            blocks = cls._read_blocks(template_name)
+            # En DEBUG las plantillas se editan en caliente
+            if not settings.DEBUG:
+                cls._blocks[template_name] = blocks
+        return blocks
+
+    @staticmethod
+    def _read_blocks(template_name: str) -> Tuple[Tuple[str, str], ...]:
+        try:
+            source = get_template(template_name).template.source
+        except Exception as e:
+            logger.warning(f"TemplateStyles: no se pudo leer {template_name} ({e})")
+            return ()
+        blocks = tuple((m.group(0), m.group(1)) for m in STYLE_BLOCK.finditer(source))
+        if any(s in tag for tag, _ in blocks for s in TEMPLATE_SYNTAX):
+            return ()
+        if any(IMPORTANT.search(css) for _, css in blocks):
+            return ()
+        return blocks
+
+    @classmethod
+    def split(
+        cls, template_name: str, html: str, country_code: Optional[str] = None
+    ) -> Tuple[str, Optional[Styles]]:
+        """
+        Quita del HTML los bloques <style> de la plantilla y los retorna
+        como hojas para el pool. Sin bloques, sin coincidencia exacta con
+        el HTML renderizado o con CSS de autor restante (ver el docstring
+        del módulo) el HTML queda intacto y las hojas son None.
+        """
+        blocks = cls.blocks(template_name)
+        if not all(tag in html for tag, _ in blocks):
+            return html, None
+
+        stripped = html
+        texts = []
+        for tag, css in blocks:
+            stripped = stripped.replace(tag, "", 1)
+            texts.append(css)
+        if country_code:
+            country_css = cls.country_css(country_code)
+            if IMPORTANT.search(country_css):
+                return html, None
+            texts.append(country_css)
+        if not texts or AUTHOR_CSS.search(stripped):
+            return html, None
+
+        digest = hashlib.sha1("\0".join(texts).encode()).hexdigest()
+        key = (template_name, country_code or "", digest)
+        return stripped, (key, tuple(texts))
+
+    @classmethod
+    def country_css(cls, country_code: str) -> str:
+        """CSS del país (medical/css/country_xx.css) o universal.css."""
+        country = cls.css_file(f"medical/css/country_{country_code.lower()}.css")
+        return country or cls.css_file("medical/css/universal.css")
+
+    @classmethod
+    def css_file(cls, relative_path: str) -> str:
+        """Archivo CSS bajo el directorio de plantillas ("" si no existe)."""
+        css = cls._css_files.get(relative_path)
+        if css is None:
+            try:
+                path = Path(settings.TEMPLATES[0]["DIRS"][0]) / relative_path
+                css = path.read_text(encoding="utf-8")
+            except (OSError, IndexError, KeyError):
+                css = ""
+            cls._css_files[relative_path] = css
+        return css
+
+
+# --- Proceso del pool ---
+_font_config = None
+_stylesheets: Dict[tuple, List] = {}
+
+
+def font_config():
+    """FontConfiguration compartida por todos los documentos del proceso."""
+    global _font_config
+    if _font_config is None:
+        from weasyprint.text.fonts import FontConfiguration
+
+        _font_config = FontConfiguration()
+    return _font_config
+
+
+def stylesheets(styles: Styles, base_url: Optional[str]) -> List:
+    """CSS(...) parseados una vez por clave y base_url."""
+    key, texts = styles
+    cache_key = (key, base_url)
+    sheets = _stylesheets.get(cache_key)
+    if sheets is None:
+        from weasyprint import CSS
+
+        sheets = [
+            CSS(string=text, base_url=base_url, font_config=font_config())
+            for text in texts
+        ]
+        _stylesheets[cache_key] = sheets
+    return sheets
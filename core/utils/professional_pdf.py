@@ -3,8 +3,6 @@
 """
 Servicio profesional para generación de PDF con WeasyPrint optimizado y soporte multi-país
 """
-from weasyprint import HTML, CSS
-from weasyprint.text.fonts import FontConfiguration
 from django.conf import settings
 from django.utils import timezone
 import logging
@@ -12,6 +10,8 @@ import json
 import hashlib
 import time
 from typing import Dict, Any, Optional, Union
+from .pdf_engine import PDFEngine
+from .pdf_styles import TemplateStyles
 logger = logging.getLogger(__name__)
 class PDFGenerationError(Exception):
     """Excepción personalizada para errores de generación de PDF"""
@@ -20,9 +20,9 @@ class ProfessionalPDFService:
     """Servicio profesional para generación de PDF con WeasyPrint optimizado y soporte multi-país"""
     
     def __init__(self):
-        # 🔥 CORRECCIÓN: Removido FontConfiguration - causa problemas
-        # self.font_config = FontConfiguration()
-        self.css_cache = {}
+        # FontConfiguration y hojas CSS: una vez por proceso del pool de
+        # PDFEngine (core/utils/pdf_styles.py), no por instancia
+        pass
     
     def generate_professional_pdf(
         self, 
@@ -151,16 +151,14 @@ class ProfessionalPDFService:
         print(f"🔍 [D] HTML rendered: {len(html_string)} chars")
         print(f"🔍 [E] HTML preview: {html_string[:200]}...")
         
-        # 🔥 CORRECCIÓN CLAVE: WeasyPrint simple y efectivo (como en el test exitoso)
-        html = HTML(
-            string=html_string, 
-            base_url=settings.MEDIA_ROOT or ""
-        )
-        print(f"🔍 [F] HTML object created")
-        
         # 🔥 SOLUCIÓN DEFINITIVA: Sin CSS externo, sin font_config, sin optimización
         # El template ya tiene CSS inline profesional - no necesita CSS externo
-        pdf_bytes = html.write_pdf()  # Método testado y probado exitosamente
+        # WeasyPrint corre en el pool de procesos de PDFEngine (fuera del request)
+        pdf_bytes = PDFEngine.render_html(
+            html_string,
+            base_url=settings.MEDIA_ROOT or "",
+            template_name=template_path
+        )
         
         print(f"🔍 [G] WeasyPrint.write_pdf() called")
         print(f"🔍 [H] Result type: {type(pdf_bytes)}")
@@ -235,52 +233,20 @@ class ProfessionalPDFService:
             raise
     
     def _get_country_css(self, country_code: str) -> str:
-        """Obtener CSS específico para el país"""
-        print(f"🔍 [C1] Getting CSS for country: {country_code}")
-        
-        if country_code not in self.css_cache:
-            # 🔥 CORRECCIÓN: Eliminar lógica duplicada
-            css_file = f"medical/css/country_{country_code.lower()}.css"
-            print(f"🔍 [C2] CSS file path: {css_file}")
-            
-            try:
-                full_path = settings.TEMPLATES[0]['DIRS'][0] + '/' + css_file
-                print(f"🔍 [C3] Full CSS path: {full_path}")
-                
-                with open(full_path, 'r', encoding='utf-8') as f:
-                    self.css_cache[country_code] = f.read()
-                print(f"🔍 [C4] CSS loaded from file: {len(self.css_cache[country_code])} chars")
-            except (FileNotFoundError, IndexError, KeyError):
-                print(f"⚠️ CSS específico no encontrado para {country_code}, usando por defecto")
-                self.css_cache[country_code] = self._get_default_css()
-                print(f"🔍 [C5] Using default CSS")
-        
-        result = self.css_cache.get(country_code, self._get_default_css())
-        print(f"🔍 [C6] Returning CSS: {len(result)} chars")
-        return result
+        """Obtener CSS específico para el país (cacheado por proceso)"""
+        return TemplateStyles.country_css(country_code) or self._get_default_css()
     
     def _get_default_css(self) -> str:
-        """CSS por defecto universal"""
-        print(f"🔍 [D1] Getting default CSS")
-        
-        try:
-            # 🔥 CORRECCIÓN: Ruta absoluta para producción
-            css_path = settings.TEMPLATES[0]['DIRS'][0] + '/medical/css/universal.css'
-            print(f"🔍 [D2] Default CSS path: {css_path}")
-            
-            with open(css_path, 'r', encoding='utf-8') as f:
-                result = f.read()
-            print(f"🔍 [D3] Default CSS loaded: {len(result)} chars")
-            return result
-        except (FileNotFoundError, IndexError, KeyError):
+        """CSS por defecto universal (cacheado por proceso)"""
+        css = TemplateStyles.css_file('medical/css/universal.css')
+        if not css:
             logger.error(f"❌ Error leyendo CSS por defecto")
-            fallback_css = """
+            css = """
             body { font-family: Arial, sans-serif; }
             .medical-header { border-bottom: 2px solid #0ea5e9; }
             .soap-section { margin: 20px 0; border: 1px solid #e2e8f0; }
             """  # CSS básico como fallback
-            print(f"🔍 [D4] Using fallback CSS: {len(fallback_css)} chars")
-            return fallback_css
+        return css
     
     def _generate_audit_code(
         self, 
@@ -0,0 +1,60 @@
+# core/utils/qr.py
+"""
+QR de verificación de documentos como data URI SVG, memoizado por payload.
+
+Antes cada documento armaba un qrcode.QRCode, pintaba una imagen PIL RGB
+de 10 px por módulo (~330x330), la codificaba en PNG y luego en base64;
+WeasyPrint después la decodificaba para dibujarla a 70-80 px de alto.
+Aquí la matriz se serializa como un único <path> SVG (un trazo de 1
+módulo de grosor por tramo horizontal de módulos negros) en un data URI
+sin base64: sin PIL ni PNG, y nítido a cualquier tamaño.
+
+qr_data_uri() guarda en un LRU (QR_CACHE_SIZE entradas, por proceso) el
+data URI por (payload, borde): la reimpresión o el mismo payload en varios
+documentos no vuelve a codificar.
+"""
+from functools import lru_cache
+from typing import List
+from urllib.parse import quote
+
+import qrcode
+from qrcode.constants import ERROR_CORRECT_M
+
+QR_CACHE_SIZE = 1024
+QR_BORDER = 2  # módulos de margen (qrcode.make() usa 4)
+
+
+@lru_cache(maxsize=QR_CACHE_SIZE)
+def qr_data_uri(payload: str, border: int = QR_BORDER) -> str:
+    """data:image/svg+xml del QR de `payload`."""
+    return "data:image/svg+xml," + quote(qr_svg(payload, border), safe="/:=',")
+
+
+def qr_svg(payload: str, border: int = QR_BORDER) -> str:
+    qr = qrcode.QRCode(error_correction=ERROR_CORRECT_M, border=border)
+    qr.add_data(payload)
+    qr.make(fit=True)
+    return matrix_svg(qr.get_matrix())
+
+
+def matrix_svg(matrix: List[List[bool]]) -> str:
+    """SVG de una matriz QR (con su borde): 1 unidad = 1 módulo = 1 mm."""
+    size = len(matrix)
+    runs = []
+    for y, row in enumerate(matrix):
+        x = 0
+        while x < size:
+            if not row[x]:
+                x += 1
+                continue
+            start = x
+            while x < size and row[x]:
+                x += 1
+            runs.append(f"M{start},{y}.5h{x - start}")
+    # Comillas simples, colores por nombre y comas: poco que escapar en la URI
+    return (
+        f"<svg xmlns='http://www.w3.org/2000/svg' width='{size}mm' "
+        f"height='{size}mm' viewBox='0,0,{size},{size}' "
+        f"shape-rendering='crispEdges'><rect width='{size}' height='{size}' "
+        f"fill='white'/><path stroke='black' d='{''.join(runs)}'/></svg>"
+    )
@@ -0,0 +1,179 @@
+# core/utils/report_engine.py
+"""
+Motor de reports_api: montos por servicio (DoctorService) y día.
+
+- CLINICAL: ítems de cobro de órdenes con cita en el rango, agrupados por
+  servicio y fecha de cita. Una sola consulta con JOIN directo (FK hacia
+  arriba, sin fan-out) y el rango sobre appointment_date (indexada).
+- FINANCIAL: pagos confirmados y ítems se agregan POR SEPARADO y luego se
+  cruzan los agregados en una sola consulta (CTEs):
+    1. pagos → (orden, día de pago, monto pagado)
+    2. ítems → (orden, servicio, subtotal), solo de órdenes con pagos en el
+       rango (semi-join, no multiplica filas)
+  Lo pagado por una orden en un día se reparte entre sus servicios según su
+  peso en la orden, así que la suma del reporte coincide con lo cobrado.
+  Antes cada ítem se unía con cada pago de su orden y se contaba una vez
+  por pago.
+
+Las fechas se filtran sobre la columna (received_at >= inicio, < día
+siguiente) para poder usar el índice (status, received_at).
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Dict, List
+
+from django.db import connections
+from django.db.models import F, Sum
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from core.models import ChargeItem, Payment
+
+DEFAULT_SERVICE = "General Service"
+CENTS = Decimal("0.01")
+
+
+class ReportEngine:
+    REPORT_TYPES = ("FINANCIAL", "CLINICAL", "COMBINED")
+
+    def __init__(
+        self, report_type="FINANCIAL", start_date=None, end_date=None, currency="USD"
+    ):
+        report_type = (report_type or "FINANCIAL").upper()
+        if report_type not in self.REPORT_TYPES:
+            raise ValueError(f"Tipo de reporte no soportado: {report_type}")
+        self.report_type = report_type
+        self.start = self._parse(start_date)
+        self.end = self._parse(end_date)
+        self.currency = currency
+
+    @staticmethod
+    def _parse(value):
+        if not value:
+            return None
+        day = parse_date(str(value))
+        if day is None:
+            raise ValueError(f"Fecha inválida: {value}")
+        return day
+
+    @staticmethod
+    def _start_of(day):
+        return timezone.make_aware(datetime.combine(day, time.min))
+
+    # --- Consultas ---
+    def confirmed_payments(self):
+        qs = Payment.objects.filter(status="confirmed", received_at__isnull=False)
+        if self.start:
+            qs = qs.filter(received_at__gte=self._start_of(self.start))
+        if self.end:
+            qs = qs.filter(
+                received_at__lt=self._start_of(self.end + timedelta(days=1))
+            )
+        return qs
+
+    def payments_by_order_day(self):
+        """(orden, día, monto pagado) de los pagos confirmados del rango."""
+        return (
+            self.confirmed_payments()
+            .values(order_ref=F("charge_order_id"), day=TruncDate("received_at"))
+            .annotate(amount=Sum("amount"))
+            .order_by()
+        )
+
+    def items_by_order_service(self):
+        """(orden, servicio, subtotal) de las órdenes con pagos en el rango."""
+        orders = self.confirmed_payments().values("charge_order_id")
+        return (
+            ChargeItem.objects.filter(order_id__in=orders)
+            .values(order_ref=F("order_id"), service=F("doctor_service__name"))
+            .annotate(subtotal=Sum("subtotal"))
+            .order_by()
+        )
+
+    def clinical_items(self):
+        """Subtotal por (servicio, fecha de cita) en una sola consulta."""
+        qs = ChargeItem.objects.filter(order__appointment__isnull=False)
+        if self.start:
+            qs = qs.filter(order__appointment__appointment_date__gte=self.start)
+        if self.end:
+            qs = qs.filter(order__appointment__appointment_date__lte=self.end)
+        return (
+            qs.annotate(day=F("order__appointment__appointment_date"))
+            .values("doctor_service__name", "day")
+            .annotate(total_amount=Sum("subtotal"))
+            .order_by()
+        )
+
+    # --- Agregados ---
+    def clinical_totals(self) -> Dict[tuple, Decimal]:
+        totals: Dict[tuple, Decimal] = defaultdict(Decimal)
+        for row in self.clinical_items():
+            service = row["doctor_service__name"] or DEFAULT_SERVICE
+            totals[(row["day"], service)] += row["total_amount"] or Decimal("0")
+        return totals
+
+    def financial_totals(self) -> Dict[tuple, Decimal]:
+        """
+        Cruza los dos agregados en la base (CTEs) y reparte lo pagado por
+        orden y día según el peso de cada servicio en la orden. Los
+        agregados se compilan desde el ORM (filtros y zona horaria de
+        TruncDate incluidos).
+        """
+        payments = self.payments_by_order_day()
+        payments_sql, payments_params = payments.query.sql_with_params()
+        items_sql, items_params = self.items_by_order_service().query.sql_with_params()
+        sql = f"""
+            WITH order_paid AS ({payments_sql}),
+                 order_items AS ({items_sql}),
+                 order_totals AS (
+                     SELECT order_ref, SUM(subtotal) AS total
+                     FROM order_items GROUP BY order_ref
+                 )
+            SELECT order_paid.day, order_items.service,
+                   SUM(
+                       order_paid.amount * order_items.subtotal / order_totals.total
+                   )
+            FROM order_paid
+            JOIN order_items ON order_items.order_ref = order_paid.order_ref
+            JOIN order_totals ON order_totals.order_ref = order_paid.order_ref
+            WHERE order_totals.total > 0
+            GROUP BY order_paid.day, order_items.service
+        """
+        totals: Dict[tuple, Decimal] = defaultdict(Decimal)
+        with connections[payments.db].cursor() as cursor:
+            cursor.execute(sql, (*payments_params, *items_params))
+            for day, service, amount in cursor.fetchall():
+                if isinstance(day, str):
+                    day = parse_date(day)
+                # SQLite devuelve float; Postgres, Decimal
+                totals[(day, service or DEFAULT_SERVICE)] += Decimal(str(amount or 0))
+        return totals
+
+    # --- Filas ---
+    def _rows(self, totals, prefix, row_type, status) -> List[dict]:
+        return [
+            {
+                "id": f"{prefix}-{day}-{service}",
+                "date": str(day),
+                "type": row_type,
+                "entity": service,
+                "status": status,
+                "amount": float(amount.quantize(CENTS, ROUND_HALF_UP)),
+                "currency": self.currency,
+            }
+            for (day, service), amount in sorted(
+                totals.items(), key=lambda item: (-item[0][0].toordinal(), item[0][1])
+            )
+        ]
+
+    def rows(self) -> List[dict]:
+        rows: List[dict] = []
+        if self.report_type in ("CLINICAL", "COMBINED"):
+            rows += self._rows(self.clinical_totals(), "CLI", "clinical", "COMPLETED")
+        if self.report_type in ("FINANCIAL", "COMBINED"):
+            rows += self._rows(self.financial_totals(), "FIN", "financial", "CONFIRMED")
+        if self.report_type == "COMBINED":
+            rows.sort(key=lambda row: row["date"], reverse=True)
+        return rows
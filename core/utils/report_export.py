@@ -0,0 +1,266 @@
+# core/utils/report_export.py
+"""
+Exportación de reportes en streaming (reports_export_api).
+
+Las filas salen de proyecciones values() recorridas con
+.iterator(chunk_size=...) —sin instanciar modelos ni hacer consultas por
+fila— y se escriben directo al formato de salida:
+
+- csv:   StreamingHttpResponse; cada fila se envía al cliente al generarse.
+- excel: openpyxl en modo write_only sobre un archivo temporal, enviado con
+         FileResponse por bloques.
+
+En ambos casos la memoria se mantiene plana aunque el reporte tenga
+cientos de miles de filas.
+
+Las filas se acotan a una institución y a los pacientes accesibles para el
+usuario (PatientAccessScope); sin alcance no se exporta nada.
+"""
+import csv
+import tempfile
+from datetime import datetime, time, timedelta
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Iterator, List, Optional
+
+from django.http import FileResponse, StreamingHttpResponse
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Font
+from rest_framework.renderers import JSONRenderer
+
+from core.models import Appointment, Payment
+from core.permissions import PatientAccessScope
+
+CLINICAL_STATUSES = ["pending", "completed", "canceled"]
+STATUS_LABELS = dict(Appointment.STATUS_CHOICES)
+PATIENT_NAME_FIELDS = [
+    "patient__first_name",
+    "patient__middle_name",
+    "patient__last_name",
+    "patient__second_last_name",
+]
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+class ExcelFormatRenderer(JSONRenderer):
+    """
+    DRF usa ?format= para elegir renderer (y responde 404 si ninguno
+    coincide). Estos renderers aceptan format=excel|csv; el archivo lo arma
+    ReportExport y solo las respuestas de error pasan por aquí (como JSON).
+    """
+
+    format = "excel"
+
+
+class CSVFormatRenderer(ExcelFormatRenderer):
+    format = "csv"
+
+
+EXPORT_RENDERERS = [JSONRenderer, ExcelFormatRenderer, CSVFormatRenderer]
+
+
+class _Echo:
+    """Pseudo-buffer para csv.writer: devuelve la línea en lugar de guardarla."""
+
+    def write(self, value):
+        return value
+
+
+class ReportExport:
+    CHUNK_SIZE = 2000
+    REPORT_TYPES = ("FINANCIAL", "CLINICAL", "COMBINED")
+    FORMATS = ("excel", "csv")
+
+    COLUMNS = {
+        "FINANCIAL": [
+            "ID", "Fecha de Pago", "Monto", "Método", "Orden de Cobro", "Estado",
+        ],
+        "CLINICAL": ["ID", "Fecha de Cita", "Paciente", "Estado", "Médico"],
+        "COMBINED": [
+            "ID", "Tipo", "Fecha", "Monto", "Método", "Estado", "Paciente", "Médico",
+        ],
+    }
+
+    def __init__(
+        self,
+        report_type="FINANCIAL",
+        start_date=None,
+        end_date=None,
+        currency="USD",
+        institution_id=None,
+        scope: Optional[PatientAccessScope] = None,
+    ):
+        if report_type not in self.REPORT_TYPES:
+            raise ValueError(f"Tipo de reporte no soportado: {report_type}")
+        self.report_type = report_type
+        self.institution_id = institution_id
+        self.scope = scope or PatientAccessScope(None)
+        self.start = self._parse(start_date)
+        self.end = self._parse(end_date)
+        self.currency = currency
+        self.rate = Decimal("1")
+        if currency == "VES":
+            from core.services import get_bcv_rate
+
+            self.rate = Decimal(str(get_bcv_rate()))
+
+    @staticmethod
+    def _parse(value):
+        if not value:
+            return None
+        day = parse_date(str(value))
+        if day is None:
+            raise ValueError(f"Fecha inválida: {value}")
+        return day
+
+    @staticmethod
+    def _start_of(day):
+        return timezone.make_aware(datetime.combine(day, time.min))
+
+    # --- Fuentes (proyecciones values()) ---
+    def _scoped(self, queryset, patient_field: str):
+        """Institución del reporte y pacientes accesibles (subconsulta)."""
+        queryset = queryset.filter(institution_id=self.institution_id)
+        return self.scope.filter_queryset(queryset, patient_field)
+
+    def payments(self):
+        qs = self._scoped(
+            Payment.objects.filter(status="confirmed"), "charge_order__patient_id"
+        )
+        # Rango sobre la columna (sin __date) para poder usar índices
+        if self.start:
+            qs = qs.filter(received_at__gte=self._start_of(self.start))
+        if self.end:
+            qs = qs.filter(
+                received_at__lt=self._start_of(self.end + timedelta(days=1))
+            )
+        return (
+            qs.order_by("received_at", "id")
+            .values_list(
+                "id", "received_at", "amount", "method", "charge_order_id", "status"
+            )
+            .iterator(chunk_size=self.CHUNK_SIZE)
+        )
+
+    def appointments(self):
+        qs = self._scoped(
+            Appointment.objects.filter(status__in=CLINICAL_STATUSES), "patient_id"
+        )
+        if self.start:
+            qs = qs.filter(appointment_date__gte=self.start)
+        if self.end:
+            qs = qs.filter(appointment_date__lte=self.end)
+        return (
+            qs.order_by("appointment_date", "id")
+            .values_list(
+                "id",
+                "appointment_date",
+                "status",
+                "doctor__full_name",
+                *PATIENT_NAME_FIELDS,
+            )
+            .iterator(chunk_size=self.CHUNK_SIZE)
+        )
+
+    # --- Formato de celdas ---
+    def _amount(self, amount) -> float:
+        value = (amount or Decimal("0")) * self.rate
+        return float(value.quantize(Decimal("0.01"), ROUND_HALF_UP))
+
+    @staticmethod
+    def _received(value) -> str:
+        return timezone.localtime(value).strftime("%d/%m/%Y") if value else ""
+
+    @staticmethod
+    def _day(value) -> str:
+        return value.strftime("%d/%m/%Y") if value else ""
+
+    @staticmethod
+    def _full_name(parts) -> str:
+        # Igual que Patient.full_name
+        return " ".join(p for p in parts if p).strip()
+
+    # --- Filas ---
+    def columns(self) -> List[str]:
+        return self.COLUMNS[self.report_type]
+
+    def rows(self) -> Iterator[list]:
+        combined = self.report_type == "COMBINED"
+        if self.report_type in ("FINANCIAL", "COMBINED"):
+            for pk, received_at, amount, method, order_id, status in self.payments():
+                received, amount = self._received(received_at), self._amount(amount)
+                if combined:
+                    yield [pk, "Pago", received, amount, method or "", status, "", ""]
+                else:
+                    yield [pk, received, amount, method or "", order_id or "", status]
+
+        if self.report_type in ("CLINICAL", "COMBINED"):
+            for pk, day, status, doctor, *name_parts in self.appointments():
+                patient = self._full_name(name_parts)
+                label = STATUS_LABELS.get(status, status) or ""
+                day, doctor = self._day(day), doctor or ""
+                if combined:
+                    yield [pk, "Cita", day, "", "", label, patient, doctor]
+                else:
+                    yield [pk, day, patient, label, doctor]
+
+    # --- Salida ---
+    def filename(self, export_format: str) -> str:
+        extension = "csv" if export_format == "csv" else "xlsx"
+        parts = ["reporte", self.report_type.lower()]
+        if self.start:
+            parts.append(str(self.start))
+        if self.end:
+            parts.append(str(self.end))
+        return f"{'_'.join(parts)}.{extension}"
+
+    def response(self, export_format: str = "excel"):
+        if export_format not in self.FORMATS:
+            raise ValueError(f"Formato de exportación no soportado: {export_format}")
+        if export_format == "csv":
+            return self.csv_response()
+        return self.xlsx_response()
+
+    def csv_lines(self) -> Iterator[str]:
+        writer = csv.writer(_Echo())
+        # BOM para que Excel detecte UTF-8 (acentos)
+        yield "\ufeff" + writer.writerow(self.columns())
+        for row in self.rows():
+            yield writer.writerow(row)
+
+    def csv_response(self) -> StreamingHttpResponse:
+        response = StreamingHttpResponse(
+            self.csv_lines(), content_type="text/csv; charset=utf-8"
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="{self.filename("csv")}"'
+        )
+        return response
+
+    def write_xlsx(self, fileobj):
+        """Escribe el libro en modo write_only (las filas no quedan en memoria)."""
+        wb = Workbook(write_only=True)
+        ws = wb.create_sheet("Reporte")
+        header = []
+        for title in self.columns():
+            cell = WriteOnlyCell(ws, value=title)
+            cell.font = Font(bold=True)
+            header.append(cell)
+        ws.append(header)
+        for row in self.rows():
+            ws.append(row)
+        wb.save(fileobj)
+
+    def xlsx_response(self, fileobj: Optional[object] = None) -> FileResponse:
+        fileobj = fileobj or tempfile.TemporaryFile()
+        self.write_xlsx(fileobj)
+        fileobj.seek(0)
+        return FileResponse(
+            fileobj,
+            as_attachment=True,
+            filename=self.filename("excel"),
+            content_type=XLSX_CONTENT_TYPE,
+        )
@@ -0,0 +1,281 @@
+# core/utils/report_jobs.py
+"""
+Reportes en segundo plano (ReportJob).
+
+- submit(): valida los parámetros y crea el job; si el mismo usuario ya
+  pidió uno idéntico (mismo fingerprint) dentro de REPORT_JOBS_DEDUP_SECONDS
+  que no haya fallado, se reutiliza junto con su artefacto.
+- Los jobs pending/running por más de REPORT_JOBS_STALE_SECONDS (worker
+  caído o reiniciado) se marcan como fallidos: no se reutilizan y el
+  polling deja de esperar.
+- Cada job solo es visible para quien lo pidió (for_user()).
+- El job se encola al confirmarse la transacción: tarea Celery
+  core.tasks.render_report_job si Celery está disponible, o un
+  ThreadPoolExecutor local como respaldo.
+- run() genera el archivo (ReportExport o export_institutional_report), lo
+  guarda en MEDIA (ReportJob.file) y, con R2 habilitado, lo sube a R2.
+"""
+import hashlib
+import json
+import logging
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any, Dict, Optional, Tuple
+
+from django.conf import settings
+from django.core.files import File
+from django.db import connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from core.models import ReportJob
+from core.permissions import PatientAccessScope
+from core.utils.report_export import XLSX_CONTENT_TYPE, ReportExport
+
+logger = logging.getLogger(__name__)
+
+INSTITUTIONAL_FORMATS = ("pdf", "excel")
+
+
+class ReportJobs:
+    DEFAULT_DEDUP_SECONDS = 600
+    DEFAULT_STALE_SECONDS = 1800
+    DEFAULT_WORKERS = 2
+
+    _executor: Optional[ThreadPoolExecutor] = None
+
+    # --- Parámetros ---
+    @staticmethod
+    def fingerprint(kind: str, params: Dict[str, Any], user_id=None) -> str:
+        payload = json.dumps([kind, params, user_id], sort_keys=True, default=str)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def clean_params(kind: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """Normaliza y valida los parámetros; ValueError si no son válidos."""
+        if kind == "export":
+            cleaned = {
+                "type": params.get("type") or "FINANCIAL",
+                "start_date": params.get("start_date") or None,
+                "end_date": params.get("end_date") or None,
+                "currency": params.get("currency") or "USD",
+                "format": params.get("format") or "excel",
+                "institution_id": params.get("institution_id"),
+            }
+            if cleaned["format"] not in ReportExport.FORMATS:
+                raise ValueError(
+                    f"Formato de exportación no soportado: {cleaned['format']}"
+                )
+            # Valida tipo y fechas
+            ReportExport(
+                cleaned["type"], cleaned["start_date"], cleaned["end_date"], "USD"
+            )
+            return cleaned
+
+        if kind == "institutional":
+            cleaned = {
+                "format": params.get("format") or "pdf",
+                "filters": params.get("filters") or {},
+                "data": params.get("data") or [],
+                "currency": params.get("currency") or "USD",
+                "user_name": params.get("user_name") or "",
+            }
+            if cleaned["format"] not in INSTITUTIONAL_FORMATS:
+                raise ValueError(
+                    f"Formato de exportación no soportado: {cleaned['format']}"
+                )
+            if not isinstance(cleaned["data"], list):
+                raise ValueError("data debe ser una lista")
+            return cleaned
+
+        raise ValueError(f"Tipo de job no soportado: {kind}")
+
+    # --- Creación ---
+    @classmethod
+    def submit(
+        cls, kind: str, params: Dict[str, Any], user=None
+    ) -> Tuple[ReportJob, bool]:
+        """Crea (o reutiliza) un job. Retorna (job, reused)."""
+        params = cls.clean_params(kind, params)
+        if user is not None and not user.is_authenticated:
+            user = None
+        fingerprint = cls.fingerprint(kind, params, user.pk if user else None)
+        window = getattr(
+            settings, "REPORT_JOBS_DEDUP_SECONDS", cls.DEFAULT_DEDUP_SECONDS
+        )
+
+        cls.fail_stale(ReportJob.objects.filter(fingerprint=fingerprint))
+        existing = (
+            ReportJob.objects.filter(
+                fingerprint=fingerprint,
+                requested_by=user,
+                created_at__gte=timezone.now() - timedelta(seconds=window),
+            )
+            .exclude(status="failed")
+            .order_by("-created_at")
+            .first()
+        )
+        if existing:
+            return existing, True
+
+        job = ReportJob.objects.create(
+            kind=kind,
+            params=params,
+            fingerprint=fingerprint,
+            requested_by=user,
+        )
+        transaction.on_commit(lambda: cls.enqueue(job.pk))
+        return job, False
+
+    # --- Consulta ---
+    @staticmethod
+    def for_user(user):
+        """Jobs visibles para el usuario: solo los que pidió él mismo."""
+        if user is None or not user.is_authenticated:
+            return ReportJob.objects.none()
+        return ReportJob.objects.filter(requested_by=user)
+
+    @classmethod
+    def fail_stale(cls, queryset=None) -> int:
+        """
+        Marca como fallidos los jobs pending/running que superaron
+        REPORT_JOBS_STALE_SECONDS. Retorna cuántos.
+        """
+        timeout = getattr(
+            settings, "REPORT_JOBS_STALE_SECONDS", cls.DEFAULT_STALE_SECONDS
+        )
+        now = timezone.now()
+        cutoff = now - timedelta(seconds=timeout)
+        queryset = ReportJob.objects.all() if queryset is None else queryset
+        return queryset.filter(
+            Q(status="pending", created_at__lt=cutoff)
+            | Q(status="running", started_at__lt=cutoff)
+        ).update(
+            status="failed",
+            error="Tiempo de generación excedido",
+            finished_at=now,
+        )
+
+    # --- Ejecución ---
+    @classmethod
+    def enqueue(cls, job_id: int):
+        from core.tasks import CELERY_AVAILABLE, render_report_job
+
+        if CELERY_AVAILABLE:
+            try:
+                render_report_job.delay(job_id)
+                return
+            except Exception as e:
+                logger.warning(f"ReportJobs: Celery no disponible ({e}), hilo local")
+
+        cls._get_executor().submit(cls._run_in_thread, job_id)
+
+    @classmethod
+    def _get_executor(cls) -> ThreadPoolExecutor:
+        if cls._executor is None:
+            cls._executor = ThreadPoolExecutor(
+                max_workers=getattr(
+                    settings, "REPORT_JOBS_WORKERS", cls.DEFAULT_WORKERS
+                ),
+                thread_name_prefix="report-job",
+            )
+        return cls._executor
+
+    @classmethod
+    def _run_in_thread(cls, job_id: int):
+        try:
+            cls.run(job_id)
+        finally:
+            # Conexiones propias del hilo del pool
+            connections.close_all()
+
+    @classmethod
+    def run(cls, job_id: int) -> Optional[ReportJob]:
+        """Genera el artefacto de un job pendiente (idempotente)."""
+        claimed = ReportJob.objects.filter(pk=job_id, status="pending").update(
+            status="running", started_at=timezone.now()
+        )
+        if not claimed:
+            return None
+
+        job = ReportJob.objects.get(pk=job_id)
+        try:
+            with tempfile.TemporaryFile() as fileobj:
+                content_type, filename = cls.render(job, fileobj)
+                cls._store(job, fileobj, content_type, filename)
+            job.status = "done"
+        except Exception as e:
+            logger.error(f"ReportJobs: error generando job {job.uuid}: {e}")
+            job.status = "failed"
+            job.error = str(e)
+        job.finished_at = timezone.now()
+        job.save()
+        return job
+
+    @staticmethod
+    def render(job: ReportJob, fileobj) -> Tuple[str, str]:
+        """Escribe el reporte en fileobj. Retorna (content_type, filename)."""
+        params = job.params
+        if job.kind == "export":
+            # Mismo alcance que el export en línea: institución del request y
+            # pacientes de quien lo pidió
+            export = ReportExport(
+                params["type"],
+                params["start_date"],
+                params["end_date"],
+                params["currency"],
+                institution_id=params.get("institution_id"),
+                scope=PatientAccessScope(job.requested_by),
+            )
+            if params["format"] == "csv":
+                for line in export.csv_lines():
+                    fileobj.write(line.encode("utf-8"))
+                return "text/csv; charset=utf-8", export.filename("csv")
+            export.write_xlsx(fileobj)
+            return XLSX_CONTENT_TYPE, export.filename("excel")
+
+        from core.services import export_institutional_report
+
+        buffer, content_type, filename = export_institutional_report(
+            params["data"],
+            params["format"],
+            params["filters"],
+            params["currency"],
+            params["user_name"],
+        )
+        fileobj.write(buffer.getvalue())
+        return content_type, filename
+
+    @staticmethod
+    def _store(job: ReportJob, fileobj, content_type: str, filename: str):
+        fileobj.seek(0, 2)
+        job.size = fileobj.tell()
+        fileobj.seek(0)
+        job.filename = filename
+        job.content_type = content_type
+        job.file.save(f"{job.uuid.hex[:12]}_{filename}", File(fileobj), save=False)
+
+        if getattr(settings, "R2_ENABLED", False):
+            from core.utils.r2_storage import get_r2_client
+
+            fileobj.seek(0)
+            date_path = timezone.localdate().strftime("%Y/%m")
+            object_key = f"reports/{date_path}/{job.uuid.hex}_{filename}"
+            job.file_url = (
+                get_r2_client().upload_file(fileobj.read(), object_key, content_type)
+                or ""
+            )
+
+    # --- Mantenimiento ---
+    @classmethod
+    def purge(cls, older_than: timedelta) -> int:
+        """Elimina jobs (y sus archivos locales) más antiguos que older_than."""
+        deleted = 0
+        stale = ReportJob.objects.filter(created_at__lt=timezone.now() - older_than)
+        for job in stale.iterator():
+            if job.file:
+                job.file.delete(save=False)
+            job.delete()
+            deleted += 1
+        return deleted
@@ -0,0 +1,491 @@
+# core/utils/rollups.py
+"""
+Rollups diarios por institución (DailyInstitutionRollup) para dashboards.
+
+Cada guardado/borrado de Appointment, ChargeOrder, Payment o
+WaitingRoomEntry marca como "sucio" su (institución, día), y también el
+(institución, día) anterior si la fecha o la institución cambiaron. En
+pre_save se leen de la base los valores anteriores (TRACKED_FIELDS) solo
+para filas existentes; un guardado que no cambia ninguno de ellos no marca
+nada. Los días sucios de una transacción se recalculan una sola vez en
+transaction.on_commit, con una consulta agregada solo por las fuentes que
+cambiaron; en autocommit se recalculan al instante. Los días de una
+transacción revertida quedan pendientes hasta el siguiente commit: el
+recálculo lee el estado actual de la base, así que recalcularlos de más no
+altera nada.
+
+Se recalcula el día completo en lugar de sumar deltas: así las
+actualizaciones y los borrados son idempotentes. Lo que no dispara señales
+(queryset.update(), bulk_create) se corrige con
+`manage.py rebuild_daily_rollups`. La migración 0026 carga el histórico.
+"""
+import logging
+import threading
+from datetime import date, datetime, time, timedelta
+from decimal import Decimal
+from functools import partial
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections, transaction
+from django.db.models import Count, DecimalField, Max, Min, Q, Sum
+from django.db.models.functions import TruncDate
+from django.dispatch import Signal
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from core.models import (
+    Appointment,
+    ChargeOrder,
+    DailyInstitutionRollup,
+    Payment,
+    WaitingRoomEntry,
+)
+
+logger = logging.getLogger(__name__)
+
+# Enviada tras escribir rollups; institution_ids=None significa "todas"
+rollups_refreshed = Signal()
+
+RollupKey = Tuple[int, date]
+Span = Tuple[date, date]
+
+# Campo que define el día de cada fuente
+DAY_FIELDS = {
+    Appointment: "appointment_date",
+    ChargeOrder: "issued_at",
+    Payment: "received_at",
+    WaitingRoomEntry: "arrival_time",
+}
+
+# Campos (attname) que leen los agregados de cada fuente
+TRACKED_FIELDS = {
+    Appointment: ("institution_id", "appointment_date", "status"),
+    ChargeOrder: ("institution_id", "issued_at", "status", "total", "balance_due"),
+    Payment: ("institution_id", "received_at", "status", "amount"),
+    WaitingRoomEntry: ("institution_id", "arrival_time", "status"),
+}
+
+# Métricas que escribe cada fuente
+SOURCE_METRICS = {
+    Appointment: ["appointments_total"]
+    + [f"appointments_{status}" for status, _ in Appointment.STATUS_CHOICES],
+    ChargeOrder: [
+        "orders_count",
+        "billed_total",
+        "balance_due_total",
+        "waived_count",
+        "waived_total",
+        "void_count",
+    ],
+    Payment: ["payments_count", "collected_total"],
+    WaitingRoomEntry: ["waiting_room_arrivals", "waiting_room_waiting"],
+}
+
+# pre_save con update_fields que no tocan TRACKED_FIELDS
+UNCHANGED = object()
+
+METRIC_FIELDS = [
+    field.name
+    for field in DailyInstitutionRollup._meta.concrete_fields
+    if field.name not in ("id", "institution", "date", "updated_at")
+]
+DECIMAL_FIELDS = {
+    field.name
+    for field in DailyInstitutionRollup._meta.concrete_fields
+    if isinstance(field, DecimalField)
+}
+
+
+def _as_day(value) -> Optional[date]:
+    """Día local de un date/datetime (acepta strings aún no normalizados)."""
+    if isinstance(value, str):
+        try:
+            value = parse_datetime(value) or parse_date(value)
+        except ValueError:
+            return None
+    if isinstance(value, datetime):
+        if timezone.is_aware(value):
+            return timezone.localdate(value)
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return None
+
+
+def _key(sender, state) -> Optional[RollupKey]:
+    if not state:
+        return None
+    institution_id = state.get("institution_id")
+    day = _as_day(state.get(DAY_FIELDS[sender]))
+    if institution_id is None or day is None:
+        return None
+    return (institution_id, day)
+
+
+def _day_spans(days: Iterable[date]) -> List[Span]:
+    """Agrupa días sueltos en rangos contiguos [inicio, fin]."""
+    spans: List[Span] = []
+    for day in sorted(set(days)):
+        if spans and day == spans[-1][1] + timedelta(days=1):
+            spans[-1] = (spans[-1][0], day)
+        else:
+            spans.append((day, day))
+    return spans
+
+
+def _model(model, apps=None):
+    """Modelo histórico (migraciones) o el actual."""
+    if apps is None:
+        return model
+    return apps.get_model(model._meta.app_label, model._meta.model_name)
+
+
+def _start_of(day: date) -> datetime:
+    start = datetime.combine(day, time.min)
+    return timezone.make_aware(start) if settings.USE_TZ else start
+
+
+def _span_filter(field: str, spans: List[Span], is_datetime: bool) -> Q:
+    q = Q()
+    for start, end in spans:
+        if is_datetime:
+            q |= Q(
+                **{
+                    f"{field}__gte": _start_of(start),
+                    f"{field}__lt": _start_of(end + timedelta(days=1)),
+                }
+            )
+        else:
+            q |= Q(**{f"{field}__range": (start, end)})
+    return q
+
+
+class DailyRollup:
+    # Días pendientes por hilo y alias de base de datos
+    _local = threading.local()
+
+    @classmethod
+    def enabled(cls) -> bool:
+        return getattr(settings, "DAILY_ROLLUPS_ENABLED", True)
+
+    # --- Seguimiento de cambios (señales) ---
+    @classmethod
+    def capture(
+        cls, sender, instance, using: str = DEFAULT_DB_ALIAS, update_fields=None
+    ):
+        """pre_save: lee de la base los valores anteriores de una fila existente."""
+        instance._rollup_previous = None
+        if instance.pk is None or instance._state.adding or not cls.enabled():
+            return
+        fields = TRACKED_FIELDS[sender]
+        if update_fields is not None:
+            updated = {sender._meta.get_field(name).attname for name in update_fields}
+            if updated.isdisjoint(fields):
+                instance._rollup_previous = UNCHANGED
+                return
+        instance._rollup_previous = (
+            sender._base_manager.using(using)
+            .filter(pk=instance.pk)
+            .values(*fields)
+            .first()
+        )
+
+    @classmethod
+    def track(cls, sender, instance, using: str = DEFAULT_DB_ALIAS, deleted=False):
+        """post_save/post_delete: marca los días afectados."""
+        previous = instance.__dict__.pop("_rollup_previous", None)
+        if deleted:
+            previous = None
+        elif previous is UNCHANGED:
+            return
+        # Solo valores cargados: un campo diferido no se guardó y conserva el
+        # valor anterior
+        current = dict(previous or {})
+        current.update(
+            (name, instance.__dict__[name])
+            for name in TRACKED_FIELDS[sender]
+            if name in instance.__dict__
+        )
+        if previous is not None and current == previous:
+            return
+
+        keys = {key for key in (_key(sender, previous), _key(sender, current)) if key}
+        if not keys or not cls.enabled():
+            return
+        if connections[using].in_atomic_block:
+            pending = cls._pending(using)
+            pending["keys"].update(keys)
+            pending["models"].add(sender)
+            # Un volcado por señal: el primero que corre vacía el conjunto y
+            # los demás no hacen nada. Un rollback descarta los callbacks.
+            transaction.on_commit(partial(cls._flush_pending, using), using=using)
+        else:
+            cls.refresh_safely(keys, {sender})
+
+    @classmethod
+    def _pending(cls, using: str) -> Dict[str, Set]:
+        pending = getattr(cls._local, "pending", None)
+        if pending is None:
+            pending = cls._local.pending = {}
+        return pending.setdefault(using, {"keys": set(), "models": set()})
+
+    @classmethod
+    def _flush_pending(cls, using: str):
+        pending = cls._pending(using)
+        keys, models = set(pending["keys"]), set(pending["models"])
+        pending["keys"].clear()
+        pending["models"].clear()
+        if keys:
+            cls.refresh_safely(keys, models)
+
+    # --- Cálculo ---
+    @classmethod
+    def refresh_safely(cls, keys: Iterable[RollupKey], models=None):
+        try:
+            cls.refresh(keys, models)
+        except Exception as e:
+            logger.error(f"DailyRollup: error recalculando rollups: {e}")
+
+    @classmethod
+    def refresh(cls, keys: Iterable[RollupKey], models=None) -> int:
+        """
+        Recalcula los (institución, día) indicados. Con `models` solo se
+        recalculan las métricas de esas fuentes. Retorna cuántos.
+        """
+        keys = set(keys)
+        if not keys:
+            return 0
+        models = set(models or DAY_FIELDS)
+        metrics = cls.compute(
+            _day_spans(day for _, day in keys),
+            {institution_id for institution_id, _ in keys},
+            models,
+        )
+        fields = [
+            name
+            for model in DAY_FIELDS
+            if model in models
+            for name in SOURCE_METRICS[model]
+        ]
+        with transaction.atomic():
+            cls._store({key: metrics.get(key) for key in keys}, fields)
+        rollups_refreshed.send(
+            sender=cls, institution_ids={institution_id for institution_id, _ in keys}
+        )
+        return len(keys)
+
+    @classmethod
+    def rebuild(cls, start: date, end: date, institution_ids=None, apps=None) -> int:
+        """
+        Reconstruye todos los rollups del rango. Retorna filas escritas.
+        `apps` (registro de una migración) usa los modelos históricos.
+        """
+        rollup_model = _model(DailyInstitutionRollup, apps)
+        metrics = cls.compute([(start, end)], institution_ids, apps=apps)
+        with transaction.atomic():
+            stale = rollup_model.objects.filter(date__range=(start, end))
+            if institution_ids is not None:
+                stale = stale.filter(institution_id__in=institution_ids)
+            stale.delete()
+            rollup_model.objects.bulk_create(
+                [
+                    rollup_model(institution_id=institution_id, date=day, **values)
+                    for (institution_id, day), values in metrics.items()
+                ],
+                batch_size=1000,
+            )
+        rollups_refreshed.send(sender=cls, institution_ids=institution_ids)
+        return len(metrics)
+
+    @classmethod
+    def rebuild_range(
+        cls, start: date, end: date, institution_ids=None, chunk_days=31, apps=None
+    ) -> Iterator[Tuple[date, date, int]]:
+        """Reconstruye el rango por tramos; produce (inicio, fin, filas)."""
+        step = timedelta(days=max(1, chunk_days))
+        chunk_start = start
+        while chunk_start <= end:
+            chunk_end = min(chunk_start + step - timedelta(days=1), end)
+            rows = cls.rebuild(chunk_start, chunk_end, institution_ids, apps=apps)
+            yield chunk_start, chunk_end, rows
+            chunk_start = chunk_end + timedelta(days=1)
+
+    @classmethod
+    def history_bounds(cls, apps=None) -> Optional[Span]:
+        """Primer y último día con datos en cualquiera de las fuentes."""
+        days: List[date] = []
+        for model, field in DAY_FIELDS.items():
+            bounds = _model(model, apps).objects.aggregate(
+                low=Min(field), high=Max(field)
+            )
+            days.extend(
+                day
+                for day in (_as_day(bounds["low"]), _as_day(bounds["high"]))
+                if day
+            )
+        return (min(days), max(days)) if days else None
+
+    @classmethod
+    def compute(
+        cls, spans: List[Span], institution_ids=None, models=None, apps=None
+    ) -> Dict[RollupKey, Dict[str, Any]]:
+        """
+        Métricas por (institución, día) para los rangos dados: una consulta
+        agregada por fuente (todas, o solo las de `models`). Los días sin
+        actividad en esas fuentes no aparecen.
+        """
+        results: Dict[RollupKey, Dict[str, Any]] = {}
+        models = set(models or DAY_FIELDS)
+        if not spans:
+            return results
+
+        def scoped(model, is_datetime):
+            qs = _model(model, apps).objects.filter(
+                _span_filter(DAY_FIELDS[model], spans, is_datetime)
+            )
+            if institution_ids is not None:
+                qs = qs.filter(institution_id__in=institution_ids)
+            return qs.order_by()
+
+        def merge(rows, day_field):
+            for row in rows:
+                key = (row.pop("institution_id"), row.pop(day_field))
+                values = results.setdefault(key, cls._empty())
+                for name, value in row.items():
+                    if value is not None:
+                        values[name] = value
+
+        appointments_by_status = {
+            f"appointments_{status}": Count("id", filter=Q(status=status))
+            for status, _ in Appointment.STATUS_CHOICES
+        }
+        if Appointment in models:
+            merge(
+                scoped(Appointment, False)
+                .values("institution_id", "appointment_date")
+                .annotate(appointments_total=Count("id"), **appointments_by_status),
+                "appointment_date",
+            )
+
+        not_void = ~Q(status="void")
+        if ChargeOrder in models:
+            merge(
+                scoped(ChargeOrder, True)
+                .annotate(day=TruncDate("issued_at"))
+                .values("institution_id", "day")
+                .annotate(
+                    orders_count=Count("id", filter=not_void),
+                    billed_total=Sum("total", filter=not_void),
+                    balance_due_total=Sum("balance_due", filter=not_void),
+                    waived_count=Count("id", filter=Q(status="waived")),
+                    waived_total=Sum("total", filter=Q(status="waived")),
+                    void_count=Count("id", filter=Q(status="void")),
+                ),
+                "day",
+            )
+
+        if Payment in models:
+            merge(
+                scoped(Payment, True)
+                .filter(status="confirmed")
+                .annotate(day=TruncDate("received_at"))
+                .values("institution_id", "day")
+                .annotate(payments_count=Count("id"), collected_total=Sum("amount")),
+                "day",
+            )
+
+        if WaitingRoomEntry in models:
+            merge(
+                scoped(WaitingRoomEntry, True)
+                .annotate(day=TruncDate("arrival_time"))
+                .values("institution_id", "day")
+                .annotate(
+                    waiting_room_arrivals=Count("id"),
+                    waiting_room_waiting=Count("id", filter=Q(status="waiting")),
+                ),
+                "day",
+            )
+        return results
+
+    @staticmethod
+    def _empty() -> Dict[str, Any]:
+        return {
+            name: Decimal("0.00") if name in DECIMAL_FIELDS else 0
+            for name in METRIC_FIELDS
+        }
+
+    @staticmethod
+    def _row(key: RollupKey, values: Dict[str, Any]) -> DailyInstitutionRollup:
+        institution_id, day = key
+        return DailyInstitutionRollup(institution_id=institution_id, date=day, **values)
+
+    @classmethod
+    def _store(
+        cls,
+        metrics: Dict[RollupKey, Optional[Dict[str, Any]]],
+        fields: List[str] = METRIC_FIELDS,
+    ):
+        """
+        Upsert de `fields` en los días con actividad; los días sin actividad
+        en esas fuentes quedan en cero y se borran si ya no les queda nada.
+        Una fila nueva lleva cero en el resto de métricas: si no existía, las
+        demás fuentes no tenían actividad ese día.
+        """
+        rows = [cls._row(key, values) for key, values in metrics.items() if values]
+        if rows:
+            DailyInstitutionRollup.objects.bulk_create(
+                rows,
+                batch_size=1000,
+                update_conflicts=True,
+                unique_fields=["institution", "date"],
+                update_fields=list(fields) + ["updated_at"],
+            )
+        empty = Q()
+        for (institution_id, day), values in metrics.items():
+            if not values:
+                empty |= Q(institution_id=institution_id, date=day)
+        if not empty:
+            return
+        idle = DailyInstitutionRollup.objects.filter(empty)
+        if len(fields) < len(METRIC_FIELDS):
+            idle.update(**{name: 0 for name in fields}, updated_at=timezone.now())
+            idle = idle.filter(**{name: 0 for name in METRIC_FIELDS})
+        idle.delete()
+
+    # --- Lectura ---
+    @classmethod
+    def queryset(cls, start=None, end=None, institution_id=None):
+        qs = DailyInstitutionRollup.objects.all()
+        if start is not None:
+            qs = qs.filter(date__gte=start)
+        if end is not None:
+            qs = qs.filter(date__lte=end)
+        if institution_id is not None:
+            qs = qs.filter(institution_id=institution_id)
+        return qs
+
+    @classmethod
+    def totals(
+        cls, *fields: str, start=None, end=None, institution_id=None
+    ) -> Dict[str, Any]:
+        """Suma de las métricas indicadas en el rango (0 si no hay filas)."""
+        agg = cls.queryset(start, end, institution_id).aggregate(
+            **{name: Sum(name) for name in fields}
+        )
+        empty = cls._empty()
+        return {name: agg[name] if agg[name] is not None else empty[name] for name in fields}
+
+    @classmethod
+    def series(
+        cls, field: str, start=None, end=None, institution_id=None
+    ) -> List[Tuple[date, Any]]:
+        """Serie diaria de una métrica (solo días con valor > 0)."""
+        rows = (
+            cls.queryset(start, end, institution_id)
+            .values("date")
+            .annotate(value=Sum(field))
+            .filter(value__gt=0)
+            .order_by("date")
+        )
+        return [(row["date"], row["value"]) for row in rows]
@@ -1,10 +1,15 @@
+import re
 import unicodedata
-from typing import Union
+from typing import List, Union
 
 from django.db.models import F, Expression, Value
 from django.db.models.functions import Lower
 from django.db.models import Func
 
+# Palabra del índice de búsqueda: letras y dígitos. Todo lo demás (guiones,
+# puntos, apóstrofos, "_") separa, igual que el tokenizer unicode61 de FTS5.
+WORD_RE = re.compile(r"[^\W_]+")
+
 
 class Translate(Func):
     """
@@ -38,3 +43,29 @@ def normalize_token(token: str) -> str:
     token = token.lower()
     token = unicodedata.normalize("NFKD", token)
     return "".join(c for c in token if not unicodedata.combining(c))
+
+
+def search_words(text: str) -> List[str]:
+    """
+    Palabras normalizadas de un texto para el índice de búsqueda
+    ("García-López" -> ["garcia", "lopez"]). Se usa tanto para el documento
+    como para la consulta.
+    """
+    return WORD_RE.findall(normalize_token(text))
+
+
+def build_search_document(*parts) -> str:
+    """
+    Construye el documento de búsqueda precomputado de una entidad:
+    - separa cada parte en palabras con search_words
+    - las une por espacios simples y rodea con espacios
+    El espacio inicial permite detectar prefijos de palabra con LIKE '% token%'.
+    """
+    tokens = []
+    for part in parts:
+        if not part:
+            continue
+        tokens.extend(search_words(str(part)))
+    if not tokens:
+        return ""
+    return f" {' '.join(tokens)} "
@@ -0,0 +1,111 @@
+# core/utils/write_buffer.py
+"""
+Buffer de escritura diferida (write-behind) por proceso.
+
+Acumula registros en memoria y los entrega en lotes a una función de
+volcado (normalmente un bulk_create / UPDATE con F()) desde un hilo en
+segundo plano, fuera del ciclo request/response.
+
+- Volcado periódico cada `flush_interval` segundos o al llegar a `max_size`.
+- Buffer acotado: si se alcanza `max_pending` el registro se vuelca de
+  forma síncrona en el hilo que llama (back-pressure) en lugar de crecer.
+- Con settings.WRITE_BEHIND_ENABLED = False todo se escribe al instante.
+- Al salir el proceso (atexit: fin normal o SIGTERM de gunicorn) se vuelca
+  lo pendiente; un crash o SIGKILL lo pierde. Usar solo para datos que se
+  pueden perder (contadores), nunca para trazas de auditoría.
+"""
+import atexit
+import logging
+import threading
+from typing import Any, Callable, List
+
+from django.conf import settings
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class WriteBehindBuffer:
+    def __init__(
+        self,
+        name: str,
+        flush_func: Callable[[List[Any]], None],
+        max_size: int = 200,
+        max_pending: int = 5000,
+        flush_interval: float = 2.0,
+    ):
+        self.name = name
+        self.flush_func = flush_func
+        self.max_size = max_size
+        self.max_pending = max_pending
+        self.flush_interval = flush_interval
+        self._items: List[Any] = []
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread = None
+        atexit.register(self.flush)
+
+    @property
+    def enabled(self) -> bool:
+        return getattr(settings, "WRITE_BEHIND_ENABLED", True)
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, item: Any):
+        """Encola un registro (o lo escribe al instante si el buffer está deshabilitado)."""
+        if not self.enabled:
+            self._write([item])
+            return
+
+        with self._lock:
+            self._items.append(item)
+            pending = len(self._items)
+
+        if pending >= self.max_pending:
+            logger.warning(
+                f"WriteBehindBuffer[{self.name}]: {pending} pendientes, volcado síncrono"
+            )
+            self.flush()
+        elif pending >= self.max_size:
+            self._wakeup.set()
+        self._ensure_thread()
+
+    def flush(self) -> int:
+        """Vuelca todo lo pendiente. Retorna la cantidad de registros escritos."""
+        with self._flush_lock:
+            with self._lock:
+                items, self._items = self._items, []
+            if items:
+                self._write(items)
+            return len(items)
+
+    def _write(self, items: List[Any]):
+        try:
+            self.flush_func(items)
+        except Exception as e:
+            logger.error(
+                f"WriteBehindBuffer[{self.name}]: error volcando {len(items)} registros: {e}"
+            )
+
+    def _ensure_thread(self):
+        if self._thread is not None and self._thread.is_alive():
+            return
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return
+            self._thread = threading.Thread(
+                target=self._run, name=f"write-behind-{self.name}", daemon=True
+            )
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            close_old_connections()
+            try:
+                self.flush()
+            finally:
+                close_old_connections()
@@ -211,6 +211,59 @@ else:
         }
     }
 
+# === Cache ===
+# Con CACHE_URL (redis://...) el cache es compartido entre workers; sin él,
+# cada proceso usa memoria local y las invalidaciones solo afectan a ese proceso.
+CACHE_URL = os.environ.get("CACHE_URL", "")
+if CACHE_URL:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": CACHE_URL,
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        }
+    }
+
+# Datos de autorización (pacientes accesibles por médico, niveles de permiso
+# institucional, InstitutionSettings del middleware) solo se cachean entre
+# requests con un cache compartido: con LocMemCache una revocación o un cambio
+# invalidaría únicamente al worker que lo procesó.
+AUTHORIZATION_CACHE_ENABLED = bool(CACHE_URL)
+
+# Escrituras diferidas en lote (core/utils/write_buffer.py)
+WRITE_BEHIND_ENABLED = os.environ.get("WRITE_BEHIND_ENABLED", "True") == "True"
+
+# Bus de eventos de auditoría (core/utils/events.py): escritura síncrona,
+# en lote dentro de EventBus.batch()
+EVENT_BUS_ENABLED = os.environ.get("EVENT_BUS_ENABLED", "True") == "True"
+
+# Rollups diarios por institución (core/utils/rollups.py) para los dashboards
+DAILY_ROLLUPS_ENABLED = os.environ.get("DAILY_ROLLUPS_ENABLED", "True") == "True"
+
+# Reportes en segundo plano (core/utils/report_jobs.py): solicitudes idénticas
+# del mismo usuario dentro de la ventana reutilizan el mismo job; sin Celery se
+# usa un pool local. Un job sin terminar tras STALE_SECONDS se marca fallido
+REPORT_JOBS_DEDUP_SECONDS = int(os.environ.get("REPORT_JOBS_DEDUP_SECONDS", "600"))
+REPORT_JOBS_STALE_SECONDS = int(os.environ.get("REPORT_JOBS_STALE_SECONDS", "1800"))
+REPORT_JOBS_WORKERS = int(os.environ.get("REPORT_JOBS_WORKERS", "2"))
+
+# Motor de PDF (core/utils/pdf_engine.py): WeasyPrint en un pool de procesos
+# por proceso web; 0 workers = conversión en el mismo proceso
+PDF_ENGINE_WORKERS = int(os.environ.get("PDF_ENGINE_WORKERS", "2"))
+PDF_ENGINE_TIMEOUT = int(os.environ.get("PDF_ENGINE_TIMEOUT", "60"))
+PDF_ENGINE_MAX_PENDING = int(os.environ.get("PDF_ENGINE_MAX_PENDING", "8"))
+PDF_ENGINE_QUEUE_TIMEOUT = int(os.environ.get("PDF_ENGINE_QUEUE_TIMEOUT", "5"))
+
+# Cache de PDFs renderizados por contenido (core/utils/pdf_cache.py), en disco
+# y fuera de MEDIA_ROOT; LRU por tamaño total, 0 bytes la desactiva
+PDF_CACHE_DIR = os.environ.get("PDF_CACHE_DIR", str(BASE_DIR / "pdf_cache"))
+PDF_CACHE_MAX_BYTES = int(os.environ.get("PDF_CACHE_MAX_BYTES", str(512 * 1024**2)))
+
 # === Internacionalización ===
 LANGUAGE_CODE = "es-ve"
 TIME_ZONE = "America/Caracas"
@@ -254,6 +307,8 @@ CORS_ALLOW_HEADERS = [
     "x-doctor-id",
     "x-portal",
 ]
+# Paginación keyset de auditoría (audit_page_response) y badge de notificaciones
+CORS_EXPOSE_HEADERS = ["x-next-cursor", "x-unread-count"]
 _csrf_origins = os.environ.get("CSRF_TRUSTED_ORIGINS", "")
 CSRF_TRUSTED_ORIGINS = (
     [origin.strip() for origin in _csrf_origins.split(",") if origin.strip()]